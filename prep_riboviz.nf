@@ -142,6 +142,11 @@ def helpMessage() {
     * If 'dedup_umis' is 'TRUE' but 'extract_umis' is 'FALSE' then a
       warning will be displayed, but processing will continue.
     * 'trim_5p_mismatches': Trim mismatched 5' base? (default 'TRUE')
+    * 'fuse_trim_sort': Pipe reads aligned to ORFs by 'hisat2' into
+      'trim_5p_mismatch', which trims, sorts and indexes them in a
+      single step, without writing 'orf_map.sam' and
+      'orf_map_clean.sam'? Only used if 'trim_5p_mismatches' is
+      'TRUE' (default 'FALSE')
 
     Statistics and figure generation input files:
 
@@ -182,6 +187,15 @@ def helpMessage() {
     * 'min_read_length': Minimum read length in H5 output (default 10)
     * 'primary_id': Primary gene IDs to access the data (YAL001C,
       YAL003W, etc.) (default 'Name')
+    * 'python_bam_to_h5': Convert BAM files to H5 files using
+      'riboviz.tools.bam_to_h5' instead of 'bam_to_h5.R'? (default
+      'FALSE')
+    * 'python_dedup_umis': Deduplicate and group reads in a single
+      pass using 'riboviz.tools.dedup_umis' instead of 'umi_tools
+      dedup' and 'umi_tools group'? (default 'FALSE')
+    * 'python_make_bedgraph': Make bedgraph files using
+      'riboviz.tools.make_bedgraphs' instead of 'bedtools genomecov'?
+      (default 'FALSE')
     * 'rpf': Is the dataset an RPF or mRNA dataset? (default 'TRUE')
     * 'secondary_id': Secondary gene IDs to access the data (COX1,
       EFB1, etc. or 'NULL') (default 'NULL')
@@ -318,6 +332,7 @@ params.dir_tmp = "tmp"
 params.do_pos_sp_nt_freq = true
 params.extract_umis = false
 params.trim_5p_mismatches = true
+params.fuse_trim_sort = false
 params.feature = "CDS"
 params.fq_files = [:]
 params.group_umis = false
@@ -330,6 +345,9 @@ params.multiplex_fq_files = []
 params.num_processes = 1
 params.output_pdfs = true
 params.publish_index_tmp = false
+params.python_bam_to_h5 = false
+params.python_dedup_umis = false
+params.python_make_bedgraph = false
 params.primary_id = "Name"
 params.rpf = true
 params.run_static_html = true
@@ -694,7 +712,9 @@ process buildIndicesORF {
 // 'params.build_indices' one one of 'pre_built_rrna|orf_index_ht2' or
 // 'built_rrna|orf_index_ht2' will have content.
 rrna_index_ht2 = pre_built_rrna_index_ht2.mix(built_rrna_index_ht2)
-orf_index_ht2 = pre_built_orf_index_ht2.mix(built_orf_index_ht2)
+pre_built_orf_index_ht2.mix(built_orf_index_ht2).into {
+    orf_index_ht2; trim_sort_orf_index_ht2
+}
 
 /*
 Sample file (fq_files)-specific processes.
@@ -893,7 +913,8 @@ process hisat2rRNA {
         tuple val(sample_id), file(sample_fq) from trimmed_fq
         each file(rrna_index_ht2) from rrna_index_ht2
     output:
-        tuple val(sample_id), file("nonrRNA.fq") into non_rrna_fq
+        tuple val(sample_id), file("nonrRNA.fq") \
+            into non_rrna_fq, trim_sort_non_rrna_fq
         tuple val(sample_id), file("rRNA_map.sam") into rrna_map_sam
     shell:
         """
@@ -916,6 +937,8 @@ process hisat2ORF {
     output:
         tuple val(sample_id), file("unaligned.fq") into unaligned_fq
         tuple val(sample_id), file("orf_map.sam") into trim_5p_mismatches
+    when:
+        ! (params.trim_5p_mismatches && params.fuse_trim_sort)
     shell:
         """
         hisat2 --version
@@ -926,6 +949,41 @@ process hisat2ORF {
         """
 }
 
+process hisat2ORFTrim5pMismatchesSort {
+    tag "${sample_id}"
+    publishDir "${dir_tmp}/${sample_id}", \
+        mode: publish_index_tmp_type, overwrite: true
+    errorStrategy 'ignore'
+    input:
+        // Use '.toString' to prevent changing hashes of
+        // 'workflow.projectDir' triggering reexecution of this
+        // process if 'nextflow run' is run with '-resume'.
+        env PYTHONPATH from workflow.projectDir.toString()
+        tuple val(sample_id), file(sample_fq) from trim_sort_non_rrna_fq
+        each file(orf_index_ht2) from trim_sort_orf_index_ht2
+    output:
+        tuple val(sample_id), file("unaligned.fq") \
+            into trim_sort_unaligned_fq
+        tuple val(sample_id), file("orf_map_clean.bam"), \
+            file("orf_map_clean.bam.bai") into trim_sort_orf_map_bam
+        tuple val(sample_id), file("trim_5p_mismatch.tsv") \
+            into trim_sort_summary_tsv
+    when:
+        params.trim_5p_mismatches && params.fuse_trim_sort
+    shell:
+        """
+        set -o pipefail
+        hisat2 --version
+        hisat2 -p ${params.num_processes} -k 2 \
+            --no-spliced-alignment --rna-strandness F --no-unal \
+            --un unaligned.fq -x ${params.orf_index_prefix} \
+            -U ${sample_fq} \
+            | python -m riboviz.tools.trim_5p_mismatch -m 2 \
+            -i - -o orf_map_clean.bam -s trim_5p_mismatch.tsv \
+            -S -t ${params.num_processes}
+        """
+}
+
 // Route 'trim_5p_branch' channel outputs depending on whether mismatched
 // 5' base are to be trimmed or not
 trim_5p_mismatches.branch {
@@ -953,7 +1011,8 @@ process trim5pMismatches {
     shell:
         """
         python -m riboviz.tools.trim_5p_mismatch -m 2 \
-            -i ${sample_sam} -o orf_map_clean.sam -s trim_5p_mismatch.tsv
+            -i ${sample_sam} -o orf_map_clean.sam -s trim_5p_mismatch.tsv \
+            -p ${params.num_processes}
         """
 }
 
@@ -977,15 +1036,17 @@ process samViewSort {
         memory = params.samsort_memory != null ? "-m ${params.samsort_memory}" : ""
         """
         samtools --version
-        samtools view -b ${sample_sam} | samtools sort ${memory} \
-            -@ ${params.num_processes} -O bam -o orf_map_clean.bam -
+        samtools sort ${memory} -@ ${params.num_processes} \
+            -O bam -o orf_map_clean.bam ${sample_sam}
         samtools index orf_map_clean.bam
         """
 }
 
-// Route "orf_map_bam" channel outputs depending on whether UMIs are
+// Combine channels for downstream processing. By definition of
+// upstream conditions and processes, only one of the channels
+// will have content. Route outputs depending on whether UMIs are
 // to be deduplicated or not.
-orf_map_bam.branch {
+orf_map_bam.mix(trim_sort_orf_map_bam).branch {
     dedup_bam: params.dedup_umis
     non_dedup_bam: ! params.dedup_umis
 }
@@ -1008,7 +1069,7 @@ process groupUmisPreDedup {
         tuple val(sample_id), file("pre_dedup_groups.tsv") \
             into pre_dedup_group_tsv
     when:
-        params.dedup_umis && params.group_umis
+        params.dedup_umis && params.group_umis && ! params.python_dedup_umis
     shell:
         """
         umi_tools group -I ${sample_bam} --group-out pre_dedup_groups.tsv
@@ -1029,16 +1090,31 @@ process dedupUmis {
         tuple val(sample_id), file("dedup_stats*.tsv") \
             optional (! params.dedup_stats) \
             into dedup_stats_tsv
+        tuple val(sample_id), file("*_dedup_groups.tsv") \
+            optional (! (params.python_dedup_umis && params.group_umis)) \
+            into dedup_group_tsv
     when:
         params.dedup_umis
     shell:
         output_stats_flag = params.dedup_stats \
             ? "--output-stats=dedup_stats" : ''
-        """
-        umi_tools dedup -I ${sample_bam} -S dedup.bam ${output_stats_flag}
-        samtools --version
-        samtools index dedup.bam
-        """
+        groups_summary_flag = params.dedup_stats \
+            ? "--groups-summary=dedup_stats_groups" : ''
+        group_flag = params.group_umis \
+            ? "--group-out-pre=pre_dedup_groups.tsv --group-out-post=post_dedup_groups.tsv" : ''
+        if (params.python_dedup_umis)
+            """
+            python -m riboviz.tools.dedup_umis \
+                -I ${sample_bam} -S dedup.bam ${output_stats_flag} \
+                ${groups_summary_flag} ${group_flag} \
+                -p ${params.num_processes}
+            """
+        else
+            """
+            umi_tools dedup -I ${sample_bam} -S dedup.bam ${output_stats_flag}
+            samtools --version
+            samtools index dedup.bam
+            """
 }
 
 // Split channel for use in multiple downstream processes.
@@ -1056,7 +1132,7 @@ process groupUmisPostDedup {
         tuple val(sample_id), file("post_dedup_groups.tsv") \
             into post_dedup_group_tsv
     when:
-        params.dedup_umis && params.group_umis
+        params.dedup_umis && params.group_umis && ! params.python_dedup_umis
     shell:
         """
         umi_tools group -I ${sample_bam} --group-out post_dedup_groups.tsv
@@ -1103,13 +1179,20 @@ process makeBedgraphs {
     when:
         params.make_bedgraph
     shell:
-        """
-        bedtools --version
-        bedtools genomecov -ibam ${sample_bam} -trackline -bga -5 \
-            -strand + > plus.bedgraph
-        bedtools genomecov -ibam ${sample_bam} -trackline -bga -5 \
-            -strand - > minus.bedgraph
-        """
+        if (params.python_make_bedgraph)
+            """
+            python -m riboviz.tools.make_bedgraphs -i ${sample_bam} \
+                --plus=plus.bedgraph --minus=minus.bedgraph \
+                -p ${params.num_processes}
+            """
+        else
+            """
+            bedtools --version
+            bedtools genomecov -ibam ${sample_bam} -trackline -bga -5 \
+                -strand + > plus.bedgraph
+            bedtools genomecov -ibam ${sample_bam} -trackline -bga -5 \
+                -strand - > minus.bedgraph
+            """
 }
 
 process bamToH5 {
@@ -1126,8 +1209,11 @@ process bamToH5 {
     shell:
         secondary_id_flag = (secondary_id != null) \
             ? "--secondary-id=${secondary_id}" : ''
+        bam_to_h5 = params.python_bam_to_h5 \
+            ? "python -m riboviz.tools.bam_to_h5" \
+            : "Rscript --vanilla ${workflow.projectDir}/rscripts/bam_to_h5.R"
         """
-        Rscript --vanilla ${workflow.projectDir}/rscripts/bam_to_h5.R \
+        ${bam_to_h5} \
            --num-processes=${params.num_processes} \
            --min-read-length=${params.min_read_length} \
            --max-read-length=${params.max_read_length} \
@@ -1327,7 +1413,9 @@ process countReads {
            -i ${file(dir_in).toAbsolutePath()} \
            -t ${file(dir_tmp).toAbsolutePath()} \
            -o ${file(dir_out).toAbsolutePath()} \
-           -r read_counts.tsv
+           -r read_counts.tsv \
+           -p ${params.num_processes} \
+           -k ${file(dir_tmp).toAbsolutePath()}/read_counts_cache.tsv
         """
 }
 
@@ -0,0 +1,461 @@
+"""
+Convert BAM files to RiboViz HDF5 files.
+
+This is a Python implementation of ``rscripts/bam_to_h5.R`` (see
+``BamToH5`` in ``rscripts/bam_to_h5_functions.R``) which writes H5
+files with the same layout (see :py:func:`bam_to_h5`). The content
+of these files has not been compared to that of H5 files written by
+``rscripts/bam_to_h5.R``. It differs in how reads are counted. Rather
+than querying the BAM file for each gene, the BAM file is read
+sequentially, once, in chunks of reads, and each chunk is assigned to
+the features from the GFF file using NumPy.
+
+Read counts for a gene are held in a matrix with a row for each
+nucleotide position in the gene (including its flanking regions) and
+a column for each read length from ``min_read_length`` to
+``max_read_length``. Reads are mapped to their 5' ends. Reads are
+counted for a gene if they:
+
+* Overlap the gene's feature or flanking regions.
+* Are on the same strand as the gene.
+* Have a length, including soft-clipped bases, between
+  ``min_read_length`` and ``max_read_length``.
+"""
+import numpy as np
+import pysam
+from riboviz import fasta_gff
+from riboviz import h5
+
+UTR5 = "UTR5"
+""" GFF UTR5 feature type. """
+UTR3 = "UTR3"
+""" GFF UTR3 feature type. """
+CHUNK_SIZE = 1000000
+""" Number of reads counted at a time. """
+
+
+def read_gff(gff_file, keys):
+    """
+    Read GFF2/GTF or GFF3 records, using
+    :py:func:`riboviz.fasta_gff.read_gff_records`.
+
+    Each record is returned as a tuple with the sequence name, feature
+    type, 1-indexed start and end coordinates (inclusive), strand and
+    the values of the attributes ``keys`` which the record defines.
+    Attributes with more than one value have these joined by commas,
+    and leading and trailing whitespace is removed from values.
+
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    :param keys: Attribute names
+    :type keys: list(str or unicode)
+    :return: Records
+    :rtype: list(tuple(str or unicode, str or unicode, int, int, \
+    str or unicode, dict(str or unicode => str or unicode)))
+    :raises FileNotFoundError: If the GFF file cannot be found
+    :raises ValueError: If the GFF file has invalid lines
+    """
+    records = []
+    for _, fields, values in fasta_gff.read_gff_records(gff_file, keys):
+        attributes = {key: ",".join(value).strip()
+                      for key, value in zip(keys, values)
+                      if value is not None}
+        records.append((fields[0], fields[2], int(fields[3]),
+                        int(fields[4]), fields[6], attributes))
+    return records
+
+
+def get_gene_locations(gff_file, feature="CDS", buffer=250,
+                       primary_id="gene_id", secondary_id=None,
+                       is_riboviz_gff=True, stop_in_feature=False):
+    """
+    Get the locations of genes' features, and flanking regions, from
+    a GFF file.
+
+    A list of dictionaries is returned, one for each gene, in order of
+    first appearance in the GFF file. Each has keys:
+
+    * ``gene``: gene name, from the ``primary_id`` attribute.
+    * ``alt_gene``: alternative gene name, from the ``secondary_id``
+      attribute, or ``None``.
+    * ``seqname``: sequence name.
+    * ``is_reverse``: is the gene on the ``-`` strand?
+    * ``ranges``: list of tuples with 1-indexed start and end
+      coordinates (inclusive) of the feature, expanded to include the
+      flanking regions.
+    * ``positions``: ``numpy.ndarray`` of nucleotide positions
+      covered by ``ranges``, in increasing order, including pseudo
+      positions (``<= 0``) for flanking regions that extend past the
+      start of the sequence.
+    * ``start_codon_pos``, ``stop_codon_pos``: positions of start and
+      stop codon nucleotides.
+
+    If ``is_riboviz_gff`` then the flanking regions are the ``UTR5``
+    and ``UTR3`` features, else ``buffer`` is used.
+
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    :param feature: Feature e.g. ``CDS``, ``ORF``, or ``uORF``
+    :type feature: str or unicode
+    :param buffer: Length of flanking region around the feature, \
+    used only if ``is_riboviz_gff`` is ``False``
+    :type buffer: int
+    :param primary_id: Primary gene IDs attribute
+    :type primary_id: str or unicode
+    :param secondary_id: Secondary gene IDs attribute or ``None``
+    :type secondary_id: str or unicode
+    :param is_riboviz_gff: Does the GFF file contain 3 elements per \
+    gene - UTR5, feature, and UTR3?
+    :type is_riboviz_gff: bool
+    :param stop_in_feature: Are stop codons part of the feature \
+    annotations? Used only if ``is_riboviz_gff`` is ``False``
+    :type stop_in_feature: bool
+    :return: Gene locations
+    :rtype: list(dict)
+    :raise ValueError: If there are no features of type ``feature`` \
+    or ``primary_id`` or ``secondary_id`` are not attributes
+    """
+    keys = [primary_id]
+    if secondary_id is not None:
+        keys.append(secondary_id)
+    gff = read_gff(gff_file, keys)
+    features = [record for record in gff if record[1] == feature]
+    if not features:
+        raise ValueError("No {} features found in {}".format(
+            feature, gff_file))
+    if not is_riboviz_gff:
+        gff = features
+    attributes = {key for record in gff for key in record[5]}
+    if primary_id not in attributes:
+        raise ValueError("primary_id {} is not a GFF attribute".format(
+            primary_id))
+    if secondary_id is not None and secondary_id not in attributes:
+        raise ValueError(
+            "Attribute secondary_id {} is not a GFF attribute".format(
+                secondary_id))
+    gene_records = {}
+    for record in gff:
+        gene_records.setdefault(record[5].get(primary_id),
+                                []).append(record)
+    genes = list(gene_records)
+    alt_genes = [None] * len(genes)
+    if secondary_id is not None:
+        # As for BamToH5, genes and unique secondary IDs are paired
+        # by their order in the GFF file.
+        alt_genes = list(dict.fromkeys(
+            record[5].get(secondary_id) for record in gff))
+    locations = []
+    for gene, alt_gene in zip(genes, alt_genes):
+        records = gene_records[gene]
+        gene_features = [record for record in records
+                         if record[1] == feature]
+        if not gene_features:
+            raise ValueError("No {} feature found for {}".format(
+                feature, gene))
+        if is_riboviz_gff:
+            buffer_left = sum(record[3] - record[2] + 1
+                              for record in records
+                              if record[1] == UTR5)
+            buffer_right = sum(record[3] - record[2] + 1
+                               for record in records
+                               if record[1] == UTR3)
+        else:
+            buffer_left = buffer
+            buffer_right = buffer
+        is_reverse = gene_features[0][4] == "-"
+        if is_reverse:
+            buffer_left, buffer_right = buffer_right, buffer_left
+        ranges = [[record[2], record[3]] for record in gene_features]
+        min_start = min(start for start, _ in ranges)
+        max_end = max(end for _, end in ranges)
+        for location in ranges:
+            if location[0] == min_start:
+                location[0] -= buffer_left
+            if location[1] == max_end:
+                location[1] += buffer_right
+        min_start -= buffer_left
+        coverage = np.zeros(max_end + buffer_right - min_start + 2,
+                            dtype=np.int32)
+        for start, end in ranges:
+            coverage[start - min_start] += 1
+            coverage[end - min_start + 1] -= 1
+        positions = np.flatnonzero(np.cumsum(coverage) == 1) + min_start
+        start_codon = gene_features[0][2]
+        stop_codon = gene_features[0][3] - 2
+        if not is_riboviz_gff and not stop_in_feature:
+            stop_codon = gene_features[0][3] + 1
+        locations.append({
+            "gene": gene,
+            "alt_gene": alt_gene,
+            "seqname": gene_features[0][0],
+            "is_reverse": is_reverse,
+            "ranges": [tuple(location) for location in ranges],
+            "positions": positions,
+            "start_codon_pos": np.arange(start_codon, start_codon + 3),
+            "stop_codon_pos": np.arange(stop_codon, stop_codon + 3)
+        })
+    return locations
+
+
+def count_chunk(counts, ranges, tids, starts, ends, is_reverse,
+                lengths, min_read_length):
+    """
+    Count a chunk of reads, adding the counts for each gene into
+    ``counts``.
+
+    ``ranges`` maps each BAM reference ID to a list of tuples with a
+    gene's index into ``counts``, its 0-indexed start and end
+    coordinates (end exclusive), whether it is on the ``-`` strand,
+    and its nucleotide positions (see :py:func:`get_gene_locations`).
+
+    :param counts: Read counts for each gene, a matrix of positions \
+    by read lengths
+    :type counts: list(numpy.ndarray)
+    :param ranges: Gene ranges for each reference ID
+    :type ranges: dict(int => list(tuple(int, int, int, bool, \
+    numpy.ndarray)))
+    :param tids: Reads' reference IDs
+    :type tids: numpy.ndarray
+    :param starts: Reads' 0-indexed alignment start coordinates
+    :type starts: numpy.ndarray
+    :param ends: Reads' 0-indexed alignment end coordinates (exclusive)
+    :type ends: numpy.ndarray
+    :param is_reverse: Are reads on ``-`` strand?
+    :type is_reverse: numpy.ndarray
+    :param lengths: Reads' lengths
+    :type lengths: numpy.ndarray
+    :param min_read_length: Minimum read length
+    :type min_read_length: int
+    """
+    order = np.lexsort((starts, tids))
+    tids = tids[order]
+    starts = starts[order]
+    ends = ends[order]
+    is_reverse = is_reverse[order]
+    lengths = lengths[order]
+    # Reads' 5' ends, 1-indexed.
+    five_p = np.where(is_reverse, starts + lengths, starts + 1)
+    unique_tids, tid_starts = np.unique(tids, return_index=True)
+    tid_ends = np.append(tid_starts[1:], len(tids))
+    for tid, lo, hi in zip(unique_tids, tid_starts, tid_ends):
+        if tid not in ranges:
+            continue
+        tid_starts_sorted = starts[lo:hi]
+        max_span = int((ends[lo:hi] - tid_starts_sorted).max())
+        for gene, start, end, gene_reverse, positions in ranges[tid]:
+            # Only reads starting within max_span of the range can
+            # overlap it.
+            first = lo + np.searchsorted(tid_starts_sorted,
+                                         start - max_span + 1)
+            last = lo + np.searchsorted(tid_starts_sorted, end)
+            if first >= last:
+                continue
+            selected = (ends[first:last] > start) & \
+                (is_reverse[first:last] == gene_reverse)
+            read_five_p = five_p[first:last][selected]
+            columns = np.searchsorted(positions, read_five_p)
+            columns[columns == len(positions)] = 0
+            found = positions[columns] == read_five_p
+            columns = columns[found]
+            if gene_reverse:
+                columns = len(positions) - 1 - columns
+            np.add.at(counts[gene],
+                      (columns,
+                       lengths[first:last][selected][found] -
+                       min_read_length),
+                      1)
+
+
+def count_reads(bam_file, locations, min_read_length=10,
+                max_read_length=50, chunk_size=CHUNK_SIZE,
+                num_threads=1):
+    """
+    Count reads for each gene in a single pass through a BAM file.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param locations: Gene locations (see \
+    :py:func:`get_gene_locations`)
+    :type locations: list(dict)
+    :param min_read_length: Minimum read length
+    :type min_read_length: int
+    :param max_read_length: Maximum read length
+    :type max_read_length: int
+    :param chunk_size: Maximum number of reads counted at a time
+    :type chunk_size: int
+    :param num_threads: Number of BGZF decompression threads
+    :type num_threads: int
+    :return: Read counts for each gene, a matrix of positions by read \
+    lengths
+    :rtype: list(numpy.ndarray)
+    :raise ValueError: If ``chunk_size`` is less than 1
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    num_lengths = max_read_length - min_read_length + 1
+    counts = [np.zeros((len(location["positions"]), num_lengths),
+                       dtype=np.int32)
+              for location in locations]
+    with pysam.AlignmentFile(bam_file, threads=num_threads) as bam:
+        ranges = {}
+        for gene, location in enumerate(locations):
+            tid = bam.get_tid(location["seqname"])
+            if tid < 0:
+                continue
+            for start, end in location["ranges"]:
+                ranges.setdefault(tid, []).append(
+                    (gene, start - 1, end, location["is_reverse"],
+                     location["positions"]))
+        chunk = ([], [], [], [], [])
+        add_tid, add_start, add_end, add_reverse, add_length = [
+            values.append for values in chunk]
+        num_reads = 0
+        for read in bam.fetch(until_eof=True):
+            # Reads with no CIGAR have no length and are unmapped.
+            length = read.infer_query_length()
+            if length is None or length < min_read_length or \
+               length > max_read_length or read.is_unmapped:
+                continue
+            add_tid(read.reference_id)
+            add_start(read.reference_start)
+            add_end(read.reference_end)
+            add_reverse(read.is_reverse)
+            add_length(length)
+            num_reads += 1
+            if num_reads == chunk_size:
+                count_chunk(counts, ranges,
+                            *[np.array(values) for values in chunk],
+                            min_read_length)
+                for values in chunk:
+                    values.clear()
+                num_reads = 0
+        if num_reads:
+            count_chunk(counts, ranges,
+                        *[np.array(values) for values in chunk],
+                        min_read_length)
+    return counts
+
+
+def get_gene_attributes(location, counts, min_read_length,
+                        max_read_length):
+    """
+    Get H5 attributes for a gene. See :py:func:`bam_to_h5`.
+
+    :param location: Gene location (see \
+    :py:func:`get_gene_locations`)
+    :type location: dict
+    :param counts: Read counts, a matrix of positions by read lengths
+    :type counts: numpy.ndarray
+    :param min_read_length: Minimum read length
+    :type min_read_length: int
+    :param max_read_length: Maximum read length
+    :type max_read_length: int
+    :return: Attributes (:py:const:`riboviz.h5.GENE_ATTRIBUTES`)
+    :rtype: dict(str or unicode => numpy.ndarray)
+    """
+    start_codon_pos = location["start_codon_pos"]
+    stop_codon_pos = location["stop_codon_pos"]
+    attributes = {
+        h5.READS_TOTAL: [counts.sum()],
+        h5.BUFFER_LEFT: [start_codon_pos[0] - 1],
+        h5.BUFFER_RIGHT: [counts.shape[0] - stop_codon_pos[2]],
+        h5.START_CODON_POS: start_codon_pos,
+        h5.STOP_CODON_POS: stop_codon_pos,
+        h5.READS_BY_LEN: counts.sum(axis=0),
+        h5.LENGTHS: np.arange(min_read_length, max_read_length + 1)
+    }
+    return {name: np.asarray(value, dtype=np.int32)
+            for name, value in attributes.items()}
+
+
+def bam_to_h5(bam_file, orf_gff_file, h5_file, feature="CDS",
+              min_read_length=10, max_read_length=50, buffer=250,
+              primary_id="gene_id", secondary_id=None, dataset="data",
+              stop_in_feature=False, is_riboviz_gff=True,
+              chunk_size=CHUNK_SIZE, num_threads=1, layout=h5.LEGACY):
+    """
+    Convert BAM file to RiboViz H5 file.
+
+    ``h5_file`` has a group, ``/<gene>/<dataset>/reads`` for each
+    ``<gene>`` in ``orf_gff_file``, identified by its ``primary_id``
+    attribute, with attributes:
+
+    * ``reads_total``: total number of reads.
+    * ``buffer_left``: number of nucleotides upstream of the start
+      codon.
+    * ``buffer_right``: number of nucleotides downstream of the stop
+      codon.
+    * ``start_codon_pos``: positions of start codon nucleotides.
+    * ``stop_codon_pos``: positions of stop codon nucleotides. If
+      ``is_riboviz_gff`` is ``False`` and ``stop_in_feature`` is
+      ``False``, the first position is the last nucleotide of the
+      feature + 1.
+    * ``lengths``: read lengths, ``min_read_length`` to
+      ``max_read_length``.
+    * ``reads_by_len``: number of reads of each length.
+
+    and a ``data`` data set with the number of reads whose 5' ends map
+    to each nucleotide position (rows) with each length (columns).
+
+    If ``secondary_id`` is provided then, for each gene whose
+    ``secondary_id`` attribute differs from its ``primary_id``
+    attribute, an external link from the former to the latter is
+    created.
+
+    All data sets and attributes are 32-bit integers.
+
+    This is the legacy layout. If ``layout`` is
+    :py:const:`riboviz.h5.CSR` then the same data is written in the
+    consolidated layout (see :py:mod:`riboviz.h5`).
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param orf_gff_file: GFF2/GFF3 Matched genome feature file, \
+    specifying coding sequences locations (start and stop coordinates) \
+    within the transcripts
+    :type orf_gff_file: str or unicode
+    :param h5_file: H5 output file
+    :type h5_file: str or unicode
+    :param feature: Feature e.g. ``CDS``, ``ORF``, or ``uORF``
+    :type feature: str or unicode
+    :param min_read_length: Minimum read length in H5 output
+    :type min_read_length: int
+    :param max_read_length: Maximum read length in H5 output
+    :type max_read_length: int
+    :param buffer: Length of flanking region around the feature, \
+    used only if ``is_riboviz_gff`` is ``False``
+    :type buffer: int
+    :param primary_id: Primary gene IDs to access the data
+    :type primary_id: str or unicode
+    :param secondary_id: Secondary gene IDs to access the data, or \
+    ``None``
+    :type secondary_id: str or unicode
+    :param dataset: Human-readable name of the dataset
+    :type dataset: str or unicode
+    :param stop_in_feature: Are stop codons part of the feature \
+    annotations in ``orf_gff_file``? Used only if ``is_riboviz_gff`` \
+    is ``False``
+    :type stop_in_feature: bool
+    :param is_riboviz_gff: Does ``orf_gff_file`` contain 3 elements \
+    per gene - UTR5, feature, and UTR3?
+    :type is_riboviz_gff: bool
+    :param chunk_size: Maximum number of reads counted at a time
+    :type chunk_size: int
+    :param num_threads: Number of BGZF decompression threads
+    :type num_threads: int
+    :param layout: H5 layout, one of :py:const:`riboviz.h5.LAYOUTS`
+    :type layout: str or unicode
+    :raise ValueError: If there are no features of type ``feature``, \
+    ``primary_id`` or ``secondary_id`` are not attributes, \
+    ``chunk_size`` is less than 1 or ``layout`` is unknown
+    """
+    locations = get_gene_locations(orf_gff_file, feature, buffer,
+                                   primary_id, secondary_id,
+                                   is_riboviz_gff, stop_in_feature)
+    counts = count_reads(bam_file, locations, min_read_length,
+                         max_read_length, chunk_size, num_threads)
+    genes = ((location["gene"], location["alt_gene"], gene_counts,
+              get_gene_attributes(location, gene_counts,
+                                  min_read_length, max_read_length))
+             for location, gene_counts in zip(locations, counts))
+    h5.write_h5(h5_file, dataset, genes, layout)
@@ -1,15 +1,78 @@
 """
 Barcode and UMI-related constants and functions.
 """
-import csv
+import gzip
 import itertools
+import numpy as np
 
 NUCLEOTIDES = "ACGT"
 """ Nucleotide letters. """
+BARCODE_INDEX_ALPHABET = NUCLEOTIDES + "N"
+"""
+Letters used to enumerate barcode variants when creating a barcode
+index.
+"""
 BARCODE_DELIMITER = "_"
 """ Default barcode delmiter in FASTQ headers. """
 UMI_DELIMITER = "_"
 """ Default UMI delmiter in FASTQ headers. """
+MAX_PACKED_LENGTH = 32
+"""
+Maximum length of barcodes encoded as 2-bit packed integers by
+:py:func:`encode_barcodes`.
+"""
+TILE_SIZE = 1 << 16
+"""
+Default maximum number of barcode pairs whose Hamming distances are
+computed at a time by :py:func:`get_barcode_distance_blocks`.
+"""
+MIN_PACKED_PAIRS = 1024
+"""
+Minimum number of sequence pairs for which :py:func:`hamming_distances`
+packs sequences before computing distances. For fewer pairs, the cost
+of packing outweighs its benefit.
+"""
+TSV_FORMAT = "tsv"
+"""
+:py:func:`create_barcode_pairs` format for barcode pairs and Hamming
+distances as delimiter-separated values.
+"""
+BINARY_FORMAT = "binary"
+"""
+:py:func:`create_barcode_pairs` format for barcode pairs and Hamming
+distances as :py:const:`BARCODE_PAIR_DTYPE` records.
+"""
+HISTOGRAM_FORMAT = "histogram"
+"""
+:py:func:`create_barcode_pairs` format for numbers of barcode pairs
+with each Hamming distance, as delimiter-separated values.
+"""
+BARCODE_PAIR_FORMATS = [TSV_FORMAT, BINARY_FORMAT, HISTOGRAM_FORMAT]
+""" :py:func:`create_barcode_pairs` formats. """
+BARCODE_PAIR_DTYPE = np.dtype([("barcode1", "<u8"),
+                               ("barcode2", "<u8"),
+                               ("distance", "u1")])
+"""
+Barcode pair record, with barcodes encoded by
+:py:func:`encode_barcodes`, for :py:const:`BINARY_FORMAT`.
+"""
+DISTANCE = "Distance"
+""" :py:const:`HISTOGRAM_FORMAT` column name. """
+COUNT = "Count"
+""" :py:const:`HISTOGRAM_FORMAT` column name. """
+NUCLEOTIDE_CODES = np.array(
+    [NUCLEOTIDES.index(chr(byte)) if chr(byte) in NUCLEOTIDES else 255
+     for byte in range(256)],
+    dtype=np.uint8)
+"""
+2-bit code of each byte in :py:const:`NUCLEOTIDES`, or 255 for other
+bytes, used by :py:func:`pack_sequence_bytes`.
+"""
+LINE_TERMINATOR = "\r\n"
+"""
+Line terminator for :py:const:`TSV_FORMAT` and
+:py:const:`HISTOGRAM_FORMAT`, as used by ``csv.writer``.
+"""
 
 
 def hamming_distance(str1, str2):
@@ -26,28 +89,443 @@ def hamming_distance(str1, str2):
     return sum(1 for (a, b) in zip(str1, str2) if a != b)
 
 
-def create_barcode_pairs(filename, length=1, delimiter="\t"):
+def get_sequence_bytes(sequences):
+    """
+    Get sequences of equal length as a 2D array of bytes, one row per
+    sequence.
+
+    :param sequences: Sequences
+    :type sequences: list(str or unicode or bytes)
+    :return: Bytes, with shape ``(len(sequences), length)``
+    :rtype: numpy.ndarray(numpy.uint8)
+    :raise ValueError: If sequences have different lengths
+    """
+    sequences = [sequence.encode("ascii") if isinstance(sequence, str)
+                 else bytes(sequence) for sequence in sequences]
+    if not sequences:
+        return np.zeros((0, 0), dtype=np.uint8)
+    length = len(sequences[0])
+    if any(len(sequence) != length for sequence in sequences):
+        raise ValueError("Sequences have different lengths")
+    return np.frombuffer(b"".join(sequences), dtype=np.uint8).reshape(
+        len(sequences), length)
+
+
+def pack_sequence_bytes(data):
+    """
+    Encode sequences, as returned by :py:func:`get_sequence_bytes`, as
+    2-bit packed integers, as for :py:func:`encode_barcodes`.
+
+    :param data: Bytes, with shape ``(number of sequences, length)``
+    :type data: numpy.ndarray(numpy.uint8)
+    :return: Codes or ``None`` if the sequences are longer than \
+    :py:const:`MAX_PACKED_LENGTH` or have letters not in \
+    :py:const:`NUCLEOTIDES`
+    :rtype: numpy.ndarray(numpy.uint64)
+    """
+    if data.shape[1] > MAX_PACKED_LENGTH:
+        return None
+    digits = NUCLEOTIDE_CODES[data]
+    if (digits == 255).any():
+        return None
+    shifts = np.arange(2 * (data.shape[1] - 1), -1, -2, dtype=np.uint64)
+    return (digits.astype(np.uint64) << shifts).sum(axis=1,
+                                                    dtype=np.uint64)
+
+
+def hamming_distances(candidates, references, tile_size=TILE_SIZE):
+    """
+    Get the Hamming distances between each of a batch of candidate
+    sequences and each of a set of reference sequences, all of equal
+    length.
+
+    If there are at least :py:const:`MIN_PACKED_PAIRS` pairs and
+    every sequence can be packed by :py:func:`pack_sequence_bytes`
+    then distances are computed by
+    :py:func:`packed_hamming_distances`, otherwise the sequences'
+    bytes are compared using NumPy broadcasting. Either way, rows of
+    candidates are processed in blocks so at most about ``tile_size``
+    distances are computed at a time.
+
+    :param candidates: Candidate sequences
+    :type candidates: list(str or unicode or bytes)
+    :param references: Reference sequences
+    :type references: list(str or unicode or bytes)
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    :return: Hamming distances, with shape ``(len(candidates), \
+    len(references))``
+    :rtype: numpy.ndarray(numpy.int32)
+    :raise ValueError: If sequences have different lengths
+    """
+    data1 = get_sequence_bytes(candidates)
+    data2 = get_sequence_bytes(references)
+    distances = np.zeros((len(data1), len(data2)), dtype=np.int32)
+    if len(data1) == 0 or len(data2) == 0:
+        return distances
+    if data1.shape[1] != data2.shape[1]:
+        raise ValueError("Sequences have different lengths")
+    codes1 = codes2 = None
+    if len(data1) * len(data2) >= MIN_PACKED_PAIRS:
+        codes1 = pack_sequence_bytes(data1)
+    if codes1 is not None:
+        codes2 = pack_sequence_bytes(data2)
+    num_rows = max(1, tile_size // len(data2))
+    for row in range(0, len(data1), num_rows):
+        end = row + num_rows
+        if codes2 is not None:
+            distances[row:end] = packed_hamming_distances(
+                codes1[row:end], codes2)
+        else:
+            distances[row:end] = np.count_nonzero(
+                data1[row:end, np.newaxis, :] != data2[np.newaxis, :, :],
+                axis=2)
+    return distances
+
+
+def encode_barcodes(barcodes):
+    """
+    Encode barcodes of equal length, using letters from
+    :py:const:`NUCLEOTIDES`, as 2-bit packed integers, with the first
+    letter in the most significant bits. Sorting codes sorts the
+    barcodes in the order given by ``itertools.product`` over
+    :py:const:`NUCLEOTIDES`, so the codes of every barcode of length
+    ``k``, in that order, are ``0`` to ``4 ** k - 1``.
+
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :return: Codes
+    :rtype: numpy.ndarray(numpy.uint64)
+    :raise ValueError: If barcodes have different lengths, are longer \
+    than :py:const:`MAX_PACKED_LENGTH` or have letters not in \
+    :py:const:`NUCLEOTIDES`
+    """
+    if not barcodes:
+        return np.zeros(0, dtype=np.uint64)
+    if len(barcodes[0]) > MAX_PACKED_LENGTH:
+        raise ValueError("Barcodes are longer than {}".format(
+            MAX_PACKED_LENGTH))
+    try:
+        data = get_sequence_bytes(barcodes)
+    except ValueError as e:
+        raise ValueError("Barcodes have different lengths") from e
+    codes = pack_sequence_bytes(data)
+    if codes is None:
+        raise ValueError("Barcodes have letters other than {}".format(
+            NUCLEOTIDES))
+    return codes
+
+
+def decode_barcodes(codes, length):
+    """
+    Decode barcodes encoded by :py:func:`encode_barcodes`.
+
+    :param codes: Codes
+    :type codes: numpy.ndarray(numpy.uint64)
+    :param length: Barcode length
+    :type length: int
+    :return: Barcodes
+    :rtype: list(str or unicode)
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    letters = np.frombuffer(NUCLEOTIDES.encode("ascii"), dtype=np.uint8)
+    shifts = np.arange(2 * (length - 1), -1, -2, dtype=np.uint64)
+    digits = (codes[:, np.newaxis] >> shifts) & np.uint64(3)
+    data = letters[digits].tobytes().decode("ascii")
+    return [data[start:start + length]
+            for start in range(0, len(data), length)]
+
+
+def packed_hamming_distances(codes1, codes2):
+    """
+    Get the Hamming distances between every pair of barcodes encoded
+    by :py:func:`encode_barcodes`.
+
+    Each pair of codes is XORed, so each 2-bit letter which differs
+    is non-zero, then these letters are each reduced to a single bit
+    and the bits counted, using a bitwise population count.
+
+    :param codes1: Codes
+    :type codes1: numpy.ndarray(numpy.uint64)
+    :param codes2: Codes
+    :type codes2: numpy.ndarray(numpy.uint64)
+    :return: Hamming distances, with shape ``(len(codes1), \
+    len(codes2))``
+    :rtype: numpy.ndarray(numpy.uint8)
+    """
+    codes1 = np.asarray(codes1, dtype=np.uint64)
+    codes2 = np.asarray(codes2, dtype=np.uint64)
+    # Use 32-bit arithmetic, which is faster, for barcodes of length
+    # 16 or less.
+    dtype = np.uint64
+    if (len(codes1) == 0 or codes1.max() <= 0xffffffff) and \
+       (len(codes2) == 0 or codes2.max() <= 0xffffffff):
+        dtype = np.uint32
+    num_bits = np.dtype(dtype).itemsize * 8
+    diff = codes1.astype(dtype)[:, np.newaxis] ^ \
+        codes2.astype(dtype)[np.newaxis, :]
+    # One bit, the lower, per letter which differs.
+    diff |= diff >> dtype(1)
+    diff &= dtype(0x5555555555555555 >> (64 - num_bits))
+    # Population count, starting with 2-bit counts.
+    diff = (diff & dtype(0x3333333333333333 >> (64 - num_bits))) + \
+        ((diff >> dtype(2)) & dtype(0x3333333333333333 >> (64 - num_bits)))
+    diff += diff >> dtype(4)
+    diff &= dtype(0x0f0f0f0f0f0f0f0f >> (64 - num_bits))
+    diff *= dtype(0x0101010101010101 >> (64 - num_bits))
+    diff >>= dtype(num_bits - 8)
+    return diff.astype(np.uint8)
+
+
+def get_barcode_distance_blocks(codes,
+                                unordered=False,
+                                tile_size=TILE_SIZE):
+    """
+    Iterate over blocks of the matrix of Hamming distances between
+    every pair of barcodes encoded by :py:func:`encode_barcodes`,
+    computing at most ``tile_size`` distances at a time, using
+    :py:func:`packed_hamming_distances`.
+
+    Blocks are either whole rows or parts of a single row, so
+    iterating over the blocks, and their rows, gives the pairs in the
+    order given by ``itertools.product(codes, repeat=2)``. If
+    ``unordered`` is ``True`` then blocks wholly below the diagonal
+    are skipped.
+
+    :param codes: Codes
+    :type codes: numpy.ndarray(numpy.uint64)
+    :param unordered: Skip blocks wholly below the diagonal?
+    :type unordered: bool
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    :return: Iterator over blocks, each (row indices, column \
+    indices, Hamming distances)
+    :rtype: collections.Iterable(tuple(numpy.ndarray(numpy.int64), \
+    numpy.ndarray(numpy.int64), numpy.ndarray(numpy.uint8)))
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    num_codes = len(codes)
+    num_rows = max(1, tile_size // max(num_codes, 1))
+    num_columns = min(num_codes, max(1, tile_size))
+    for row in range(0, num_codes, num_rows):
+        rows = np.arange(row, min(row + num_rows, num_codes))
+        start = row + 1 if unordered and num_rows == 1 else 0
+        for column in range(start, num_codes, num_columns):
+            columns = np.arange(column, min(column + num_columns,
+                                            num_codes))
+            yield rows, columns, packed_hamming_distances(
+                codes[rows], codes[columns])
+
+
+def get_barcode_distance_tiles(codes,
+                               unordered=False,
+                               max_distance=None,
+                               tile_size=TILE_SIZE):
+    """
+    Iterate over the Hamming distances between pairs of barcodes
+    encoded by :py:func:`encode_barcodes`, using
+    :py:func:`get_barcode_distance_blocks`.
+
+    Pairs are (``codes[i]``, ``codes[j]``) for every ``i`` and ``j``
+    in the order given by ``itertools.product(codes, repeat=2)``, or,
+    if ``unordered`` is ``True``, only those with ``i < j``. If
+    ``max_distance`` is not ``None`` then only pairs within this
+    distance are included.
+
+    :param codes: Codes
+    :type codes: numpy.ndarray(numpy.uint64)
+    :param unordered: Include each unordered pair of distinct \
+    barcodes once only?
+    :type unordered: bool
+    :param max_distance: Maximum Hamming distance or ``None``
+    :type max_distance: int
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    :return: Iterator over tiles, each (indices of first barcodes, \
+    indices of second barcodes, Hamming distances)
+    :rtype: collections.Iterable(tuple(numpy.ndarray(numpy.int64), \
+    numpy.ndarray(numpy.int64), numpy.ndarray(numpy.uint8)))
+    """
+    for rows, columns, distances in get_barcode_distance_blocks(
+            codes, unordered, tile_size):
+        mask = None
+        if unordered:
+            mask = columns[np.newaxis, :] > rows[:, np.newaxis]
+        if max_distance is not None:
+            within = distances <= max_distance
+            mask = within if mask is None else mask & within
+        if mask is None:
+            indices1 = np.repeat(rows, len(columns))
+            indices2 = np.tile(columns, len(rows))
+            distances = distances.ravel()
+        else:
+            tile_rows, tile_columns = np.nonzero(mask)
+            indices1 = rows[tile_rows]
+            indices2 = columns[tile_columns]
+            distances = distances[tile_rows, tile_columns]
+        if len(distances):
+            yield indices1, indices2, distances
+
+
+def count_barcode_distances(codes,
+                            length,
+                            unordered=False,
+                            tile_size=TILE_SIZE):
+    """
+    Count the pairs of barcodes encoded by :py:func:`encode_barcodes`
+    with each Hamming distance, using
+    :py:func:`get_barcode_distance_blocks`.
+
+    :param codes: Codes
+    :type codes: numpy.ndarray(numpy.uint64)
+    :param length: Barcode length
+    :type length: int
+    :param unordered: Count each unordered pair of distinct barcodes \
+    once only?
+    :type unordered: bool
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    :return: Number of pairs with each distance, from 0 to ``length``
+    :rtype: numpy.ndarray(numpy.int64)
+    """
+    counts = np.zeros(length + 1, dtype=np.int64)
+    for rows, columns, distances in get_barcode_distance_blocks(
+            codes, unordered, tile_size):
+        if unordered:
+            distances = distances[columns[np.newaxis, :] >
+                                  rows[:, np.newaxis]]
+        counts += np.bincount(distances.ravel(), minlength=length + 1)
+    return counts
+
+
+def create_barcode_pairs(filename,
+                         length=1,
+                         delimiter="\t",
+                         barcodes=None,
+                         unordered=False,
+                         max_distance=None,
+                         output_format=TSV_FORMAT,
+                         tile_size=TILE_SIZE):
     """
     Create barcode pairs and write each pair plus the Hamming distance
-    between them to a file of tab-separated values.
+    between them to a file.
+
+    Barcodes are every barcode of length ``length`` over
+    :py:const:`NUCLEOTIDES` or, if provided, ``barcodes`` (for
+    example, the ``TagRead`` column of a sample sheet). Barcodes are
+    encoded by :py:func:`encode_barcodes` and distances computed in
+    tiles by :py:func:`get_barcode_distance_tiles` which describes
+    ``unordered`` and ``max_distance``.
+
+    ``output_format`` is one of:
+
+    * :py:const:`TSV_FORMAT`: a row per pair with the barcodes and
+      distance separated by ``delimiter``.
+    * :py:const:`BINARY_FORMAT`: a :py:const:`BARCODE_PAIR_DTYPE`
+      record per pair, readable using
+      :py:func:`read_barcode_pairs`.
+    * :py:const:`HISTOGRAM_FORMAT`: a header, with
+      :py:const:`DISTANCE` and :py:const:`COUNT` columns, then a row
+      per distance, from 0 to the barcode length, with the number of
+      pairs with that distance, separated by ``delimiter``.
+
+    If ``filename`` ends with ``.gz`` then the file is
+    GZIP-compressed. If there are no barcodes (``length`` is 0 or
+    less and ``barcodes`` is ``None`` or ``barcodes`` is empty) then
+    an empty file is created.
 
     :param filename: Filename
     :type filename: str or unicode
-    :param length: Barcode length
+    :param length: Barcode length, if ``barcodes`` is ``None``
     :type length: int
     :param delimiter: Delimiter
     :type delimiter: str or unicode
+    :param barcodes: Barcodes or ``None``
+    :type barcodes: list(str or unicode)
+    :param unordered: Include each unordered pair of distinct \
+    barcodes once only?
+    :type unordered: bool
+    :param max_distance: Maximum Hamming distance or ``None``
+    :type max_distance: int
+    :param output_format: Output format, one of \
+    :py:const:`BARCODE_PAIR_FORMATS`
+    :type output_format: str or unicode
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    :raise ValueError: If ``output_format`` is invalid or \
+    ``barcodes`` cannot be encoded by :py:func:`encode_barcodes`
     """
-    if length <= 0:
-        open(filename, 'w').close()
-        return
-    barcodes = [''.join(i) for i in itertools.product(NUCLEOTIDES,
-                                                      repeat=length)]
-    with open(filename, "w") as f:
-        writer = csv.writer(f, delimiter=delimiter)
-        for (a, b) in itertools.product(barcodes, repeat=2):
-            distance = hamming_distance(a, b)
-            writer.writerow([a, b, distance])
+    if output_format not in BARCODE_PAIR_FORMATS:
+        raise ValueError("Invalid format {}, expected one of {}".format(
+            output_format, BARCODE_PAIR_FORMATS))
+    if barcodes is None:
+        if length > MAX_PACKED_LENGTH:
+            raise ValueError("Barcodes are longer than {}".format(
+                MAX_PACKED_LENGTH))
+        length = max(length, 0)
+        codes = np.arange(4 ** length if length > 0 else 0,
+                          dtype=np.uint64)
+    else:
+        barcodes = list(barcodes)
+        codes = encode_barcodes(barcodes)
+        length = len(barcodes[0]) if barcodes else 0
+    open_file = gzip.open if filename.endswith(".gz") else open
+    with open_file(filename, "wb") as f:
+        if len(codes) == 0:
+            return
+        if output_format == HISTOGRAM_FORMAT:
+            counts = count_barcode_distances(codes, length, unordered,
+                                             tile_size)
+            rows = [DISTANCE + delimiter + COUNT]
+            rows.extend(delimiter.join([str(distance), str(count)])
+                        for distance, count in enumerate(counts))
+            f.write("".join(row + LINE_TERMINATOR
+                            for row in rows).encode())
+            return
+        tiles = get_barcode_distance_tiles(codes, unordered,
+                                           max_distance, tile_size)
+        if output_format == BINARY_FORMAT:
+            for indices1, indices2, distances in tiles:
+                records = np.empty(len(distances),
+                                   dtype=BARCODE_PAIR_DTYPE)
+                records["barcode1"] = codes[indices1]
+                records["barcode2"] = codes[indices2]
+                records["distance"] = distances
+                f.write(records.tobytes())
+            return
+        if barcodes is None:
+            barcodes = decode_barcodes(codes, length)
+        prefixes = [barcode + delimiter for barcode in barcodes]
+        suffixes = [str(distance) + LINE_TERMINATOR
+                    for distance in range(length + 1)]
+        for indices1, indices2, distances in tiles:
+            f.write("".join([
+                prefixes[index1] + prefixes[index2] + suffixes[distance]
+                for index1, index2, distance in zip(
+                    indices1.tolist(),
+                    indices2.tolist(),
+                    distances.tolist())]).encode())
+
+
+def read_barcode_pairs(filename, length):
+    """
+    Read barcode pairs and Hamming distances written by
+    :py:func:`create_barcode_pairs` in :py:const:`BINARY_FORMAT`.
+
+    :param filename: Filename, GZIP-compressed if it ends with ``.gz``
+    :type filename: str or unicode
+    :param length: Barcode length
+    :type length: int
+    :return: Iterator over (barcode, barcode, Hamming distance)
+    :rtype: collections.Iterable(tuple(str or unicode, str or \
+    unicode, int))
+    """
+    open_file = gzip.open if filename.endswith(".gz") else open
+    with open_file(filename, "rb") as f:
+        records = np.frombuffer(f.read(), dtype=BARCODE_PAIR_DTYPE)
+    yield from zip(decode_barcodes(records["barcode1"], length),
+                   decode_barcodes(records["barcode2"], length),
+                   records["distance"].tolist())
 
 
 def barcode_matches(record,
@@ -85,3 +563,217 @@ def barcode_matches(record,
     if len(candidate) != len(barcode):
         return False
     return hamming_distance(candidate, barcode) <= mismatches
+
+
+def get_barcode(record, delimiter=BARCODE_DELIMITER):
+    """
+    Get the barcode from a FASTQ record header.
+
+    The header is assumed to be of form::
+
+        @...<DELIMITER><BARCODE><DELIMITER>...
+
+    :param record: FASTQ record
+    :type record: str or unicode
+    :param delimiter: Barcode delimiter
+    :type delimiter: str or unicode
+    :returns: ``<BARCODE>`` or ``None`` if there is no barcode
+    :rtype: str or unicode
+    """
+    chunks = record.split(delimiter, 2)
+    if len(chunks) == 1:
+        return None
+    return chunks[1]
+
+
+def get_barcode_variants(barcode,
+                         mismatches=0,
+                         alphabet=BARCODE_INDEX_ALPHABET):
+    """
+    Get all variants of a barcode within a given number of
+    mismatches, using letters from ``alphabet`` for substitutions.
+
+    :param barcode: Barcode
+    :type barcode: str or unicode
+    :param mismatches: Number of mismatches
+    :type mismatches: int
+    :param alphabet: Letters to substitute
+    :type alphabet: str or unicode
+    :returns: Iterator over (variant, Hamming distance from \
+    ``barcode``) pairs
+    :rtype: collections.Iterable(tuple(str or unicode, int))
+    """
+    for distance in range(min(mismatches, len(barcode)) + 1):
+        for positions in itertools.combinations(range(len(barcode)),
+                                                distance):
+            substitutions = [[letter for letter in alphabet
+                              if letter != barcode[position]]
+                             for position in positions]
+            for letters in itertools.product(*substitutions):
+                variant = list(barcode)
+                for position, letter in zip(positions, letters):
+                    variant[position] = letter
+                yield "".join(variant), distance
+
+
+def create_barcode_index(barcodes,
+                         mismatches=0,
+                         alphabet=BARCODE_INDEX_ALPHABET):
+    """
+    Create an index from every barcode variant within ``mismatches``
+    of a barcode in ``barcodes`` to the barcode closest to it in
+    terms of Hamming distance.
+
+    Each index value is a tuple (index into ``barcodes``, Hamming
+    distance, ambiguous flag). If a variant is equally close to two
+    or more barcodes then it is mapped to the first of these in
+    ``barcodes`` and its ambiguous flag is ``True``.
+
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param mismatches: Number of mismatches
+    :type mismatches: int
+    :param alphabet: Letters to substitute
+    :type alphabet: str or unicode
+    :returns: Barcode index
+    :rtype: dict(str or unicode, tuple(int, int, bool))
+    """
+    barcode_index = {}
+    for position, barcode in enumerate(barcodes):
+        for variant, distance in get_barcode_variants(barcode,
+                                                      mismatches,
+                                                      alphabet):
+            match = barcode_index.get(variant)
+            if match is None or distance < match[1]:
+                barcode_index[variant] = (position, distance, False)
+            elif distance == match[1] and position != match[0]:
+                barcode_index[variant] = (match[0], distance, True)
+    return barcode_index
+
+
+def match_barcode(candidate,
+                  barcodes,
+                  barcode_index,
+                  mismatches=0,
+                  alphabet=BARCODE_INDEX_ALPHABET):
+    """
+    Find the barcode closest to ``candidate`` in terms of Hamming
+    distance, using an index created by
+    :py:func:`create_barcode_index`.
+
+    If ``candidate`` has letters not in ``alphabet`` then
+    ``barcodes`` are scanned. The result is not added to
+    ``barcode_index``, so the index does not grow with the number of
+    distinct candidates read.
+
+    :param candidate: Barcode to match
+    :type candidate: str or unicode
+    :param barcodes: Barcodes used to create ``barcode_index``
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param mismatches: Number of mismatches used to create \
+    ``barcode_index``
+    :type mismatches: int
+    :param alphabet: Letters used to create ``barcode_index``
+    :type alphabet: str or unicode
+    :returns: (index into ``barcodes``, Hamming distance, \
+    ambiguous flag) or ``None`` if no barcode is within \
+    ``mismatches`` of ``candidate``
+    :rtype: tuple(int, int, bool)
+    """
+    if candidate is None:
+        return None
+    match = barcode_index.get(candidate)
+    if match is not None or all(letter in alphabet for letter in candidate):
+        return match
+    return match_barcodes([candidate], barcodes, mismatches)[0]
+
+
+def match_barcodes(candidates, barcodes, mismatches=0):
+    """
+    Find the barcodes closest to each of a batch of candidates in
+    terms of Hamming distance, by computing the distances from all the
+    candidates to all the barcodes of the same length using
+    :py:func:`hamming_distances`.
+
+    If a candidate is equally close to two or more barcodes then it
+    is matched to the first of these in ``barcodes`` and its
+    ambiguous flag is ``True``.
+
+    :param candidates: Barcodes to match (or ``None``)
+    :type candidates: list(str or unicode)
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param mismatches: Number of mismatches
+    :type mismatches: int
+    :returns: For each candidate, (index into ``barcodes``, Hamming \
+    distance, ambiguous flag) or ``None`` if no barcode is within \
+    ``mismatches`` of the candidate
+    :rtype: list(tuple(int, int, bool))
+    """
+    matches = [None] * len(candidates)
+    for length in set(len(candidate) for candidate in candidates
+                      if candidate is not None):
+        rows = [index for index, candidate in enumerate(candidates)
+                if candidate is not None and len(candidate) == length]
+        columns = np.array([index for index, barcode in enumerate(barcodes)
+                            if len(barcode) == length], dtype=np.int64)
+        if len(columns) == 0:
+            continue
+        distances = hamming_distances(
+            [candidates[row] for row in rows],
+            [barcodes[column] for column in columns])
+        closest = distances.argmin(axis=1)
+        min_distances = distances.min(axis=1)
+        ambiguous = (distances == min_distances[:, np.newaxis]).sum(
+            axis=1) > 1
+        for row, column, distance, is_ambiguous in zip(
+                rows,
+                columns[closest].tolist(),
+                min_distances.tolist(),
+                ambiguous.tolist()):
+            if distance <= mismatches:
+                matches[row] = (column, distance, is_ambiguous)
+    return matches
+
+
+def match_barcodes_by_index(candidates,
+                            barcodes,
+                            barcode_index,
+                            mismatches=0,
+                            alphabet=BARCODE_INDEX_ALPHABET):
+    """
+    Find the barcodes closest to each of a batch of candidates in
+    terms of Hamming distance, as for :py:func:`match_barcode`.
+
+    Candidates not in ``barcode_index`` with letters not in
+    ``alphabet`` are matched together by :py:func:`match_barcodes`.
+    The results are not added to ``barcode_index``.
+
+    :param candidates: Barcodes to match (or ``None``)
+    :type candidates: list(str or unicode)
+    :param barcodes: Barcodes used to create ``barcode_index``
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param mismatches: Number of mismatches used to create \
+    ``barcode_index``
+    :type mismatches: int
+    :param alphabet: Letters used to create ``barcode_index``
+    :type alphabet: str or unicode
+    :returns: For each candidate, (index into ``barcodes``, Hamming \
+    distance, ambiguous flag) or ``None`` if no barcode is within \
+    ``mismatches`` of the candidate
+    :rtype: list(tuple(int, int, bool))
+    """
+    unindexed = list({candidate for candidate in candidates
+                      if candidate is not None and
+                      candidate not in barcode_index and
+                      not all(letter in alphabet for letter in candidate)})
+    unindexed_matches = dict(zip(unindexed, match_barcodes(
+        unindexed, barcodes, mismatches)))
+    return [None if candidate is None else
+            barcode_index.get(candidate,
+                              unindexed_matches.get(candidate))
+            for candidate in candidates]
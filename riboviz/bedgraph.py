@@ -1,7 +1,16 @@
 """
 Bedgraph-related constants and functions.
+
+:py:func:`write_bedgraphs` is a Python alternative to running
+``bedtools genomecov -ibam <BAM> -trackline -bga -5 -strand +`` and
+``... -strand -``. It reads the BAM file once, counting the 5' ends
+of reads on both strands, and writes both bedGraph files.
 """
+import multiprocessing
+import os
+import numpy as np
 import pandas as pd
+import pysam
 
 BEDGRAPH_EXT = "bedgraph"
 """ File extension. """
@@ -11,6 +20,10 @@ TRACK_PREFIX = "track type=bedGraph"
 """ Track line prefix. """
 COLUMNS = ["Chromosome", "Start", "End", "Data"]
 """ Column names. """
+PLUS_STRAND = "+"
+""" Plus strand. """
+MINUS_STRAND = "-"
+""" Minus strand. """
 
 
 def load_bedgraph(bed_file):
@@ -71,3 +84,209 @@ def equal_bedgraph(file1, file2):
         % (file1, data1.shape[0], file2, data2.shape[0])
     assert data1.equals(data2),\
         "Unequal bedGraph data: %s, %s" % (file1, file2)
+
+
+def get_five_prime_end(read):
+    """
+    Get the 0-indexed position of a read's 5' end, as for ``bedtools
+    genomecov -5``: the alignment start for reads on the ``+`` strand
+    and the alignment end, inclusive, for reads on the ``-`` strand.
+    Soft-clipped bases are not included.
+
+    :param read: Read
+    :type read: pysam.AlignedSegment
+    :return: Position
+    :rtype: int
+    """
+    if read.is_reverse:
+        return read.reference_end - 1
+    return read.reference_start
+
+
+def format_intervals(contig, counts):
+    """
+    Run-length encode counts for each position of a reference
+    sequence into bedGraph rows, one for each run of positions with
+    the same count, as for ``bedtools genomecov -bga``, including
+    runs with count 0.
+
+    :param contig: Reference sequence name
+    :type contig: str or unicode
+    :param counts: Count at each position
+    :type counts: numpy.ndarray
+    :return: bedGraph rows
+    :rtype: str or unicode
+    """
+    if len(counts) == 0:
+        return ""
+    starts = np.flatnonzero(np.r_[True, counts[1:] != counts[:-1]])
+    ends = np.r_[starts[1:], len(counts)]
+    return "".join(["{}\t{}\t{}\t{}\n".format(contig, start, end, value)
+                    for start, end, value in zip(starts.tolist(),
+                                                 ends.tolist(),
+                                                 counts[starts].tolist())])
+
+
+def format_positions(contig, length, positions):
+    """
+    Count the 5' ends at each position of a reference sequence and
+    format these as bedGraph rows (see :py:func:`format_intervals`).
+    Positions outside the reference sequence are ignored.
+
+    :param contig: Reference sequence name
+    :type contig: str or unicode
+    :param length: Reference sequence length
+    :type length: int
+    :param positions: 5' end positions
+    :type positions: list(int)
+    :return: bedGraph rows
+    :rtype: str or unicode
+    """
+    positions = np.array(positions, dtype=np.int64)
+    positions = positions[(positions >= 0) & (positions < length)]
+    return format_intervals(contig,
+                            np.bincount(positions, minlength=length))
+
+
+def count_contig(bam_file, contig, num_threads=1):
+    """
+    Count the 5' ends of the mapped reads on a reference sequence, for
+    each strand, and format these as bedGraph rows (see
+    :py:func:`format_positions`).
+
+    :param bam_file: Indexed BAM file
+    :type bam_file: str or unicode
+    :param contig: Reference sequence name
+    :type contig: str or unicode
+    :param num_threads: Number of BGZF decompression threads
+    :type num_threads: int
+    :return: bedGraph rows for the ``+`` and ``-`` strands, or \
+    ``None`` for a strand with no reads
+    :rtype: tuple(str or unicode, str or unicode)
+    """
+    positions = ([], [])
+    with pysam.AlignmentFile(bam_file, "rb", threads=num_threads) as bam:
+        length = bam.get_reference_length(contig)
+        for read in bam.fetch(contig):
+            if read.is_unmapped:
+                continue
+            positions[read.is_reverse].append(get_five_prime_end(read))
+    return tuple(format_positions(contig, length, strand_positions)
+                 if strand_positions else None
+                 for strand_positions in positions)
+
+
+def _count_contig_task(args):
+    """
+    Unpack arguments and call :py:func:`count_contig`.
+
+    :param args: Arguments
+    :type args: tuple
+    :return: See :py:func:`count_contig`
+    :rtype: tuple(str or unicode, str or unicode)
+    """
+    return count_contig(*args)
+
+
+def count_reads(bam):
+    """
+    Count the 5' ends of mapped reads in a single pass through a BAM
+    file, for each strand, and format these as bedGraph rows (see
+    :py:func:`format_positions`). As for ``bedtools genomecov``, the
+    counts for a reference sequence on a strand are output each time
+    a read on that strand is on a different reference sequence to
+    the previous read on that strand.
+
+    :param bam: BAM file
+    :type bam: pysam.AlignmentFile
+    :return: Strand (0 for ``+``, 1 for ``-``), reference sequence \
+    name and bedGraph rows
+    :rtype: collections.Iterable(tuple(int, str or unicode, \
+    str or unicode))
+    """
+    tids = [None, None]
+    positions = ([], [])
+    for read in bam.fetch(until_eof=True):
+        if read.is_unmapped:
+            continue
+        strand = int(read.is_reverse)
+        if read.reference_id != tids[strand]:
+            if tids[strand] is not None:
+                contig = bam.get_reference_name(tids[strand])
+                yield strand, contig, format_positions(
+                    contig, bam.lengths[tids[strand]], positions[strand])
+            tids[strand] = read.reference_id
+            positions[strand].clear()
+        positions[strand].append(get_five_prime_end(read))
+    for strand, tid in enumerate(tids):
+        if tid is not None:
+            contig = bam.get_reference_name(tid)
+            yield strand, contig, format_positions(
+                contig, bam.lengths[tid], positions[strand])
+
+
+def write_bedgraphs(bam_file,
+                    plus_bedgraph_file,
+                    minus_bedgraph_file,
+                    num_processes=1,
+                    num_threads=1):
+    """
+    Write bedGraph files of the number of 5' ends of mapped reads at
+    each position on the ``+`` and ``-`` strands, in the format of
+    ``bedtools genomecov -ibam <BAM> -trackline -bga -5 -strand
+    <STRAND>``. The files have not been compared to files from
+    ``bedtools``.
+
+    The BAM file is read once and both files are written as the
+    counts for each reference sequence are completed. Each file has a
+    track line then the rows for each reference sequence with reads on
+    the strand, in the order in which they are first seen, followed by
+    a row with count 0 for each other reference sequence, in header
+    order.
+
+    If ``num_processes`` is more than 1 and ``bam_file`` is indexed
+    then the reads on each reference sequence are counted by a
+    separate task and the results written in reference order, which,
+    for a coordinate-sorted BAM file, gives the same files.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param plus_bedgraph_file: ``+`` strand bedGraph file
+    :type plus_bedgraph_file: str or unicode
+    :param minus_bedgraph_file: ``-`` strand bedGraph file
+    :type minus_bedgraph_file: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param num_threads: Number of BGZF decompression threads
+    :type num_threads: int
+    :raise FileNotFoundError: If the BAM file cannot be found
+    """
+    if not os.path.isfile(bam_file):
+        raise FileNotFoundError(bam_file)
+    with pysam.AlignmentFile(bam_file, "rb", threads=num_threads) as bam, \
+            open(plus_bedgraph_file, "w") as plus_file, \
+            open(minus_bedgraph_file, "w") as minus_file:
+        files = (plus_file, minus_file)
+        visited = (set(), set())
+        for bedgraph_file in files:
+            bedgraph_file.write(TRACK_PREFIX + "\n")
+        if num_processes > 1 and bam.has_index():
+            contigs = [stats.contig for stats in
+                       bam.get_index_statistics() if stats.mapped > 0]
+            tasks = [(bam_file, contig) for contig in contigs]
+            with multiprocessing.Pool(num_processes) as pool:
+                for contig, rows in zip(
+                        contigs, pool.imap(_count_contig_task, tasks)):
+                    for strand, strand_rows in enumerate(rows):
+                        if strand_rows is not None:
+                            files[strand].write(strand_rows)
+                            visited[strand].add(contig)
+        else:
+            for strand, contig, rows in count_reads(bam):
+                files[strand].write(rows)
+                visited[strand].add(contig)
+        for strand, bedgraph_file in enumerate(files):
+            for contig, length in zip(bam.references, bam.lengths):
+                if contig not in visited[strand] and length > 0:
+                    bedgraph_file.write(
+                        "{}\t0\t{}\t0\n".format(contig, length))
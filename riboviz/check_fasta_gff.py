@@ -3,15 +3,20 @@ Functions to check FASTA and GFF files for coding sequence (CDS) features.
 """
 import bisect
 import csv
+import mmap
+import multiprocessing
 import os
 import warnings
 from Bio import SeqIO
-import gffutils
+import numpy as np
+import pyfaidx
 from pyfaidx import Fasta
 from pyfaidx import FastaIndexingError
 from riboviz.fasta_gff import CDS_FEATURE_FORMAT
+from riboviz.fasta_gff import GFF_INDEX_DIR
 from riboviz.fasta_gff import START_CODON
 from riboviz.fasta_gff import STOP_CODONS
+from riboviz.fasta_gff import get_gff_index
 from riboviz.get_cds_codons import get_feature_id
 from riboviz.get_cds_codons import sequence_to_codons
 from riboviz import provenance
@@ -86,6 +91,10 @@ NUM_FEATURES = "NumFeatures"
 """ TSV file header tag. """
 NUM_CDS_FEATURES = "NumCDSFeatures"
 """ TSV file header tag. """
+BATCH_SIZE = 16000000
+""" Maximum number of CDS nucleotides checked at a time. """
+PAD_BASE = ord("N")
+""" Base used to pad CDS whose length is not divisible by 3. """
 
 
 def get_fasta_sequence_ids(fasta):
@@ -109,11 +118,304 @@ def get_fasta_sequence_ids(fasta):
     return seq_ids
 
 
+def get_complement_table():
+    """
+    Get a table mapping each ASCII base to its complement, using the
+    same complements as ``pyfaidx``. Bases with no complement are
+    mapped to 0.
+
+    :return: Table
+    :rtype: numpy.ndarray
+    """
+    table = np.zeros(256, dtype=np.uint8)
+    for code in range(1, 128):
+        try:
+            complement = pyfaidx.complement(chr(code))
+        except ValueError:
+            continue
+        if len(complement) == 1:
+            table[code] = ord(complement)
+    return table
+
+
+def codon_to_int(codon):
+    """
+    Convert a codon to an integer, as used by
+    :py:func:`check_cds_codons`.
+
+    :param codon: Codon
+    :type codon: str or unicode or bytes
+    :return: Integer or -1 if ``codon`` is not 3 ASCII characters
+    :rtype: int
+    """
+    if isinstance(codon, str):
+        try:
+            codon = codon.encode("ascii")
+        except UnicodeEncodeError:
+            return -1
+    if len(codon) != 3:
+        return -1
+    return (codon[0] << 16) | (codon[1] << 8) | codon[2]
+
+
+def int_to_codon(value):
+    """
+    Convert an integer, as used by :py:func:`check_cds_codons`, to a
+    codon.
+
+    :param value: Integer
+    :type value: int
+    :return: Codon
+    :rtype: str or unicode
+    """
+    return bytes([(value >> 16) & 0xFF, (value >> 8) & 0xFF,
+                  value & 0xFF]).decode("ascii")
+
+
+def check_cds_codons(fasta, starts, ends, lengths, is_reverse=False):
+    """
+    Check the codons of a batch of CDS, all on the same strand, in an
+    uncompressed FASTA file.
+
+    The FASTA file is memory-mapped and the bytes of each CDS, from
+    ``starts`` to ``ends``, are read and line terminators removed.
+    CDS are padded with ``N`` to a multiple of 3 nucleotides. If
+    ``is_reverse`` then CDS are reversed and complemented, using the
+    same complements as ``pyfaidx`` (see
+    :py:func:`get_complement_table`). Each codon is converted to an
+    integer (see :py:func:`codon_to_int`).
+
+    A CDS cannot be checked, and it is ``False`` in the returned
+    validity mask, if it has a non-ASCII nucleotide, if ``is_reverse``
+    and it has a nucleotide with no complement, or if its number of
+    nucleotides is not as expected.
+
+    :param fasta: FASTA file
+    :type fasta: str or unicode
+    :param starts: For each CDS, the file offset of its first \
+    nucleotide
+    :type starts: numpy.ndarray
+    :param ends: For each CDS, the file offset after its last \
+    nucleotide
+    :type ends: numpy.ndarray
+    :param lengths: For each CDS, its number of nucleotides, at \
+    least 1
+    :type lengths: numpy.ndarray
+    :param is_reverse: Are the CDS on the reverse strand?
+    :type is_reverse: bool
+    :return: For each CDS, its first codon, its last codon, whether \
+    it has an internal stop codon and whether it could be checked
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray, \
+    numpy.ndarray)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    span_lengths = np.asarray(ends, dtype=np.int64) - starts
+    lengths = np.asarray(lengths, dtype=np.int64)
+    pads = -lengths % 3
+    if is_reverse:
+        # Read CDS in reverse order, then reverse all the
+        # nucleotides, so each CDS is reversed but the CDS are in
+        # their original order. Padding goes before each CDS so it
+        # is after each CDS once reversed.
+        starts, span_lengths, pads = \
+            starts[::-1], span_lengths[::-1], pads[::-1]
+        span_offsets = pads
+    else:
+        span_offsets = np.zeros(len(starts), dtype=np.int64)
+    run_lengths = span_lengths + pads
+    run_starts = np.cumsum(run_lengths) - run_lengths
+    with open(fasta, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        buffer = np.frombuffer(m, dtype=np.uint8)
+        file_offsets = np.arange(int(run_lengths.sum()), dtype=np.int64) + \
+            np.repeat(starts - span_offsets - run_starts, run_lengths)
+        is_pad = np.zeros(len(file_offsets), dtype=bool)
+        pad_positions = np.repeat(
+            run_starts + np.where(is_reverse, 0, span_lengths), pads) + \
+            (np.arange(int(pads.sum())) -
+             np.repeat(np.cumsum(pads) - pads, pads))
+        is_pad[pad_positions] = True
+        file_offsets[is_pad] = 0
+        bases = buffer[file_offsets]
+        del buffer
+    bases[is_pad] = PAD_BASE
+    bases = bases[(bases != ord("\n")) & (bases != ord("\r"))]
+    num_cds = len(lengths)
+    padded_lengths = lengths + -lengths % 3
+    if len(bases) != padded_lengths.sum():
+        return np.zeros(num_cds, dtype=np.int64), \
+            np.zeros(num_cds, dtype=np.int64), \
+            np.zeros(num_cds, dtype=bool), \
+            np.zeros(num_cds, dtype=bool)
+    is_invalid = bases > 127
+    if is_reverse:
+        bases = get_complement_table()[bases[::-1]]
+        is_invalid = is_invalid[::-1] | (bases == 0)
+    base_starts = np.cumsum(padded_lengths) - padded_lengths
+    is_valid = np.add.reduceat(is_invalid, base_starts) == 0
+    codon_bases = bases.reshape(-1, 3).astype(np.int32)
+    codons = (codon_bases[:, 0] << 16) | (codon_bases[:, 1] << 8) | \
+        codon_bases[:, 2]
+    codon_starts = base_starts // 3
+    last_codons = codon_starts + padded_lengths // 3 - 1
+    is_stop = np.isin(codons, [codon_to_int(codon)
+                               for codon in STOP_CODONS])
+    is_stop[last_codons] = False
+    has_internal_stop = np.add.reduceat(is_stop, codon_starts) > 0
+    return codons[codon_starts].astype(np.int64), \
+        codons[last_codons].astype(np.int64), has_internal_stop, is_valid
+
+
+def get_feature_sequence_issues(feature, feature_id_name, fasta_genes,
+                                start_codons=[START_CODON]):
+    """
+    Get issues for the sequence of a coding sequence (CDS) feature,
+    using ``pyfaidx`` to get the sequence. See
+    :py:func:`get_issues` for the issues.
+
+    :param feature: GFF feature
+    :type feature: riboviz.fasta_gff.GffFeature
+    :param feature_id_name: Feature ID
+    :type feature_id_name: str or unicode
+    :param fasta_genes: FASTA file
+    :type fasta_genes: pyfaidx.Fasta
+    :param start_codons: Allowable start codons.
+    :type start_codons: list(str or unicode)
+    :return: Issues
+    :rtype: list(tuple(str or unicode, str or unicode, \
+    str or unicode, object))
+    :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
+    formatted sequences
+    """
+    issues = []
+    try:
+        sequence = feature.sequence(fasta_genes)
+    except KeyError as e:  # Missing sequence.
+        issues.append((feature.seqid,
+                       NOT_APPLICABLE,
+                       SEQUENCE_NOT_IN_FASTA,
+                       None))
+        return issues
+    except FastaIndexingError as e:
+        raise e
+    except Exception as e:
+        warnings.warn(str(e))
+        return issues
+    seq_len_remainder = len(sequence) % 3
+    if seq_len_remainder != 0:
+        issues.append((feature.seqid, feature_id_name,
+                       INCOMPLETE_FEATURE, None))
+        sequence += ("N" * (3 - seq_len_remainder))
+
+    sequence_codons = sequence_to_codons(sequence)
+    if sequence_codons[0] not in start_codons:
+        issues.append((feature.seqid, feature_id_name,
+                       NO_START_CODON, sequence_codons[0]))
+    if not sequence_codons[-1] in STOP_CODONS:
+        issues.append((feature.seqid, feature_id_name,
+                       NO_STOP_CODON, sequence_codons[-1]))
+    if any([codon in STOP_CODONS
+            for codon in sequence_codons[:-1]]):
+        issues.append((feature.seqid, feature_id_name,
+                       INTERNAL_STOP_CODON, None))
+    return issues
+
+
+def get_cds_codons(fasta, fasta_genes, features, num_processes=1):
+    """
+    Get the first and last codons, and whether there are internal
+    stop codons, for coding sequence (CDS) features, using
+    :py:func:`check_cds_codons`.
+
+    Features are checked in batches of up to :py:const:`BATCH_SIZE`
+    nucleotides, in parallel if ``num_processes`` is more than 1.
+
+    Features are not checked, and are ``None`` in the returned list,
+    if their sequence is not in the FASTA file, their coordinates are
+    not within their sequence, the FASTA file is compressed or they
+    cannot be checked by :py:func:`check_cds_codons`.
+
+    :param fasta: FASTA file
+    :type fasta: str or unicode
+    :param fasta_genes: FASTA file
+    :type fasta_genes: pyfaidx.Fasta
+    :param features: GFF features
+    :type features: list(riboviz.fasta_gff.GffFeature)
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :return: For each feature, ``None`` or its first codon, its last \
+    codon and whether it has an internal stop codon
+    :rtype: list(tuple(str or unicode, str or unicode, bool))
+    """
+    results = [None] * len(features)
+    with open(fasta, "rb") as f:
+        if f.read(2) == b"\x1f\x8b":  # gzip or BGZF.
+            return results
+    index = fasta_genes.faidx.index
+    rows = []
+    for feature_index, feature in enumerate(features):
+        record = index.get(feature.seqid)
+        if record is None or record.lenc <= 0 or \
+           not 1 <= feature.start <= feature.end <= record.rlen:
+            continue
+        rows.append((feature_index, record.offset, record.lenc,
+                     record.lenb, feature.start - 1, feature.end,
+                     feature.strand == "-"))
+    if not rows:
+        return results
+    feature_indices, offsets, line_lengths, line_byte_lengths, \
+        starts, ends, is_reverse = [np.array(column)
+                                    for column in zip(*rows)]
+    # File offsets of first nucleotide and after last nucleotide.
+    start_offsets = offsets + (starts // line_lengths) * \
+        line_byte_lengths + starts % line_lengths
+    end_offsets = offsets + ((ends - 1) // line_lengths) * \
+        line_byte_lengths + (ends - 1) % line_lengths + 1
+    lengths = ends - starts
+    batches = []
+    for strand_reverse in [False, True]:
+        strand_indices = np.flatnonzero(is_reverse == strand_reverse)
+        if not len(strand_indices):
+            continue
+        cumulative_lengths = np.cumsum(lengths[strand_indices])
+        boundaries = np.unique(np.concatenate((
+            [0],
+            np.searchsorted(cumulative_lengths,
+                            np.arange(BATCH_SIZE, cumulative_lengths[-1],
+                                      BATCH_SIZE),
+                            side="right"),
+            [len(strand_indices)])))
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            batch_indices = strand_indices[start:end]
+            batches.append((batch_indices,
+                            (fasta, start_offsets[batch_indices],
+                             end_offsets[batch_indices],
+                             lengths[batch_indices], strand_reverse)))
+    if num_processes > 1 and len(batches) > 1:
+        with multiprocessing.Pool(num_processes) as pool:
+            batch_results = pool.starmap(
+                check_cds_codons, [args for _, args in batches])
+    else:
+        batch_results = [check_cds_codons(*args) for _, args in batches]
+    for (batch_indices, _), (first_codons, last_codons,
+                             has_internal_stop, is_valid) in \
+            zip(batches, batch_results):
+        for row, batch_index in enumerate(batch_indices):
+            if is_valid[row]:
+                results[feature_indices[batch_index]] = (
+                    int_to_codon(first_codons[row]),
+                    int_to_codon(last_codons[row]),
+                    bool(has_internal_stop[row]))
+    return results
+
+
 def get_issues(fasta,
                gff,
                feature_format=CDS_FEATURE_FORMAT,
                use_feature_name=False,
-               start_codons=[START_CODON]):
+               start_codons=[START_CODON],
+               num_processes=1,
+               cache_dir=GFF_INDEX_DIR):
     """
     Check FASTA and GFF files for coding sequence (CDS) features and
     return a list of issues for relating to coding sequences, ``CDS``,
@@ -184,6 +486,13 @@ def get_issues(fasta,
     Issue data is supplementary data relating to the issue. Unless
     already noted above this will be ``None``.
 
+    CDS features are read using
+    :py:func:`riboviz.fasta_gff.get_gff_index`. CDS sequences are
+    read from the FASTA file, and their codons
+    checked, in batches (see :py:func:`get_cds_codons`). CDS which
+    cannot be checked in this way are checked one at a time (see
+    :py:func:`get_feature_sequence_issues`).
+
     :param fasta: FASTA file
     :type fasta: str or unicode
     :param gff: GFF file
@@ -198,6 +507,12 @@ def get_issues(fasta,
     :type use_feature_name: bool
     :param start_codons: Allowable start codons.
     :type start_codons: list(str or unicode)
+    :param num_processes: Number of processes used to check CDS \
+    sequences (see :py:func:`get_cds_codons`)
+    :type num_processes: int
+    :param cache_dir: Directory for cached GFF indices or ``None`` \
+    to not cache GFF indices
+    :type cache_dir: str or unicode
     :return: Number of FASTA sequences, number of GFF features, \
     number of GFF CDS features, list of unique sequence IDs in GFF \
     file and list of issues for sequences and features.
@@ -207,23 +522,12 @@ def get_issues(fasta,
     cannot be found
     :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
     formatted sequences
-    :raises ValueError: If GFF file is empty
-    :raises Exception: Exceptions specific to gffutils.create_db \
-    (these are undocumented in the gffutils documentation)
+    :raises ValueError: If GFF file is empty or has invalid lines
     """
     for f in [fasta, gff]:
         if not os.path.exists(f) or (not os.path.isfile(f)):
             raise FileNotFoundError(f)
-    try:
-        gffdb = gffutils.create_db(gff,
-                                   dbfn='gff.db',
-                                   force=True,
-                                   keep_order=True,
-                                   merge_strategy='merge',
-                                   sort_attribute_values=True)
-    except ValueError as e:
-        # Wrap and rethrow exception so file name is included
-        raise ValueError("{} ({})".format(e, gff)) from e
+    gff_index = get_gff_index(gff, cache_dir=cache_dir)
     issues = []
     # Track IDs of features encountered. Each ID must be unique within
     # a GFF file. See http://gmod.org/wiki/GFF3.
@@ -232,7 +536,9 @@ def get_issues(fasta,
     # each.
     sequence_features = {}
     fasta_genes = Fasta(fasta)
-    for feature in gffdb.features_of_type('CDS'):
+    features = []
+    feature_id_names = []
+    for feature in gff_index:
         if feature.seqid not in sequence_features:
             sequence_features[feature.seqid] = 0
         sequence_features[feature.seqid] += 1
@@ -244,39 +550,33 @@ def get_issues(fasta,
                 feature_ids[feature_id].append(feature.seqid)
             else:
                 feature_ids[feature_id] = [feature.seqid]
-        feature_id_name = get_feature_id(feature, use_feature_name)
+        features.append(feature)
+        feature_id_names.append(get_feature_id(feature, use_feature_name))
+
+    cds_codons = get_cds_codons(fasta, fasta_genes, features,
+                                num_processes)
+    for feature, feature_id_name, codons in zip(features,
+                                                feature_id_names,
+                                                cds_codons):
         if feature_id_name is None:
             feature_id_name = feature_format.format(feature.seqid)
             issues.append((feature.seqid, feature_id_name,
                            NO_ID_NAME, None))
-        try:
-            sequence = feature.sequence(fasta_genes)
-        except KeyError as e:  # Missing sequence.
-            issues.append((feature.seqid,
-                           NOT_APPLICABLE,
-                           SEQUENCE_NOT_IN_FASTA,
-                           None))
-            continue
-        except FastaIndexingError as e:
-            raise e
-        except Exception as e:
-            warnings.warn(str(e))
+        if codons is None:
+            issues.extend(get_feature_sequence_issues(
+                feature, feature_id_name, fasta_genes, start_codons))
             continue
-        seq_len_remainder = len(sequence) % 3
-        if seq_len_remainder != 0:
+        first_codon, last_codon, has_internal_stop = codons
+        if (feature.end - feature.start + 1) % 3 != 0:
             issues.append((feature.seqid, feature_id_name,
                            INCOMPLETE_FEATURE, None))
-            sequence += ("N" * (3 - seq_len_remainder))
-
-        sequence_codons = sequence_to_codons(sequence)
-        if sequence_codons[0] not in start_codons:
+        if first_codon not in start_codons:
             issues.append((feature.seqid, feature_id_name,
-                           NO_START_CODON, sequence_codons[0]))
-        if not sequence_codons[-1] in STOP_CODONS:
+                           NO_START_CODON, first_codon))
+        if last_codon not in STOP_CODONS:
             issues.append((feature.seqid, feature_id_name,
-                           NO_STOP_CODON, sequence_codons[-1]))
-        if any([codon in STOP_CODONS
-                for codon in sequence_codons[:-1]]):
+                           NO_STOP_CODON, last_codon))
+        if has_internal_stop:
             issues.append((feature.seqid, feature_id_name,
                            INTERNAL_STOP_CODON, None))
 
@@ -300,8 +600,8 @@ def get_issues(fasta,
     for seq_id in fasta_only_seq_ids:
         issues.append((seq_id, NOT_APPLICABLE, SEQUENCE_NOT_IN_GFF, None))
     num_sequences = len(fasta_seq_ids)
-    num_features = len(list(gffdb.all_features()))
-    num_cds_features = len(list(gffdb.features_of_type('CDS')))
+    num_features = gff_index.num_features
+    num_cds_features = len(gff_index)
     return num_sequences, num_features, num_cds_features, issues
 
 
@@ -364,7 +664,9 @@ def run_fasta_gff_check(fasta,
                         gff,
                         feature_format=CDS_FEATURE_FORMAT,
                         use_feature_name=False,
-                        start_codons=[START_CODON]):
+                        start_codons=[START_CODON],
+                        num_processes=1,
+                        cache_dir=GFF_INDEX_DIR):
     """
     Check FASTA and GFF files for coding sequence (CDS) features
     and get a list of issues for each sequence and coding sequence,
@@ -402,21 +704,27 @@ def run_fasta_gff_check(fasta,
     :type use_feature_name: bool
     :param start_codons: Allowable start codons.
     :type start_codons: list(str or unicode)
+    :param num_processes: Number of processes used to check CDS \
+    sequences (see :py:func:`get_cds_codons`)
+    :type num_processes: int
+    :param cache_dir: Directory for cached GFF indices or ``None`` \
+    to not cache GFF indices
+    :type cache_dir: str or unicode
     :return: Configuration, metadata, issues
     :raises FileNotFoundError: If the FASTA or GFF files \
     cannot be found
     :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
     formatted sequences
-    :raises ValueError: If GFF file is empty
-    :raises Exception: Exceptions specific to gffutils.create_db \
-    (these are undocumented in the gffutils documentation)
+    :raises ValueError: If GFF file is empty or has invalid lines
     """
     num_sequences, num_features, num_cds_features, issues = \
         get_issues(fasta,
                    gff,
                    feature_format=feature_format,
                    use_feature_name=use_feature_name,
-                   start_codons=start_codons)
+                   start_codons=start_codons,
+                   num_processes=num_processes,
+                   cache_dir=cache_dir)
     config = {}
     config[FASTA_FILE] = fasta
     config[GFF_FILE] = gff
@@ -435,7 +743,9 @@ def check_fasta_gff(fasta,
                     use_feature_name=False,
                     start_codons=[START_CODON],
                     is_verbose=False,
-                    delimiter="\t"):
+                    delimiter="\t",
+                    num_processes=1,
+                    cache_dir=GFF_INDEX_DIR):
     """
     Check FASTA and GFF files for coding sequence (CDS) features
     and both print and save a list of issues for each sequence and
@@ -473,16 +783,21 @@ def check_fasta_gff(fasta,
     :type is_verbose: bool
     :param delimiter: Delimiter
     :type delimiter: str or unicode
+    :param num_processes: Number of processes used to check CDS \
+    sequences (see :py:func:`get_cds_codons`)
+    :type num_processes: int
+    :param cache_dir: Directory for cached GFF indices or ``None`` \
+    to not cache GFF indices
+    :type cache_dir: str or unicode
     :raises FileNotFoundError: If the FASTA or GFF files \
     cannot be found
     :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
     formatted sequences
-    :raises ValueError: If GFF file is empty
-    :raises Exception: Exceptions specific to gffutils.create_db \
-    (these are undocumented in the gffutils documentation)
+    :raises ValueError: If GFF file is empty or has invalid lines
     """
     config, metadata, issues = run_fasta_gff_check(
-        fasta, gff, feature_format, use_feature_name, start_codons)
+        fasta, gff, feature_format, use_feature_name, start_codons,
+        num_processes, cache_dir)
     issue_counts = count_issues(issues)
     header = dict(config)
     header.update(metadata)
@@ -0,0 +1,355 @@
+"""
+CIGAR and MD tag constants and functions for editing alignments.
+
+Alignments are edited using their CIGAR operations (as returned by
+``pysam.AlignedSegment.cigartuples``) and a tokenized form of their
+MD tags. MD tags are tokenized by :py:func:`parse_md` into a list of:
+
+* ``int``: number of matching bases.
+* ``str`` of length 1: mismatched reference base.
+* ``str`` starting with ``^``: deleted reference bases.
+
+For example, ``10A5^AC6`` is tokenized as
+``[10, "A", 5, "^AC", 6]``.
+"""
+import string
+import pysam
+
+MD_TAG = "MD"
+""" SAM MD (mismatching positions) tag. """
+NM_TAG = "NM"
+""" SAM NM (edit distance) tag. """
+DELETION_PREFIX = "^"
+""" MD tag deleted reference bases prefix. """
+SOFT_CLIP = pysam.CSOFT_CLIP
+""" CIGAR soft-clip operation. """
+HARD_CLIP = pysam.CHARD_CLIP
+""" CIGAR hard-clip operation. """
+INSERTION = pysam.CINS
+""" CIGAR insertion operation. """
+PADDING = pysam.CPAD
+""" CIGAR padding operation. """
+ALIGNED_OPS = (pysam.CMATCH, pysam.CEQUAL, pysam.CDIFF)
+""" CIGAR operations consuming query and reference bases. """
+REFERENCE_OPS = (pysam.CDEL, pysam.CREF_SKIP)
+""" CIGAR operations consuming reference bases only. """
+
+
+def pop_md_token(md_tag, from_end=False):
+    """
+    Get the first, or last, token of an MD tag and the remainder of
+    the MD tag. See module documentation for the token format.
+
+    Runs of digits and letters are found using ``str.lstrip`` and
+    ``str.rstrip`` so only the token is parsed, not the remainder of
+    the MD tag.
+
+    :param md_tag: MD tag, which must not be empty
+    :type md_tag: str or unicode
+    :param from_end: Get last token?
+    :type from_end: bool
+    :return: MD tag token and remainder of MD tag
+    :rtype: tuple(int or str or unicode, str or unicode)
+    :raise ValueError: If the token has an unexpected character
+    """
+    if from_end:
+        rest = md_tag.rstrip(string.digits)
+        if len(rest) < len(md_tag):
+            return int(md_tag[len(rest):]), rest
+        if md_tag[-1].isalpha():
+            rest = md_tag.rstrip(string.ascii_letters)
+            if rest.endswith(DELETION_PREFIX):
+                # Last of a run of deleted bases.
+                return DELETION_PREFIX + md_tag[len(rest):], rest[:-1]
+            return md_tag[-1], md_tag[:-1]
+    else:
+        rest = md_tag.lstrip(string.digits)
+        if len(rest) < len(md_tag):
+            return int(md_tag[:len(md_tag) - len(rest)]), rest
+        if md_tag[0] == DELETION_PREFIX:
+            rest = md_tag[1:].lstrip(string.ascii_letters)
+            return md_tag[:len(md_tag) - len(rest)], rest
+        if md_tag[0].isalpha():
+            return md_tag[0], md_tag[1:]
+    raise ValueError("Unexpected character in MD tag {}".format(md_tag))
+
+
+def scan_md(md_tag, from_end=False):
+    """
+    Iterate through the tokens of an MD tag, from its start or end,
+    with the remainder of the MD tag after each token. See
+    :py:func:`pop_md_token`.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param from_end: Scan from end of MD tag?
+    :type from_end: bool
+    :return: MD tag tokens and remainders
+    :rtype: collections.Iterable(tuple(int or str or unicode, \
+    str or unicode))
+    :raise ValueError: If the MD tag has an unexpected character
+    """
+    while md_tag:
+        token, md_tag = pop_md_token(md_tag, from_end)
+        yield token, md_tag
+
+
+def parse_md(md_tag):
+    """
+    Tokenize an MD tag. See module documentation for the token
+    format.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :return: MD tag tokens
+    :rtype: list(int or str or unicode)
+    :raise ValueError: If the MD tag has an unexpected character
+    """
+    return [token for token, _ in scan_md(md_tag)]
+
+
+def format_md(tokens):
+    """
+    Format MD tag tokens as an MD tag. Adjacent numbers of matching
+    bases are merged and ``0`` is inserted at the start and end and
+    between mismatches and deletions, if required, so the MD tag
+    conforms to the SAM specification.
+
+    :param tokens: MD tag tokens
+    :type tokens: list(int or str or unicode)
+    :return: MD tag
+    :rtype: str or unicode
+    """
+    parts = []
+    num_matches = 0
+    for token in tokens:
+        if isinstance(token, int):
+            num_matches += token
+        else:
+            parts.append(str(num_matches))
+            parts.append(token)
+            num_matches = 0
+    parts.append(str(num_matches))
+    return "".join(parts)
+
+
+def count_end_mismatches(md_tag, from_end=False):
+    """
+    Count number of consecutive mismatched bases at the start, or the
+    end, of an alignment.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param from_end: Count from end of alignment?
+    :type from_end: bool
+    :return: Number of mismatches
+    :rtype: int
+    :raise ValueError: If the MD tag has an unexpected character
+    """
+    # Mismatches at the start, or end, are mismatched bases separated
+    # by "0" e.g. "0C0T16" or "16G0A0". Separators may be omitted
+    # e.g. "16GA0".
+    step = -1 if from_end else 1
+    i = len(md_tag) - 1 if from_end else 0
+    num_mismatches = 0
+    while 0 <= i < len(md_tag):
+        if md_tag[i] == "0":
+            i += step
+            if not 0 <= i < len(md_tag):
+                break
+        base = md_tag[i]
+        if base.isdigit() or base == DELETION_PREFIX:
+            break
+        if not base.isalpha():
+            raise ValueError("Unexpected character in MD tag {}".format(
+                md_tag))
+        if from_end and not md_tag[i - 1:i].isdigit() and \
+           md_tag[:i].rstrip(string.ascii_letters).endswith(
+               DELETION_PREFIX):
+            # Last of a run of deleted bases e.g. "16^AG0".
+            break
+        num_mismatches += 1
+        i += step
+    return num_mismatches
+
+
+def clip_md(md_tag, num_bases, from_end=False):
+    """
+    Remove aligned bases from the start, or the end, of an MD tag.
+    Any deletions at the new start, or end, are also removed.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param num_bases: Number of aligned bases to remove
+    :type num_bases: int
+    :param from_end: Remove bases from end of alignment?
+    :type from_end: bool
+    :return: MD tag, number of mismatches removed, number of deleted \
+    bases removed
+    :rtype: tuple(str or unicode, int, int)
+    :raise ValueError: If the MD tag has fewer than ``num_bases`` \
+    aligned bases or has an unexpected character
+    """
+    num_mismatches = 0
+    num_deleted = 0
+    num_matches = 0
+    remaining = num_bases
+    rest = md_tag
+    while rest:
+        token, next_rest = pop_md_token(rest, from_end)
+        if isinstance(token, int):
+            if token > remaining:
+                # Keep matches that are not removed.
+                num_matches = token - remaining
+                remaining = 0
+                rest = next_rest
+                break
+            remaining -= token
+        elif token[0] == DELETION_PREFIX:
+            num_deleted += len(token) - 1
+        elif remaining == 0:
+            # Keep mismatch following removed bases.
+            break
+        else:
+            num_mismatches += 1
+            remaining -= 1
+        rest = next_rest
+    if remaining > 0:
+        raise ValueError("Cannot remove {} bases from MD tag {}".format(
+            num_bases, md_tag))
+    # The remainder of the MD tag starts, or ends, with a mismatch,
+    # or is empty, so needs a number of matching bases.
+    if from_end:
+        return rest + str(num_matches), num_mismatches, num_deleted
+    return str(num_matches) + rest, num_mismatches, num_deleted
+
+
+def clip_cigar(cigartuples, num_bases, from_end=False):
+    """
+    Soft-clip query bases from the start, or the end, of an
+    alignment's CIGAR operations. The bases are added to any existing
+    soft-clip, inside any hard-clip. Any deletions or skipped
+    reference bases at the new start, or end, of the alignment are
+    removed.
+
+    :param cigartuples: CIGAR operations
+    :type cigartuples: list(tuple(int, int))
+    :param num_bases: Number of query bases to soft-clip
+    :type num_bases: int
+    :param from_end: Soft-clip bases from end of alignment?
+    :type from_end: bool
+    :return: CIGAR operations, number of reference bases clipped, \
+    number of aligned bases clipped, number of inserted bases clipped
+    :rtype: tuple(list(tuple(int, int)), int, int, int)
+    :raise ValueError: If the alignment has fewer than ``num_bases`` \
+    unclipped query bases
+    """
+    ops = list(cigartuples)
+    if from_end:
+        ops.reverse()
+    num_ops = len(ops)
+    i = 0
+    while i < num_ops and ops[i][0] == HARD_CLIP:
+        i += 1
+    hard_clip = ops[:i]
+    soft_clip = 0
+    while i < num_ops and ops[i][0] == SOFT_CLIP:
+        soft_clip += ops[i][1]
+        i += 1
+    num_reference = 0
+    num_aligned = 0
+    num_inserted = 0
+    remaining = num_bases
+    while remaining > 0:
+        if i >= num_ops or ops[i][0] == SOFT_CLIP or \
+           ops[i][0] == HARD_CLIP:
+            raise ValueError("Cannot soft-clip {} bases from {}".format(
+                num_bases, cigartuples))
+        op, length = ops[i]
+        if op in ALIGNED_OPS or op == INSERTION:
+            clipped = min(length, remaining)
+            remaining -= clipped
+            soft_clip += clipped
+            if op == INSERTION:
+                num_inserted += clipped
+            else:
+                num_reference += clipped
+                num_aligned += clipped
+            if clipped < length:
+                ops[i] = (op, length - clipped)
+                break
+        elif op in REFERENCE_OPS:
+            num_reference += length
+        i += 1
+    while i < num_ops and (ops[i][0] in REFERENCE_OPS or
+                           ops[i][0] == PADDING):
+        if ops[i][0] != PADDING:
+            num_reference += ops[i][1]
+        i += 1
+    ops = hard_clip + [(SOFT_CLIP, soft_clip)] + ops[i:]
+    if from_end:
+        ops.reverse()
+    return ops, num_reference, num_aligned, num_inserted
+
+
+def soft_clip(read, num_bases, from_end=False):
+    """
+    Soft-clip query bases from the start, or the end, of an alignment,
+    editing the read in place. See :py:func:`clip_cigar`.
+
+    If bases are clipped from the start then the alignment position is
+    incremented by the number of reference bases clipped. If the read
+    has an MD tag then this is updated (see :py:func:`clip_md`) and, if
+    the read has an NM tag, the edit distance is reduced by the
+    number of mismatched, inserted and deleted bases clipped.
+
+    :param read: Read
+    :type read: pysam.libcalignedsegment.AlignedSegment
+    :param num_bases: Number of query bases to soft-clip
+    :type num_bases: int
+    :param from_end: Soft-clip bases from end of alignment?
+    :type from_end: bool
+    :return: Number of mismatched, inserted and deleted bases \
+    clipped or ``None`` if the read has no MD tag
+    :rtype: int
+    :raise ValueError: If the alignment has fewer than ``num_bases`` \
+    unclipped query bases
+    """
+    cigartuples, num_reference, num_aligned, num_inserted = clip_cigar(
+        read.cigartuples, num_bases, from_end)
+    if not from_end:
+        read.reference_start += num_reference
+    read.cigartuples = cigartuples
+    try:
+        md_tag = read.get_tag(MD_TAG)
+    except KeyError:
+        return None
+    md_tag, num_mismatches, num_deleted = clip_md(
+        md_tag, num_aligned, from_end)
+    read.set_tag(MD_TAG, md_tag)
+    num_edits = num_mismatches + num_inserted + num_deleted
+    try:
+        read.set_tag(NM_TAG, read.get_tag(NM_TAG) - num_edits)
+    except KeyError:
+        pass
+    return num_edits
+
+
+def soft_clip_5p(read, num_bases):
+    """
+    Soft-clip query bases from the 5' end of a read, editing the read
+    in place. For reads mapped to the reverse strand this is the end
+    of the alignment, otherwise it is the start. See
+    :py:func:`soft_clip`.
+
+    :param read: Read
+    :type read: pysam.libcalignedsegment.AlignedSegment
+    :param num_bases: Number of query bases to soft-clip
+    :type num_bases: int
+    :return: Number of mismatched, inserted and deleted bases \
+    clipped or ``None`` if the read has no MD tag
+    :rtype: int
+    :raise ValueError: If the alignment has fewer than ``num_bases`` \
+    unclipped query bases
+    """
+    return soft_clip(read, num_bases, read.is_reverse)
@@ -7,17 +7,43 @@ used by the workflow.
 The following information is included:
 
 * Input files: number of reads in the FASTQ files used as inputs.
-* ``cutadapt``: number of reads in the FASTQ file output.
+* ``cutadapt``: number of reads in the FASTQ file output. For
+  multiplexed files, if these were demultiplexed without UMI
+  extraction, the total number of reads in the associated
+  ``num_reads.tsv`` summary file is used.
 * :py:mod:`riboviz.tools.demultiplex_fastq`:  number of reads in the
   FASTQ files output, using the information in the associated
   ``num_reads.tsv`` summary files, or, if these can't be found, the
   FASTQ files themselves.
 * ``hisat2``: number of reads in the SAM file and FASTQ file output.
+  If ORF-mapped reads were piped directly into
+  :py:mod:`riboviz.tools.trim_5p_mismatch`, without writing a SAM
+  file, then the number of reads processed, as recorded in the
+  ``trim_5p_mismatch.tsv`` summary file, is used.
 * :py:mod:`riboviz.tools.trim_5p_mismatch`: number of reads in the SAM
-  file output as recorded in the ``trim_5p_mismatch.tsv`` summary file
-  output, or the SAM file itself, if the TSV file cannot be found.
+  file, or sorted BAM file, output as recorded in the
+  ``trim_5p_mismatch.tsv`` summary file output, or the SAM file
+  itself, if the TSV file cannot be found.
 * ``umi_tools dedup``: number of reads in the BAM file output.
 
+Wherever possible, counts are taken from metadata rather than by
+scanning files. Summary files output by upstream stages are used as
+described above. For BAM files with complementary BAI files, counts
+are taken from the index statistics (see
+:py:func:`riboviz.sam_bam.count_indexed_sequences`). SAM output by
+:py:mod:`riboviz.tools.trim_5p_mismatch` is counted using the index
+statistics of the sorted and indexed BAM file derived from it, if
+its summary file cannot be found. Files are only scanned if no such
+metadata is available.
+
+Files can be counted in parallel, one task per file, using a pool of
+processes.
+
+Counts can be cached in a TSV file, with columns ``File``, ``Type``,
+``Size``, ``MTime``, ``NumReads`` and ``NumMappedReads``. A file is
+only recounted if its size or modification time differ from those in
+the cache.
+
 The output file is a TSV file with columns:
 
 * ``SampleName``: Name of the sample to which this file belongs. This
@@ -44,7 +70,9 @@ For example::
     WT3AT	hisat2  vignette/tmp/WT3AT/rRNA_map.sam	1373362	Reads with rRNA and other contaminating reads removed by alignment to rRNA index files
 
 """
+import fnmatch
 import glob
+import multiprocessing
 import os
 import os.path
 import yaml
@@ -75,9 +103,215 @@ HEADER = [SAMPLE_NAME, PROGRAM, FILE, NUM_READS, DESCRIPTION]
 """ File header. """
 INPUT = "input"
 """ ``Program`` value to denote input files """
+FILE_TYPE = "Type"
+""" Count cache column name. """
+SIZE = "Size"
+""" Count cache column name. """
+MTIME = "MTime"
+""" Count cache column name. """
+NUM_MAPPED_READS = "NumMappedReads"
+""" Count cache column name. """
+CACHE_HEADER = [FILE, FILE_TYPE, SIZE, MTIME, NUM_READS, NUM_MAPPED_READS]
+""" Count cache file header. """
+FASTQ_TYPE = "fastq"
+""" Count cache ``Type`` value for FASTQ files. """
+SAM_BAM_TYPE = "sam_bam"
+""" Count cache ``Type`` value for SAM and BAM files. """
+
+
+def load_count_cache(cache_file):
+    """
+    Load a count cache from a file. See :py:func:`count_sequences`
+    for the structure of the cache.
+
+    :param cache_file: Count cache file
+    :type cache_file: str or unicode
+    :return: Count cache, empty if ``cache_file`` does not exist
+    :rtype: dict
+    """
+    cache = {}
+    if not os.path.isfile(cache_file):
+        return cache
+    cache_df = pd.read_csv(cache_file, delimiter="\t", comment="#")
+    for _, row in cache_df.iterrows():
+        if row[FILE_TYPE] == SAM_BAM_TYPE:
+            counts = (int(row[NUM_READS]), int(row[NUM_MAPPED_READS]))
+        else:
+            counts = int(row[NUM_READS])
+        cache[(row[FILE], row[FILE_TYPE])] = (int(row[SIZE]),
+                                              int(row[MTIME]),
+                                              counts)
+    return cache
+
+
+def save_count_cache(cache, cache_file):
+    """
+    Save a count cache to a file. See :py:func:`count_sequences`
+    for the structure of the cache.
+
+    :param cache: Count cache
+    :type cache: dict
+    :param cache_file: Count cache file
+    :type cache_file: str or unicode
+    """
+    rows = []
+    for (file_name, file_type), (size, mtime, counts) in \
+            sorted(cache.items()):
+        if file_type == SAM_BAM_TYPE:
+            num_reads, num_mapped_reads = counts
+        else:
+            num_reads, num_mapped_reads = counts, ""
+        rows.append([file_name, file_type, size, mtime, num_reads,
+                     num_mapped_reads])
+    cache_df = pd.DataFrame(rows, columns=CACHE_HEADER)
+    provenance.write_provenance_header(__file__, cache_file)
+    cache_df.to_csv(cache_file, mode='a', sep="\t", index=False)
+
+
+def count_sequences(file_name, file_type, cache=None):
+    """
+    Count number of sequences in a FASTQ, SAM or BAM file, using
+    :py:func:`riboviz.fastq.count_sequences` or
+    :py:func:`riboviz.sam_bam.count_sequences`.
+
+    If ``cache`` is provided then it is checked for the counts for
+    the file and these are used if the size and modification time
+    of the file are the same as those recorded in the cache. If not,
+    then the file is counted and the cache is updated. The cache maps
+    (absolute file path, ``file_type``) to (size, modification time
+    in nanoseconds, counts).
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param file_type: :py:const:`FASTQ_TYPE` or \
+    :py:const:`SAM_BAM_TYPE`
+    :type file_type: str or unicode
+    :param cache: Count cache or ``None``
+    :type cache: dict
+    :return: Number of sequences if ``file_type`` is \
+    :py:const:`FASTQ_TYPE`, (number of sequences, number of mapped \
+    sequences) if ``file_type`` is :py:const:`SAM_BAM_TYPE`
+    :rtype: int or tuple(int, int)
+    :raise Exception: If problems arise when counting the file
+    """
+    if file_type == SAM_BAM_TYPE:
+        count = sam_bam.count_sequences
+    else:
+        count = fastq.count_sequences
+    if cache is None:
+        return count(file_name)
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), file_type)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == stat.st_size and \
+       entry[1] == stat.st_mtime_ns:
+        return entry[2]
+    counts = count(file_name)
+    cache[key] = (stat.st_size, stat.st_mtime_ns, counts)
+    return counts
+
 
+def count_sam_bam_sequences(file_name, cache=None):
+    """
+    Count number of sequences in a SAM or BAM file. If the file is a
+    BAM file with a complementary BAI file then the number of
+    sequences is taken from the index statistics (see
+    :py:func:`riboviz.sam_bam.count_indexed_sequences`), otherwise the
+    file is scanned (see :py:func:`count_sequences`).
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
+    :return: Number of sequences
+    :rtype: int
+    :raise Exception: If problems arise when counting the file
+    """
+    num_sequences = sam_bam.count_indexed_sequences(file_name)
+    if num_sequences is None:
+        num_sequences, _ = count_sequences(file_name, SAM_BAM_TYPE, cache)
+    return num_sequences
+
+
+def load_deplex_num_reads(num_reads_file):
+    """
+    Load number of reads per sample from a ``num_reads.tsv`` file
+    output by :py:mod:`riboviz.tools.demultiplex_fastq`. See
+    :py:func:`riboviz.sample_sheets.save_deplexed_sample_sheet`.
 
-def input_fq(config_file, input_dir):
+    :param num_reads_file: File name
+    :type num_reads_file: str or unicode
+    :return: Map from sample ID (including ``Unassigned`` and \
+    ``Total``) to number of reads
+    :rtype: dict(str or unicode, int)
+    :raise Exception: If problems arise when loading the file
+    """
+    deplex_df = pd.read_csv(num_reads_file, delimiter="\t", comment="#")
+    return {str(sample_id): int(num_reads) for sample_id, num_reads in
+            zip(deplex_df[sample_sheets.SAMPLE_ID],
+                deplex_df[sample_sheets.NUM_READS])}
+
+
+def input_fq_files(config_file, input_dir):
+    """
+    Extract names of FASTQ input files from workflow configuration
+    file. See :py:func:`input_fq`.
+
+    :param config_file: Configuration file
+    :type config_file: str or unicode
+    :param input_dir: Directory
+    :type input_dir: str or unicode
+    :return: list of (sample name or ``''`` for multiplexed files, \
+    file name)
+    :rtype: list(tuple(str or unicode, str or unicode))
+    """
+    with open(config_file, 'r') as f:
+        config = yaml.load(f, yaml.SafeLoader)
+    if utils.value_in_dict(params.FQ_FILES, config):
+        sample_files = [(sample_name, os.path.join(input_dir, file_name))
+                        for sample_name, file_name in
+                        list(config[params.FQ_FILES].items())]
+    else:
+        sample_files = []
+    if utils.value_in_dict(params.MULTIPLEX_FQ_FILES, config):
+        multiplex_files = [("", os.path.join(input_dir, file_name))
+                           for file_name in config[params.MULTIPLEX_FQ_FILES]]
+    else:
+        multiplex_files = []
+    return sample_files + multiplex_files
+
+
+def input_fq_file(sample_name, file_name, cache=None):
+    """
+    Count the number of reads in a FASTQ input file.
+
+    A ``pandas.core.frame.Series`` is created with fields
+    ``SampleName``, ``Program`` (set to ``input``), ``File``,
+    ``NumReads``, ``Description`` (``input``).
+
+    :param sample_name: Sample name or ``''`` for multiplexed files
+    :type sample_name: str or unicode
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
+    :return: ``pandas.core.frame.Series``, or ``None``
+    :rtype: pandas.core.frame.Series
+    """
+    print(file_name)
+    try:
+        num_reads = count_sequences(file_name, FASTQ_TYPE, cache)
+    except Exception as e:
+        print(e)
+        return None
+    return pd.DataFrame(
+        [[sample_name, INPUT, file_name, num_reads, INPUT]],
+        columns=HEADER)
+
+
+def input_fq(config_file, input_dir, cache=None):
     """
     Extract names of FASTQ input files from workflow configuration
     file and count the number of reads in each file.
@@ -105,39 +339,56 @@ def input_fq(config_file, input_dir):
     :type config_file: str or unicode
     :param input_dir: Directory
     :type input_dir: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: list of ``pandas.core.frame.Series``, or ``[]``
     :rtype: list(pandas.core.frame.Series)
     """
-    with open(config_file, 'r') as f:
-        config = yaml.load(f, yaml.SafeLoader)
-    rows = []
-    if utils.value_in_dict(params.FQ_FILES, config):
-        sample_files = [(sample_name, os.path.join(input_dir, file_name))
-                        for sample_name, file_name in
-                        list(config[params.FQ_FILES].items())]
-    else:
-        sample_files = []
-    if utils.value_in_dict(params.MULTIPLEX_FQ_FILES, config):
-        multiplex_files = [("", os.path.join(input_dir, file_name))
-                           for file_name in config[params.MULTIPLEX_FQ_FILES]]
-    else:
-        multiplex_files = []
-    files = sample_files + multiplex_files
-    for (sample_name, file_name) in files:
-        print(file_name)
-        try:
-            num_reads = fastq.count_sequences(file_name)
-            row = pd.DataFrame(
-                [[sample_name, INPUT, file_name, num_reads, INPUT]],
-                columns=HEADER)
-            rows.append(row)
-        except Exception as e:
-            print(e)
-            continue
-    return rows
+    rows = [input_fq_file(sample_name, file_name, cache)
+            for (sample_name, file_name) in
+            input_fq_files(config_file, input_dir)]
+    return [row for row in rows if row is not None]
+
+
+def deplex_total_reads(tmp_dir, fq_file):
+    """
+    Get the total number of reads in a multiplexed FASTQ file output
+    by ``cutadapt`` from the ``num_reads.tsv`` file output when it was
+    demultiplexed. See :py:func:`cutadapt_fq`.
+
+    :param tmp_dir: Directory
+    :type tmp_dir: str or unicode
+    :param fq_file: FASTQ file
+    :type fq_file: str or unicode
+    :return: Number of reads or ``None`` if this cannot be determined
+    :rtype: int
+    """
+    fq_suffix = workflow_files.ADAPTER_TRIM_FQ_FORMAT.format("")
+    fq_name = os.path.basename(fq_file)
+    if not fq_name.endswith(fq_suffix):
+        return None
+    prefix = fq_name[:-len(fq_suffix)]
+    if os.path.exists(os.path.join(
+            tmp_dir, workflow_files.UMI_EXTRACT_FQ_FORMAT.format(prefix))):
+        return None
+    num_reads_file = os.path.join(
+        tmp_dir,
+        workflow_files.DEPLEX_DIR_FORMAT.format(prefix),
+        demultiplex_fastq.NUM_READS_FILE)
+    if not os.path.isfile(num_reads_file) or \
+       os.path.getmtime(num_reads_file) < os.path.getmtime(fq_file):
+        return None
+    print(num_reads_file)
+    try:
+        return load_deplex_num_reads(num_reads_file)[
+            sample_sheets.TOTAL_READS]
+    except Exception as e:
+        print(e)
+        return None
 
 
-def cutadapt_fq(tmp_dir, sample=""):
+def cutadapt_fq(tmp_dir, sample="", cache=None):
     """
     Count number of reads in the FASTQ file output by ``cutadapt``.
 
@@ -147,6 +398,17 @@ def cutadapt_fq(tmp_dir, sample=""):
     is then removed (these file names overlap). The number of reads in
     the resulting file are counted.
 
+    If ``sample`` is ``''`` (i.e. the file is a multiplexed file) then
+    the temporary directory is checked for a directory matching
+    :py:const:`riboviz.workflow_files.DEPLEX_DIR_FORMAT` with a TSV
+    file matching :py:const:`riboviz.demultiplex_fastq.NUM_READS_FILE`.
+    If this file exists, is not older than the FASTQ file, and there
+    is no file matching
+    :py:const:`riboviz.workflow_files.UMI_EXTRACT_FQ_FORMAT` (in which
+    case the FASTQ file was demultiplexed directly) then the total
+    number of reads is taken from the TSV file rather than the FASTQ
+    file.
+
     A ``pandas.core.frame.Series`` is created with fields
     ``SampleName``, ``Program``, ``File``, ``NumReads``,
     ``Description``.
@@ -155,6 +417,9 @@ def cutadapt_fq(tmp_dir, sample=""):
     :type tmp_dir: str or unicode
     :param sample: Sample name
     :type sample: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: ``pandas.core.frame.Series``, or ``None``
     :rtype: pandas.core.frame.Series
     """
@@ -170,19 +435,23 @@ def cutadapt_fq(tmp_dir, sample=""):
     if not fq_files:
         return None
     fq_file = fq_files[0]  # Only 1 match expected.
-    print(fq_file)
-    try:
-        num_reads = fastq.count_sequences(fq_file)
-    except Exception as e:
-        print(e)
-        return None
+    num_reads = None
+    if not sample:
+        num_reads = deplex_total_reads(tmp_dir, fq_file)
+    if num_reads is None:
+        print(fq_file)
+        try:
+            num_reads = count_sequences(fq_file, FASTQ_TYPE, cache)
+        except Exception as e:
+            print(e)
+            return None
     description = "Reads after removal of sequencing library adapters"
     row = pd.DataFrame([[sample, "cutadapt", fq_file, num_reads,
                          description]], columns=HEADER)
     return row
 
 
-def umi_tools_deplex_fq(tmp_dir):
+def umi_tools_deplex_fq(tmp_dir, cache=None):
     """
     Count number of reads in the FASTQ files output by
     :py:mod:`riboviz.tools.demultiplex_fastq`.
@@ -205,6 +474,9 @@ def umi_tools_deplex_fq(tmp_dir):
 
     :param tmp_dir: Directory
     :type tmp_dir: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: list of ``pandas.core.frame.Series``, or ``[]``
     :rtype: list(pandas.core.frame.Series)
     """
@@ -230,20 +502,19 @@ def umi_tools_deplex_fq(tmp_dir):
             num_reads_file = tsv_files[0]
             print(num_reads_file)
             try:
-                deplex_df = pd.read_csv(num_reads_file,
-                                        delimiter="\t",
-                                        comment="#")
+                deplex_num_reads = load_deplex_num_reads(num_reads_file)
+                tsv_rows = []
                 for fq_file in fq_files:
                     tag = os.path.basename(fq_file).split(".")[0]
-                    tag_df = deplex_df[
-                        deplex_df[sample_sheets.SAMPLE_ID] == tag]
-                    num_reads = tag_df.iloc[0][sample_sheets.NUM_READS]
+                    num_reads = deplex_num_reads[tag]
                     row = pd.DataFrame(
                         [[tag,
                           demultiplex_fastq_tools_module.__name__,
                           fq_file, num_reads, description]],
                         columns=HEADER)
-                    rows.append(row)
+                    tsv_rows.append(row)
+                # Only add rows if all FASTQ files are in the TSV file.
+                rows.extend(tsv_rows)
             except Exception as e:
                 print(e)
                 is_tsv_problem = True
@@ -253,7 +524,7 @@ def umi_tools_deplex_fq(tmp_dir):
                 print(fq_file)
                 tag = os.path.basename(fq_file).split(".")[0]
                 try:
-                    num_reads = fastq.count_sequences(fq_file)
+                    num_reads = count_sequences(fq_file, FASTQ_TYPE, cache)
                 except Exception as e:
                     print(e)
                     continue
@@ -266,7 +537,7 @@ def umi_tools_deplex_fq(tmp_dir):
     return rows
 
 
-def hisat2_fq(tmp_dir, sample, fq_file_name, description):
+def hisat2_fq(tmp_dir, sample, fq_file_name, description, cache=None):
     """
     Count number of reads in the FASTQ file output by ``hisat2``.
 
@@ -285,6 +556,9 @@ def hisat2_fq(tmp_dir, sample, fq_file_name, description):
     :type fq_file_name: str or unicode
     :param description: Description of this step
     :type description: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: ``pandas.core.frame.Series``, or ``None``
     :rtype: pandas.core.frame.Series
     """
@@ -294,7 +568,7 @@ def hisat2_fq(tmp_dir, sample, fq_file_name, description):
     fq_file = fq_files[0]  # Only 1 match expected
     print(fq_file)
     try:
-        num_reads = fastq.count_sequences(fq_file)
+        num_reads = count_sequences(fq_file, FASTQ_TYPE, cache)
     except Exception as e:
         print(e)
         return None
@@ -303,7 +577,7 @@ def hisat2_fq(tmp_dir, sample, fq_file_name, description):
     return row
 
 
-def hisat2_sam(tmp_dir, sample, sam_file_name, description):
+def hisat2_sam(tmp_dir, sample, sam_file_name, description, cache=None):
     """
     Count number of reads in the SAM file output by ``hisat2``.
 
@@ -322,6 +596,9 @@ def hisat2_sam(tmp_dir, sample, sam_file_name, description):
     :type sam_file_name: str or unicode
     :param description: Description of this step
     :type description: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: ``pandas.core.frame.Series``, or ``None``
     :rtype: pandas.core.frame.Series
     """
@@ -331,7 +608,7 @@ def hisat2_sam(tmp_dir, sample, sam_file_name, description):
     sam_file = sam_files[0]  # Only 1 match expected.
     print(sam_file)
     try:
-        sequences, _ = sam_bam.count_sequences(sam_file)
+        sequences = count_sam_bam_sequences(sam_file, cache)
     except Exception as e:
         print(e)
         return None
@@ -340,7 +617,75 @@ def hisat2_sam(tmp_dir, sample, sam_file_name, description):
     return row
 
 
-def trim_5p_mismatch_sam(tmp_dir, sample):
+def load_trim_5p_mismatch_summary(tmp_dir, sample):
+    """
+    Load the trimming summary output by
+    :py:mod:`riboviz.tools.trim_5p_mismatch`.
+
+    ``<tmp_dir>/<sample>`` is searched for a TSV file matching
+    :py:const:`riboviz.workflow_files.TRIM_5P_MISMATCH_TSV`.
+
+    :param tmp_dir: Directory
+    :type tmp_dir: str or unicode
+    :param sample: Sample name
+    :type sample: str or unicode
+    :return: TSV file and trimming summary, or ``None`` if the file \
+    cannot be found or parsed
+    :rtype: tuple(str or unicode, pandas.core.frame.Series)
+    """
+    tsv_files = glob.glob(os.path.join(
+        tmp_dir, sample, workflow_files.TRIM_5P_MISMATCH_TSV))
+    if not tsv_files:
+        return None
+    tsv_file = tsv_files[0]
+    print(tsv_file)
+    try:
+        trim_data = pd.read_csv(tsv_file, delimiter="\t", comment="#")
+        return tsv_file, trim_data.iloc[0]
+    except Exception as e:
+        print(e)
+    return None
+
+
+def hisat2_orf_map_tsv(tmp_dir, sample, cache=None):
+    """
+    Count number of reads aligned to ORFs by ``hisat2`` if these were
+    piped directly into :py:mod:`riboviz.tools.trim_5p_mismatch`.
+
+    If ``<tmp_dir>/<sample>`` has no SAM file matching
+    :py:const:`riboviz.workflow_files.ORF_MAP_SAM` then the number of
+    reads processed is taken from the trimming summary (see
+    :py:func:`load_trim_5p_mismatch_summary`).
+
+    A ``pandas.core.frame.Series`` is created with fields
+    ``SampleName``, ``Program``, ``File``, ``NumReads``,
+    ``Description``.
+
+    :param tmp_dir: Directory
+    :type tmp_dir: str or unicode
+    :param sample: Sample name
+    :type sample: str or unicode
+    :param cache: Count cache or ``None``, unused as no files are \
+    scanned
+    :type cache: dict
+    :return: ``pandas.core.frame.Series``, or ``None``
+    :rtype: pandas.core.frame.Series
+    """
+    if glob.glob(os.path.join(tmp_dir, sample,
+                              workflow_files.ORF_MAP_SAM)):
+        return None
+    summary = load_trim_5p_mismatch_summary(tmp_dir, sample)
+    if summary is None:
+        return None
+    tsv_file, trim_row = summary
+    row = pd.DataFrame([[sample, "hisat2", tsv_file,
+                         trim_row[trim_5p_mismatch.NUM_PROCESSED],
+                         "Reads aligned to ORFs index files"]],
+                       columns=HEADER)
+    return row
+
+
+def trim_5p_mismatch_sam(tmp_dir, sample, cache=None):
     """
     Count number of reads in the SAM file output by
     :py:mod:`riboviz.tools.trim_5p_mismatch`.
@@ -348,11 +693,18 @@ def trim_5p_mismatch_sam(tmp_dir, sample):
     ``<tmp_dir>/<sample>`` is searched for a SAM file matching
     :py:const:`riboviz.workflow_files.ORF_MAP_CLEAN_SAM` and
     a TSV file matching
-    :py:const:`riboviz.workflow_files.TRIM_5P_MISMATCH_TSV`.
+    :py:const:`riboviz.workflow_files.TRIM_5P_MISMATCH_TSV`. If there
+    is no SAM file, as reads were trimmed, sorted and indexed in a
+    single step, then the BAM file matching
+    :py:const:`riboviz.workflow_files.ORF_MAP_CLEAN_BAM` is used
+    instead.
 
     If the TSV file exists it is parsed and the number of reads output
     extracted. If the TSV file cannot be found then the number of
-    reads in the SAM file itself are counted.
+    reads is taken from the index statistics of the BAM file matching
+    :py:const:`riboviz.workflow_files.ORF_MAP_CLEAN_BAM`, if it and
+    its complementary BAI file exist. Otherwise, the number of reads
+    in the SAM file itself are counted.
 
     A ``pandas.core.frame.Series`` is created with fields
     ``SampleName``, ``Program``, ``File``, ``NumReads``,
@@ -362,34 +714,41 @@ def trim_5p_mismatch_sam(tmp_dir, sample):
     :type tmp_dir: str or unicode
     :param sample: Sample name
     :type sample: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: ``pandas.core.frame.Series``, or ``None``
     :rtype: pandas.core.frame.Series
     """
-    # Look for the SAM file.
+    bam_file = os.path.join(tmp_dir, sample,
+                            workflow_files.ORF_MAP_CLEAN_BAM)
+    # Look for the SAM file, or the BAM file if there is no SAM file.
     sam_files = glob.glob(os.path.join(
         tmp_dir, sample, workflow_files.ORF_MAP_CLEAN_SAM))
+    if not sam_files:
+        sam_files = glob.glob(bam_file)
     if not sam_files:
         return None
     sam_file = sam_files[0]  # Only 1 match expected.
     # Look for trim_5p_mismatch.tsv.
-    tsv_files = glob.glob(os.path.join(
-        tmp_dir, sample, workflow_files.TRIM_5P_MISMATCH_TSV))
-    is_tsv_problem = False
-    if tsv_files:
-        tsv_file = tsv_files[0]
-        print(tsv_file)
+    sequences = None
+    summary = load_trim_5p_mismatch_summary(tmp_dir, sample)
+    if summary is not None:
+        _, trim_row = summary
+        sequences = trim_row[trim_5p_mismatch.NUM_WRITTEN]
+    if sequences is None:
+        # Use index statistics of BAM file derived from the SAM file.
         try:
-            trim_data = pd.read_csv(tsv_file, delimiter="\t", comment="#")
-            trim_row = trim_data.iloc[0]
-            sequences = trim_row[trim_5p_mismatch.NUM_WRITTEN]
+            sequences = sam_bam.count_indexed_sequences(bam_file)
         except Exception as e:
             print(e)
-            is_tsv_problem = True
-    if is_tsv_problem or not tsv_files:
+        if sequences is not None:
+            print(bam_file)
+    if sequences is None:
         # Traverse SAM file directly.
         print(sam_file)
         try:
-            sequences, _ = sam_bam.count_sequences(sam_file)
+            sequences, _ = count_sequences(sam_file, SAM_BAM_TYPE, cache)
         except Exception as e:
             print(e)
             return None
@@ -401,7 +760,7 @@ def trim_5p_mismatch_sam(tmp_dir, sample):
     return row
 
 
-def umi_tools_dedup_bam(tmp_dir, output_dir, sample):
+def umi_tools_dedup_bam(tmp_dir, output_dir, sample, cache=None):
     """
     Count number of reads in the BAM file output by
     ``umi_tools dedup``.
@@ -421,6 +780,9 @@ def umi_tools_dedup_bam(tmp_dir, output_dir, sample):
     :type output_dir: str or unicode
     :param sample: Sample name
     :type sample: str or unicode
+    :param cache: Count cache or ``None``, see \
+    :py:func:`count_sequences`
+    :type cache: dict
     :return: ``pandas.core.frame.Series``, or ``None``
     :rtype: pandas.core.frame.Series
     """
@@ -438,7 +800,7 @@ def umi_tools_dedup_bam(tmp_dir, output_dir, sample):
     file_name = files[0]
     print(file_name)
     try:
-        sequences, _ = sam_bam.count_sequences(file_name)
+        sequences = count_sam_bam_sequences(file_name, cache)
     except Exception as e:
         print(e)
         return None
@@ -449,13 +811,74 @@ def umi_tools_dedup_bam(tmp_dir, output_dir, sample):
     return row
 
 
-def count_reads_df(config_file, input_dir, tmp_dir, output_dir):
+def get_task_cache(cache, directory, file_name="*"):
+    """
+    Get the entries of a count cache for files in directories
+    matching ``directory`` with names matching ``file_name``. See
+    :py:func:`count_sequences` for the structure of the cache.
+
+    :param cache: Count cache or ``None``
+    :type cache: dict
+    :param directory: Directory name or glob pattern
+    :type directory: str or unicode
+    :param file_name: File name or glob pattern
+    :type file_name: str or unicode
+    :return: Count cache entries or ``None`` if ``cache`` is ``None``
+    :rtype: dict
+    """
+    if cache is None:
+        return None
+    directory = os.path.abspath(directory)
+    return {key: value for key, value in cache.items()
+            if fnmatch.fnmatchcase(os.path.dirname(key[0]), directory)
+            and fnmatch.fnmatchcase(os.path.basename(key[0]), file_name)}
+
+
+def _count_task(function, args, cache):
+    """
+    Call a function, which counts the reads in a file, with a
+    count cache.
+
+    :param function: Function
+    :type function: function
+    :param args: Function arguments, excluding ``cache``
+    :type args: tuple
+    :param cache: Count cache entries for the files counted by the \
+    function, or ``None``, see :py:func:`get_task_cache`
+    :type cache: dict
+    :return: Function result and the count cache entries added or \
+    updated by the function, or ``None`` if ``cache`` is ``None``
+    :rtype: tuple(pandas.core.frame.Series or \
+    list(pandas.core.frame.Series), dict)
+    """
+    if cache is None:
+        return function(*args), None
+    task_cache = dict(cache)
+    result = function(*args, cache=task_cache)
+    return result, {key: value for key, value in task_cache.items()
+                    if cache.get(key) != value}
+
+
+def count_reads_df(config_file,
+                   input_dir,
+                   tmp_dir,
+                   output_dir,
+                   num_processes=1,
+                   cache_file=None):
     """
     Scan input, temporary and output directories and count the number
     of reads (sequences) processed by specific stages of a
     workflow. The scan is based on the directory structure and file
     patterns used by the workflow.
 
+    Each file to be counted is handled by a separate task. If
+    ``num_processes`` is greater than 1 then these tasks are run
+    using a pool of processes. The rows are in the same order
+    regardless of the number of processes.
+
+    If ``cache_file`` is provided then counts are loaded from, and
+    saved to, this file. See :py:func:`count_sequences`.
+
     A ``pandas.core.frame.DataFrame`` is created with columns
     ``SampleName``, ``Program``, ``File``, ``NumReads``,
     ``Description``.
@@ -468,34 +891,79 @@ def count_reads_df(config_file, input_dir, tmp_dir, output_dir):
     :type tmp_dir: str or unicode
     :param output_dir: Output files directory
     :type output_dir: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param cache_file: Count cache file or ``None``
+    :type cache_file: str or unicode
     :return: ``pandas.core.frame.DataFrame``
     :rtype: pandas.core.frame.DataFrame
     """
-    df = pd.DataFrame(columns=HEADER)
-    rows = []
-    rows.extend(input_fq(config_file, input_dir))
-    rows.append(cutadapt_fq(tmp_dir))
-    rows.extend(umi_tools_deplex_fq(tmp_dir))
+    cache = None
+    if cache_file is not None:
+        cache = load_count_cache(cache_file)
+    task_args = [(input_fq_file,
+                  (sample_name, file_name),
+                  get_task_cache(cache,
+                                 os.path.dirname(file_name),
+                                 glob.escape(os.path.basename(file_name))))
+                 for sample_name, file_name in
+                 input_fq_files(config_file, input_dir)]
+    task_args.append((cutadapt_fq, (tmp_dir,),
+                      get_task_cache(cache, tmp_dir)))
+    task_args.append((umi_tools_deplex_fq, (tmp_dir,),
+                      get_task_cache(cache, os.path.join(
+                          tmp_dir,
+                          workflow_files.DEPLEX_DIR_FORMAT.format("*")))))
     tmp_samples = [f.name for f in os.scandir(tmp_dir) if f.is_dir()]
     tmp_samples.sort()
     for sample in tmp_samples:
-        rows.append(cutadapt_fq(tmp_dir, sample))
-        rows.append(hisat2_fq(tmp_dir, sample, workflow_files.NON_RRNA_FQ,
-                              "rRNA or other contaminating reads removed by alignment to rRNA index files"))
-        rows.append(hisat2_sam(tmp_dir, sample, workflow_files.RRNA_MAP_SAM,
-                               "Reads with rRNA and other contaminating reads removed by alignment to rRNA index files"))
-        rows.append(hisat2_fq(tmp_dir, sample, workflow_files.UNALIGNED_FQ,
-                              "Unaligned reads removed by alignment of remaining reads to ORFs index files"))
-        rows.append(hisat2_sam(tmp_dir, sample, workflow_files.ORF_MAP_SAM,
-                               "Reads aligned to ORFs index files"))
-        rows.append(trim_5p_mismatch_sam(tmp_dir, sample))
-        rows.append(umi_tools_dedup_bam(tmp_dir, output_dir, sample))
+        sample_cache = get_task_cache(cache, os.path.join(tmp_dir, sample))
+        tasks = [
+            (cutadapt_fq, (tmp_dir, sample)),
+            (hisat2_fq, (tmp_dir, sample, workflow_files.NON_RRNA_FQ,
+                         "rRNA or other contaminating reads removed by alignment to rRNA index files")),
+            (hisat2_sam, (tmp_dir, sample, workflow_files.RRNA_MAP_SAM,
+                          "Reads with rRNA and other contaminating reads removed by alignment to rRNA index files")),
+            (hisat2_fq, (tmp_dir, sample, workflow_files.UNALIGNED_FQ,
+                         "Unaligned reads removed by alignment of remaining reads to ORFs index files")),
+            (hisat2_sam, (tmp_dir, sample, workflow_files.ORF_MAP_SAM,
+                          "Reads aligned to ORFs index files")),
+            (hisat2_orf_map_tsv, (tmp_dir, sample)),
+            (trim_5p_mismatch_sam, (tmp_dir, sample))]
+        task_args.extend([(function, args, sample_cache)
+                          for function, args in tasks])
+        task_args.append((umi_tools_dedup_bam,
+                          (tmp_dir, output_dir, sample),
+                          get_task_cache(cache,
+                                         os.path.join(output_dir, sample))))
+    if num_processes > 1:
+        with multiprocessing.Pool(num_processes) as pool:
+            results = pool.starmap(_count_task, task_args, chunksize=1)
+    else:
+        results = [_count_task(*args) for args in task_args]
+    rows = []
+    for result, task_cache in results:
+        if isinstance(result, list):
+            rows.extend(result)
+        else:
+            rows.append(result)
+        if cache is not None:
+            cache.update(task_cache)
+    if cache_file is not None:
+        save_count_cache(cache, cache_file)
+    df = pd.DataFrame(columns=HEADER)
     rows = [row for row in rows if row is not None]
     df = df.append(rows)
     return df
 
 
-def count_reads(config_file, input_dir, tmp_dir, output_dir, reads_file):
+def count_reads(config_file,
+                input_dir,
+                tmp_dir,
+                output_dir,
+                reads_file,
+                num_processes=1,
+                cache_file=None):
     """
     Scan input, temporary and output directories and count the number
     of reads (sequences) processed by specific stages of a
@@ -506,6 +974,9 @@ def count_reads(config_file, input_dir, tmp_dir, output_dir, reads_file):
     `reads_file`. The file header has column names ``SampleName``,
     ``Program``, ``File``, ``NumReads``, ``Description``.
 
+    See :py:func:`count_reads_df` for information on
+    ``num_processes`` and ``cache_file``.
+
     :param config_file: Configuration file
     :type config_file: str or unicode
     :param input_dir: Input files directory
@@ -516,9 +987,13 @@ def count_reads(config_file, input_dir, tmp_dir, output_dir, reads_file):
     :type output_dir: str or unicode
     :param reads_file: Reads file output
     :type reads_file: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param cache_file: Count cache file or ``None``
+    :type cache_file: str or unicode
     """
     reads_df = count_reads_df(config_file, input_dir, tmp_dir,
-                              output_dir)
+                              output_dir, num_processes, cache_file)
     provenance.write_provenance_header(__file__, reads_file)
     reads_df[list(reads_df.columns)].to_csv(
         reads_file, mode='a', sep="\t", index=False)
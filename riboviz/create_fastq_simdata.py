@@ -84,9 +84,6 @@ from random import choices
 from random import seed
 import shutil
 import pandas as pd
-from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
 from riboviz import barcodes_umis
 from riboviz import demultiplex_fastq
 from riboviz import fastq
@@ -132,17 +129,16 @@ def make_fastq_record(name, reads, scores=None, qualities=QUALITY_MEDIUM):
     ``None``, in conjunction with :py:func:`simulate_quality` \
     to calculate quality scores
     :type qualities: list(int)
-    :return: fastq record
-    :rtype: Bio.SeqRecord.SeqRecord
+    :return: fastq record (header, sequence, plus, quality), see \
+    :py:func:`riboviz.fastq.read_fastq_records`
+    :rtype: tuple(bytes, bytes, bytes, bytes)
     """
     if scores is None:
         scores = simulate_quality(len(reads), qualities=qualities)
-    record = SeqRecord(Seq(reads),
-                       id=name,
-                       name=name,
-                       description=name)
-    record.letter_annotations["phred_quality"] = scores
-    return record
+    return (name.encode(),
+            reads.encode(),
+            b"",
+            bytes(score + 33 for score in scores))
 
 
 def trim_fastq_record_3prime(record,
@@ -154,7 +150,7 @@ def trim_fastq_record_3prime(record,
     by given length.
 
     :param record: Record
-    :type record: Bio.SeqRecord.SeqRecord
+    :type record: tuple(bytes, bytes, bytes, bytes)
     :param trim: Number of nts to trim by
     :type trim: int
     :param delimiter: Delimiter to use, if ``add_trim`` is ``True``
@@ -162,16 +158,14 @@ def trim_fastq_record_3prime(record,
     :param add_trim: Add subsequence that was trimmed to record ID?
     :type add_trim: bool
     :return: New record
-    :rtype: Bio.SeqRecord.SeqRecord
+    :rtype: tuple(bytes, bytes, bytes, bytes)
     """
-    quality = record.letter_annotations["phred_quality"]
-    sequence = str(record.seq)
-    record_extension = ""
+    name, sequence, plus, quality = record
+    record_extension = b""
     if add_trim:
-        record_extension = delimiter + sequence[-trim:]
-    return make_fastq_record(record.id + record_extension,
-                             sequence[0:-trim],
-                             quality[0:-trim])
+        record_extension = delimiter.encode() + sequence[-trim:]
+    return (name + record_extension, sequence[0:-trim], plus,
+            quality[0:-trim])
 
 
 def trim_fastq_record_5prime(record,
@@ -183,7 +177,7 @@ def trim_fastq_record_5prime(record,
     by given length.
 
     :param record: Record
-    :type record: Bio.SeqRecord.SeqRecord
+    :type record: tuple(bytes, bytes, bytes, bytes)
     :param trim: Number of nts to trim by
     :type trim: int
     :param add_trim: Add subsequence that was trimmed to record ID?
@@ -191,16 +185,13 @@ def trim_fastq_record_5prime(record,
     :param delimiter: Delimiter to use, if ``add_trim`` is ``True``
     :type delimiter: str or unicode
     :return: New record
-    :rtype: Bio.SeqRecord.SeqRecord
+    :rtype: tuple(bytes, bytes, bytes, bytes)
     """
-    quality = record.letter_annotations["phred_quality"]
-    sequence = str(record.seq)
-    record_extension = ""
+    name, sequence, plus, quality = record
+    record_extension = b""
     if add_trim:
-        record_extension = delimiter + sequence[0:trim]
-    return make_fastq_record(record.id + record_extension,
-                             sequence[trim:],
-                             quality[trim:])
+        record_extension = delimiter.encode() + sequence[0:trim]
+    return (name + record_extension, sequence[trim:], plus, quality[trim:])
 
 
 def make_fastq_records(tag,
@@ -246,8 +237,8 @@ def make_fastq_records(tag,
     :type post_adaptor_nt: str or unicode
     :return: full record, adaptor-trimmed record, barcode- and \
     UMI-extracted record
-    :rtype: tuple(Bio.SeqRecord.SeqRecord, Bio.SeqRecord.SeqRecord, \
-    Bio.SeqRecord.SeqRecord)
+    :rtype: tuple(tuple(bytes, bytes, bytes, bytes), \
+    tuple(bytes, bytes, bytes, bytes), tuple(bytes, bytes, bytes, bytes))
     """
     sequence = umi5 + read + umi3 + barcode + adaptor + post_adaptor_nt
     record = make_fastq_record(tag, sequence, qualities=qualities)
@@ -359,8 +350,9 @@ def create_fastq_simdata(output_dir):
                   "umi5_umi3"]
     file_names = [fastq.FASTQ_FORMAT.format(f) for f in file_names]
     for file_name, fastq_records in zip(file_names, zip(*records)):
-        with open(os.path.join(output_dir, file_name), "w") as f:
-            SeqIO.write(fastq_records, f, "fastq")
+        with fastq.FastqWriter(
+                open(os.path.join(output_dir, file_name), "wb")) as writer:
+            writer.write_records(fastq_records)
 
     # Simulate raw data with only 3' umi.
     config_3 = [
@@ -381,8 +373,9 @@ def create_fastq_simdata(output_dir):
                   "umi3"]
     file_names = [fastq.FASTQ_FORMAT.format(f) for f in file_names]
     for file_name, fastq_records in zip(file_names, zip(*records)):
-        with open(os.path.join(output_dir, file_name), "w") as f:
-            SeqIO.write(fastq_records, f, "fastq")
+        with fastq.FastqWriter(
+                open(os.path.join(output_dir, file_name), "wb")) as writer:
+            writer.write_records(fastq_records)
 
     # Create multiplexed data.
     # Use same data as 5' and 3' UMIs and an adaptor but with
@@ -450,15 +443,17 @@ def create_fastq_simdata(output_dir):
                           "multiplex"]
             file_names = [fastq.FASTQ_FORMAT.format(f) for f in file_names]
             for file_name, fastq_records in zip(file_names, records_by_type):
-                with open(os.path.join(output_dir, file_name), "a") as f:
-                    SeqIO.write(fastq_records, f, "fastq")
+                with fastq.FastqWriter(open(
+                        os.path.join(output_dir, file_name), "ab")) as writer:
+                    writer.write_records(fastq_records)
             # Save records with UMI+barcode extracted in
             # barcode-specific files.
             _, _, extracted_records = records_by_type
             file_name = fastq.FASTQ_FORMAT.format(
                 tag_format.format(barcode_index))
-            with open(os.path.join(deplex_dir, file_name), "a") as f:
-                SeqIO.write(extracted_records, f, "fastq")
+            with fastq.FastqWriter(
+                    open(os.path.join(deplex_dir, file_name), "ab")) as writer:
+                writer.write_records(extracted_records)
 
     # The last file of barcode-specific reads will be that for the
     # unassigned reads so rename that file.
@@ -16,12 +16,13 @@ The sample sheet is assumed to have a header with column names
 
 See also :py:mod:`riboviz.sample_sheets`.
 
-Known issue:
-
-If the number of mismatches is less than the Hamming distance between
-the barcodes (``TagReads`` within the sample sheet) then a read will
-be assigned to the first barcode that matches even if this is not the
-closest barcode in terms of Hamming distance.
+Each read is assigned to the barcode (``TagRead`` within the sample
+sheet) closest to the read's barcode in terms of Hamming distance, if
+this distance is within the number of mismatches allowed. Barcodes
+are looked up in an index of every barcode variant within the number
+of mismatches (see
+:py:func:`riboviz.barcodes_umis.create_barcode_index`), which is
+created once per run.
 
 For example, imagine we had a barcode in a read, AGA, and our barcodes
 in our samplesheet are AAA, CCC, GGG, TTT. The Hamming distances
@@ -32,24 +33,37 @@ between the barcode and the sample barcodes are as follows:
 * d(AGA, TTT) = 3
 * d(AGA, CCC) = 3
 
-If mismatches is 2 then AGA could be assigned to AAA or GGG, depending
-on the ordering of barcodes in the sample sheet, even though AAA is
+If mismatches is 2 or 3 then AGA is assigned to AAA, as this is
 closest in terms of Hamming distance.
 
-If mismatches is 3 then AGA could be assigned to AAA, GGG, TTT
-depending on the ordering of barcodes in the sample sheet.
+Known issue:
+
+If a read's barcode is equally close to two or more barcodes in the
+sample sheet then the read is assigned to the first of these barcodes
+in the sample sheet. The number of such ambiguous reads is
+printed. For example, if mismatches is 2 then a read with barcode
+ACT, which is distance 2 from each of AAA, CCC and TTT, would be
+assigned to AAA.
 
 Caution should be taken if the Hamming distance of the barcodes in the
-sample sheet is less than the number of mismatches times 2. In the
-above two examples, the Hamming distance between each of the sample
-barcodes is 3 is less than the number of mismatches times 2, which is
-4 and 6 respectively.
+sample sheet is less than the number of mismatches times 2.
 
 Files are not output for any barcode that has no matching reads.
+
+If the input files are GZIPped then the output files are written in
+BGZF format, a GZIP-compatible format made of independently
+compressed blocks which can be indexed, with blocks compressed by a
+pool of threads shared by all output files (see
+:py:func:`riboviz.fastq.open_fastq_writer`), and the input files are
+read, and decompressed, by background threads (see
+:py:class:`riboviz.fastq.ThreadedReader`).
 """
-import gzip
+import collections
+import concurrent.futures
+import io
+import multiprocessing
 import os
-from itertools import islice
+from itertools import zip_longest
 from riboviz import barcodes_umis
 from riboviz import fastq
 from riboviz import sample_sheets
@@ -60,6 +74,16 @@ NUM_READS_FILE = "num_reads.tsv"
 """ Number of reads file name. """
 OUTPUT_DIR = "output"
 """ Default directory name for demultiplexed files. """
+BATCH_SIZE = 100000
+"""
+Default number of FASTQ records per batch when demultiplexing using
+more than one process.
+"""
+_WORKER_STATE = {}
+"""
+Barcodes, barcode index, mismatches and delimiter used by worker
+processes, set by :py:func:`_init_worker`.
+"""
 
 
 def assign_sample(fastq_record1,
@@ -168,12 +192,349 @@ def assign_samples(fastq_record1,
     return is_assigned
 
 
+def assign_samples_by_index(fastq_record1,
+                            fastq_record2,
+                            barcodes,
+                            barcode_index,
+                            read1_split_writers,
+                            read2_split_writers,
+                            is_paired_end,
+                            num_reads,
+                            mismatches,
+                            delimiter):
+    """
+    Look up the barcode of a FASTQ record in a barcode index and, if
+    it matches the barcode for a sample, add the record to the FASTQ
+    output file for the sample and update the count in
+    ``num_reads`` for the sample.
+
+    `read1_split_writers`, `read2_split_writers` (if
+    ``is_paired_end`` is ``True``), ``barcodes`` and ``num_reads``
+    are all expected to be the same length.
+
+    :param fastq_record1: FASTQ record, see \
+    :py:func:`riboviz.fastq.read_fastq_records`
+    :type fastq_record1: tuple(bytes, bytes, bytes, bytes)
+    :param fastq_record2: FASTQ record for paired read, or ``None``
+    :type fastq_record2: tuple(bytes, bytes, bytes, bytes)
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index, created by \
+    :py:func:`riboviz.barcodes_umis.create_barcode_index` using \
+    ``barcodes`` and ``mismatches``
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param read1_split_writers: Read 1 output file writers
+    :type read1_split_writers: list(riboviz.fastq.FastqWriter)
+    :param read2_split_writers: Read 2 output file writers, or \
+    ``None``
+    :type read2_split_writers: list(riboviz.fastq.FastqWriter)
+    :param is_paired_end: Are paired reads being used? (if \
+    ``True`` then ``fastq_record2`` is assumed to have a FASTQ \
+    record and ``read2_split_writers`` is assumed to have a \
+    complementary output file writer)
+    :type is_paired_end: bool
+    :param num_reads: Number of matched reads for each sample
+    :type num_reads: list(int)
+    :param mismatches: Mismatches allowed
+    :type mismatches: int
+    :param delimiter: Barcode delimiter
+    :type delimiter: str or unicode
+    :returns: (index into ``barcodes``, Hamming distance, \
+    ambiguous flag) or ``None`` if the FASTQ record matches no \
+    barcode
+    :rtype: tuple(int, int, bool)
+    """
+    match = barcodes_umis.match_barcode(
+        barcodes_umis.get_barcode(fastq_record1[0].decode(), delimiter),
+        barcodes,
+        barcode_index,
+        mismatches)
+    if match is not None:
+        sample = match[0]
+        read1_split_writers[sample].write(fastq_record1)
+        if is_paired_end:
+            read2_split_writers[sample].write(fastq_record2)
+        num_reads[sample] += 1
+    return match
+
+
+def assign_headers(headers,
+                   barcodes,
+                   barcode_index,
+                   mismatches,
+                   delimiter):
+    """
+    Look up the barcodes of a batch of FASTQ record headers in a
+    barcode index, using
+    :py:func:`riboviz.barcodes_umis.match_barcodes_by_index`.
+
+    :param headers: FASTQ record headers, see \
+    :py:func:`riboviz.fastq.read_fastq_records`
+    :type headers: list(bytes)
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index, created by \
+    :py:func:`riboviz.barcodes_umis.create_barcode_index` using \
+    ``barcodes`` and ``mismatches``
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param mismatches: Mismatches allowed
+    :type mismatches: int
+    :param delimiter: Barcode delimiter
+    :type delimiter: str or unicode
+    :returns: For each header, (index into ``barcodes``, Hamming \
+    distance, ambiguous flag) or ``None`` if the header matches no \
+    barcode
+    :rtype: list(tuple(int, int, bool))
+    """
+    return barcodes_umis.match_barcodes_by_index(
+        [barcodes_umis.get_barcode(header.decode(), delimiter)
+         for header in headers],
+        barcodes,
+        barcode_index,
+        mismatches)
+
+
+def _init_worker(barcodes, barcode_index, mismatches, delimiter):
+    """
+    Initialise a worker process with the barcodes and barcode index
+    so these are not sent with every batch.
+
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param mismatches: Mismatches allowed
+    :type mismatches: int
+    :param delimiter: Barcode delimiter
+    :type delimiter: str or unicode
+    """
+    _WORKER_STATE["barcodes"] = barcodes
+    _WORKER_STATE["barcode_index"] = barcode_index
+    _WORKER_STATE["mismatches"] = mismatches
+    _WORKER_STATE["delimiter"] = delimiter
+
+
+def demultiplex_chunk(chunk1,
+                      chunk2,
+                      barcodes,
+                      barcode_index,
+                      mismatches,
+                      delimiter):
+    """
+    Parse a chunk of FASTQ records, and the chunk of paired records
+    (if any), match the barcodes of the records and format the
+    records for the samples they were assigned to, or as unassigned
+    records, in the order in which they occur in the chunk.
+
+    :param chunk1: FASTQ records, see \
+    :py:func:`riboviz.fastq.read_fastq_chunks`
+    :type chunk1: bytes
+    :param chunk2: Paired FASTQ records, or ``None``
+    :type chunk2: bytes
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index, created by \
+    :py:func:`riboviz.barcodes_umis.create_barcode_index` using \
+    ``barcodes`` and ``mismatches``
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param mismatches: Mismatches allowed
+    :type mismatches: int
+    :param delimiter: Barcode delimiter
+    :type delimiter: str or unicode
+    :returns: Formatted records for each sample and for unassigned \
+    records, formatted paired records for each sample and for \
+    unassigned records (or ``None``), number of matched reads for \
+    each sample, number of reads, number of unassigned reads and \
+    number of ambiguous reads
+    :rtype: tuple(list(bytes), list(bytes), list(int), int, int, int)
+    :raise ValueError: If a record is malformed or truncated or if \
+    ``chunk1`` and ``chunk2`` have different numbers of records
+    """
+    if chunk2 is None:
+        batch = [(record1, None) for record1 in
+                 fastq.read_fastq_records(io.BytesIO(chunk1))]
+    else:
+        batch = list(fastq.read_fastq_record_pairs(io.BytesIO(chunk1),
+                                                   io.BytesIO(chunk2)))
+    matches = assign_headers([record1[0] for record1, _ in batch],
+                             barcodes,
+                             barcode_index,
+                             mismatches,
+                             delimiter)
+    num_samples = len(barcodes)
+    split_records = [[] for _ in range(num_samples + 1)]
+    num_reads = [0] * num_samples
+    num_ambiguous_reads = 0
+    for records, match in zip(batch, matches):
+        if match is None:
+            sample = num_samples
+        else:
+            sample = match[0]
+            num_reads[sample] += 1
+            if match[2]:
+                num_ambiguous_reads += 1
+        split_records[sample].append(records)
+    data1 = [b"".join(fastq.format_fastq_record(record1)
+                      for record1, _ in records)
+             for records in split_records]
+    data2 = None
+    if chunk2 is not None:
+        data2 = [b"".join(fastq.format_fastq_record(record2)
+                          for _, record2 in records)
+                 for records in split_records]
+    return (data1,
+            data2,
+            num_reads,
+            len(batch),
+            len(split_records[num_samples]),
+            num_ambiguous_reads)
+
+
+def _demultiplex_chunk_worker(chunk1, chunk2):
+    """
+    Call :py:func:`demultiplex_chunk` using the state set by
+    :py:func:`_init_worker`.
+
+    :param chunk1: FASTQ records
+    :type chunk1: bytes
+    :param chunk2: Paired FASTQ records, or ``None``
+    :type chunk2: bytes
+    :returns: See :py:func:`demultiplex_chunk`
+    :rtype: tuple(list(bytes), list(bytes), list(int), int, int, int)
+    """
+    return demultiplex_chunk(chunk1,
+                             chunk2,
+                             _WORKER_STATE["barcodes"],
+                             _WORKER_STATE["barcode_index"],
+                             _WORKER_STATE["mismatches"],
+                             _WORKER_STATE["delimiter"])
+
+
+def demultiplex_batches(read1_fh,
+                        read2_fh,
+                        barcodes,
+                        barcode_index,
+                        read1_split_writers,
+                        read2_split_writers,
+                        read1_unassigned_writer,
+                        read2_unassigned_writer,
+                        num_reads,
+                        mismatches,
+                        delimiter,
+                        num_processes,
+                        batch_size=BATCH_SIZE):
+    """
+    Demultiplex FASTQ records using a pool of worker processes.
+
+    Chunks of ``batch_size`` records are read, without being parsed,
+    and each chunk is parsed, matched to barcodes and formatted by a
+    worker process, using :py:func:`demultiplex_chunk`. The formatted
+    records are then written in the order in which they were read,
+    so the output is the same as when demultiplexing records one at
+    a time. At most twice ``num_processes`` chunks are held in memory
+    at any time.
+
+    :param read1_fh: FASTQ file handle, opened in binary mode
+    :type read1_fh: io.IOBase
+    :param read2_fh: FASTQ file handle, for paired reads, opened in \
+    binary mode, or ``None``
+    :type read2_fh: io.IOBase
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    :param barcode_index: Barcode index, created by \
+    :py:func:`riboviz.barcodes_umis.create_barcode_index` using \
+    ``barcodes`` and ``mismatches``
+    :type barcode_index: dict(str or unicode, tuple(int, int, bool))
+    :param read1_split_writers: Read 1 output file writers
+    :type read1_split_writers: list(riboviz.fastq.FastqWriter)
+    :param read2_split_writers: Read 2 output file writers, or \
+    ``None``
+    :type read2_split_writers: list(riboviz.fastq.FastqWriter)
+    :param read1_unassigned_writer: Read 1 unassigned output file \
+    writer
+    :type read1_unassigned_writer: riboviz.fastq.FastqWriter
+    :param read2_unassigned_writer: Read 2 unassigned output file \
+    writer, or ``None``
+    :type read2_unassigned_writer: riboviz.fastq.FastqWriter
+    :param num_reads: Number of matched reads for each sample
+    :type num_reads: list(int)
+    :param mismatches: Mismatches allowed
+    :type mismatches: int
+    :param delimiter: Barcode delimiter
+    :type delimiter: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param batch_size: Number of FASTQ records per chunk
+    :type batch_size: int
+    :returns: Total number of reads, number of unassigned reads and \
+    number of ambiguous reads
+    :rtype: tuple(int, int, int)
+    :raise ValueError: If a record is malformed or truncated or if \
+    the files have different numbers of records
+    """
+    total_reads = 0
+    num_unassigned_reads = 0
+    num_ambiguous_reads = 0
+    writers1 = list(read1_split_writers) + [read1_unassigned_writer]
+    writers2 = list(read2_split_writers or []) + [read2_unassigned_writer]
+    pending = collections.deque()
+    chunks1 = fastq.read_fastq_chunks(read1_fh, batch_size)
+    if read2_fh is None:
+        chunks = ((chunk1, None) for chunk1 in chunks1)
+    else:
+        chunks = zip_longest(chunks1,
+                             fastq.read_fastq_chunks(read2_fh, batch_size))
+
+    def write_next():
+        nonlocal total_reads, num_unassigned_reads, num_ambiguous_reads
+        data1, data2, chunk_num_reads, num_chunk_reads, num_unassigned, \
+            num_ambiguous = pending.popleft().get()
+        for sample, data in enumerate(data1):
+            if data:
+                writers1[sample].write_formatted(data)
+        for sample, data in enumerate(data2 or []):
+            if data:
+                writers2[sample].write_formatted(data)
+        for sample, num_sample_reads in enumerate(chunk_num_reads):
+            num_reads[sample] += num_sample_reads
+        # Count number of processed reads, output every millionth.
+        if (total_reads + num_chunk_reads) // 1000000 > \
+           total_reads // 1000000:
+            print(("{} reads processed".format(
+                1000000 * ((total_reads + num_chunk_reads) // 1000000))))
+        total_reads += num_chunk_reads
+        num_unassigned_reads += num_unassigned
+        num_ambiguous_reads += num_ambiguous
+
+    with multiprocessing.Pool(num_processes,
+                              initializer=_init_worker,
+                              initargs=(barcodes,
+                                        barcode_index,
+                                        mismatches,
+                                        delimiter)) as pool:
+        for chunk1, chunk2 in chunks:
+            if chunk1 is None or (read2_fh is not None and chunk2 is None):
+                raise ValueError(
+                    "Paired FASTQ files have different numbers of records")
+            pending.append(pool.apply_async(_demultiplex_chunk_worker,
+                                            (chunk1, chunk2)))
+            if len(pending) >= 2 * num_processes:
+                write_next()
+        while pending:
+            write_next()
+    return total_reads, num_unassigned_reads, num_ambiguous_reads
+
+
 def demultiplex(sample_sheet_file,
                 read1_file,
                 read2_file=None,
                 mismatches=1,
                 out_dir=OUTPUT_DIR,
-                delimiter=barcodes_umis.BARCODE_DELIMITER):
+                delimiter=barcodes_umis.BARCODE_DELIMITER,
+                num_processes=1,
+                batch_size=BATCH_SIZE,
+                num_threads=1,
+                max_open_files=fastq.MAX_OPEN_FILES):
     """
     Demultiplex FASTQ files using UMI-tools-compliant barcodes present
     within the FASTQ headers and a sample sheet file. GZIPped FASTQ
@@ -186,6 +547,25 @@ def demultiplex(sample_sheet_file,
     ``read1_file`` i.e. if ``read1_file`` is GZIPped then
     ``read2_file`` must be also.
 
+    If ``num_processes`` is greater than 1 then FASTQ records are
+    read in chunks of ``batch_size`` records, each chunk is parsed,
+    matched to barcodes and formatted by a pool of ``num_processes``
+    worker processes and the records are written in the order in
+    which they were read. The output files are the same as when
+    using 1 process. See :py:func:`demultiplex_batches`.
+
+    If ``num_threads`` is non-zero then input files are read, and
+    decompressed, by background threads and, if the input files are
+    GZIPped, output files are compressed in BGZF format by a pool of
+    ``num_threads`` threads. Otherwise, files are read, and
+    compressed, using :py:mod:`gzip`.
+
+    Output files are written using a
+    :py:class:`riboviz.fastq.FastqWriterPool`, which buffers records
+    per file, keeps at most ``max_open_files`` output files open and
+    creates output files only when records are first written to
+    them. Unassigned output files are always created.
+
     :param sample_sheet_file: Sample sheet file name
     :type sample_sheet_file: str or unicode
     :param read1_file: FASTQ file name
@@ -198,6 +578,16 @@ def demultiplex(sample_sheet_file,
     :type out_dir: str or unicode
     :param delimiter: Barcode delimiter
     :type delimiter: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param batch_size: Number of FASTQ records per batch, if \
+    ``num_processes`` is greater than 1
+    :type batch_size: int
+    :param num_threads: Number of threads for reading and \
+    compression, or 0 to read and compress in the calling thread
+    :type num_threads: int
+    :param max_open_files: Maximum number of open output files
+    :type max_open_files: int
      """
     print(("Demultiplexing reads for file: " + read1_file))
     print(("Using sample sheet: " + sample_sheet_file))
@@ -209,8 +599,13 @@ def demultiplex(sample_sheet_file,
     print(("Number of samples: {}".format(num_samples)))
     print(("Allowed mismatches: {}".format(mismatches)))
     print(("Barcode delimiter: {}".format(delimiter)))
+    print(("Number of processes: {}".format(num_processes)))
+    print(("Number of threads: {}".format(num_threads)))
     num_reads = [0] * num_samples
     num_unassigned_reads = 0
+    num_ambiguous_reads = 0
+    barcode_index = barcodes_umis.create_barcode_index(barcodes,
+                                                       mismatches)
     total_reads = 0
 
     if not os.path.isfile(read1_file):
@@ -218,19 +613,22 @@ def demultiplex(sample_sheet_file,
             "Error: read 1 file {} does not exist".format(read1_file))
 
     file_format = fastq.FASTQ_FORMATS[utils.get_file_ext(read1_file)]
-    if fastq.is_fastq_gz(read1_file):
-        open_file = gzip.open
-    else:
-        open_file = open
 
-    read1_fh = open_file(read1_file, 'rt')
+    def open_input(file_name):
+        if num_threads:
+            return fastq.ThreadedReader(file_name)
+        return fastq.open_fastq(file_name)
+
+    read1_fh = open_input(read1_file)
     is_paired_end = read2_file is not None
     if is_paired_end:
         if not os.path.isfile(read2_file):
             raise FileNotFoundError(
                 "Error: read 2 file {} does not exist".format(
                     read2_file))
-        read2_fh = open_file(read2_file, 'rt')
+        read2_fh = open_input(read2_file)
+    else:
+        read2_fh = None
 
     if not os.path.exists(out_dir):
         try:
@@ -242,6 +640,16 @@ def demultiplex(sample_sheet_file,
         raise IOError(
             "Error: output directory {} cannot be created".format(out_dir))
 
+    # Compression threads shared by all output files.
+    executor = None
+    if num_threads and fastq.is_fastq_gz(read1_file):
+        executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+
+    writer_pool = fastq.FastqWriterPool(max_open_files,
+                                        num_threads,
+                                        executor)
+    open_writer = writer_pool.get_writer
+
     num_reads_file = os.path.join(out_dir, NUM_READS_FILE)
     if not is_paired_end:
         extension = ""
@@ -254,77 +662,97 @@ def demultiplex(sample_sheet_file,
     read1_unassigned_file = os.path.join(
         out_dir,
         file_format.format(sample_sheets.UNASSIGNED_TAG + extension))
-    read1_split_fhs = [open_file(file_name, "wt")
-                       for file_name in read1_split_files]
-    read1_unassigned_fh = open_file(read1_unassigned_file, "wt")
+    read1_split_writers = [open_writer(file_name)
+                           for file_name in read1_split_files]
+    read1_unassigned_writer = open_writer(read1_unassigned_file)
+    writer_pool.create(read1_unassigned_file)
     if is_paired_end:
         read2_split_files = [
             os.path.join(out_dir,
                          file_format.format(sample_id + "_R2"))
             for sample_id in sample_ids]
-        read2_split_fhs = [open_file(file_name, "wt")
-                           for file_name in read2_split_files]
+        read2_split_writers = [open_writer(file_name)
+                               for file_name in read2_split_files]
         read2_unassigned_file = os.path.join(
             out_dir,
             file_format.format(sample_sheets.UNASSIGNED_TAG + "_R2"))
-        read2_unassigned_fh = open_file(read2_unassigned_file, "wt")
+        read2_unassigned_writer = open_writer(read2_unassigned_file)
+        writer_pool.create(read2_unassigned_file)
     else:
         read2_split_files = []
-        read2_split_fhs = []
+        read2_split_writers = []
         read2_unassigned_file = None
-        read2_unassigned_fh = None
-    while True:
-        # Get fastq record/read (4 lines)
-        fastq_record1 = list(islice(read1_fh, 4))
-        if not fastq_record1:
-            break
+        read2_unassigned_writer = None
+    if num_processes > 1:
+        total_reads, num_unassigned_reads, num_ambiguous_reads = \
+            demultiplex_batches(read1_fh,
+                                read2_fh,
+                                barcodes,
+                                barcode_index,
+                                read1_split_writers,
+                                read2_split_writers,
+                                read1_unassigned_writer,
+                                read2_unassigned_writer,
+                                num_reads,
+                                mismatches,
+                                delimiter,
+                                num_processes,
+                                batch_size)
+    else:
         if is_paired_end:
-            fastq_record2 = list(islice(read2_fh, 4))
+            fastq_records = fastq.read_fastq_record_pairs(read1_fh,
+                                                          read2_fh)
         else:
-            fastq_record2 = None
-        # Count number of processed reads, output every millionth.
-        total_reads += 1
-        if (total_reads % 1000000) == 0:
-            print(("{} reads processed".format(total_reads)))
-        # Assign read to a SampleID,
-        # TagRead is 1st read with less than threshold mismatches.
-        # Beware: this could cause problems if many mismatches.
-        is_assigned = assign_samples(fastq_record1,
-                                     fastq_record2,
-                                     barcodes,
-                                     read1_split_fhs,
-                                     read2_split_fhs,
-                                     is_paired_end,
-                                     num_reads,
-                                     mismatches,
-                                     delimiter)
-        if not is_assigned:
-            # Write unassigned read to file.
-            # Note: unassigned reads are not trimmed.
-            read1_unassigned_fh.writelines(fastq_record1)
-            if is_paired_end:
-                read2_unassigned_fh.writelines(fastq_record2)
-            num_unassigned_reads += 1
+            fastq_records = ((record1, None) for record1 in
+                             fastq.read_fastq_records(read1_fh))
+        for fastq_record1, fastq_record2 in fastq_records:
+            # Count number of processed reads, output every millionth.
+            total_reads += 1
+            if (total_reads % 1000000) == 0:
+                print(("{} reads processed".format(total_reads)))
+            # Assign read to a SampleID,
+            # TagRead is closest TagRead within threshold mismatches,
+            # or 1st such TagRead if there are ties.
+            match = assign_samples_by_index(fastq_record1,
+                                            fastq_record2,
+                                            barcodes,
+                                            barcode_index,
+                                            read1_split_writers,
+                                            read2_split_writers,
+                                            is_paired_end,
+                                            num_reads,
+                                            mismatches,
+                                            delimiter)
+            if match is not None:
+                if match[2]:
+                    num_ambiguous_reads += 1
+            else:
+                # Write unassigned read to file.
+                # Note: unassigned reads are not trimmed.
+                read1_unassigned_writer.write(fastq_record1)
+                if is_paired_end:
+                    read2_unassigned_writer.write(fastq_record2)
+                num_unassigned_reads += 1
 
     # Close output handles and fastq file.
-    for fh in read1_split_fhs:
-        fh.close()
-    read1_unassigned_fh.close()
+    writer_pool.close()
     read1_fh.close()
     if is_paired_end:
-        for fh in read2_split_fhs:
-            fh.close()
-        read2_unassigned_fh.close()
         read2_fh.close()
+    if executor is not None:
+        executor.shutdown()
 
     print(("All {} reads processed".format(total_reads)))
+    print(("{} reads matched more than one barcode equally closely".format(
+        num_ambiguous_reads)))
 
-    # Purge files with no reads.
+    # Files with no reads are not created, but remove any such files
+    # left by previous runs.
     for (_, index) in zip(sample_ids, range(len(sample_ids))):
         if num_reads[index] == 0:
-            os.remove(read1_split_files[index])
-            if is_paired_end:
-                os.remove(read2_split_files[index])
+            for split_files in [read1_split_files, read2_split_files]:
+                if split_files and os.path.exists(split_files[index]):
+                    os.remove(split_files[index])
 
     # Output number of reads by sample to file.
     sample_sheet[sample_sheets.NUM_READS] = num_reads
@@ -1,6 +1,20 @@
 """
 General FASTA and GFF related constants and functions.
+
+GFF3 features of a given type, by default coding sequences (CDS), can
+be read into a :py:class:`GffIndex`, which holds each feature's
+sequence ID, start, end, strand, phase and ``ID`` and ``Name``
+attributes in arrays. :py:func:`get_gff_index` caches indices on disk,
+in files named after a hash of the GFF file contents, so indices are
+shared between runs and are rebuilt only when a GFF file changes.
 """
+import collections
+import gzip
+import hashlib
+import os
+import tempfile
+import urllib.parse
+import numpy as np
 
 CDS_FEATURE_FORMAT = "{}_CDS"
 """
@@ -11,3 +25,364 @@ START_CODON = "ATG"
 """ Canonical start codon. """
 STOP_CODONS = ["TAA", "TAG", "TGA"]
 """ Canonical stop codons. """
+CDS_FEATURE = "CDS"
+""" GFF feature type for coding sequences. """
+GFF_INDEX_DIR = os.path.join(tempfile.gettempdir(), "riboviz-gff-index")
+""" Default directory for cached GFF indices. """
+GFF_INDEX_VERSION = 1
+"""
+GFF index file format version. This is part of the GFF index file
+names so that indices cached by other versions are not used.
+"""
+GFF_INDEX_COLUMNS = ["seqids", "starts", "ends", "strands", "phases",
+                     "ids", "has_ids", "names", "has_names"]
+""" :py:class:`GffIndex` columns. """
+FASTA_DIRECTIVE = "##FASTA"
+""" GFF3 directive marking the start of embedded FASTA sequences. """
+HASH_BLOCK_SIZE = 1 << 20
+""" Number of bytes hashed at a time. """
+
+
+class GffFeature(collections.namedtuple(
+        "GffFeature",
+        ["seqid", "start", "end", "strand", "phase", "attributes"])):
+    """
+    GFF feature, with 1-indexed, inclusive, ``start`` and ``end``
+    and ``attributes`` holding lists of ``ID`` and ``Name`` attribute
+    values, if defined. This supports the ``gffutils.feature.Feature``
+    fields used within RiboViz.
+    """
+
+    __slots__ = ()
+
+    def sequence(self, fasta):
+        """
+        Get the sequence of the feature, reverse-complemented if the
+        feature is on the ``-`` strand.
+
+        :param fasta: FASTA genes
+        :type fasta: pyfaidx.Fasta
+        :return: Sequence
+        :rtype: str or unicode
+        :raises KeyError: If the sequence is not in the FASTA file
+        """
+        sequence = fasta[self.seqid][self.start - 1:self.end]
+        if self.strand == "-":
+            sequence = sequence.reverse.complement
+        return sequence.seq
+
+
+class GffIndex:
+    """
+    Index of GFF features of a single type, in the order they occur in
+    the GFF file. Features can be accessed via the ``seqids``,
+    ``starts``, ``ends``, ``strands`` and ``phases`` arrays, and the
+    ``ids`` and ``names`` arrays (whose values are valid only where
+    ``has_ids`` and ``has_names`` are ``True``), or by iterating
+    over the index, which yields :py:class:`GffFeature`.
+
+    ``num_features`` is the number of features of any type in the GFF
+    file.
+    """
+
+    def __init__(self, num_features, seqids, starts, ends, strands,
+                 phases, ids, has_ids, names, has_names):
+        """
+        Constructor.
+
+        :param num_features: Number of features of any type
+        :type num_features: int
+        :param seqids: Sequence IDs
+        :type seqids: numpy.ndarray or list(str or unicode)
+        :param starts: Start positions (1-indexed)
+        :type starts: numpy.ndarray or list(int)
+        :param ends: End positions (1-indexed, inclusive)
+        :type ends: numpy.ndarray or list(int)
+        :param strands: Strands
+        :type strands: numpy.ndarray or list(str or unicode)
+        :param phases: Phases
+        :type phases: numpy.ndarray or list(str or unicode)
+        :param ids: First ``ID`` attribute values
+        :type ids: numpy.ndarray or list(str or unicode)
+        :param has_ids: Do features have ``ID`` attribute values?
+        :type has_ids: numpy.ndarray or list(bool)
+        :param names: First ``Name`` attribute values
+        :type names: numpy.ndarray or list(str or unicode)
+        :param has_names: Do features have ``Name`` attribute values?
+        :type has_names: numpy.ndarray or list(bool)
+        """
+        self.num_features = int(num_features)
+        self.seqids = np.asarray(seqids, dtype=str)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.strands = np.asarray(strands, dtype=str)
+        self.phases = np.asarray(phases, dtype=str)
+        self.ids = np.asarray(ids, dtype=str)
+        self.has_ids = np.asarray(has_ids, dtype=bool)
+        self.names = np.asarray(names, dtype=str)
+        self.has_names = np.asarray(has_names, dtype=bool)
+
+    def __len__(self):
+        """
+        Get number of features in the index.
+
+        :return: Number of features
+        :rtype: int
+        """
+        return len(self.seqids)
+
+    def __iter__(self):
+        """
+        Iterate over features in the index.
+
+        :return: Features
+        :rtype: iterator(GffFeature)
+        """
+        for seqid, start, end, strand, phase, feature_id, has_id, \
+                name, has_name in zip(*[getattr(self, column).tolist()
+                                        for column in GFF_INDEX_COLUMNS]):
+            attributes = {}
+            if has_id:
+                attributes["ID"] = [feature_id]
+            if has_name:
+                attributes["Name"] = [name]
+            yield GffFeature(seqid, start, end, strand, phase,
+                             attributes)
+
+
+def open_gff(gff):
+    """
+    Open a GFF file, which may be gzip-compressed, for reading.
+
+    :param gff: GFF file
+    :type gff: str or unicode
+    :return: File
+    :rtype: io.TextIOWrapper
+    """
+    with open(gff, "rb") as f:
+        is_gzip = f.read(2) == b"\x1f\x8b"
+    if is_gzip:
+        return gzip.open(gff, "rt")
+    return open(gff, "r")
+
+
+def get_attribute_values(attributes, keys):
+    """
+    Get values of GFF3 or GFF2/GTF attributes. GFF3 attributes have
+    form ``<key>=<value>``, and their values are split at commas and
+    percent-encoded characters decoded. An attribute with an empty
+    value has no values. If ``attributes`` has no ``=`` then it is
+    parsed as GFF2/GTF attributes, of form ``<key> "<value>"``.
+
+    :param attributes: GFF3 or GFF2/GTF attributes column
+    :type attributes: str or unicode
+    :param keys: Attribute names
+    :type keys: list(str or unicode)
+    :return: Values of each attribute, or ``None`` if the attribute \
+    is undefined
+    :rtype: list(list(str or unicode))
+    """
+    is_gff3 = "=" in attributes
+    values = [None] * len(keys)
+    for attribute in attributes.split(";"):
+        if is_gff3:
+            key, _, value = attribute.partition("=")
+        else:
+            key, _, value = attribute.strip().partition(" ")
+            value = value.strip().strip('"')
+        key = key.strip()
+        if key not in keys:
+            continue
+        index = keys.index(key)
+        if values[index] is None:
+            values[index] = []
+        if value and is_gff3:
+            values[index].extend(urllib.parse.unquote(v)
+                                 for v in value.split(","))
+        elif value:
+            values[index].append(value)
+    return values
+
+
+def read_gff_records(gff, keys):
+    """
+    Iterate through the records of a GFF3 or GFF2/GTF file, which may
+    be gzip-compressed, yielding, for each record, its line number,
+    its fields and the values of the attributes ``keys`` (see
+    :py:func:`get_attribute_values`).
+
+    Comment lines and lines following a :py:const:`FASTA_DIRECTIVE`
+    are ignored.
+
+    :param gff: GFF file
+    :type gff: str or unicode
+    :param keys: Attribute names
+    :type keys: list(str or unicode)
+    :return: Line number, fields and attribute values of each record
+    :rtype: collections.Iterable(tuple(int, list(str or unicode), \
+    list(list(str or unicode))))
+    :raises FileNotFoundError: If the GFF file cannot be found
+    :raises ValueError: If the GFF file has invalid lines
+    """
+    if not os.path.exists(gff) or (not os.path.isfile(gff)):
+        raise FileNotFoundError(gff)
+    with open_gff(gff) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if line.startswith(FASTA_DIRECTIVE):
+                break
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) not in (8, 9):
+                raise ValueError("Invalid GFF line {} ({})".format(
+                    line_number, gff))
+            attributes = fields[8] if len(fields) == 9 else ""
+            yield line_number, fields, get_attribute_values(attributes,
+                                                            keys)
+
+
+def read_gff_index(gff, feature_type=CDS_FEATURE):
+    """
+    Read GFF3 features of a given type into an index, in a single
+    pass through the file, using :py:func:`read_gff_records`.
+
+    As for ``gffutils.create_db`` with ``merge_strategy='merge'``,
+    features with the same ``ID`` attribute and the same values for
+    all other columns are treated as a single feature, with the
+    attribute values of the first.
+
+    :param gff: GFF file
+    :type gff: str or unicode
+    :param feature_type: Feature type
+    :type feature_type: str or unicode
+    :return: Index
+    :rtype: GffIndex
+    :raises FileNotFoundError: If the GFF file cannot be found
+    :raises ValueError: If the GFF file is empty or has invalid lines
+    """
+    columns = [[] for _ in GFF_INDEX_COLUMNS]
+    num_features = 0
+    # ID attributes and other columns of features with ID attributes.
+    id_features = set()
+    for line_number, fields, (id_values, name_values) in \
+            read_gff_records(gff, ["ID", "Name"]):
+        if id_values:
+            id_key = (id_values[0], tuple(fields[:8]))
+            if id_key in id_features:
+                continue
+            id_features.add(id_key)
+        num_features += 1
+        if fields[2] != feature_type:
+            continue
+        try:
+            start, end = int(fields[3]), int(fields[4])
+        except ValueError as e:
+            raise ValueError("Invalid GFF line {}: {} ({})".format(
+                line_number, e, gff)) from e
+        for column, value in zip(
+                columns,
+                [fields[0], start, end, fields[6], fields[7],
+                 id_values[0] if id_values else "",
+                 bool(id_values),
+                 name_values[0] if name_values else "",
+                 bool(name_values)]):
+            column.append(value)
+    if num_features == 0:
+        raise ValueError(
+            "No lines parsed -- was an empty file provided? ({})".format(
+                gff))
+    return GffIndex(num_features, *columns)
+
+
+def get_file_hash(file_name):
+    """
+    Get SHA-256 hash of a file's contents.
+
+    :param file_name: File
+    :type file_name: str or unicode
+    :return: Hash, as hexadecimal digits
+    :rtype: str or unicode
+    """
+    file_hash = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def save_gff_index(index, index_file):
+    """
+    Save GFF index. The index is written to a temporary file which is
+    then renamed, so concurrent readers and writers of the same index
+    file always see a complete index.
+
+    :param index: Index
+    :type index: GffIndex
+    :param index_file: Index file
+    :type index_file: str or unicode
+    """
+    index_dir = os.path.dirname(index_file)
+    os.makedirs(index_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=index_dir, suffix=".npz",
+                                     delete=False) as f:
+        np.savez(f, num_features=index.num_features,
+                 **{column: getattr(index, column)
+                    for column in GFF_INDEX_COLUMNS})
+    os.replace(f.name, index_file)
+
+
+def load_gff_index(index_file):
+    """
+    Load GFF index.
+
+    :param index_file: Index file
+    :type index_file: str or unicode
+    :return: Index
+    :rtype: GffIndex
+    """
+    with np.load(index_file, allow_pickle=False) as data:
+        return GffIndex(data["num_features"],
+                        *[data[column] for column in GFF_INDEX_COLUMNS])
+
+
+def get_gff_index(gff, feature_type=CDS_FEATURE, cache_dir=GFF_INDEX_DIR):
+    """
+    Get index of GFF3 features of a given type, using
+    :py:func:`read_gff_index`.
+
+    If ``cache_dir`` is not ``None`` then the index is loaded from,
+    or, if not present, saved to, a file in ``cache_dir`` named after
+    the SHA-256 hash of the GFF file, the feature type and
+    :py:const:`GFF_INDEX_VERSION`. If the index cannot be saved (for
+    example, ``cache_dir`` is not writable) then it is not cached.
+
+    :param gff: GFF file
+    :type gff: str or unicode
+    :param feature_type: Feature type
+    :type feature_type: str or unicode
+    :param cache_dir: Directory for cached indices or ``None``
+    :type cache_dir: str or unicode
+    :return: Index
+    :rtype: GffIndex
+    :raises FileNotFoundError: If the GFF file cannot be found
+    :raises ValueError: If the GFF file is empty or has invalid lines
+    """
+    if cache_dir is None:
+        return read_gff_index(gff, feature_type)
+    if not os.path.exists(gff) or (not os.path.isfile(gff)):
+        raise FileNotFoundError(gff)
+    index_file = os.path.join(cache_dir, "{}.{}.v{}.npz".format(
+        get_file_hash(gff),
+        urllib.parse.quote(feature_type, safe=""),
+        GFF_INDEX_VERSION))
+    try:
+        return load_gff_index(index_file)
+    except (OSError, KeyError, ValueError):
+        pass
+    index = read_gff_index(gff, feature_type)
+    try:
+        save_gff_index(index, index_file)
+    except OSError:
+        pass
+    return index
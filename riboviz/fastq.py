@@ -1,8 +1,16 @@
 """
 FASTQ-related constants and functions.
 """
+import collections
+import concurrent.futures
 import gzip
+import itertools
+import mmap
 import os.path
+import queue
+import struct
+import threading
+import zlib
 from Bio import SeqIO
 from riboviz import utils
 
@@ -33,6 +41,47 @@ FASTQ_FORMATS = {FASTQ_EXT: FASTQ_FORMAT,
                  FASTQ_GZ_EXT: FASTQ_GZ_FORMAT,
                  FQ_GZ_EXT: FQ_GZ_FORMAT}
 """ Map from file extensions to file name formats. """
+BLOCK_SIZE = 4 * 1024 * 1024
+""" Default size, in bytes, of blocks read from FASTQ files. """
+RECORD_FORMAT = b"@%b\n%b\n+%b\n%b\n"
+""" FASTQ record format for (header, sequence, plus, quality) tuples. """
+WRITE_BATCH_SIZE = 10000
+""" Default number of records buffered by :py:class:`FastqWriter`. """
+GZ_MAGIC = b"\x1f\x8b"
+""" First bytes of a GZIP file. """
+GZ_MEMBER_SIZE = 1024 * 1024
+"""
+Default size, in bytes, of uncompressed data compressed into each
+GZIP member by :py:class:`ParallelGzipWriter`.
+"""
+GZ_COMPRESS_LEVEL = 6
+""" Default GZIP compression level. """
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+"""
+Header of each BGZF block, up to the block size, as written by
+``bgzip`` and ``htslib``.
+"""
+BGZF_BLOCK_SIZE = 0xff00
+"""
+Maximum size, in bytes, of uncompressed data in each BGZF block, as
+used by ``htslib``.
+"""
+BGZF_EOF = BGZF_HEADER + b"\x1b\x00\x03\x00" + b"\x00" * 8
+""" Empty BGZF block marking the end of a BGZF file. """
+BGZF_MEMBER_SIZE = 16 * BGZF_BLOCK_SIZE
+"""
+Default size, in bytes, of uncompressed data compressed, into BGZF
+blocks, at a time by :py:class:`ParallelBgzfWriter`.
+"""
+MAX_OPEN_FILES = 256
+""" Default maximum number of open files in a :py:class:`FastqWriterPool`. """
+POOL_BUFFER_SIZE = 256 * 1024 * 1024
+"""
+Default maximum number of bytes buffered across all files in a
+:py:class:`FastqWriterPool`.
+"""
+READ_QUEUE_SIZE = 4
+""" Maximum number of blocks read ahead by :py:class:`ThreadedReader`. """
 
 
 def is_fastq_gz(file_name):
@@ -64,25 +113,1085 @@ def strip_fastq_gz(file_name):
     return file_name
 
 
-def count_sequences(file_name):
+def open_fastq(file_name, mode="rb"):
+    """
+    Open a FASTQ file in binary mode. GZIPped FASTQ files can be
+    handled too.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param mode: Mode, ``rb``, ``wb`` or ``ab``
+    :type mode: str or unicode
+    :return: File handle
+    :rtype: io.IOBase
+    """
+    if is_fastq_gz(file_name):
+        return gzip.open(file_name, mode)
+    return open(file_name, mode)
+
+
+def read_fastq_lines(fh, block_size=BLOCK_SIZE):
+    """
+    Iterate over the records in a FASTQ file, read in blocks of
+    ``block_size`` bytes, as tuples of the four lines of each record,
+    without their newlines.
+
+    Each record is validated: the header must start with ``@``, the
+    third line with ``+`` and the sequence and quality must be the
+    same length.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over records' lines
+    :rtype: collections.Iterable(tuple(bytes, bytes, bytes, bytes))
+    :raise ValueError: If a record is malformed or truncated
+    """
+    remainder = b""
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        lines = (remainder + block).split(b"\n")
+        num_lines = (len(lines) - 1) // 4 * 4
+        remainder = b"\n".join(lines[num_lines:])
+        it = iter(lines[:num_lines])
+        yield from _check_fastq_lines(zip(it, it, it, it))
+    lines = remainder.split(b"\n")
+    while lines and not lines[-1]:
+        lines.pop()
+    if not lines:
+        return
+    if len(lines) != 4:
+        raise ValueError(
+            "Truncated FASTQ record: {}".format(lines[0]))
+    yield from _check_fastq_lines([tuple(lines)])
+
+
+def _check_fastq_lines(records):
+    """
+    Validate records' lines. See :py:func:`read_fastq_lines`.
+
+    :param records: Records' lines
+    :type records: collections.Iterable(tuple(bytes, bytes, bytes, \
+    bytes))
+    :return: Iterator over records' lines
+    :rtype: collections.Iterable(tuple(bytes, bytes, bytes, bytes))
+    :raise ValueError: If a record is malformed
+    """
+    for record in records:
+        header, sequence, plus, quality = record
+        if header[:1] != b"@" or plus[:1] != b"+" or \
+           len(sequence) != len(quality):
+            raise ValueError(
+                "Malformed FASTQ record: {}".format(header))
+        yield record
+
+
+def read_fastq_records(fh, block_size=BLOCK_SIZE):
+    """
+    Iterate over the records in a FASTQ file, read in blocks of
+    ``block_size`` bytes. See :py:func:`read_fastq_lines`.
+
+    Each record is returned as a tuple of (header, sequence, plus,
+    quality) ``bytes``. The header excludes the leading ``@`` and
+    the plus excludes the leading ``+``, so records can be written
+    back out, using :py:func:`format_fastq_record`, unchanged.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over records
+    :rtype: collections.Iterable(tuple(bytes, bytes, bytes, bytes))
+    :raise ValueError: If a record is malformed or truncated
+    """
+    for header, sequence, plus, quality in read_fastq_lines(fh,
+                                                            block_size):
+        yield header[1:], sequence, plus[1:], quality
+
+
+def read_fastq_raw_records(fh, block_size=BLOCK_SIZE):
+    """
+    Iterate over the records in a FASTQ file, read in blocks of
+    ``block_size`` bytes, as the original ``bytes`` of each record.
+    See :py:func:`read_fastq_lines`.
+
+    Each record is returned as its four lines, including the
+    content of the ``+`` line, each terminated by a newline.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over records
+    :rtype: collections.Iterable(bytes)
+    :raise ValueError: If a record is malformed or truncated
+    """
+    for lines in read_fastq_lines(fh, block_size):
+        yield b"%b\n%b\n%b\n%b\n" % lines
+
+
+def read_fastq_record_pairs(fh1, fh2, block_size=BLOCK_SIZE):
+    """
+    Iterate over the records in two paired FASTQ files in
+    lockstep. See :py:func:`read_fastq_records`.
+
+    :param fh1: Read 1 file handle, opened in binary mode
+    :type fh1: io.IOBase
+    :param fh2: Read 2 file handle, opened in binary mode
+    :type fh2: io.IOBase
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over pairs of records
+    :rtype: collections.Iterable(tuple(tuple(bytes, bytes, bytes, \
+    bytes), tuple(bytes, bytes, bytes, bytes)))
+    :raise ValueError: If a record is malformed or truncated or if \
+    the files have different numbers of records
+    """
+    for record1, record2 in itertools.zip_longest(
+            read_fastq_records(fh1, block_size),
+            read_fastq_records(fh2, block_size)):
+        if record1 is None or record2 is None:
+            raise ValueError(
+                "Paired FASTQ files have different numbers of records")
+        yield record1, record2
+
+
+def read_fastq_chunks(fh, num_records, block_size=BLOCK_SIZE):
+    """
+    Iterate over the records in a FASTQ file, read in blocks of
+    ``block_size`` bytes, as chunks of the original ``bytes`` of
+    ``num_records`` records. The last chunk may have fewer records.
+
+    Chunks are split after every ``4 * num_records`` newlines, without
+    the records being parsed, so paired FASTQ files split using the
+    same ``num_records`` have paired records in each chunk. Records
+    in a chunk can be parsed, and validated, using
+    :py:func:`read_fastq_records` and :py:class:`io.BytesIO`.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param num_records: Number of records per chunk
+    :type num_records: int
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over chunks
+    :rtype: collections.Iterable(bytes)
+    """
+    num_lines = 4 * num_records
+    blocks = []
+    num_newlines = 0
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        while block:
+            count = block.count(b"\n")
+            if num_newlines + count < num_lines:
+                blocks.append(block)
+                num_newlines += count
+                break
+            remainder = block.split(b"\n", num_lines - num_newlines)[-1]
+            blocks.append(block[:len(block) - len(remainder)])
+            yield b"".join(blocks)
+            blocks = []
+            num_newlines = 0
+            block = remainder
+    chunk = b"".join(blocks)
+    if chunk.strip(b"\n"):
+        if not chunk.endswith(b"\n"):
+            chunk += b"\n"
+        yield chunk
+
+
+def format_fastq_record(record):
+    """
+    Format a FASTQ record as ``bytes``.
+
+    :param record: Record (header, sequence, plus, quality), where \
+    the header excludes the leading ``@`` and the plus excludes the \
+    leading ``+``
+    :type record: tuple(bytes, bytes, bytes, bytes)
+    :return: Record
+    :rtype: bytes
+    """
+    return RECORD_FORMAT % record
+
+
+class FastqWriter:
+    """
+    FASTQ file writer which buffers records and writes these in
+    batches.
+
+    Records are tuples of (header, sequence, plus, quality) ``bytes``,
+    as returned by :py:func:`read_fastq_records`.
+    """
+
+    def __init__(self, fh, batch_size=WRITE_BATCH_SIZE):
+        """
+        :param fh: File handle, opened in binary mode
+        :type fh: io.IOBase
+        :param batch_size: Number of records to buffer before writing
+        :type batch_size: int
+        """
+        self.fh = fh
+        self.batch_size = batch_size
+        self._buffer = []
+
+    def write(self, record):
+        """
+        Write a record.
+
+        :param record: Record
+        :type record: tuple(bytes, bytes, bytes, bytes)
+        """
+        self._buffer.append(RECORD_FORMAT % record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_records(self, records):
+        """
+        Write records.
+
+        :param records: Records
+        :type records: collections.Iterable(tuple(bytes, bytes, bytes, \
+        bytes))
+        """
+        self._buffer.extend(RECORD_FORMAT % record for record in records)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_formatted(self, data):
+        """
+        Write formatted records, after any buffered records.
+
+        :param data: Records, formatted using \
+        :py:func:`format_fastq_record`
+        :type data: bytes
+        """
+        self._buffer.append(data)
+        self.flush()
+
+    def flush(self):
+        """
+        Write buffered records to the file.
+        """
+        if self._buffer:
+            self.fh.writelines(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        """
+        Write buffered records to the file and close the file.
+        """
+        self.flush()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_gz_blocks(file_name, block_size=BLOCK_SIZE):
+    """
+    Iterate over the decompressed content of a GZIP file in blocks,
+    decompressing ``block_size`` bytes of compressed data at a
+    time. Files with multiple GZIP members (e.g. BGZF files) can be
+    handled too.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over decompressed blocks
+    :rtype: collections.Iterable(bytes)
+    :raise zlib.error: If the file is not a valid GZIP file
+    :raise EOFError: If the file is truncated, as for \
+    :py:func:`gzip.open`
+    """
+    decompressor = None
+    with open(file_name, "rb") as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            while data:
+                if decompressor is None or decompressor.eof:
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                yield decompressor.decompress(data)
+                data = decompressor.unused_data if decompressor.eof \
+                    else b""
+    if decompressor is None:
+        return
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream "
+                       "marker was reached: {}".format(file_name))
+
+
+def read_blocks(file_name, block_size=BLOCK_SIZE):
+    """
+    Iterate over the content of a file in blocks. Plain files are
+    memory-mapped. GZIPped FASTQ files are decompressed using
+    :py:func:`read_gz_blocks`.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over blocks
+    :rtype: collections.Iterable(bytes)
+    """
+    if is_fastq_gz(file_name):
+        yield from read_gz_blocks(file_name, block_size)
+        return
+    if os.path.getsize(file_name) == 0:
+        return
+    with open(file_name, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for start in range(0, len(m), block_size):
+            yield m[start:start + block_size]
+
+
+def is_gz_file(file_name):
+    """
+    Is the given file GZIP-compressed, going by its first bytes?
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: ``True`` or ``False``
+    :rtype: bool
+    """
+    with open(file_name, "rb") as f:
+        return f.read(len(GZ_MAGIC)) == GZ_MAGIC
+
+
+class ThreadedReader:
+    """
+    Read-only binary file-like object whose content is read, and, if
+    the file is GZIP-compressed, decompressed, by a background thread
+    using :py:func:`read_gz_blocks` or :py:func:`read_blocks`. Up to
+    :py:const:`READ_QUEUE_SIZE` blocks are read ahead, so reading and
+    decompression, during which ``zlib`` releases the GIL, overlap
+    processing of the content by the caller.
+
+    Only :py:meth:`read` is supported.
+    """
+
+    def __init__(self, file_name, block_size=BLOCK_SIZE,
+                 queue_size=READ_QUEUE_SIZE):
+        """
+        :param file_name: File name
+        :type file_name: str or unicode
+        :param block_size: Block size in bytes
+        :type block_size: int
+        :param queue_size: Maximum number of blocks read ahead
+        :type queue_size: int
+        :raise FileNotFoundError: If the file cannot be found
+        """
+        if is_gz_file(file_name):
+            blocks = read_gz_blocks(file_name, block_size)
+        else:
+            blocks = read_blocks(file_name, block_size)
+        self._queue = queue.Queue(queue_size)
+        self._closed = threading.Event()
+        self._buffer = b""
+        self._eof = False
+        self._thread = threading.Thread(target=self._read_blocks,
+                                        args=(blocks,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """
+        Add an item to the queue, unless the reader is closed.
+
+        :param item: Block, exception or ``None``, denoting end of file
+        :type item: bytes or Exception
+        :return: ``True`` if the item was added
+        :rtype: bool
+        """
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read_blocks(self, blocks):
+        """
+        Add blocks to the queue, followed by ``None`` or, if an error
+        arises, the exception raised.
+
+        :param blocks: Blocks
+        :type blocks: collections.Iterable(bytes)
+        """
+        try:
+            for block in blocks:
+                if block and not self._put(block):
+                    return
+        except Exception as e:  # pylint: disable=broad-except
+            self._put(e)
+            return
+        self._put(None)
+
+    def read(self, size=-1):
+        """
+        Read up to ``size`` bytes, or, if ``size`` is negative, all
+        the remaining bytes.
+
+        :param size: Number of bytes
+        :type size: int
+        :return: Bytes, empty at the end of the file
+        :rtype: bytes
+        :raise Exception: If an error arose when reading the file
+        """
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while (size < 0 or length < size) and not self._eof:
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, Exception):
+                self._eof = True
+                raise item
+            else:
+                chunks.append(item)
+                length += len(item)
+        data = b"".join(chunks)
+        if size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        """
+        Close the reader and stop the background thread.
+        """
+        self._closed.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def compress_gz_member(data, compresslevel=GZ_COMPRESS_LEVEL):
+    """
+    Compress data into a single GZIP member.
+
+    :param data: Data
+    :type data: bytes
+    :param compresslevel: Compression level
+    :type compresslevel: int
+    :return: GZIP member
+    :rtype: bytes
+    """
+    return gzip.compress(data, compresslevel, mtime=0)
+
+
+class ParallelGzipWriter:
+    """
+    Write-only binary file-like object which writes a GZIP file,
+    in the manner of ``pigz``. Data is buffered and each
+    ``member_size`` bytes is compressed into a separate GZIP member,
+    using ``compress`` (by default :py:func:`compress_gz_member`), on
+    a pool of threads, during which ``zlib`` releases the GIL. Members
+    are written in order, so the file content, once decompressed, is
+    the same as that written.
+
+    Multi-member GZIP files can be read by ``gzip``, ``zcat`` and
+    Python's ``gzip`` module.
+    """
+
+    def __init__(self, file_name, num_threads=None,
+                 member_size=GZ_MEMBER_SIZE,
+                 compresslevel=GZ_COMPRESS_LEVEL,
+                 compress=compress_gz_member,
+                 executor=None,
+                 mode="wb"):
+        """
+        :param file_name: File name
+        :type file_name: str or unicode
+        :param num_threads: Number of compression threads or ``None`` \
+        for the number of CPUs
+        :type num_threads: int
+        :param member_size: Size, in bytes, of uncompressed data \
+        compressed into each GZIP member
+        :type member_size: int
+        :param compresslevel: Compression level
+        :type compresslevel: int
+        :param compress: Function which, given data and a \
+        compression level, returns compressed data
+        :type compress: collections.abc.Callable
+        :param executor: Executor, with ``num_threads`` threads, to \
+        use for compression, shared with other writers, or ``None`` \
+        to create one. A shared executor is not shut down by \
+        :py:meth:`close`.
+        :type executor: concurrent.futures.Executor
+        :param mode: Mode, ``wb`` or, to add GZIP members to the end \
+        of an existing file, ``ab``
+        :type mode: str or unicode
+        """
+        if num_threads is None:
+            num_threads = os.cpu_count() or 1
+        self.fh = open(file_name, mode)
+        self.num_threads = num_threads
+        self.member_size = member_size
+        self.compresslevel = compresslevel
+        self.compress = compress
+        self._is_shared_executor = executor is not None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+        self._executor = executor
+        self._pending = collections.deque()
+        self._buffer = []
+        self._size = 0
+        self._num_members = 0
+
+    def write(self, data):
+        """
+        Write data.
+
+        :param data: Data
+        :type data: bytes
+        """
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.member_size:
+            self._submit()
+
+    def writelines(self, lines):
+        """
+        Write lines.
+
+        :param lines: Lines
+        :type lines: collections.Iterable(bytes)
+        """
+        for line in lines:
+            self._buffer.append(line)
+            self._size += len(line)
+        if self._size >= self.member_size:
+            self._submit()
+
+    def _submit(self):
+        """
+        Submit buffered data for compression, in members of
+        ``member_size`` bytes, then write any compressed members
+        while more than two per thread are pending.
+        """
+        data = b"".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        for start in range(0, len(data), self.member_size):
+            self._pending.append(self._executor.submit(
+                self.compress,
+                data[start:start + self.member_size],
+                self.compresslevel))
+            self._num_members += 1
+        while len(self._pending) > 2 * self.num_threads:
+            self.fh.write(self._pending.popleft().result())
+
+    def flush(self):
+        """
+        Compress and write all buffered data.
+        """
+        self._submit()
+        while self._pending:
+            self.fh.write(self._pending.popleft().result())
+        self.fh.flush()
+
+    def close(self):
+        """
+        Compress and write all buffered data and close the file. If
+        no data was written then a single, empty, GZIP member is
+        written.
+        """
+        if self.fh.closed:
+            return
+        try:
+            if self._num_members == 0 and self._size == 0:
+                self._pending.append(self._executor.submit(
+                    self.compress, b"", self.compresslevel))
+                self._num_members += 1
+            self.flush()
+            self._write_trailer()
+        finally:
+            if not self._is_shared_executor:
+                self._executor.shutdown()
+            self.fh.close()
+
+    def _write_trailer(self):
+        """
+        Write any data that must follow the compressed data. This
+        writes nothing.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def compress_bgzf_blocks(data, compresslevel=GZ_COMPRESS_LEVEL):
+    """
+    Compress data into BGZF blocks, each holding up to
+    :py:const:`BGZF_BLOCK_SIZE` bytes of uncompressed data. Each BGZF
+    block is a GZIP member with the block size in an extra field,
+    so the blocks can be read as GZIP and indexed, for example by
+    ``samtools faidx`` or ``Bio.bgzf``.
+
+    :param data: Data
+    :type data: bytes
+    :param compresslevel: Compression level
+    :type compresslevel: int
+    :return: BGZF blocks, or empty ``bytes`` if ``data`` is empty
+    :rtype: bytes
+    """
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        block = data[start:start + BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        compressed = compressor.compress(block) + compressor.flush()
+        blocks.append(BGZF_HEADER)
+        blocks.append(struct.pack("<H", len(compressed) + 25))
+        blocks.append(compressed)
+        blocks.append(struct.pack("<II", zlib.crc32(block), len(block)))
+    return b"".join(blocks)
+
+
+class ParallelBgzfWriter(ParallelGzipWriter):
+    """
+    :py:class:`ParallelGzipWriter` which writes a BGZF file, using
+    :py:func:`compress_bgzf_blocks`, ending with
+    :py:const:`BGZF_EOF`.
+
+    If appending to a file ending with :py:const:`BGZF_EOF` then this
+    is removed before appending, so the file has a single
+    :py:const:`BGZF_EOF`, at its end.
+    """
+
+    def __init__(self, file_name, num_threads=None,
+                 member_size=BGZF_MEMBER_SIZE,
+                 compresslevel=GZ_COMPRESS_LEVEL,
+                 executor=None,
+                 mode="wb"):
+        """
+        :param file_name: File name
+        :type file_name: str or unicode
+        :param num_threads: Number of compression threads or ``None`` \
+        for the number of CPUs
+        :type num_threads: int
+        :param member_size: Size, in bytes, of uncompressed data \
+        compressed at a time, a multiple of \
+        :py:const:`BGZF_BLOCK_SIZE`
+        :type member_size: int
+        :param compresslevel: Compression level
+        :type compresslevel: int
+        :param executor: Executor shared with other writers, see \
+        :py:class:`ParallelGzipWriter`
+        :type executor: concurrent.futures.Executor
+        :param mode: Mode, ``wb`` or ``ab``
+        :type mode: str or unicode
+        """
+        super().__init__(file_name, num_threads, member_size,
+                         compresslevel, compress_bgzf_blocks, executor,
+                         mode)
+        if mode == "ab":
+            size = self.fh.seek(0, os.SEEK_END)
+            if size >= len(BGZF_EOF):
+                with open(file_name, "rb") as f:
+                    f.seek(size - len(BGZF_EOF))
+                    if f.read() == BGZF_EOF:
+                        self.fh.truncate(size - len(BGZF_EOF))
+
+    def _write_trailer(self):
+        """
+        Write :py:const:`BGZF_EOF`.
+        """
+        self.fh.write(BGZF_EOF)
+
+
+def open_fastq_output(file_name, num_threads=0, executor=None,
+                      mode="wb"):
+    """
+    Open a FASTQ file for writing in binary mode.
+
+    If the file is to be GZIPped and ``num_threads`` is non-zero then
+    it is written as BGZF, compressed using ``num_threads`` threads,
+    using :py:class:`ParallelBgzfWriter`. Otherwise the file is
+    opened using :py:func:`open_fastq`.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param num_threads: Number of compression threads
+    :type num_threads: int
+    :param executor: Executor shared with other writers, see \
+    :py:class:`ParallelGzipWriter`
+    :type executor: concurrent.futures.Executor
+    :param mode: Mode, ``wb`` or ``ab``
+    :type mode: str or unicode
+    :return: File handle
+    :rtype: io.IOBase or ParallelBgzfWriter
+    """
+    if num_threads and is_fastq_gz(file_name):
+        return ParallelBgzfWriter(file_name, num_threads,
+                                  executor=executor, mode=mode)
+    return open_fastq(file_name, mode)
+
+
+def open_fastq_writer(file_name, num_threads=0, executor=None,
+                      batch_size=WRITE_BATCH_SIZE):
+    """
+    Open a FASTQ file for writing with a :py:class:`FastqWriter`,
+    using :py:func:`open_fastq_output`.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param num_threads: Number of compression threads
+    :type num_threads: int
+    :param executor: Executor shared with other writers, see \
+    :py:class:`ParallelGzipWriter`
+    :type executor: concurrent.futures.Executor
+    :param batch_size: Number of records to buffer before writing
+    :type batch_size: int
+    :return: Writer
+    :rtype: FastqWriter
+    """
+    return FastqWriter(
+        open_fastq_output(file_name, num_threads, executor), batch_size)
+
+
+class FastqWriterPool:
+    """
+    Pool of FASTQ output files, for writing many FASTQ files at once
+    (for example, one per sample when demultiplexing) while keeping
+    at most ``max_open_files`` files open.
+
+    Records are buffered in memory, per file, and written in batches
+    of ``batch_size`` records, or, if more than ``buffer_size`` bytes
+    are buffered across all files, the largest buffer is written.
+    Files are opened, using :py:func:`open_fastq_output`, when
+    buffered records are written. If ``max_open_files`` files are
+    already open then the least recently written file is closed
+    first and is reopened, in append mode, when next written to.
+
+    Files are created when records are first written, so no file is
+    created for a file name with no records, unless
+    :py:meth:`create` is called.
+
+    Use :py:meth:`get_writer` to get a writer for a file, which can
+    be used in place of a :py:class:`FastqWriter`.
+    """
+
+    def __init__(self, max_open_files=MAX_OPEN_FILES, num_threads=0,
+                 executor=None, batch_size=WRITE_BATCH_SIZE,
+                 buffer_size=POOL_BUFFER_SIZE):
+        """
+        :param max_open_files: Maximum number of open files
+        :type max_open_files: int
+        :param num_threads: Number of compression threads, see \
+        :py:func:`open_fastq_output`
+        :type num_threads: int
+        :param executor: Executor shared by all files, see \
+        :py:class:`ParallelGzipWriter`
+        :type executor: concurrent.futures.Executor
+        :param batch_size: Number of records to buffer, per file, \
+        before writing
+        :type batch_size: int
+        :param buffer_size: Maximum number of bytes to buffer across \
+        all files
+        :type buffer_size: int
+        :raise ValueError: If ``max_open_files`` is less than 1
+        """
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        self.max_open_files = max_open_files
+        self.num_threads = num_threads
+        self.executor = executor
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self._handles = collections.OrderedDict()
+        self._created = set()
+        self._buffers = {}
+        self._buffer_sizes = {}
+        self._total_size = 0
+
+    def get_writer(self, file_name):
+        """
+        Get a writer for a file.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        :return: Writer
+        :rtype: PooledFastqWriter
+        """
+        self._buffers.setdefault(file_name, [])
+        self._buffer_sizes.setdefault(file_name, 0)
+        return PooledFastqWriter(self, file_name)
+
+    def is_created(self, file_name):
+        """
+        Has a file been created?
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        :return: ``True`` or ``False``
+        :rtype: bool
+        """
+        return file_name in self._created
+
+    def create(self, file_name):
+        """
+        Create a file, if it has not been created already.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        """
+        self._get_handle(file_name)
+
+    def _get_handle(self, file_name):
+        """
+        Get the handle for a file, opening the file if needed and
+        closing the least recently used file if ``max_open_files``
+        files are open.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        :return: File handle
+        :rtype: io.IOBase or ParallelBgzfWriter
+        """
+        if file_name in self._handles:
+            self._handles.move_to_end(file_name)
+            return self._handles[file_name]
+        while len(self._handles) >= self.max_open_files:
+            _, fh = self._handles.popitem(last=False)
+            fh.close()
+        mode = "ab" if file_name in self._created else "wb"
+        fh = open_fastq_output(file_name, self.num_threads,
+                               self.executor, mode)
+        self._created.add(file_name)
+        self._handles[file_name] = fh
+        return fh
+
+    def write(self, file_name, record):
+        """
+        Buffer a record for a file, see :py:meth:`write_records`.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        :param record: Record
+        :type record: tuple(bytes, bytes, bytes, bytes)
+        """
+        data = RECORD_FORMAT % record
+        buffer = self._buffers.setdefault(file_name, [])
+        buffer.append(data)
+        self._buffer_sizes[file_name] = \
+            self._buffer_sizes.get(file_name, 0) + len(data)
+        self._total_size += len(data)
+        if len(buffer) >= self.batch_size:
+            self.flush(file_name)
+        while self._total_size > self.buffer_size:
+            self.flush(max(self._buffer_sizes,
+                           key=self._buffer_sizes.get))
+
+    def write_records(self, file_name, records):
+        """
+        Buffer records for a file, writing these if ``batch_size``
+        records are buffered for the file, or more than
+        ``buffer_size`` bytes are buffered across all files.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        :param records: Records
+        :type records: collections.Iterable(tuple(bytes, bytes, bytes, \
+        bytes))
+        """
+        buffer = self._buffers.setdefault(file_name, [])
+        size = 0
+        for record in records:
+            data = RECORD_FORMAT % record
+            buffer.append(data)
+            size += len(data)
+        self._buffer_sizes[file_name] = \
+            self._buffer_sizes.get(file_name, 0) + size
+        self._total_size += size
+        if len(buffer) >= self.batch_size:
+            self.flush(file_name)
+        while self._total_size > self.buffer_size:
+            self.flush(max(self._buffer_sizes,
+                           key=self._buffer_sizes.get))
+
+    def write_formatted(self, file_name, data):
+        """
+        Write formatted records for a file, after any buffered
+        records.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        :param data: Records, formatted using \
+        :py:func:`format_fastq_record`
+        :type data: bytes
+        """
+        self._buffers.setdefault(file_name, []).append(data)
+        self._buffer_sizes[file_name] = \
+            self._buffer_sizes.get(file_name, 0) + len(data)
+        self._total_size += len(data)
+        self.flush(file_name)
+
+    def flush(self, file_name):
+        """
+        Write buffered records for a file.
+
+        :param file_name: File name
+        :type file_name: str or unicode
+        """
+        buffer = self._buffers.get(file_name)
+        if not buffer:
+            return
+        self._get_handle(file_name).writelines(buffer)
+        self._buffers[file_name] = []
+        self._total_size -= self._buffer_sizes[file_name]
+        self._buffer_sizes[file_name] = 0
+
+    def close(self):
+        """
+        Write buffered records for all files and close all files.
+        """
+        try:
+            for file_name in list(self._buffers):
+                self.flush(file_name)
+        finally:
+            while self._handles:
+                _, fh = self._handles.popitem(last=False)
+                fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PooledFastqWriter:
+    """
+    Writer for a file in a :py:class:`FastqWriterPool`, with the
+    same writing methods as :py:class:`FastqWriter`.
+    """
+
+    def __init__(self, pool, file_name):
+        """
+        :param pool: Pool
+        :type pool: FastqWriterPool
+        :param file_name: File name
+        :type file_name: str or unicode
+        """
+        self.pool = pool
+        self.file_name = file_name
+
+    def write(self, record):
+        """
+        Write a record.
+
+        :param record: Record
+        :type record: tuple(bytes, bytes, bytes, bytes)
+        """
+        self.pool.write(self.file_name, record)
+
+    def write_records(self, records):
+        """
+        Write records.
+
+        :param records: Records
+        :type records: collections.Iterable(tuple(bytes, bytes, bytes, \
+        bytes))
+        """
+        self.pool.write_records(self.file_name, records)
+
+    def write_formatted(self, data):
+        """
+        Write formatted records, after any buffered records.
+
+        :param data: Records, formatted using \
+        :py:func:`format_fastq_record`
+        :type data: bytes
+        """
+        self.pool.write_formatted(self.file_name, data)
+
+    def flush(self):
+        """
+        Write buffered records to the file.
+        """
+        self.pool.flush(self.file_name)
+
+    def close(self):
+        """
+        Write buffered records to the file. The file is closed when
+        the pool is closed.
+        """
+        self.flush()
+
+
+def count_sequences(file_name, strict=False):
     """
     Count number of sequences in a FASTQ file. GZIPped FASTQ files can
     be handled too.
 
+    By default the number of lines in the file is counted, assuming
+    each record has four lines, without parsing the records. If
+    ``strict`` is ``True`` then each record is parsed and validated
+    using :py:func:`read_fastq_records`.
+
     :param file_name: File name
     :type file_name: str or unicode
+    :param strict: Parse and validate each record?
+    :type strict: bool
     :return: number of sequences
     :rtype: int
+    :raise ValueError: If the number of lines is not a multiple of \
+    4 or, if ``strict`` is ``True``, a record is malformed or \
+    truncated
     """
-    num_sequences = 0
-    if is_fastq_gz(file_name):
-        open_file = gzip.open
+    if strict:
+        num_sequences = 0
+        with open_fastq(file_name) as f:
+            for _ in read_fastq_records(f):
+                num_sequences = num_sequences + 1
+        return num_sequences
+    num_newlines = 0
+    num_trailing_newlines = 0
+    is_empty = True
+    for block in read_blocks(file_name):
+        num_newlines += block.count(b"\n")
+        content = block.rstrip(b"\n")
+        if content:
+            is_empty = False
+            num_trailing_newlines = len(block) - len(content)
+        else:
+            num_trailing_newlines += len(block)
+    # Ignore trailing empty lines and count a final line with no
+    # newline.
+    if is_empty:
+        num_lines = 0
+    elif num_trailing_newlines > 0:
+        num_lines = num_newlines - num_trailing_newlines + 1
     else:
-        open_file = open
-    with open_file(file_name, "rt") as f:
-        for _ in SeqIO.parse(f, "fastq"):
-            num_sequences = num_sequences + 1
-    return num_sequences
+        num_lines = num_newlines + 1
+    if num_lines % 4 != 0:
+        raise ValueError(
+            "Number of lines in {} is not a multiple of 4".format(
+                file_name))
+    return num_lines // 4
 
 
 def equal_fastq(file1, file2):
@@ -3,12 +3,16 @@ Functions use CDS entries within a GFF file to get the codons from
 each coding sequence in a complementary FASTA file.
 """
 import csv
+import io
 import os
 import warnings
-import gffutils
+from Bio import bgzf
+import pandas as pd
 from pyfaidx import Fasta
 from riboviz import provenance
 from riboviz.fasta_gff import CDS_FEATURE_FORMAT
+from riboviz.fasta_gff import GFF_INDEX_DIR
+from riboviz.fasta_gff import get_gff_index
 
 
 GENE = "Gene"
@@ -20,6 +24,13 @@ Codon positions column name (codon position in coding sequence,
 """
 CODON = "Codon"
 """ Codon positions column name (codon). """
+OFFSET = "Offset"
+"""
+Codon positions index column name (offset of first row for a gene in
+codon positions file).
+"""
+NUM_CODONS = "NumCodons"
+""" Codon positions index column name (number of codons for a gene). """
 
 
 def sequence_to_codons(sequence):
@@ -44,7 +55,7 @@ def get_feature_id(feature, use_feature_name=False):
     is returned.
 
     :param feature: GFF feature
-    :type feature: gffutils.feature.Feature
+    :type feature: riboviz.fasta_gff.GffFeature
     :param use_feature_name: If a feature defines both ``ID`` and ``Name`` \
     attributes then use ``Name`` as its identifier, otherwise use ``ID``.
     :type use_feature_name: bool
@@ -78,17 +89,16 @@ def get_cds_from_fasta(feature, fasta):
     for the CDS.
 
     :param feature: GFF feature for the CDS
-    :type feature: gffutils.feature.Feature
+    :type feature: riboviz.fasta_gff.GffFeature
     :param fasta: FASTA genes
     :type fasta: pyfaidx.Fasta
     :return: sequence
     :rtype: str or unicode
     :raises AssertionError: If sequence has length not divisible by 3
     :raises Exception: Exceptions specific to \
-    gffutils.Feature.sequence (these are undocumented in the \
-    gffutils documentation - a typical exception that can be thrown \
+    ``pyfaidx`` - a typical exception that can be thrown \
     is ``KeyError`` which can arise if the GFF file contains \
-    information on a sequence that is not in the FASTA file).
+    information on a sequence that is not in the FASTA file.
     """
     sequence = feature.sequence(fasta)
     assert (len(sequence) % 3) == 0, \
@@ -97,11 +107,124 @@ def get_cds_from_fasta(feature, fasta):
     return sequence
 
 
+def get_feature_codons(features,
+                       fasta_genes,
+                       exclude_stop_codons=False,
+                       cds_feature_format=CDS_FEATURE_FORMAT,
+                       use_feature_name=False):
+    """
+    Get the codons in each coding sequence (CDS), one CDS at a time.
+
+    Feature names, and the handling of CDSs whose sequences are
+    missing or don't have a length divisible by 3, are as described
+    in :py:func:`get_cds_codons_from_fasta`.
+
+    :param features: GFF features for CDSs
+    :type features: iterable(riboviz.fasta_gff.GffFeature)
+    :param fasta_genes: FASTA genes
+    :type fasta_genes: pyfaidx.Fasta
+    :param exclude_stop_codons: Should stop codons be excluded from \
+    codons returned?
+    :type exclude_stop_codons: bool
+    :param cds_feature_format: CDS feature name format for CDS \
+    features which do not define ``ID``  or ``Name`` attributes. \
+    This format is applied to the sequence ID to create a \
+    feature name.
+    :type cds_feature_format: str or unicode
+    :param use_feature_name: If a feature defines both ``ID`` and \
+    ``Name`` attributes then use ``Name`` in reporting, otherwise use \
+    ``ID``.
+    :type use_feature_name: bool
+    :return: Feature name and codons for each CDS
+    :rtype: iterator(tuple(str or unicode, list(str or unicode)))
+    """
+    # Number of CDSs with each feature name.
+    feature_id_counts = {}
+    for feature in features:
+        try:
+            sequence = get_cds_from_fasta(feature, fasta_genes)
+            codons = sequence_to_codons(sequence)
+        except KeyError as e:  # Missing sequence.
+            warnings.warn(str(e))
+            continue
+        except AssertionError as e:  # Sequence length not divisible by 3.
+            warnings.warn(str(e))
+            continue
+        feature_id = get_feature_id(feature, use_feature_name)
+        if feature_id is None:
+            feature_id = cds_feature_format.format(feature.seqid)
+        same_feature_id_count = feature_id_counts.get(feature_id, 0)
+        feature_id_counts[feature_id] = same_feature_id_count + 1
+        if same_feature_id_count > 0:
+            feature_id = "{}.{}".format(feature_id,
+                                        same_feature_id_count)
+        if exclude_stop_codons:
+            codons = codons[:-1]
+        yield feature_id, codons
+
+
+def iter_cds_codons_from_fasta(fasta,
+                               gff,
+                               exclude_stop_codons=False,
+                               cds_feature_format=CDS_FEATURE_FORMAT,
+                               use_feature_name=False,
+                               cache_dir=GFF_INDEX_DIR):
+    """
+    Using CDS entries within a GFF file, get the codons in each coding
+    sequence in the complementary FASTA file, one CDS at a time, in
+    the order of the CDS entries in the GFF file.
+
+    The files are checked, and CDS entries read using
+    :py:func:`riboviz.fasta_gff.get_gff_index`, when this function
+    is called. Sequences are read from the FASTA file as the
+    returned iterator is consumed. See
+    :py:func:`get_feature_codons`.
+
+    :param fasta: FASTA file
+    :type fasta: str or unicode
+    :param gff: GFF file
+    :type gff: str or unicode
+    :param exclude_stop_codons: Should stop codons be excluded from \
+    codons returned?
+    :type exclude_stop_codons: bool
+    :param cds_feature_format: CDS feature name format for CDS \
+    features which do not define ``ID``  or ``Name`` attributes. \
+    This format is applied to the sequence ID to create a \
+    feature name.
+    :type cds_feature_format: str or unicode
+    :param use_feature_name: If a feature defines both ``ID`` and \
+    ``Name`` attributes then use ``Name`` in reporting, otherwise use \
+    ``ID``.
+    :type use_feature_name: bool
+    :param cache_dir: Directory for cached GFF indices or ``None`` \
+    to not cache GFF indices
+    :type cache_dir: str or unicode
+    :return: Feature name and codons for each CDS
+    :rtype: iterator(tuple(str or unicode, list(str or unicode)))
+    :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
+    formatted sequences
+    :raises FileNotFoundError: If the FASTA or GFF files \
+    cannot be found
+    :raises ValueError: If GFF file is empty or has invalid lines
+    """
+    for f in [fasta, gff]:
+        if not os.path.exists(f) or (not os.path.isfile(f)):
+            raise FileNotFoundError(f)
+    gff_index = get_gff_index(gff, cache_dir=cache_dir)
+    fasta_genes = Fasta(fasta)
+    return get_feature_codons(gff_index,
+                              fasta_genes,
+                              exclude_stop_codons,
+                              cds_feature_format,
+                              use_feature_name)
+
+
 def get_cds_codons_from_fasta(fasta,
                               gff,
                               exclude_stop_codons=False,
                               cds_feature_format=CDS_FEATURE_FORMAT,
-                              use_feature_name=False):
+                              use_feature_name=False,
+                              cache_dir=GFF_INDEX_DIR):
     """
     Using CDS entries within a GFF file, get the codons in each coding
     sequence in the complementary FASTA file.
@@ -116,10 +239,11 @@ def get_cds_codons_from_fasta(fasta,
     defined in the feature the the ``cds_feature_format`` is used to
     format the sequence ID into a feature name.
 
-    If two or more CDSs for the same sequence have the same feature
-    name then the first CDS for that sequence has a feature name, as
-    defined above. Subsequent CDSs for that sequence have the feature
-    name with with the suffix ``.1``, ``.2`` etc. appended.
+    If two or more CDSs have the same feature name then the first CDS
+    has a feature name, as defined above. Subsequent CDSs have the
+    feature name with with the suffix ``.1``, ``.2`` etc. appended.
+
+    See :py:func:`iter_cds_codons_from_fasta`.
 
     See also :py:func:`get_cds_from_fasta` and
     :py:func:`sequence_to_codons`.
@@ -139,61 +263,66 @@ def get_cds_codons_from_fasta(fasta,
     ``Name`` attributes then use ``Name`` in reporting, otherwise use \
     ``ID``.
     :type use_feature_name: bool
+    :param cache_dir: Directory for cached GFF indices or ``None`` \
+    to not cache GFF indices
+    :type cache_dir: str or unicode
     :return: Codons for each coding sequence, keyed by feature name
     :rtype: dict(str or unicode -> list(str or unicode))
     :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
     formatted sequences
     :raises FileNotFoundError: If the FASTA or GFF files \
     cannot be found
-    :raises ValueError: If GFF file is empty
-    :raises Exception: Exceptions specific to gffutils.create_db \
-    (these are undocumented in the gffutils documentation)
+    :raises ValueError: If GFF file is empty or has invalid lines
     """
-    for f in [fasta, gff]:
-        if not os.path.exists(f) or (not os.path.isfile(f)):
-            raise FileNotFoundError(f)
-    try:
-        gffdb = gffutils.create_db(gff,
-                                   dbfn='gff.db',
-                                   force=True,
-                                   keep_order=True,
-                                   merge_strategy='merge',
-                                   sort_attribute_values=True)
-    except ValueError as e:
-        # Wrap and rethrow exception so file name is included
-        raise ValueError("{} ({})".format(e, gff)) from e
-    cds_codons = {}
-    same_feature_id_count = 0
-    fasta_genes = Fasta(fasta)
-    for feature in gffdb.features_of_type('CDS'):
-        try:
-            sequence = get_cds_from_fasta(feature, fasta_genes)
-            codons = sequence_to_codons(sequence)
-        except KeyError as e:  # Missing sequence.
-            warnings.warn(str(e))
-            continue
-        except AssertionError as e:  # Sequence length not divisible by 3.
-            warnings.warn(str(e))
-            continue
-        feature_id = get_feature_id(feature, use_feature_name)
-        if feature_id is None:
-            feature_id = cds_feature_format.format(feature.seqid)
-        if feature_id not in cds_codons:
-            same_feature_id_count = 0
-        else:
-            same_feature_id_count += 1
-            feature_id = "{}.{}".format(feature_id,
-                                        same_feature_id_count)
-        if exclude_stop_codons:
-            codons = codons[:-1]
-        cds_codons[feature_id] = codons
-    return cds_codons
+    return dict(iter_cds_codons_from_fasta(fasta,
+                                           gff,
+                                           exclude_stop_codons,
+                                           cds_feature_format,
+                                           use_feature_name,
+                                           cache_dir))
+
+
+def is_bgzf_file(file_name):
+    """
+    Is the given file to be BGZF-compressed? This is the case for
+    files ending with ``gz``, ``GZ``, ``gzip``, ``GZIP``, ``bgz`` or
+    ``BGZ``.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: ``True`` or ``False``
+    :rtype: bool
+    """
+    return file_name.lower().endswith((".gz", ".gzip", ".bgz"))
 
 
-def write_feature_codons_to_csv(feature_codons, csv_file, delimiter="\t"):
+def open_feature_codons(csv_file, mode="rb"):
     """
-    Write a dictionary of the codons for features, keyed by feature
-    name into a CSV file, including a header.
+    Open a feature codons file in binary mode. BGZF-compressed
+    files (see :py:func:`is_bgzf_file`) can be handled too, in which
+    case file offsets are BGZF virtual offsets.
+
+    :param csv_file: CSV file name
+    :type csv_file: str or unicode
+    :param mode: Mode, ``rb`` or ``wb``
+    :type mode: str or unicode
+    :return: File handle
+    :rtype: io.IOBase or Bio.bgzf.BgzfReader or Bio.bgzf.BgzfWriter
+    """
+    if is_bgzf_file(csv_file):
+        if "r" in mode:
+            return bgzf.BgzfReader(csv_file, mode)
+        return bgzf.BgzfWriter(csv_file, mode)
+    return open(csv_file, mode)
+
+
+def write_feature_codons_to_csv(feature_codons, csv_file, delimiter="\t",
+                                index_file=None):
+    """
+    Write the codons for features, keyed by feature name, into a CSV
+    file, including a header. Codons are written one feature at a
+    time, so ``feature_codons`` can be an iterator such as that
+    returned by :py:func:`iter_cds_codons_from_fasta`.
 
     The CSV file has columns:
 
@@ -201,21 +330,97 @@ def write_feature_codons_to_csv(feature_codons, csv_file, delimiter="\t"):
     * :py:const:`POS`: codon position in coding sequence (1-indexed).
     * :py:const:`CODON`: codon.
 
+    If ``csv_file`` ends in ``.gz``, ``.gzip`` or ``.bgz`` it is
+    BGZF-compressed, which can be read as a gzip file.
+
+    If ``index_file`` is provided then a tab-separated values file is
+    also written with, for each feature, the offset within
+    ``csv_file`` of its first row, so that the rows for a feature can
+    be read without reading the whole of ``csv_file``. See
+    :py:func:`read_feature_codons_from_csv`. The index file has
+    columns:
+
+    * :py:const:`GENE`: feature name.
+    * :py:const:`OFFSET`: offset of first row for the feature, in
+      bytes, or, if ``csv_file`` is BGZF-compressed, as a BGZF virtual
+      offset.
+    * :py:const:`NUM_CODONS`: number of codons (rows) for the feature.
+
     :param feature_codons: Codons for each feature, keyed by feature \
-    name
-    :type feature_codons: dict(str or unicode -> list(str or unicode))
+    name, or an iterable of (feature name, codons) tuples
+    :type feature_codons: dict(str or unicode -> list(str or unicode)) \
+    or iterable(tuple(str or unicode, list(str or unicode)))
     :param csv_file: CSV file name
     :type csv_file: str or unicode
     :param delimiter: Delimiter
     :type delimiter: str or unicode
+    :param index_file: Index file name or ``None``
+    :type index_file: str or unicode
     """
-    provenance.write_provenance_header(__file__, csv_file)
-    with open(csv_file, "a") as f:
-        writer = csv.writer(f, delimiter=delimiter, lineterminator='\n')
+    if isinstance(feature_codons, dict):
+        feature_codons = feature_codons.items()
+    index = []
+    with open_feature_codons(csv_file, "wb") as f:
+        buffer = io.StringIO()
+        provenance.write_provenance(buffer, __file__)
+        writer = csv.writer(buffer, delimiter=delimiter,
+                            lineterminator='\n')
         writer.writerow([GENE, POS, CODON])
-        for feature_id, codons in list(feature_codons.items()):
-            for pos, codon in zip(range(0, len(codons)), codons):
-                writer.writerow([feature_id, pos+1, codon])
+        f.write(buffer.getvalue().encode())
+        for feature_id, codons in feature_codons:
+            # Format rows directly, as codons never need quoting, but
+            # use writer to quote feature name, if required.
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([feature_id, ""])
+            prefix = buffer.getvalue()[:-1]
+            rows = "".join([prefix + str(pos) + delimiter + codon + "\n"
+                            for pos, codon in enumerate(codons, 1)])
+            index.append((feature_id, f.tell(), len(codons)))
+            f.write(rows.encode())
+    if index_file is not None:
+        provenance.write_provenance_header(__file__, index_file)
+        with open(index_file, "a") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator='\n')
+            writer.writerow([GENE, OFFSET, NUM_CODONS])
+            writer.writerows(index)
+
+
+def read_feature_codons_from_csv(csv_file, index_file, features=None,
+                                 delimiter="\t"):
+    """
+    Read the codons for features from a CSV file written by
+    :py:func:`write_feature_codons_to_csv`, using its index file to
+    read only the rows for the given features.
+
+    :param csv_file: CSV file name
+    :type csv_file: str or unicode
+    :param index_file: Index file name
+    :type index_file: str or unicode
+    :param features: Feature names or ``None`` for all features
+    :type features: list(str or unicode)
+    :param delimiter: Delimiter
+    :type delimiter: str or unicode
+    :return: Codons for each feature, keyed by feature name
+    :rtype: dict(str or unicode -> list(str or unicode))
+    :raises KeyError: If a feature is not in the index file
+    """
+    index_df = pd.read_csv(index_file, delimiter="\t", comment="#",
+                           dtype={GENE: str})
+    index = {feature_id: (offset, num_codons)
+             for feature_id, offset, num_codons in zip(
+                 index_df[GENE], index_df[OFFSET], index_df[NUM_CODONS])}
+    if features is None:
+        features = list(index_df[GENE])
+    feature_codons = {}
+    with open_feature_codons(csv_file, "rb") as f:
+        for feature_id in features:
+            offset, num_codons = index[feature_id]
+            f.seek(int(offset))
+            lines = [f.readline().decode() for _ in range(num_codons)]
+            feature_codons[feature_id] = [
+                row[2] for row in csv.reader(lines, delimiter=delimiter)]
+    return feature_codons
 
 
 def get_cds_codons_file(fasta,
@@ -224,18 +429,21 @@ def get_cds_codons_file(fasta,
                         exclude_stop_codons=False,
                         cds_feature_format=CDS_FEATURE_FORMAT,
                         use_feature_name=False,
-                        delimiter="\t"):
+                        delimiter="\t",
+                        cache_dir=GFF_INDEX_DIR,
+                        index_file=None):
     """
     Using CDS entries within a GFF file, get the codons in each coding
     sequence in the complementary FASTA file.
 
     A tab-separated values file of the codons for each CDS, keyed by
-    CDS feature name, is saved.
+    CDS feature name, is saved. Codons are written as each CDS is
+    read, so the codons for all CDSs are not held in memory.
 
-    See :py:func:`get_cds_codons_from_fasta`.
+    See :py:func:`iter_cds_codons_from_fasta`.
 
     See :py:func:`write_feature_codons_to_csv` for tab-separated values
-    file columns.
+    file columns, compression and the index file.
 
     :param fasta: FASTA file
     :type fasta: str or unicode
@@ -256,17 +464,22 @@ def get_cds_codons_file(fasta,
     ``ID``.
     :param delimiter: Delimiter
     :type delimiter: str or unicode
+    :param cache_dir: Directory for cached GFF indices or ``None`` \
+    to not cache GFF indices
+    :type cache_dir: str or unicode
+    :param index_file: Coding sequence codons index file or ``None``
+    :type index_file: str or unicode
     :raises FileNotFoundError: If the FASTA or GFF files \
     cannot be found
     :raises pyfaidx.FastaIndexingError: If the FASTA file has badly \
     formatted sequences
-    :raises ValueError: If GFF file is empty
-    :raises Exception: Exceptions specific to gffutils.create_db \
-    (these are undocumented in the gffutils documentation)
+    :raises ValueError: If GFF file is empty or has invalid lines
     """
-    cds_codons = get_cds_codons_from_fasta(fasta,
-                                           gff,
-                                           exclude_stop_codons,
-                                           cds_feature_format,
-                                           use_feature_name)
-    write_feature_codons_to_csv(cds_codons, cds_codons_file, delimiter)
+    cds_codons = iter_cds_codons_from_fasta(fasta,
+                                            gff,
+                                            exclude_stop_codons,
+                                            cds_feature_format,
+                                            use_feature_name,
+                                            cache_dir)
+    write_feature_codons_to_csv(cds_codons, cds_codons_file, delimiter,
+                                index_file)
@@ -1,30 +1,950 @@
 """
 H5-related constants and functions.
+
+RiboViz H5 files hold, for each gene, a matrix of read counts, with a
+row for each nucleotide position and a column for each read length,
+and attributes about the gene and its reads. Two layouts are
+supported.
+
+The legacy layout (:py:const:`LEGACY`), as written by
+``rscripts/bam_to_h5.R``, has a group, ``/<gene>/<dataset>/reads``,
+for each gene, with attributes :py:const:`GENE_ATTRIBUTES` and a
+``data`` data set with the read counts. Alternative gene names are
+external links to the groups for each gene.
+
+The consolidated layout (:py:const:`CSR`) holds the read counts for
+all genes in a single sparse matrix, in compressed sparse row (CSR)
+form, with a row for each gene and a column for each (position, read
+length) pair. The column index of the count at row ``p`` and column
+``l`` of a gene's matrix is ``p * len(lengths) + l``. The file has
+attributes:
+
+* ``layout``: :py:const:`CSR`.
+* ``dataset``: human-readable name of the dataset.
+* ``lengths``: read lengths.
+
+and chunked, compressed, data sets:
+
+* ``genes``: gene names.
+* ``alt_genes``: alternative gene names (empty if none).
+* ``num_positions``: number of positions for each gene.
+* ``indptr``: offsets into ``indices`` and ``data`` for each gene and
+  the total number of non-zero counts. The counts for gene ``i`` are
+  at ``indptr[i]`` to ``indptr[i + 1] - 1``.
+* ``indices``: column indices of non-zero counts.
+* ``data``: non-zero counts.
+* ``reads_total``, ``buffer_left``, ``buffer_right``,
+  ``start_codon_pos``, ``stop_codon_pos``, ``reads_by_len``: a row
+  for each gene with the value of the corresponding legacy
+  attribute.
 """
-import subprocess
+import multiprocessing
+import os
+import h5py
+import numpy as np
 
 H5_EXT = "h5"
 """ File extension. """
 H5_FORMAT = "{}." + H5_EXT
 """ File name format. """
 
+LEGACY = "legacy"
+""" Layout with a group for each gene. """
+CSR = "csr"
+""" Layout with a sparse matrix for all genes. """
+LAYOUTS = [LEGACY, CSR]
+""" Layouts. """
+
+READS = "reads"
+""" Legacy layout reads group name. """
+DATA = "data"
+""" Read counts data set name. """
+READS_TOTAL = "reads_total"
+""" Total number of reads attribute. """
+BUFFER_LEFT = "buffer_left"
+""" Number of nucleotides upstream of start codon attribute. """
+BUFFER_RIGHT = "buffer_right"
+""" Number of nucleotides downstream of stop codon attribute. """
+START_CODON_POS = "start_codon_pos"
+""" Start codon positions attribute. """
+STOP_CODON_POS = "stop_codon_pos"
+""" Stop codon positions attribute. """
+LENGTHS = "lengths"
+""" Read lengths attribute. """
+READS_BY_LEN = "reads_by_len"
+""" Number of reads of each length attribute. """
+GENE_ATTRIBUTES = [READS_TOTAL, BUFFER_LEFT, BUFFER_RIGHT,
+                   START_CODON_POS, STOP_CODON_POS, READS_BY_LEN,
+                   LENGTHS]
+""" Gene attributes. """
+COMPRESSION_LEVEL = 7
+""" Data set gzip compression level. """
+
+LAYOUT = "layout"
+""" CSR layout layout attribute. """
+DATASET = "dataset"
+""" CSR layout dataset name attribute. """
+GENES = "genes"
+""" CSR layout gene names data set. """
+ALT_GENES = "alt_genes"
+""" CSR layout alternative gene names data set. """
+NUM_POSITIONS = "num_positions"
+""" CSR layout number of positions data set. """
+INDPTR = "indptr"
+""" CSR layout offsets data set. """
+INDICES = "indices"
+""" CSR layout column indices data set. """
+CSR_CHUNK_SIZE = 65536
+""" CSR layout ``indices`` and ``data`` chunk size. """
+BLOCK_SIZE = 4000000
+"""
+Maximum number of non-zero counts read at a time when iterating over
+all genes in a CSR layout file, and maximum number of values
+compared at a time by :py:func:`equal_h5`.
+"""
+MAX_DIFFERENCES = 10
+"""
+Default maximum number of differing objects, and differing positions
+within each object, reported by :py:func:`equal_h5`.
+"""
+
+
+def write_legacy_gene(f, h5_file, gene, alt_gene, dataset, counts,
+                      attributes):
+    """
+    Write read counts and attributes for a gene to an open H5 file in
+    the legacy layout.
+
+    :param f: H5 file
+    :type f: h5py.File
+    :param h5_file: H5 file name, for external links
+    :type h5_file: str or unicode
+    :param gene: Gene name
+    :type gene: str or unicode
+    :param alt_gene: Alternative gene name or ``None``
+    :type alt_gene: str or unicode
+    :param dataset: Human-readable name of the dataset
+    :type dataset: str or unicode
+    :param counts: Read counts, a matrix of positions by read lengths
+    :type counts: numpy.ndarray
+    :param attributes: Attributes (:py:const:`GENE_ATTRIBUTES`)
+    :type attributes: dict(str or unicode => numpy.ndarray)
+    """
+    reads = f.create_group("/".join([gene, dataset, READS]))
+    if alt_gene and alt_gene != gene:
+        f[alt_gene] = h5py.ExternalLink(h5_file, gene)
+    for name in GENE_ATTRIBUTES:
+        reads.attrs.create(name, np.asarray(attributes[name],
+                                            dtype=np.int32))
+    data = reads.create_dataset(DATA,
+                                shape=counts.shape,
+                                dtype=np.int32,
+                                chunks=(max(counts.shape[0], 1), 1),
+                                compression="gzip",
+                                compression_opts=COMPRESSION_LEVEL)
+    # Each read length is a chunk. Chunks that are not written are
+    # read as 0 (the fill value) so only write those from the first
+    # to the last read length with reads.
+    lengths = np.flatnonzero(counts.any(axis=0))
+    if len(lengths):
+        columns = slice(lengths[0], lengths[-1] + 1)
+        data[:, columns] = counts[:, columns]
+
+
+def create_csr_dataset(f, name, dtype, shape=(0,)):
+    """
+    Create an extensible, chunked and compressed data set in a CSR
+    layout file.
+
+    :param f: H5 file
+    :type f: h5py.File
+    :param name: Data set name
+    :type name: str or unicode
+    :param dtype: Data type
+    :type dtype: numpy.dtype or str or unicode
+    :param shape: Initial shape
+    :type shape: tuple(int)
+    :return: Data set
+    :rtype: h5py.Dataset
+    """
+    chunks = (CSR_CHUNK_SIZE,) + tuple(shape[1:])
+    return f.create_dataset(name,
+                            shape=shape,
+                            maxshape=(None,) + tuple(shape[1:]),
+                            dtype=dtype,
+                            chunks=chunks,
+                            compression="gzip",
+                            compression_opts=COMPRESSION_LEVEL,
+                            shuffle=True)
+
+
+def append_csr_dataset(data_set, values):
+    """
+    Append values to an extensible data set.
+
+    :param data_set: Data set
+    :type data_set: h5py.Dataset
+    :param values: Values
+    :type values: numpy.ndarray
+    """
+    if len(values) == 0:
+        return
+    size = data_set.shape[0]
+    data_set.resize(size + len(values), axis=0)
+    data_set[size:] = values
+
+
+def write_h5(h5_file, dataset, genes, layout=LEGACY):
+    """
+    Write read counts and attributes for genes to an H5 file.
+
+    ``genes`` is an iterable of tuples, each with a gene name,
+    alternative gene name (or ``None``), read counts (a matrix of
+    positions by read lengths) and attributes
+    (:py:const:`GENE_ATTRIBUTES`). As ``genes`` is consumed as it is
+    written, it can be a generator. For the CSR layout, read
+    lengths are assumed to be the same for every gene.
+
+    :param h5_file: H5 file
+    :type h5_file: str or unicode
+    :param dataset: Human-readable name of the dataset
+    :type dataset: str or unicode
+    :param genes: Genes
+    :type genes: collections.Iterable(tuple(str or unicode, \
+    str or unicode, numpy.ndarray, dict(str or unicode => \
+    numpy.ndarray)))
+    :param layout: Layout, one of :py:const:`LAYOUTS`
+    :type layout: str or unicode
+    :raise ValueError: If ``layout`` is not in :py:const:`LAYOUTS`
+    """
+    if layout not in LAYOUTS:
+        raise ValueError("Unknown layout {}".format(layout))
+    with h5py.File(h5_file, "w") as f:
+        if layout == LEGACY:
+            for gene, alt_gene, counts, attributes in genes:
+                write_legacy_gene(f, h5_file, gene, alt_gene, dataset,
+                                  counts, attributes)
+            return
+        f.attrs[LAYOUT] = CSR
+        f.attrs[DATASET] = dataset
+        indices = create_csr_dataset(f, INDICES, np.int64)
+        data = create_csr_dataset(f, DATA, np.int32)
+        names = []
+        alt_names = []
+        num_positions = []
+        indptr = [0]
+        gene_attributes = {name: [] for name in GENE_ATTRIBUTES}
+        batch = ([], [])
+        batch_size = 0
+        for gene, alt_gene, counts, attributes in genes:
+            names.append(gene)
+            alt_names.append(alt_gene or "")
+            num_positions.append(counts.shape[0])
+            flat_counts = counts.ravel()
+            columns = np.flatnonzero(flat_counts)
+            batch[0].append(columns)
+            batch[1].append(flat_counts[columns])
+            batch_size += len(columns)
+            indptr.append(indptr[-1] + len(columns))
+            for name in GENE_ATTRIBUTES:
+                gene_attributes[name].append(attributes[name])
+            if batch_size >= BLOCK_SIZE:
+                append_csr_dataset(indices, np.concatenate(batch[0]))
+                append_csr_dataset(data, np.concatenate(batch[1]))
+                batch = ([], [])
+                batch_size = 0
+        if batch_size:
+            append_csr_dataset(indices, np.concatenate(batch[0]))
+            append_csr_dataset(data, np.concatenate(batch[1]))
+        lengths = gene_attributes.pop(LENGTHS)
+        f.attrs[LENGTHS] = np.asarray(lengths[0] if lengths else [],
+                                      dtype=np.int32)
+        string_dtype = h5py.string_dtype()
+        for name, values, dtype in [
+                (GENES, names, string_dtype),
+                (ALT_GENES, alt_names, string_dtype),
+                (NUM_POSITIONS, num_positions, np.int64),
+                (INDPTR, indptr, np.int64)]:
+            f.create_dataset(name,
+                             data=np.asarray(values, dtype=dtype),
+                             chunks=True,
+                             compression="gzip",
+                             compression_opts=COMPRESSION_LEVEL)
+        widths = {READS_TOTAL: 1, BUFFER_LEFT: 1, BUFFER_RIGHT: 1,
+                  START_CODON_POS: 3, STOP_CODON_POS: 3,
+                  READS_BY_LEN: len(f.attrs[LENGTHS])}
+        for name, values in gene_attributes.items():
+            f.create_dataset(name,
+                             data=np.asarray(values, dtype=np.int32).reshape(
+                                 len(names), widths[name]),
+                             chunks=True,
+                             compression="gzip",
+                             compression_opts=COMPRESSION_LEVEL)
+
+
+class H5Reader:
+    """
+    Reader for RiboViz H5 files, in either layout.
+
+    Genes can be accessed individually, by name or alternative name,
+    using :py:meth:`get_counts` and :py:meth:`get_attributes`. For the
+    CSR layout, the per-gene index is held in memory so accessing a
+    gene reads only that gene's counts. All genes can be iterated
+    over using :py:meth:`iter_genes`, which, for the CSR layout, reads
+    counts for many genes at a time.
+
+    Example::
+
+        with H5Reader("WTnone.h5") as reader:
+            counts = reader.get_counts("YAL003W")
+            for gene, counts, attributes in reader.iter_genes():
+                ...
+    """
+
+    def __init__(self, h5_file):
+        """
+        Open file and read its index.
+
+        :param h5_file: H5 file
+        :type h5_file: str or unicode
+        :raise ValueError: If the file has no genes, for the legacy \
+        layout, or an unknown layout
+        """
+        self.h5_file = h5_file
+        self.file = h5py.File(h5_file, "r")
+        self.layout = self.file.attrs.get(LAYOUT, LEGACY)
+        if isinstance(self.layout, bytes):
+            self.layout = self.layout.decode()
+        if self.layout == CSR:
+            self._read_csr_index()
+        elif self.layout == LEGACY:
+            self._read_legacy_index()
+        else:
+            self.file.close()
+            raise ValueError("Unknown layout {} in {}".format(
+                self.layout, h5_file))
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        for gene, alt_gene in zip(self.genes, self.alt_genes):
+            if alt_gene and alt_gene not in self.gene_index:
+                self.gene_index[alt_gene] = self.gene_index[gene]
+
+    def _read_csr_index(self):
+        """
+        Read gene names, positions, offsets and attributes from a CSR
+        layout file.
+        """
+        f = self.file
+        self.dataset = f.attrs[DATASET]
+        if isinstance(self.dataset, bytes):
+            self.dataset = self.dataset.decode()
+        self.lengths = f.attrs[LENGTHS]
+        self.genes = list(f[GENES].asstr()[()])
+        self.alt_genes = [alt_gene or None
+                          for alt_gene in f[ALT_GENES].asstr()[()]]
+        self.num_positions = f[NUM_POSITIONS][()]
+        self.indptr = f[INDPTR][()]
+        self.gene_attributes = {name: f[name][()]
+                                for name in GENE_ATTRIBUTES
+                                if name != LENGTHS}
+
+    def _read_legacy_index(self):
+        """
+        Read gene names, alternative gene names and the dataset name
+        from a legacy layout file.
+        """
+        f = self.file
+        self.genes = []
+        alt_genes = {}
+        for name in f:
+            link = f.get(name, getlink=True)
+            if isinstance(link, h5py.ExternalLink):
+                alt_genes[link.path.lstrip("/")] = name
+            else:
+                self.genes.append(name)
+        if not self.genes:
+            f.close()
+            raise ValueError("No genes in {}".format(self.h5_file))
+        self.alt_genes = [alt_genes.get(gene) for gene in self.genes]
+        self.dataset = next(iter(f[self.genes[0]]))
+        self.lengths = f[self.genes[0]][self.dataset][READS].attrs[
+            LENGTHS]
+
+    def close(self):
+        """
+        Close file.
+        """
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.genes)
+
+    def __contains__(self, gene):
+        return gene in self.gene_index
+
+    def _csr_counts(self, index, columns, values):
+        """
+        Create dense read counts for a gene from its CSR column
+        indices and counts.
+
+        :param index: Gene index
+        :type index: int
+        :param columns: Column indices
+        :type columns: numpy.ndarray
+        :param values: Counts
+        :type values: numpy.ndarray
+        :return: Read counts, a matrix of positions by read lengths
+        :rtype: numpy.ndarray
+        """
+        counts = np.zeros(self.num_positions[index] * len(self.lengths),
+                          dtype=np.int32)
+        counts[columns] = values
+        return counts.reshape(self.num_positions[index],
+                              len(self.lengths))
+
+    def _csr_attributes(self, index):
+        """
+        Get attributes for a gene from a CSR layout file.
+
+        :param index: Gene index
+        :type index: int
+        :return: Attributes
+        :rtype: dict(str or unicode => numpy.ndarray)
+        """
+        attributes = {name: values[index]
+                      for name, values in self.gene_attributes.items()}
+        attributes[LENGTHS] = self.lengths
+        return attributes
+
+    def _legacy_reads(self, gene):
+        """
+        Get the reads group for a gene from a legacy layout file.
+
+        :param gene: Gene name or alternative gene name
+        :type gene: str or unicode
+        :return: Group
+        :rtype: h5py.Group
+        """
+        return self.file[self.genes[self.gene_index[gene]]][
+            self.dataset][READS]
+
+    def get_counts(self, gene):
+        """
+        Get read counts for a gene.
+
+        :param gene: Gene name or alternative gene name
+        :type gene: str or unicode
+        :return: Read counts, a matrix of positions by read lengths
+        :rtype: numpy.ndarray
+        :raise KeyError: If the gene is not in the file
+        """
+        if self.layout == LEGACY:
+            return self._legacy_reads(gene)[DATA][()]
+        index = self.gene_index[gene]
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return self._csr_counts(index,
+                                self.file[INDICES][start:end],
+                                self.file[DATA][start:end])
+
+    def get_attributes(self, gene):
+        """
+        Get attributes (:py:const:`GENE_ATTRIBUTES`) for a gene.
+
+        :param gene: Gene name or alternative gene name
+        :type gene: str or unicode
+        :return: Attributes
+        :rtype: dict(str or unicode => numpy.ndarray)
+        :raise KeyError: If the gene is not in the file
+        """
+        if self.layout == LEGACY:
+            attrs = self._legacy_reads(gene).attrs
+            return {name: attrs[name] for name in GENE_ATTRIBUTES}
+        return self._csr_attributes(self.gene_index[gene])
+
+    def iter_genes(self):
+        """
+        Iterate over all genes, in file order, with their read counts
+        and attributes.
+
+        For the CSR layout, counts are read in blocks of up to
+        :py:const:`BLOCK_SIZE` non-zero counts, or one gene if it has
+        more.
+
+        :return: Genes, read counts and attributes
+        :rtype: collections.Iterable(tuple(str or unicode, \
+        numpy.ndarray, dict(str or unicode => numpy.ndarray)))
+        """
+        if self.layout == LEGACY:
+            for gene in self.genes:
+                yield gene, self.get_counts(gene), \
+                    self.get_attributes(gene)
+            return
+        num_genes = len(self.genes)
+        first = 0
+        while first < num_genes:
+            last = int(np.searchsorted(
+                self.indptr, self.indptr[first] + BLOCK_SIZE,
+                side="right")) - 1
+            last = min(max(last, first + 1), num_genes)
+            start, end = self.indptr[first], self.indptr[last]
+            columns = self.file[INDICES][start:end]
+            values = self.file[DATA][start:end]
+            for index in range(first, last):
+                gene_start = self.indptr[index] - start
+                gene_end = self.indptr[index + 1] - start
+                yield self.genes[index], \
+                    self._csr_counts(index,
+                                     columns[gene_start:gene_end],
+                                     values[gene_start:gene_end]), \
+                    self._csr_attributes(index)
+            first = last
+
 
-def equal_h5(file1, file2):
+def convert_h5(h5_file_in, h5_file_out, layout=CSR):
     """
-    Compare two H5 files for equality, using the ``h5diff``
-    command-line tool.
+    Convert an H5 file from one layout to another.
+
+    :param h5_file_in: H5 input file
+    :type h5_file_in: str or unicode
+    :param h5_file_out: H5 output file
+    :type h5_file_out: str or unicode
+    :param layout: Output layout, one of :py:const:`LAYOUTS`
+    :type layout: str or unicode
+    :raise ValueError: If ``layout`` is not in :py:const:`LAYOUTS`
+    """
+    with H5Reader(h5_file_in) as reader:
+        genes = ((gene, alt_gene, counts, attributes)
+                 for (gene, counts, attributes), alt_gene
+                 in zip(reader.iter_genes(), reader.alt_genes))
+        write_h5(h5_file_out, reader.dataset, genes, layout)
+
+
+def get_differences(values1, values2, tolerance=0.0):
+    """
+    Get a mask of the elements that differ between two arrays of the
+    same shape. Numerical values are compared to within an absolute
+    tolerance, and ``NaN`` values are considered to be equal. All
+    other values are compared for exact equality.
+
+    :param values1: Values
+    :type values1: numpy.ndarray
+    :param values2: Values
+    :type values2: numpy.ndarray
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :return: Mask, ``True`` where elements differ
+    :rtype: numpy.ndarray
+    """
+    values1 = np.asarray(values1)
+    values2 = np.asarray(values2)
+    is_number = all(np.issubdtype(values.dtype, np.number) or
+                    np.issubdtype(values.dtype, np.bool_)
+                    for values in (values1, values2))
+    if not is_number:
+        return np.asarray(values1 != values2)
+    if tolerance:
+        return ~np.isclose(values1, values2, rtol=0, atol=tolerance,
+                           equal_nan=True)
+    differences = values1 != values2
+    if np.issubdtype(values1.dtype, np.floating) or \
+       np.issubdtype(values2.dtype, np.floating):
+        differences &= ~(np.isnan(values1) & np.isnan(values2))
+    return differences
+
+
+def find_differences(values1, values2, tolerance=0.0,
+                     max_differences=MAX_DIFFERENCES, offset=0):
+    """
+    Find the elements that differ between two arrays of the same
+    shape.
+
+    :param values1: Values
+    :type values1: numpy.ndarray
+    :param values2: Values
+    :type values2: numpy.ndarray
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing elements to \
+    describe
+    :type max_differences: int
+    :param offset: Offset of the arrays along their first axis, \
+    added to each described position
+    :type offset: int
+    :return: Number of differing elements and descriptions of the \
+    first ``max_differences`` of these
+    :rtype: tuple(int, list(str or unicode))
+    """
+    values1 = np.asarray(values1)
+    values2 = np.asarray(values2)
+    differences = get_differences(values1, values2, tolerance)
+    num_differences = int(np.count_nonzero(differences))
+    descriptions = []
+    for position in np.argwhere(differences)[:max_differences]:
+        index = tuple(position)
+        reported = tuple(int(value) + (offset if axis == 0 else 0)
+                         for axis, value in enumerate(index))
+        descriptions.append("{}: {} != {}".format(
+            reported, values1[index], values2[index]))
+    return num_differences, descriptions
+
+
+def format_differences(path, num_differences, descriptions):
+    """
+    Format a description of the differences in an H5 object.
+
+    :param path: Object path
+    :type path: str or unicode
+    :param num_differences: Number of differing elements
+    :type num_differences: int
+    :param descriptions: Descriptions of differing elements
+    :type descriptions: list(str or unicode)
+    :return: Description
+    :rtype: str or unicode
+    """
+    return "{}: {} difference(s), first at {}".format(
+        path, num_differences, ", ".join(descriptions))
+
+
+def compare_values(path, values1, values2, tolerance=0.0,
+                   max_differences=MAX_DIFFERENCES):
+    """
+    Compare two arrays, or scalars.
+
+    :param path: Object path, for the description
+    :type path: str or unicode
+    :param values1: Values
+    :type values1: numpy.ndarray
+    :param values2: Values
+    :type values2: numpy.ndarray
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing elements to \
+    describe
+    :type max_differences: int
+    :return: Description of differences or ``None`` if equal
+    :rtype: str or unicode
+    """
+    values1 = np.asarray(values1)
+    values2 = np.asarray(values2)
+    if values1.shape != values2.shape:
+        return "{}: shape {} != {}".format(
+            path, values1.shape, values2.shape)
+    num_differences, descriptions = find_differences(
+        values1, values2, tolerance, max_differences)
+    if not num_differences:
+        return None
+    return format_differences(path, num_differences, descriptions)
+
+
+def compare_attributes(path, attrs1, attrs2, tolerance=0.0,
+                       max_differences=MAX_DIFFERENCES):
+    """
+    Compare the attributes of two H5 objects.
+
+    :param path: Object path, for descriptions
+    :type path: str or unicode
+    :param attrs1: Attributes
+    :type attrs1: h5py.AttributeManager
+    :param attrs2: Attributes
+    :type attrs2: h5py.AttributeManager
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing elements to \
+    describe for each attribute
+    :type max_differences: int
+    :return: Descriptions of differences
+    :rtype: list(str or unicode)
+    """
+    differences = []
+    names1 = set(attrs1.keys())
+    names2 = set(attrs2.keys())
+    for name in sorted(names1 - names2):
+        differences.append("{}: attribute {} only in first file".format(
+            path, name))
+    for name in sorted(names2 - names1):
+        differences.append("{}: attribute {} only in second file".format(
+            path, name))
+    for name in sorted(names1 & names2):
+        description = compare_values(
+            "{} attribute {}".format(path, name), attrs1[name],
+            attrs2[name], tolerance, max_differences)
+        if description:
+            differences.append(description)
+    return differences
+
+
+def equal_chunks(data_set1, data_set2):
+    """
+    Check whether two chunked H5 data sets have the same storage
+    properties and the same raw, still compressed, chunks. If so, the
+    data sets have equal values, which can be determined without
+    decompressing them.
+
+    :param data_set1: Data set
+    :type data_set1: h5py.Dataset
+    :param data_set2: Data set
+    :type data_set2: h5py.Dataset
+    :return: ``True`` if the data sets have the same storage \
+    properties and raw chunks, ``False`` otherwise, in which case \
+    their values may or may not be equal
+    :rtype: bool
+    """
+    properties = ["shape", "dtype", "chunks", "compression",
+                  "compression_opts", "shuffle", "fletcher32",
+                  "scaleoffset"]
+    if data_set1.chunks is None or \
+       not hasattr(data_set1.id, "get_num_chunks") or \
+       any(getattr(data_set1, name) != getattr(data_set2, name)
+           for name in properties):
+        return False
+    if not np.array_equal(data_set1.fillvalue, data_set2.fillvalue):
+        return False
+    num_chunks = data_set1.id.get_num_chunks()
+    if num_chunks != data_set2.id.get_num_chunks():
+        return False
+    for index in range(num_chunks):
+        info1 = data_set1.id.get_chunk_info(index)
+        info2 = data_set2.id.get_chunk_info(index)
+        if info1.chunk_offset != info2.chunk_offset or \
+           info1.size != info2.size:
+            return False
+        if data_set1.id.read_direct_chunk(info1.chunk_offset) != \
+           data_set2.id.read_direct_chunk(info2.chunk_offset):
+            return False
+    return True
+
+
+def compare_datasets(path, data_set1, data_set2, tolerance=0.0,
+                     max_differences=MAX_DIFFERENCES):
+    """
+    Compare the values of two H5 data sets. If the data sets have the
+    same raw chunks (see :py:func:`equal_chunks`) then they are equal.
+    Otherwise, values are read and compared in blocks of up to
+    :py:const:`BLOCK_SIZE` values.
+
+    :param path: Data set path, for the description
+    :type path: str or unicode
+    :param data_set1: Data set
+    :type data_set1: h5py.Dataset
+    :param data_set2: Data set
+    :type data_set2: h5py.Dataset
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing elements to \
+    describe
+    :type max_differences: int
+    :return: Description of differences or ``None`` if equal
+    :rtype: str or unicode
+    """
+    if data_set1.shape != data_set2.shape or not data_set1.shape:
+        return compare_values(path, data_set1[()], data_set2[()],
+                              tolerance, max_differences)
+    if equal_chunks(data_set1, data_set2):
+        return None
+    row_size = max(1, int(np.prod(data_set1.shape[1:])))
+    rows = max(1, BLOCK_SIZE // row_size)
+    num_differences = 0
+    descriptions = []
+    for start in range(0, data_set1.shape[0], rows):
+        count, block_descriptions = find_differences(
+            data_set1[start:start + rows], data_set2[start:start + rows],
+            tolerance, max_differences - len(descriptions), start)
+        num_differences += count
+        descriptions.extend(block_descriptions)
+    if not num_differences:
+        return None
+    return format_differences(path, num_differences, descriptions)
+
+
+def compare_objects(group1, group2, name, tolerance=0.0,
+                    max_differences=MAX_DIFFERENCES):
+    """
+    Compare an object, and any objects it contains, in two H5 groups.
+
+    Groups are compared by their attributes and members. Data sets are
+    compared by their attributes and values. Soft links are compared
+    by their paths and external links by their object paths and
+    file base names, without following the links.
+
+    :param group1: Group
+    :type group1: h5py.Group
+    :param group2: Group
+    :type group2: h5py.Group
+    :param name: Object name, in both groups
+    :type name: str or unicode
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing elements to \
+    describe for each attribute and data set
+    :type max_differences: int
+    :return: Descriptions of differences
+    :rtype: list(str or unicode)
+    """
+    path = "/".join([group1.name.rstrip("/"), name])
+    link1 = group1.get(name, getlink=True)
+    link2 = group2.get(name, getlink=True)
+    if type(link1) is not type(link2):
+        return ["{}: {} != {}".format(path, type(link1).__name__,
+                                      type(link2).__name__)]
+    if isinstance(link1, h5py.ExternalLink):
+        target1 = (os.path.basename(link1.filename), link1.path)
+        target2 = (os.path.basename(link2.filename), link2.path)
+        if target1 != target2:
+            return ["{}: external link {} != {}".format(
+                path, target1, target2)]
+        return []
+    if isinstance(link1, h5py.SoftLink):
+        if link1.path != link2.path:
+            return ["{}: soft link {} != {}".format(
+                path, link1.path, link2.path)]
+        return []
+    object1 = group1[name]
+    object2 = group2[name]
+    if type(object1) is not type(object2):
+        return ["{}: {} != {}".format(path, type(object1).__name__,
+                                      type(object2).__name__)]
+    differences = compare_attributes(path, object1.attrs, object2.attrs,
+                                     tolerance, max_differences)
+    if isinstance(object1, h5py.Dataset):
+        description = compare_datasets(path, object1, object2,
+                                       tolerance, max_differences)
+        if description:
+            differences.append(description)
+    else:
+        differences.extend(compare_members(object1, object2,
+                                           tolerance, max_differences))
+    return differences
+
+
+def compare_members(group1, group2, tolerance=0.0,
+                    max_differences=MAX_DIFFERENCES):
+    """
+    Compare the members of two H5 groups.
+
+    :param group1: Group
+    :type group1: h5py.Group
+    :param group2: Group
+    :type group2: h5py.Group
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing elements to \
+    describe for each attribute and data set
+    :type max_differences: int
+    :return: Descriptions of differences
+    :rtype: list(str or unicode)
+    """
+    differences = []
+    path = group1.name.rstrip("/")
+    names1 = list(group1.keys())
+    names2 = set(group2.keys())
+    for name in names1:
+        if name in names2:
+            differences.extend(compare_objects(
+                group1, group2, name, tolerance, max_differences))
+        else:
+            differences.append("{}/{}: only in first file".format(
+                path, name))
+    for name in sorted(names2 - set(names1)):
+        differences.append("{}/{}: only in second file".format(
+            path, name))
+    return differences
+
+
+def compare_h5_members(file1, file2, names, tolerance=0.0,
+                       max_differences=MAX_DIFFERENCES):
+    """
+    Compare root members of two H5 files.
 
     :param file1: File name
     :type file1: str or unicode
     :param file2: File name
     :type file2: str or unicode
+    :param names: Names of root members, in both files, to compare
+    :type names: list(str or unicode)
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing members to \
+    compare and differing elements to describe for each attribute and \
+    data set
+    :type max_differences: int
+    :return: Names and descriptions of differences of differing \
+    members
+    :rtype: list(tuple(str or unicode, list(str or unicode)))
+    """
+    differences = []
+    with h5py.File(file1, "r") as f1, h5py.File(file2, "r") as f2:
+        for name in names:
+            if len(differences) >= max_differences:
+                break
+            member_differences = compare_objects(
+                f1, f2, name, tolerance, max_differences)
+            if member_differences:
+                differences.append((name, member_differences))
+    return differences
+
+
+def equal_h5(file1, file2, tolerance=0.0,
+             max_differences=MAX_DIFFERENCES, num_processes=1):
+    """
+    Compare two H5 files for equality.
+
+    All groups, data sets, attributes and links are compared (see
+    :py:func:`compare_objects`). Numerical values are compared to
+    within an absolute tolerance, and ``NaN`` values are considered to
+    be equal.
+
+    Root members, which are genes for legacy layout files, can be
+    compared in parallel. The first ``max_differences`` differing root
+    members are reported, each with up to ``max_differences``
+    differing positions for each attribute and data set.
+
+    :param file1: File name
+    :type file1: str or unicode
+    :param file2: File name
+    :type file2: str or unicode
+    :param tolerance: Tolerance for numerical comparisons
+    :type tolerance: float
+    :param max_differences: Maximum number of differing root members \
+    and positions to report
+    :type max_differences: int
+    :param num_processes: Number of processes
+    :type num_processes: int
     :raise AssertionError: If the file contents differ
-    :raise Exception: If problems arise when loading the files or \
-    running ``h5diff``
-    """
-    # TODO implement in-Python comparison.
-    cmd = ["h5diff", "-q", file1, file2]
-    return_code = subprocess.call(cmd)
-    assert return_code == 0,\
-        "Non-zero return code (%d) from %s" % (
-            return_code, ' '.join(map(str, cmd)))
+    :raise Exception: If problems arise when loading the files
+    """
+    with h5py.File(file1, "r") as f1, h5py.File(file2, "r") as f2:
+        differences = compare_attributes("/", f1.attrs, f2.attrs,
+                                         tolerance, max_differences)
+        names1 = list(f1.keys())
+        names2 = set(f2.keys())
+    for name in names1:
+        if name not in names2:
+            differences.append("/{}: only in first file".format(name))
+    for name in sorted(names2 - set(names1)):
+        differences.append("/{}: only in second file".format(name))
+    names = [name for name in names1 if name in names2]
+    if num_processes > 1 and len(names) > 1:
+        # Contiguous batches, so differences are reported in file
+        # order.
+        batches = np.array_split(np.array(names, dtype=object),
+                                 min(len(names), num_processes * 4))
+        with multiprocessing.Pool(num_processes) as pool:
+            results = pool.starmap(
+                compare_h5_members,
+                [(file1, file2, list(batch), tolerance, max_differences)
+                 for batch in batches])
+        member_differences = [member for result in results
+                              for member in result]
+    else:
+        member_differences = compare_h5_members(
+            file1, file2, names, tolerance, max_differences)
+    for _, descriptions in member_differences[:max_differences]:
+        differences.extend(descriptions)
+    assert not differences,\
+        "Files differ: %s, %s\n%s" % (file1, file2,
+                                      "\n".join(differences))
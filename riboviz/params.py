@@ -36,6 +36,8 @@ MULTIPLEX_FQ_FILES = "multiplex_fq_files"
 
 TRIM_5P_MISMATCHES = "trim_5p_mismatches"
 """ Trim mismatched 5' base? """
+FUSE_TRIM_SORT = "fuse_trim_sort"
+""" Trim, sort and index ORF-mapped reads in one step? """
 RUN_STATIC_HTML = "run_static_html"
 """ Create static html visualization per sample? """
 
@@ -110,6 +112,17 @@ VALIDATE_ONLY = "validate_only"
 """ Validate configuration only? """
 PUBLISH_INDEX_TMP = "publish_index_tmp"
 """ Publish index and temporary files? """
+PYTHON_BAM_TO_H5 = "python_bam_to_h5"
+""" Convert BAM files to H5 files using Python, not R? """
+PYTHON_DEDUP_UMIS = "python_dedup_umis"
+"""
+Deduplicate and group reads using riboviz.tools.dedup_umis, not
+umi_tools?
+"""
+PYTHON_MAKE_BEDGRAPH = "python_make_bedgraph"
+"""
+Make bedgraph files using riboviz.tools.make_bedgraphs, not bedtools?
+"""
 SKIP_INPUTS = "skip_inputs"
 """
 When validating configuration skip checks for existence of ribosome
@@ -1,6 +1,14 @@
 """
 SAM and BAM-related constants and functions.
 """
+import collections
+import gc
+import heapq
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
 import pysam
 from riboviz import utils
 
@@ -18,6 +26,20 @@ BAM_FORMAT = "{}." + BAM_EXT
 """ BAM file name format. """
 BAI_FORMAT = "{}." + BAI_EXT
 """ BAI file name format. """
+SORT_BUFFER_SIZE = 1000000
+"""
+Default maximum number of reads held in memory by
+:py:func:`write_sorted_bam`.
+"""
+UNPLACED = "*"
+""" Region of reads without coordinates. """
+MAX_DIFFERENCES = 10
+"""
+Default maximum number of differing reads reported by
+:py:func:`equal_bam_sam_reads`.
+"""
+DIGEST_MASK = (1 << 64) - 1
+""" Mask for read digest sums. """
 
 
 def is_bam(file_name):
@@ -71,7 +93,149 @@ def count_sequences(file_name):
     return (num_sequences, num_mapped_sequences)
 
 
-def equal_bam(file1, file2):
+def count_indexed_sequences(file_name):
+    """
+    Count number of sequences in a BAM file using the statistics held
+    in its index, without iterating through the sequences. This is
+    equivalent to summing the mapped and unmapped counts output by
+    ``samtools idxstats``.
+
+    :param file_name: BAM file name
+    :type file_name: str or unicode
+    :return: number of sequences or ``None`` if the file is not a \
+    BAM file or has no complementary BAI file
+    :rtype: int
+    """
+    if not is_bam(file_name) or \
+       not os.path.isfile(BAI_FORMAT.format(file_name)):
+        return None
+    with pysam.AlignmentFile(file_name, mode="rb") as f:
+        if not f.has_index():
+            return None
+        num_sequences = sum([stats.total for stats in
+                             f.get_index_statistics()])
+        return num_sequences + f.nocoordinate
+
+
+def get_coordinate_sort_key(read):
+    """
+    Get key to sort a read by reference, leftmost coordinate position
+    and strand, as for ``samtools sort``. Unmapped reads with no
+    reference are sorted after all other reads.
+
+    :param read: Read
+    :type read: pysam.libcalignedsegment.AlignedSegment
+    :return: (reference ID, position, ``True`` if reverse strand)
+    :rtype: tuple(int, int, bool)
+    """
+    reference_id = read.reference_id
+    if reference_id < 0:
+        reference_id = float("inf")
+    return (reference_id, read.reference_start, read.is_reverse)
+
+
+def get_sorted_header(header):
+    """
+    Get a copy of a SAM/BAM header whose ``@HD`` line records that
+    reads are sorted by coordinate.
+
+    :param header: SAM/BAM header
+    :type header: pysam.AlignmentHeader
+    :return: SAM/BAM header
+    :rtype: pysam.AlignmentHeader
+    """
+    header_dict = header.to_dict()
+    hd = dict(header_dict.get("HD", {"VN": "1.0"}))
+    hd["SO"] = "coordinate"
+    header_dict["HD"] = hd
+    return pysam.AlignmentHeader.from_dict(header_dict)
+
+
+def write_sorted_bam(reads,
+                     bam_file,
+                     header,
+                     buffer_size=SORT_BUFFER_SIZE,
+                     tmp_dir=None,
+                     num_threads=1):
+    """
+    Sort reads by coordinate (see :py:func:`get_coordinate_sort_key`)
+    and write these to a BAM file, which is then indexed. Reads with
+    equal keys keep their input order.
+
+    At most ``buffer_size`` reads are held in memory. If there are
+    more reads than this then each batch of ``buffer_size`` reads is
+    sorted and written to an uncompressed BAM spill file in a
+    temporary directory, then the spill files are merged. The
+    temporary directory is created within ``tmp_dir``, or alongside
+    ``bam_file`` if ``tmp_dir`` is ``None``, and is deleted when
+    done.
+
+    :param reads: Reads
+    :type reads: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param header: SAM/BAM header
+    :type header: pysam.AlignmentHeader
+    :param buffer_size: Maximum number of reads held in memory
+    :type buffer_size: int
+    :param tmp_dir: Directory for temporary spill files
+    :type tmp_dir: str or unicode
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    :return: Number of spill files written
+    :rtype: int
+    :raise ValueError: If ``buffer_size`` is less than 1
+    """
+    if buffer_size < 1:
+        raise ValueError("buffer_size must be at least 1")
+    header = get_sorted_header(header)
+    if tmp_dir is None:
+        tmp_dir = os.path.dirname(os.path.abspath(bam_file))
+    spill_dir = tempfile.mkdtemp(prefix="sort", dir=tmp_dir)
+    spill_files = []
+    # Buffered reads hold no reference cycles, so disable the cyclic
+    # garbage collector which otherwise repeatedly traverses them.
+    is_gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        buffer = []
+        for read in reads:
+            buffer.append(read)
+            if len(buffer) == buffer_size:
+                buffer.sort(key=get_coordinate_sort_key)
+                spill_file = os.path.join(
+                    spill_dir, BAM_FORMAT.format(len(spill_files)))
+                with pysam.AlignmentFile(spill_file, "wbu",
+                                         header=header) as spill:
+                    for spill_read in buffer:
+                        spill.write(spill_read)
+                spill_files.append(spill_file)
+                buffer = []
+        buffer.sort(key=get_coordinate_sort_key)
+        spills = [pysam.AlignmentFile(spill_file, "rb")
+                  for spill_file in spill_files]
+        try:
+            # heapq.merge is stable so reads with equal keys are
+            # output in the order of the spill files, then buffer.
+            sorted_reads = heapq.merge(*spills, buffer,
+                                       key=get_coordinate_sort_key)
+            with pysam.AlignmentFile(bam_file, "wb", header=header,
+                                     threads=num_threads) as bam:
+                for read in sorted_reads:
+                    bam.write(read)
+        finally:
+            for spill in spills:
+                spill.close()
+    finally:
+        if is_gc_enabled:
+            gc.enable()
+        shutil.rmtree(spill_dir)
+    pysam.index(bam_file)
+    return len(spill_files)
+
+
+def equal_bam(file1, file2, num_processes=1):
     """
     Compare two BAM files for equality. The following content is
     compared:
@@ -93,6 +257,9 @@ def equal_bam(file1, file2):
     :type file1: str or unicode
     :param file2: File name
     :type file2: str or unicode
+    :param num_processes: Number of processes used to compare reads \
+    (see :py:func:`equal_bam_sam_reads`)
+    :type num_processes: int
     :raise AssertionError: if files differ in their content or BAM \
     files are missing complementary BAI files
     :raise Exception: if problems arise when loading the files or, \
@@ -121,7 +288,7 @@ def equal_bam(file1, file2):
         equal_bam_sam_metadata(bam_file1, bam_file2)
         equal_bam_sam_headers(bam_file1, bam_file2)
         equal_bam_sam_references(bam_file1, bam_file2)
-        equal_bam_sam_reads(bam_file1, bam_file2)
+        equal_bam_sam_reads(bam_file1, bam_file2, num_processes)
 
 
 def equal_sam(file1, file2):
@@ -233,116 +400,253 @@ def equal_bam_sam_headers(file1, file2):
                file2.filename, str(file2.header[key]))
 
 
-def get_segment_qname(segment):
+def get_read_digest(read):
+    """
+    Get a digest of a read's fields: query name, flag, reference,
+    position, mapping quality, CIGAR string, mate reference, mate
+    position, template length, sequence, qualities and tags, in their
+    SAM representation.
+
+    Digests use Python's hash function so are only comparable within
+    a single process.
+
+    :param read: Read
+    :type read: pysam.AlignedSegment
+    :return: Digest
+    :rtype: int
     """
-    Return the qualified name of a read segment.
+    return hash(read.to_string())
 
-    :param segment: read segment
-    :type segment: pysam.libcalignedsegment.AlignedSegment
-    :return: qualified name
-    :rtype: str or unicode
+
+def get_position_digests(reads):
+    """
+    Summarise reads by position. Reads with the same reference and
+    leftmost coordinate position are expected to be consecutive. For
+    each such group of reads the number of reads and the sum of the
+    reads' digests (see :py:func:`get_read_digest`) are returned. As
+    the sum does not depend on read order, the summaries of two groups
+    of reads are equal if the groups hold the same reads, in any
+    order.
+
+    :param reads: Reads
+    :type reads: collections.Iterable(pysam.AlignedSegment)
+    :return: Reference ID, position, number of reads and digest sum \
+    for each group of reads
+    :rtype: collections.Iterable(tuple(int, int, int, int))
+    """
+    current = None
+    num_reads = 0
+    digest = 0
+    for read in reads:
+        position = (read.reference_id, read.reference_start)
+        if position != current:
+            if current is not None:
+                yield current + (num_reads, digest & DIGEST_MASK)
+            current = position
+            num_reads = 0
+            digest = 0
+        num_reads += 1
+        digest += get_read_digest(read)
+    if current is not None:
+        yield current + (num_reads, digest & DIGEST_MASK)
+
+
+def compare_position_digests(reads1, reads2):
     """
-    return segment.qname
+    Compare reads by position (see :py:func:`get_position_digests`)
+    and return the summaries of the first position at which they
+    differ.
+
+    :param reads1: Reads
+    :type reads1: collections.Iterable(pysam.AlignedSegment)
+    :param reads2: Reads
+    :type reads2: collections.Iterable(pysam.AlignedSegment)
+    :return: ``None`` if the reads are equal, else summaries of the \
+    first differing positions, ``None`` if there are no more positions
+    :rtype: tuple(tuple(int, int, int, int), \
+    tuple(int, int, int, int))
+    """
+    for summary1, summary2 in itertools.zip_longest(
+            get_position_digests(reads1), get_position_digests(reads2)):
+        if summary1 != summary2:
+            return summary1, summary2
+    return None
 
 
-def equal_bam_sam_reads(file1, file2):
+def compare_contig_reads(file1, file2, contig):
+    """
+    Compare the reads on a reference sequence in two indexed BAM files
+    (see :py:func:`compare_position_digests`).
+
+    :param file1: File name
+    :type file1: str or unicode
+    :param file2: File name
+    :type file2: str or unicode
+    :param contig: Reference sequence name or :py:const:`UNPLACED`
+    :type contig: str or unicode
+    :return: ``None`` if the reads are equal, else summaries of the \
+    first differing positions
+    :rtype: tuple(tuple(int, int, int, int), \
+    tuple(int, int, int, int))
+    """
+    with pysam.AlignmentFile(file1) as bam_file1,\
+            pysam.AlignmentFile(file2) as bam_file2:
+        return compare_position_digests(bam_file1.fetch(contig),
+                                        bam_file2.fetch(contig))
+
+
+def fetch_position(sam_bam, reference_id, position):
+    """
+    Get the reads with a given reference and leftmost coordinate
+    position. If the file is indexed then only reads overlapping
+    the position are read, otherwise all reads are read.
+
+    :param sam_bam: BAM or SAM file
+    :type sam_bam: pysam.AlignmentFile
+    :param reference_id: Reference ID, -1 for reads without \
+    coordinates
+    :type reference_id: int
+    :param position: Leftmost coordinate position
+    :type position: int
+    :return: Reads
+    :rtype: collections.Iterable(pysam.AlignedSegment)
+    """
+    if not (sam_bam.is_bam and sam_bam.has_index()):
+        reads = sam_bam.fetch(until_eof=True)
+    elif reference_id < 0:
+        reads = sam_bam.fetch(UNPLACED)
+    else:
+        reads = sam_bam.fetch(sam_bam.get_reference_name(reference_id),
+                              max(position, 0), max(position, 0) + 1)
+    for read in reads:
+        if read.reference_id == reference_id and \
+           read.reference_start == position:
+            yield read
+
+
+def get_read_differences(file1, file2, reference_id, position,
+                         max_differences=MAX_DIFFERENCES):
+    """
+    Get reads with a given reference and leftmost coordinate position
+    that are in one file but not the other. Only read digests (see
+    :py:func:`get_read_digest`) are held in memory, plus the
+    differing reads that are returned.
+
+    :param file1: File name
+    :type file1: str or unicode
+    :param file2: File name
+    :type file2: str or unicode
+    :param reference_id: Reference ID, -1 for reads without \
+    coordinates
+    :type reference_id: int
+    :param position: Leftmost coordinate position
+    :type position: int
+    :param max_differences: Maximum number of differing reads to \
+    return from each file
+    :type max_differences: int
+    :return: Reads, in their SAM representation, only in ``file1`` \
+    and only in ``file2``
+    :rtype: tuple(list(str or unicode), list(str or unicode))
+    """
+    digests = []
+    for file_name in [file1, file2]:
+        with pysam.AlignmentFile(file_name) as sam_bam:
+            digests.append(collections.Counter(
+                get_read_digest(read) for read in
+                fetch_position(sam_bam, reference_id, position)))
+    only = [digests[0] - digests[1], digests[1] - digests[0]]
+    differences = []
+    for file_name, only_digests in zip([file1, file2], only):
+        reads = []
+        if only_digests:
+            with pysam.AlignmentFile(file_name) as sam_bam:
+                for read in fetch_position(sam_bam, reference_id,
+                                           position):
+                    digest = get_read_digest(read)
+                    if only_digests[digest] > 0:
+                        only_digests[digest] -= 1
+                        reads.append(read.to_string())
+                        if len(reads) >= max_differences:
+                            break
+        differences.append(reads)
+    return tuple(differences)
+
+
+def equal_bam_sam_reads(file1, file2, num_processes=1,
+                        max_differences=MAX_DIFFERENCES):
     """
     Compare BAM or SAM reads for equality. BAM/SAM files are assumed
-    to have been sorted by their leftmost coordinate position.
+    to have been sorted by their leftmost coordinate position. Reads
+    with the same position may be in any order.
+
+    Both files are read once, in parallel, and for each position the
+    number of reads and a digest of their fields are compared (see
+    :py:func:`get_position_digests`), so memory use does not depend on
+    the number of reads at a position. If indexed BAM files are
+    compared and ``num_processes`` is more than 1, each reference
+    sequence, and reads without coordinates, is compared in a separate
+    task.
+
+    If the files differ, then the reads at the first differing
+    position are read again to find the reads in one file but not the
+    other, and up to ``max_differences`` of these from each file are
+    reported.
 
     :param file1: File name
     :type file1: pysam.AlignmentFile
     :param file2: File name
     :type file2: pysam.AlignmentFile
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param max_differences: Maximum number of differing reads to \
+    report from each file
+    :type max_differences: int
     :raise AssertionError: if files differ in their reads
     """
-    # Get total number of reads in each file.
-    with pysam.AlignmentFile(file1.filename) as f1:
-        num_reads1 = f1.count()
-    with pysam.AlignmentFile(file2.filename) as f2:
-        num_reads2 = f2.count()
-    assert num_reads1 == num_reads2,\
-        "Unequal read counts: %s (%d), %s (%d)"\
-        % (file1.filename, num_reads1, file2.filename, num_reads2)
-    if num_reads1 == 0:
+    is_indexed = all(sam_bam.is_bam and sam_bam.has_index()
+                     for sam_bam in [file1, file2])
+    if num_processes > 1 and is_indexed:
+        contigs = list(file1.references) + [UNPLACED]
+        differences = None
+        with multiprocessing.Pool(num_processes) as pool:
+            for result in pool.imap(_compare_contig_reads_task,
+                                    [(file1.filename, file2.filename,
+                                      contig) for contig in contigs]):
+                if result is not None:
+                    differences = result
+                    break
+    else:
+        differences = compare_position_digests(
+            file1.fetch(until_eof=True), file2.fetch(until_eof=True))
+    if differences is None:
         return
-    # Iterate through files in batches to reduce memory overheads.
-    # Exit when all reads have been processed.
-    iter1 = file1.fetch(until_eof=True)
-    iter2 = file2.fetch(until_eof=True)
-    read1 = next(iter1)  # Guaranteed to be at least one.
-    read_pos = read1.pos
-    num_reads_done1 = 1
-    num_reads_done2 = 0
-    all_done = False
-    while not all_done:
-        reads1 = [read1]
-        current_pos = read_pos
-        next_pos_read = None
-        # 1. Iterate through file1 to get all references with the same
-        #    leftmost coordinate position.
-        while read_pos == current_pos:
-            try:
-                read1 = next(iter1)
-                reads1.append(read1)
-                read_pos = read1.pos
-                num_reads_done1 = num_reads_done1 + 1
-            except StopIteration:
-                all_done = True
-                break
-        positions1 = {r1.pos for r1 in reads1}
-        # Internal check to ensure that logic above:
-        # * Either returns a batch with two positions i.e. a batch
-        #   where all reads share a common position, plus one extra
-        #   read representing the start of the next
-        #   batch. Unfortunately we can't look ahead in the iterator
-        #   so need to handle the extra read from the next batch.
-        # * Or returns a batch with one position i.e. a batch that
-        #   is terminated by the end of the file.
-        assert len(positions1) <= 2,\
-            "More than two positions in batch: %s (%s)"\
-            % (file1.filename, str(positions1))
-        # 3. If we've read the first read of the next batch then
-        #    remove its read from reads1 and keep for the next
-        #    iteration.
-        if len(positions1) == 2:
-            next_pos_read = reads1.pop()
-        # 2. Read the same number of reads from file2. This
-        #    should not fail as it is already known that both files
-        #    have the same number of reads.
-        reads2 = []
-        for _ in range(len(reads1)):
-            read2 = next(iter2)
-            reads2.append(read2)
-            num_reads_done2 = num_reads_done2 + 1
-        positions2 = {r2.pos for r2 in reads2}
-        # 3. Check that the reads from file2 all share a common
-        #    position and that this position is the same as for
-        #    file1. If not, then the files differ.
-        assert len(positions2) == 1,\
-            "Unequal positions: %s (%s), %s (%s)"\
-            % (file1.filename, current_pos,
-               file2.filename, str(positions2))
-        position2 = positions2.pop()  # Get only member.
-        assert current_pos == position2,\
-            "Unequal positions: %s (%s), %s (%s)"\
-            % (file1.filename, str(current_pos),
-               file2.filename, str(position2))
-        # 4. Check that the reads from each file are the same.
-        reads1.sort(key=get_segment_qname)
-        reads2.sort(key=get_segment_qname)
-        assert reads1 == reads2,\
-            "Unequal reads at position %s: %s, %s"\
-            % (str(current_pos), file1.filename, file2.filename)
-        # 5. Initialise for next iteration.
-        if next_pos_read is not None:
-            read1 = next_pos_read
-        else:
-            all_done = True
-    # Internal checks to ensure that logic above does check all reads.
-    assert num_reads_done1 == num_reads1,\
-        "Reads processed (%d) not equal to reads (%d) in file (%s)"\
-        % (num_reads_done1, num_reads1, file1.filename)
-    assert num_reads_done2 == num_reads2,\
-        "Reads processed (%d) not equal to reads (%d) in file (%s)"\
-        % (num_reads_done2, num_reads2, file2.filename)
+    summary1, summary2 = differences
+    reference_id, position, _, _ = summary1 if summary1 is not None \
+        else summary2
+    only1, only2 = get_read_differences(
+        file1.filename, file2.filename, reference_id, position,
+        max_differences)
+    reference = file1.get_reference_name(reference_id) \
+        if reference_id >= 0 else UNPLACED
+    num_reads = [summary[2] if summary is not None and
+                 summary[:2] == (reference_id, position) else 0
+                 for summary in differences]
+    raise AssertionError(
+        "Unequal reads at position %s:%d: %s (%d reads), %s (%d reads)"
+        "\nOnly in %s:\n%s\nOnly in %s:\n%s"
+        % (reference, position + 1, file1.filename, num_reads[0],
+           file2.filename, num_reads[1], file1.filename, "\n".join(only1),
+           file2.filename, "\n".join(only2)))
+
+
+def _compare_contig_reads_task(args):
+    """
+    Unpack arguments and call :py:func:`compare_contig_reads`.
+
+    :param args: Arguments
+    :type args: tuple
+    :return: See :py:func:`compare_contig_reads`
+    :rtype: tuple(tuple(int, int, int, int), \
+    tuple(int, int, int, int))
+    """
+    return compare_contig_reads(*args)
@@ -1,19 +1,462 @@
 """
 Subsample .fastq, .fastq.gz or other sequence file.
+
+Records can be sampled with a fixed probability, or a fixed number of
+records can be sampled, either by reservoir sampling, which reads the
+whole file, or, for uncompressed or BGZF-compressed files, by seeking
+to random offsets within the file, which reads only the records
+sampled.
+
+For FASTQ and FASTA files, records are copied as-is, without being
+parsed by Bio.SeqIO. Records are always written in the order they
+appear in the input file.
+
+Paired-end read 1 and read 2 files can be subsampled together, in
+sync, using :py:func:`subsample_bioseqfiles`.
 """
+import contextlib
 import gzip
+import itertools
+import math
 import os
 import random
 from Bio import SeqIO
+from Bio import bgzf
+from riboviz import fastq
+
+RAW_FILETYPES = ["fastq", "fasta"]
+"""
+File types whose records are copied as-is, rather than parsed and
+written using Bio.SeqIO.
+"""
+BGZF_HEADER = fastq.BGZF_HEADER
+"""
+Header of each BGZF block, up to the block size, as written by
+``bgzip`` and ``htslib``.
+"""
+BGZF_MAX_BLOCK_SIZE = 1 << 16
+""" Maximum size of a BGZF block, in bytes. """
+SEEK_ATTEMPTS = 10
+"""
+Maximum number of random offsets tried, per record to be sampled,
+when sampling by seeking, before reservoir sampling is used instead.
+"""
+SEEK_LINES = 8
+"""
+Number of lines read, after seeking to a random offset, in which to
+look for the start of a record.
+"""
+WRITE_BATCH_SIZE = fastq.WRITE_BATCH_SIZE
+""" Number of records buffered before writing. """
+PROGRESS_INTERVAL = 100000
+""" Number of records read between progress statements. """
+
+
+def is_gz(file_name):
+    """
+    Does the given file end with ``.gz`` or ``.gzip``, in any case?
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: ``True`` or ``False``
+    :rtype: bool
+    """
+    return os.path.splitext(file_name)[1].lower() in [".gz", ".gzip"]
+
+
+def is_bgzf(file_name):
+    """
+    Is the given file BGZF-compressed?
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: ``True`` or ``False``
+    :rtype: bool
+    """
+    with open(file_name, "rb") as f:
+        return f.read(len(BGZF_HEADER)) == BGZF_HEADER
+
+
+def read_fasta_raw_records(fh, block_size=fastq.BLOCK_SIZE):
+    """
+    Iterate over the records in a FASTA file, read in blocks of
+    ``block_size`` bytes, as the original ``bytes`` of each record.
+
+    Each record is returned as its header line and sequence lines,
+    each terminated by a newline. Any content before the first
+    header line is ignored.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over records
+    :rtype: collections.Iterable(bytes)
+    """
+    data = b""
+    is_started = False
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        data += block
+        if not is_started:
+            if data[:1] == b">":
+                start = 0
+            else:
+                start = data.find(b"\n>")
+                if start == -1:
+                    data = data[-1:]
+                    continue
+                start += 1
+            data = data[start:]
+            is_started = True
+        start = 0
+        while True:
+            end = data.find(b"\n>", start + 1)
+            if end == -1:
+                break
+            yield data[start:end + 1]
+            start = end + 1
+        data = data[start:]
+    if is_started and data:
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        yield data
+
+
+def read_raw_records(fh, filetype, block_size=fastq.BLOCK_SIZE):
+    """
+    Iterate over the records in a FASTQ or FASTA file as the
+    original ``bytes`` of each record. See
+    :py:func:`riboviz.fastq.read_fastq_raw_records` and
+    :py:func:`read_fasta_raw_records`.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param filetype: File type, one of :py:const:`RAW_FILETYPES`
+    :type filetype: str or unicode
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :return: Iterator over records
+    :rtype: collections.Iterable(bytes)
+    :raise ValueError: If a FASTQ record is malformed or truncated
+    """
+    if filetype == "fastq":
+        return fastq.read_fastq_raw_records(fh, block_size)
+    return read_fasta_raw_records(fh, block_size)
+
+
+def get_raw_record_id(record):
+    """
+    Get ID of a FASTQ or FASTA record, the first word of its header
+    line, without the leading ``@`` or ``>``.
+
+    :param record: Record
+    :type record: bytes
+    :return: ID
+    :rtype: str or unicode
+    """
+    header = record[1:record.find(b"\n")].split()
+    return header[0].decode() if header else ""
+
+
+def get_random():
+    """
+    Get a random number in the open interval (0, 1).
+
+    :return: Random number
+    :rtype: float
+    """
+    while True:
+        value = random.random()
+        if value > 0:
+            return value
+
+
+def sample_reservoir(records, num_records):
+    """
+    Sample ``num_records`` records, each with equal probability,
+    from an iterable of records of unknown length. This uses
+    reservoir sampling (Li's "Algorithm L") so random numbers are
+    generated only for records that enter the reservoir.
+
+    The records sampled depend only on the number of records and the
+    state of the :py:mod:`random` generator, so the same records are
+    sampled from files with the same number of records, given the
+    same seed.
+
+    :param records: Records
+    :type records: collections.Iterable(object)
+    :param num_records: Number of records to sample
+    :type num_records: int
+    :return: Sampled records, in the order they were read, or all \
+    records if there are no more than ``num_records``
+    :rtype: list(object)
+    """
+    if num_records <= 0:
+        return []
+    records = enumerate(records)
+    reservoir = []
+    for index, record in records:
+        reservoir.append((index, record))
+        if len(reservoir) == num_records:
+            break
+    else:
+        return [record for _, record in reservoir]
+    weight = math.exp(math.log(get_random()) / num_records)
+    next_index = index + math.floor(
+        math.log(get_random()) / math.log(1 - weight)) + 1
+    for index, record in records:
+        if index == next_index:
+            reservoir[random.randrange(num_records)] = (index, record)
+            weight *= math.exp(math.log(get_random()) / num_records)
+            next_index += math.floor(
+                math.log(get_random()) / math.log(1 - weight)) + 1
+    reservoir.sort(key=lambda index_record: index_record[0])
+    return [record for _, record in reservoir]
+
+
+def find_record_start(lines, filetype):
+    """
+    Find the first line in a list of lines that starts a FASTQ or
+    FASTA record.
+
+    A FASTQ record start is a line starting with ``@``, followed by a
+    sequence line, a line starting with ``+`` and a quality line of
+    the same length as the sequence line, followed by another
+    ``@``-prefixed line or the end of the file (denoted by an empty
+    line). A FASTA record start is a line starting with ``>``.
+
+    :param lines: Lines, each terminated by a newline apart from \
+    the last line of a file, with an empty line denoting the end of \
+    the file
+    :type lines: list(bytes)
+    :param filetype: File type, one of :py:const:`RAW_FILETYPES`
+    :type filetype: str or unicode
+    :return: Index of line or ``None`` if none
+    :rtype: int
+    """
+    if filetype == "fasta":
+        for index, line in enumerate(lines):
+            if line[:1] == b">":
+                return index
+        return None
+    for index in range(len(lines) - 4):
+        header, sequence, plus, quality, following = \
+            lines[index:index + 5]
+        if header[:1] == b"@" and plus[:1] == b"+" and \
+           len(sequence.rstrip(b"\n")) == len(quality.rstrip(b"\n")) and \
+           following[:1] in (b"@", b""):
+            return index
+    return None
+
+
+def read_raw_record_at(fh, filetype, is_line_start=False):
+    """
+    Read the first complete FASTQ or FASTA record whose first line
+    starts at or after the current position in a file.
+
+    :param fh: File handle, opened in binary mode, positioned at the \
+    byte before the first byte to search from or, if \
+    ``is_line_start`` is ``True``, at the first byte to search from
+    :type fh: io.IOBase or Bio.bgzf.BgzfReader
+    :param filetype: File type, one of :py:const:`RAW_FILETYPES`
+    :type filetype: str or unicode
+    :param is_line_start: Is the current position the start of a line?
+    :type is_line_start: bool
+    :return: Offset of record (from ``fh.tell()``) and record, or \
+    ``None`` if there is no record
+    :rtype: tuple(int, bytes)
+    """
+    if not is_line_start:
+        fh.readline()
+    offsets = []
+    lines = []
+    for _ in range(SEEK_LINES):
+        offsets.append(fh.tell())
+        lines.append(fh.readline())
+        if not lines[-1]:
+            break
+    start = find_record_start(lines, filetype)
+    if start is None:
+        return None
+    if filetype == "fastq":
+        record_lines = lines[start:start + 4]
+    else:
+        record_lines = [lines[start]]
+        lines = lines[start + 1:]
+        while True:
+            if not lines:
+                lines = [fh.readline()]
+            line = lines.pop(0)
+            if not line or line[:1] == b">":
+                break
+            record_lines.append(line)
+    record = b"".join(record_lines)
+    if not record.endswith(b"\n"):
+        record += b"\n"
+    return offsets[start], record
+
+
+def find_bgzf_block(fh, offset):
+    """
+    Find the offset of the BGZF block containing a given offset in a
+    BGZF file, by searching backwards, at most
+    :py:const:`BGZF_MAX_BLOCK_SIZE` bytes, for
+    :py:const:`BGZF_HEADER`.
+
+    :param fh: File handle, opened in binary mode
+    :type fh: io.IOBase
+    :param offset: Offset
+    :type offset: int
+    :return: Offset of block or ``None`` if none
+    :rtype: int
+    """
+    start = max(offset - BGZF_MAX_BLOCK_SIZE + 1, 0)
+    fh.seek(start)
+    data = fh.read(offset - start + len(BGZF_HEADER))
+    index = data.rfind(BGZF_HEADER, 0, offset - start + len(BGZF_HEADER))
+    if index == -1:
+        return None
+    return start + index
+
+
+def sample_seek(file_name, filetype, num_records):
+    """
+    Sample ``num_records`` records from an uncompressed or
+    BGZF-compressed FASTQ or FASTA file by seeking to random offsets
+    in the file and reading the first complete record after each.
+    Only the records sampled, not the whole file, are read.
+
+    For BGZF files, the BGZF block containing a random offset in the
+    file is chosen, then a random offset within the block's
+    uncompressed data is chosen.
+
+    The probability of a record being sampled is proportional to the
+    size of the record that precedes it (and, for BGZF files, to the
+    compression ratio of the block containing its start), so records
+    are sampled with equal probability only if records have similar
+    sizes, as is typical of FASTQ files of sequencing reads.
+
+    If ``num_records`` distinct records are not found after
+    :py:const:`SEEK_ATTEMPTS` times ``num_records`` offsets have been
+    tried, which typically happens only if the file has few more
+    records than ``num_records``, then ``None`` is returned.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param filetype: File type, one of :py:const:`RAW_FILETYPES`
+    :type filetype: str or unicode
+    :param num_records: Number of records to sample
+    :type num_records: int
+    :return: Sampled records, in the order they appear in the file, \
+    or ``None``
+    :rtype: list(bytes)
+    """
+    file_size = os.path.getsize(file_name)
+    records = {}
+    is_bgzf_file = is_bgzf(file_name)
+    # For BGZF files, blocks are found using a separate file handle,
+    # as Bio.bgzf.BgzfReader reads blocks from its file handle's
+    # current position.
+    with open(file_name, "rb") as raw_fh, \
+            open(file_name, "rb") as block_fh:
+        if is_bgzf_file:
+            fh = bgzf.BgzfReader(fileobj=raw_fh, mode="rb")
+        else:
+            fh = raw_fh
+        for _ in range(SEEK_ATTEMPTS * num_records):
+            if len(records) == num_records:
+                break
+            offset = random.randrange(file_size)
+            if is_bgzf_file:
+                block_offset = find_bgzf_block(block_fh, offset)
+                if block_offset is None:
+                    continue
+                block_fh.seek(block_offset)
+                _, _, _, data_length = next(bgzf.BgzfBlocks(block_fh))
+                if data_length == 0:
+                    continue
+                data_offset = random.randrange(data_length)
+                is_line_start = block_offset == 0 and data_offset == 0
+                fh.seek(bgzf.make_virtual_offset(
+                    block_offset, max(data_offset - 1, 0)))
+            else:
+                is_line_start = offset == 0
+                fh.seek(max(offset - 1, 0))
+            record = read_raw_record_at(fh, filetype, is_line_start)
+            if record is not None:
+                records[record[0]] = record[1]
+    if len(records) < num_records:
+        return None
+    return [records[offset] for offset in sorted(records)]
+
+
+def open_input(file_name, is_raw, num_threads):
+    """
+    Open an input file, which may be GZIP-compressed.
+
+    If ``is_raw`` is ``True`` the file is opened in binary mode and,
+    if ``num_threads`` is non-zero, read, and decompressed, by a
+    background thread, using
+    :py:class:`riboviz.fastq.ThreadedReader`. Otherwise, the file is
+    opened in text mode.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param is_raw: Open file in binary mode?
+    :type is_raw: bool
+    :param num_threads: Number of threads
+    :type num_threads: int
+    :return: File handle
+    :rtype: io.IOBase or riboviz.fastq.ThreadedReader
+    """
+    if is_raw and num_threads:
+        return fastq.ThreadedReader(file_name)
+    mode = "rb" if is_raw else "rt"
+    if is_gz(file_name):
+        return gzip.open(file_name, mode)
+    return open(file_name, mode)
+
+
+def open_output(file_name, is_raw, num_threads):
+    """
+    Open an output file, which is GZIP-compressed if its name ends
+    with ``.gz`` or ``.gzip``.
+
+    If ``is_raw`` is ``True`` the file is opened in binary mode and,
+    if the file is to be GZIP-compressed and ``num_threads`` is
+    non-zero, compressed using ``num_threads`` threads, using
+    :py:class:`riboviz.fastq.ParallelGzipWriter`. Otherwise, the file
+    is opened in text mode.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param is_raw: Open file in binary mode?
+    :type is_raw: bool
+    :param num_threads: Number of threads
+    :type num_threads: int
+    :return: File handle
+    :rtype: io.IOBase or riboviz.fastq.ParallelGzipWriter
+    """
+    if is_gz(file_name):
+        if is_raw and num_threads:
+            return fastq.ParallelGzipWriter(file_name, num_threads)
+        return gzip.open(file_name, "wb" if is_raw else "wt")
+    return open(file_name, "wb" if is_raw else "w")
 
 
 def subsample_bioseqfile(
-        seqfilein, seqfileout, filetype, prob, overwrite, seedvalue, verbose
+        seqfilein, seqfileout, filetype, prob, overwrite, seedvalue, verbose,
+        num_records=None, seek=False, num_threads=1
 ):
     """
     Subsample a *gzipped* biological sequence file using Bio.SeqIO
     See https://biopython.org/wiki/SeqIO for description of valid filetypes
 
+    See :py:func:`subsample_bioseqfiles`.
+
     :param seqfilein: File name of input sequence file
     :type seqfilein: str or unicode
     :param seqfileout: File name of input sequence file
@@ -28,33 +471,119 @@ def subsample_bioseqfile(
     :type seedvalue: int
     :param verbose: print progress statements (default False)
     :type verbose: bool
-    :return: Bio.SeqIO
-    :rtype:
+    :param num_records: Number of records to sample or ``None`` to \
+    sample with probability ``prob``
+    :type num_records: int
+    :param seek: Sample ``num_records`` records by seeking to random \
+    offsets? The input file must be uncompressed or BGZF-compressed \
+    and ``filetype`` one of :py:const:`RAW_FILETYPES`.
+    :type seek: bool
+    :param num_threads: Number of threads for reading and GZIP \
+    compression, or 0 to read and compress in the calling thread
+    :type num_threads: int
     :raise FileNotFoundError: If the file cannot be found or is \
     not a file
+    :raise ValueError: If ``seek`` is ``True`` and ``num_records`` \
+    is ``None``, ``filetype`` is not in :py:const:`RAW_FILETYPES` or \
+    the input file is compressed, but not BGZF-compressed
     """
+    subsample_bioseqfiles([seqfilein], [seqfileout], filetype, prob,
+                          overwrite, seedvalue, verbose, num_records,
+                          seek, num_threads)
 
-    ext = os.path.splitext(seqfilein)[1].lower()
 
-    # files exist, overwrite output?
-    if os.path.exists(seqfileout) and not overwrite:
-        raise ValueError(
-            "output file {} already exists, use '-overwrite' to replace"
-            .format(seqfileout))
-    if not os.path.exists(seqfilein):
-        raise ValueError(
-            "input file {} doesn't exist".format(seqfilein))
+def subsample_bioseqfiles(
+        seqfilesin, seqfilesout, filetype, prob, overwrite, seedvalue,
+        verbose, num_records=None, seek=False, num_threads=1
+):
+    """
+    Subsample one or more biological sequence files, for example
+    paired-end read 1 and read 2 FASTQ files, sampling the same
+    records from each file, so files stay in sync. Files must have
+    the same number of records.
 
-    is_gz = ext in [".gz", ".gzip"]
+    If ``num_records`` is ``None`` then each record is sampled with
+    probability ``prob``. Otherwise, ``num_records`` records are
+    sampled (or all records, if there are fewer) using
+    :py:func:`sample_reservoir`, or, if ``seek`` is ``True``,
+    :py:func:`sample_seek`, falling back to
+    :py:func:`sample_reservoir` if too few records are found by
+    seeking. ``seek`` is supported for single files only.
 
-    if is_gz:
-        open_file = gzip.open
-        open_r = "rt"
-        open_w = "wt"
-    else:
-        open_file = open
-        open_r = "r"
-        open_w = "w"
+    If ``filetype`` is one of :py:const:`RAW_FILETYPES` (``fastq`` or
+    ``fasta``) then records are read, using
+    :py:func:`read_raw_records`, and written as-is rather than parsed
+    and written using Bio.SeqIO. Each input file is then read, and
+    decompressed, by a background thread and GZIP-compressed output
+    files are compressed by ``num_threads`` threads, so reading,
+    sampling and compression overlap (see :py:func:`open_input` and
+    :py:func:`open_output`).
+
+    Sampling with probability ``prob``, or by
+    :py:func:`sample_reservoir`, depends only on the number of
+    records, and the seed, so sampling files separately, with the
+    same seed, samples the same records as sampling them together.
+    This is not the case for :py:func:`sample_seek`.
+
+    :param seqfilesin: File names of input sequence files
+    :type seqfilesin: list(str or unicode)
+    :param seqfilesout: File names of output sequence files
+    :type seqfilesout: list(str or unicode)
+    :param filetype: SeqIO file type (default 'fastq')
+    :type filetype: str or unicode
+    :param prob: probability / proportion to sample (default 0.01)
+    :type prob: float
+    :param overwrite: overwrite if output files exist? (default False)
+    :type overwrite: bool
+    :param seedvalue: set random seed value (default 1)
+    :type seedvalue: int
+    :param verbose: print progress statements (default False)
+    :type verbose: bool
+    :param num_records: Number of records to sample or ``None`` to \
+    sample with probability ``prob``
+    :type num_records: int
+    :param seek: Sample ``num_records`` records by seeking to random \
+    offsets? There must be one input file, which must be \
+    uncompressed or BGZF-compressed, and ``filetype`` must be one of \
+    :py:const:`RAW_FILETYPES`.
+    :type seek: bool
+    :param num_threads: Number of threads for reading and GZIP \
+    compression, or 0 to read and compress in the calling thread
+    :type num_threads: int
+    :raise FileNotFoundError: If a file cannot be found or is \
+    not a file
+    :raise ValueError: If the numbers of input and output files \
+    differ, if input files have different numbers of records or if \
+    ``seek`` is ``True`` and there is more than one input file, \
+    ``num_records`` is ``None``, ``filetype`` is not in \
+    :py:const:`RAW_FILETYPES` or the input file is compressed, but \
+    not BGZF-compressed
+    """
+    if not seqfilesin or len(seqfilesin) != len(seqfilesout):
+        raise ValueError(
+            "Numbers of input files ({}) and output files ({}) differ"
+            .format(len(seqfilesin), len(seqfilesout)))
+    # files exist, overwrite output?
+    for seqfileout in seqfilesout:
+        if os.path.exists(seqfileout) and not overwrite:
+            raise ValueError(
+                "output file {} already exists, use '-overwrite' to replace"
+                .format(seqfileout))
+    for seqfilein in seqfilesin:
+        if not os.path.exists(seqfilein):
+            raise ValueError(
+                "input file {} doesn't exist".format(seqfilein))
+    if seek:
+        if len(seqfilesin) > 1:
+            raise ValueError("Cannot seek in more than one file")
+        if num_records is None:
+            raise ValueError("Number of records must be given to seek")
+        if filetype not in RAW_FILETYPES:
+            raise ValueError("Cannot seek in {} files".format(filetype))
+        if is_gz(seqfilesin[0]) and not is_bgzf(seqfilesin[0]):
+            raise ValueError(
+                "Cannot seek in {} as it is not BGZF-compressed".format(
+                    seqfilesin[0]))
 
     row_count = 0
     row_count_out = 0
@@ -62,16 +591,68 @@ def subsample_bioseqfile(
     if seedvalue is not None:
         random.seed(seedvalue)
 
-    with open_file(seqfilein, open_r) as in_handle, \
-            open_file(seqfileout, open_w) as out_handle:
-        for record in SeqIO.parse(in_handle, filetype):
+    is_raw = filetype in RAW_FILETYPES
+
+    def read_records(in_handles):
+        nonlocal row_count
+        if is_raw:
+            records = [read_raw_records(in_handle, filetype)
+                       for in_handle in in_handles]
+        else:
+            records = [SeqIO.parse(in_handle, filetype)
+                       for in_handle in in_handles]
+        for record in itertools.zip_longest(*records):
+            if any(file_record is None for file_record in record):
+                raise ValueError(
+                    "Input files have different numbers of records")
             row_count += 1
-            if row_count % 100000 == 0:
+            if row_count % PROGRESS_INTERVAL == 0:
                 print(("read {rowcount}".format(rowcount=row_count)))
-            if random.random() < prob:
-                row_count_out += 1
-                if verbose:
-                    print((record.id))
-                SeqIO.write(record, out_handle, filetype)
+            yield record
+
+    def write_records(records, out_handles):
+        nonlocal row_count_out
+        buffers = [[] for _ in out_handles]
+        for record in records:
+            row_count_out += 1
+            if verbose:
+                print(get_raw_record_id(record[0]) if is_raw
+                      else record[0].id)
+            for file_record, buffer, out_handle in zip(
+                    record, buffers, out_handles):
+                if is_raw:
+                    buffer.append(file_record)
+                    if len(buffer) >= WRITE_BATCH_SIZE:
+                        out_handle.writelines(buffer)
+                        buffer.clear()
+                else:
+                    SeqIO.write(file_record, out_handle, filetype)
+        for buffer, out_handle in zip(buffers, out_handles):
+            out_handle.writelines(buffer)
+
+    records = None
+    if seek:
+        records = sample_seek(seqfilesin[0], filetype, num_records)
+        if records is not None:
+            row_count = len(records)
+            records = [(record,) for record in records]
+    with contextlib.ExitStack() as stack:
+        if records is None:
+            in_handles = [
+                stack.enter_context(
+                    open_input(seqfilein, is_raw, num_threads))
+                for seqfilein in seqfilesin]
+            if num_records is not None:
+                records = sample_reservoir(read_records(in_handles),
+                                           num_records)
+            else:
+                records = (record for record in read_records(in_handles)
+                           if random.random() < prob)
+        out_handles = [
+            stack.enter_context(
+                open_output(seqfileout, is_raw, num_threads))
+            for seqfileout in seqfilesout]
+        write_records(records, out_handles)
     print(("subsampling complete; read {} records from {}, wrote {} records \
-to {}".format(row_count, seqfilein, row_count_out, seqfileout)))
+to {}".format(row_count, ", ".join(seqfilesin), row_count_out,
+              ", ".join(seqfilesout))))
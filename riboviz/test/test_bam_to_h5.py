@@ -0,0 +1,452 @@
+"""
+:py:mod:`riboviz.bam_to_h5` tests.
+
+These tests mirror those of ``rscripts/tests/testthat/test_bam_to_h5.R``
+and use the same test data.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import h5py
+import numpy as np
+import pysam
+import pytest
+from riboviz import bam_to_h5
+from riboviz import h5
+from riboviz import sam_bam
+from riboviz.test import DATA_DIR
+
+TINYSIM_DIR = os.path.join(DATA_DIR, "Mok-tinysim-gffsam")
+""" Test data directory. """
+TINYSIM_SAM = os.path.join(TINYSIM_DIR, "A.sam")
+""" Test SAM file. """
+TINYSIM_GFF = os.path.join(TINYSIM_DIR, "tiny_2genes_20utrs.gff3")
+""" Test GFF file, with genes ``MAT`` and ``MIKE``. """
+TINYSIM_GENES = {"MAT": (21, 32), "MIKE": (21, 35)}
+""" Test GFF file CDS start and end positions. """
+TINYSIM_UTR_LENGTH = 20
+""" Test GFF file UTR5 and UTR3 lengths. """
+DATASET = "Mok-tinysim"
+""" Dataset name. """
+
+
+@pytest.fixture(scope="function")
+def tmp_dir():
+    """
+    Create a temporary directory.
+
+    :return: path to temporary directory
+    :rtype: str or unicode
+    """
+    tmp_dir = tempfile.mkdtemp(__name__)
+    yield tmp_dir
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+
+@pytest.fixture(scope="function")
+def bam_file(tmp_dir):
+    """
+    Create an indexed BAM file from :py:const:`TINYSIM_SAM`.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :return: BAM file
+    :rtype: str or unicode
+    """
+    bam_file = os.path.join(tmp_dir, "A.bam")
+    pysam.view("-b", "-o", bam_file, TINYSIM_SAM, catch_stdout=False)
+    pysam.index(bam_file)
+    yield bam_file
+
+
+def write_gff(gff_file, feature="CDS", strand="+", secondary=False):
+    """
+    Write a copy of :py:const:`TINYSIM_GFF` with a different feature
+    type, strand and, optionally, an ``ID`` attribute.
+
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    :param feature: Feature type to replace ``CDS``
+    :type feature: str or unicode
+    :param strand: Strand
+    :type strand: str or unicode
+    :param secondary: Add ``ID`` attribute with value ``X<Name>``?
+    :type secondary: bool
+    """
+    with open(TINYSIM_GFF, "r") as f_in, open(gff_file, "w") as f_out:
+        for line in f_in:
+            if not line.startswith("#"):
+                fields = line.rstrip("\n").split("\t")
+                if fields[2] == "CDS":
+                    fields[2] = feature
+                fields[6] = strand
+                if secondary:
+                    fields[8] += ";ID=X" + fields[8].split("=")[1]
+                line = "\t".join(fields) + "\n"
+            f_out.write(line)
+
+
+def get_expected_counts(bam_file, seqname, first_pos, last_pos,
+                        min_read_length, max_read_length,
+                        is_reverse=False):
+    """
+    Count reads, one at a time, in a BAM file mapped to a sequence, by
+    their 5' end positions and lengths.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param seqname: Sequence name
+    :type seqname: str or unicode
+    :param first_pos: First position (may be <= 0)
+    :type first_pos: int
+    :param last_pos: Last position
+    :type last_pos: int
+    :param min_read_length: Minimum read length
+    :type min_read_length: int
+    :param max_read_length: Maximum read length
+    :type max_read_length: int
+    :param is_reverse: Count ``-`` strand reads and reverse positions?
+    :type is_reverse: bool
+    :return: Read counts, a matrix of positions by read lengths
+    :rtype: numpy.ndarray
+    """
+    counts = np.zeros((last_pos - first_pos + 1,
+                       max_read_length - min_read_length + 1),
+                      dtype=np.int32)
+    with pysam.AlignmentFile(bam_file) as bam:
+        for read in bam.fetch(seqname):
+            length = read.infer_query_length()
+            if read.is_reverse != is_reverse or \
+               not min_read_length <= length <= max_read_length:
+                continue
+            if is_reverse:
+                row = last_pos - (read.reference_start + length)
+            else:
+                row = read.reference_start + 1 - first_pos
+            counts[row, length - min_read_length] += 1
+    return counts
+
+
+def validate_h5(h5_file, bam_file, seqname, first_pos, last_pos,
+                start_codon, stop_codon, min_read_length=10,
+                max_read_length=50, is_reverse=False):
+    """
+    Validate the H5 group for a gene.
+
+    :param h5_file: H5 file
+    :type h5_file: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param seqname: Gene, and sequence, name
+    :type seqname: str or unicode
+    :param first_pos: First position (may be <= 0)
+    :type first_pos: int
+    :param last_pos: Last position
+    :type last_pos: int
+    :param start_codon: Position of first nucleotide of start codon
+    :type start_codon: int
+    :param stop_codon: Position of first nucleotide of stop codon
+    :type stop_codon: int
+    :param min_read_length: Minimum read length
+    :type min_read_length: int
+    :param max_read_length: Maximum read length
+    :type max_read_length: int
+    :param is_reverse: Is gene on ``-`` strand?
+    :type is_reverse: bool
+    """
+    expected = get_expected_counts(bam_file, seqname, first_pos,
+                                   last_pos, min_read_length,
+                                   max_read_length, is_reverse)
+    num_positions = last_pos - first_pos + 1
+    with h5py.File(h5_file, "r") as f:
+        reads = f["/".join([seqname, DATASET, h5.READS])]
+        data = reads[h5.DATA]
+        assert data.dtype == np.int32
+        assert data.chunks == (num_positions, 1)
+        np.testing.assert_array_equal(data[()], expected)
+        for name in reads.attrs:
+            assert reads.attrs[name].dtype == np.int32
+        attrs = {name: list(value) for name, value in reads.attrs.items()}
+    assert attrs[h5.READS_TOTAL] == [expected.sum()]
+    assert attrs[h5.READS_BY_LEN] == list(expected.sum(axis=0))
+    assert attrs[h5.LENGTHS] == list(range(min_read_length,
+                                           max_read_length + 1))
+    assert attrs[h5.START_CODON_POS] == list(
+        range(start_codon, start_codon + 3))
+    assert attrs[h5.STOP_CODON_POS] == list(
+        range(stop_codon, stop_codon + 3))
+    assert attrs[h5.BUFFER_LEFT] == [start_codon - 1]
+    assert attrs[h5.BUFFER_RIGHT] == [num_positions -
+                                      (stop_codon + 2)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, bam_to_h5.CHUNK_SIZE])
+def test_bam_to_h5(tmp_dir, bam_file, chunk_size):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with a RiboViz-style
+    GFF file, using different chunk sizes.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param chunk_size: Maximum number of reads counted at a time
+    :type chunk_size: int
+    """
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    bam_to_h5.bam_to_h5(bam_file, TINYSIM_GFF, h5_file,
+                        primary_id="Name", dataset=DATASET,
+                        chunk_size=chunk_size)
+    with h5py.File(h5_file, "r") as f:
+        assert list(f) == list(TINYSIM_GENES)
+    for gene, (start, end) in TINYSIM_GENES.items():
+        validate_h5(h5_file, bam_file, gene, 1,
+                    end + TINYSIM_UTR_LENGTH, start, end - 2)
+
+
+@pytest.mark.parametrize("buffer", [20, 25])
+@pytest.mark.parametrize("stop_in_feature", [False, True])
+def test_bam_to_h5_not_riboviz_gff(tmp_dir, bam_file, buffer,
+                                   stop_in_feature):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with
+    ``is_riboviz_gff=False``. A ``buffer`` greater than the UTR5
+    length results in pseudo positions (``<= 0``). As for
+    ``bam_to_h5.R``, codon positions are those in the GFF file.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param buffer: Length of flanking region around the feature
+    :type buffer: int
+    :param stop_in_feature: Are stop codons part of the feature \
+    annotations?
+    :type stop_in_feature: bool
+    """
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    bam_to_h5.bam_to_h5(bam_file, TINYSIM_GFF, h5_file, buffer=buffer,
+                        primary_id="Name", dataset=DATASET,
+                        is_riboviz_gff=False,
+                        stop_in_feature=stop_in_feature)
+    for gene, (start, end) in TINYSIM_GENES.items():
+        stop_codon = end - 2 if stop_in_feature else end + 1
+        validate_h5(h5_file, bam_file, gene, start - buffer,
+                    end + buffer, start, stop_codon)
+
+
+def test_bam_to_h5_feature(tmp_dir, bam_file):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with
+    ``feature=ORF``.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    """
+    gff_file = os.path.join(tmp_dir, "A.gff3")
+    write_gff(gff_file, feature="ORF")
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    bam_to_h5.bam_to_h5(bam_file, gff_file, h5_file, feature="ORF",
+                        primary_id="Name", dataset=DATASET)
+    for gene, (start, end) in TINYSIM_GENES.items():
+        validate_h5(h5_file, bam_file, gene, 1,
+                    end + TINYSIM_UTR_LENGTH, start, end - 2)
+
+
+def test_bam_to_h5_gtf(tmp_dir, bam_file):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with a GTF file.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    """
+    gtf_file = os.path.join(tmp_dir, "A.gtf")
+    with open(TINYSIM_GFF, "r") as f_in, open(gtf_file, "w") as f_out:
+        for line in f_in:
+            if not line.startswith("#"):
+                fields = line.rstrip("\n").split("\t")
+                fields[8] = 'gene_id "{}";'.format(
+                    fields[8].split("=")[1])
+                f_out.write("\t".join(fields) + "\n")
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    bam_to_h5.bam_to_h5(bam_file, gtf_file, h5_file, dataset=DATASET)
+    for gene, (start, end) in TINYSIM_GENES.items():
+        validate_h5(h5_file, bam_file, gene, 1,
+                    end + TINYSIM_UTR_LENGTH, start, end - 2)
+
+
+def test_bam_to_h5_secondary_id(tmp_dir, bam_file):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with a
+    ``secondary_id`` creates external links to each gene.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    """
+    gff_file = os.path.join(tmp_dir, "A.gff3")
+    write_gff(gff_file, secondary=True)
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    bam_to_h5.bam_to_h5(bam_file, gff_file, h5_file, primary_id="Name",
+                        secondary_id="ID", dataset=DATASET)
+    with h5py.File(h5_file, "r") as f:
+        for gene in TINYSIM_GENES:
+            link = f.get("X" + gene, getlink=True)
+            assert isinstance(link, h5py.ExternalLink)
+            assert link.path == gene
+            path = "/".join([DATASET, h5.READS, h5.DATA])
+            np.testing.assert_array_equal(f["X" + gene][path][()],
+                                          f[gene][path][()])
+
+
+def test_bam_to_h5_csr(tmp_dir, bam_file):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with a
+    :py:const:`riboviz.h5.CSR` layout produces the same read counts
+    and attributes as the :py:const:`riboviz.h5.LEGACY` layout.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    """
+    gff_file = os.path.join(tmp_dir, "A.gff3")
+    write_gff(gff_file, secondary=True)
+    legacy_file = os.path.join(tmp_dir, "legacy.h5")
+    csr_file = os.path.join(tmp_dir, "csr.h5")
+    for h5_file, layout in [(legacy_file, h5.LEGACY),
+                            (csr_file, h5.CSR)]:
+        bam_to_h5.bam_to_h5(bam_file, gff_file, h5_file,
+                            primary_id="Name", secondary_id="ID",
+                            dataset=DATASET, layout=layout)
+    with h5.H5Reader(legacy_file) as legacy, \
+            h5.H5Reader(csr_file) as csr:
+        assert csr.layout == h5.CSR
+        assert csr.genes == legacy.genes
+        assert csr.alt_genes == legacy.alt_genes
+        for gene in legacy.genes + legacy.alt_genes:
+            np.testing.assert_array_equal(csr.get_counts(gene),
+                                          legacy.get_counts(gene))
+            expected = legacy.get_attributes(gene)
+            for key, value in csr.get_attributes(gene).items():
+                np.testing.assert_array_equal(value, expected[key])
+
+
+def test_bam_to_h5_reverse(tmp_dir):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with ``-`` strand
+    genes and reads, including soft-clipped reads, reads on the other
+    strand and reads outside the read length range.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    gff_file = os.path.join(tmp_dir, "A.gff3")
+    write_gff(gff_file, strand="-")
+    bam_file = os.path.join(tmp_dir, "A.bam")
+    header = {"SQ": [{"SN": gene, "LN": end + TINYSIM_UTR_LENGTH}
+                     for gene, (_, end) in TINYSIM_GENES.items()]}
+    reads = [("MAT", 16, 0, "30M"), ("MAT", 16, 3, "2S25M"),
+             ("MAT", 16, 3, "25M2S"), ("MAT", 0, 3, "25M"),
+             ("MAT", 16, 10, "9M"), ("MAT", 16, 40, "12M"),
+             ("MIKE", 16, 4, "10M1D10M"), ("MIKE", 16, 20, "28M"),
+             ("MIKE", 16, 20, "28M")]
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as bam:
+        for seqname, flag, start, cigar in reads:
+            read = pysam.AlignedSegment(bam.header)
+            read.query_name = "read"
+            read.flag = flag
+            read.reference_id = bam.get_tid(seqname)
+            read.reference_start = start
+            read.cigarstring = cigar
+            read.query_sequence = "A" * read.query_length
+            bam.write(read)
+    pysam.index(bam_file)
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    bam_to_h5.bam_to_h5(bam_file, gff_file, h5_file, primary_id="Name",
+                        dataset=DATASET)
+    for gene, (start, end) in TINYSIM_GENES.items():
+        validate_h5(h5_file, bam_file, gene, 1,
+                    end + TINYSIM_UTR_LENGTH, start, end - 2,
+                    is_reverse=True)
+    with h5py.File(h5_file, "r") as f:
+        assert f["MAT"][DATASET][h5.READS].attrs[
+            h5.READS_TOTAL][0] == 4
+        assert f["MIKE"][DATASET][h5.READS].attrs[
+            h5.READS_TOTAL][0] == 3
+
+
+def test_bam_to_h5_unknown_feature(tmp_dir, bam_file):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with a feature not
+    in the GFF file raises ``ValueError``.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    """
+    with pytest.raises(ValueError):
+        bam_to_h5.bam_to_h5(bam_file, TINYSIM_GFF,
+                            os.path.join(tmp_dir, "A.h5"),
+                            feature="Unknown", primary_id="Name")
+
+
+@pytest.mark.parametrize("primary_id,secondary_id",
+                         [("Unknown", None), ("Name", "Unknown")])
+def test_bam_to_h5_unknown_id(tmp_dir, bam_file, primary_id,
+                              secondary_id):
+    """
+    Test :py:func:`riboviz.bam_to_h5.bam_to_h5` with an unknown
+    ``primary_id`` or ``secondary_id`` raises ``ValueError``.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param primary_id: Primary gene IDs attribute
+    :type primary_id: str or unicode
+    :param secondary_id: Secondary gene IDs attribute
+    :type secondary_id: str or unicode
+    """
+    with pytest.raises(ValueError):
+        bam_to_h5.bam_to_h5(bam_file, TINYSIM_GFF,
+                            os.path.join(tmp_dir, "A.h5"),
+                            primary_id=primary_id,
+                            secondary_id=secondary_id)
+
+
+def test_bam_to_h5_tool(tmp_dir, bam_file):
+    """
+    Test :py:mod:`riboviz.tools.bam_to_h5` accepts the same options
+    as ``rscripts/bam_to_h5.R``.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    """
+    h5_file = os.path.join(tmp_dir, "A.h5")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(sam_bam.__file__))))
+    subprocess.run([sys.executable, "-m", "riboviz.tools.bam_to_h5",
+                    "--num-processes=1", "--min-read-length=10",
+                    "--max-read-length=50", "--buffer=20",
+                    "--primary-id=Name", "--dataset=" + DATASET,
+                    "--bam-file=" + bam_file, "--hd-file=" + h5_file,
+                    "--orf-gff-file=" + TINYSIM_GFF,
+                    "--is-riboviz-gff=TRUE", "--stop-in-feature=FALSE",
+                    "--feature=CDS"],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+    for gene, (start, end) in TINYSIM_GENES.items():
+        validate_h5(h5_file, bam_file, gene, 1,
+                    end + TINYSIM_UTR_LENGTH, start, end - 2)
@@ -2,7 +2,11 @@
 :py:mod:`riboviz.barcodes_umis` tests.
 """
 import csv
+import gzip
+import itertools
+import math
 import os
+import random
 import tempfile
 import pytest
 from riboviz import barcodes_umis
@@ -197,3 +201,365 @@ def test_create_barcode_pairs_1(tmp_file, delimiter):
             assert int(row[2]) == 1,\
                 "Hamming distance of {} and {} is not 1".format(row[0],
                                                                 row[1])
+
+
+def test_get_barcode():
+    """
+    Test :py:func:`riboviz.barcodes_umis.get_barcode`.
+    """
+    record = "@X1:Tag_AAA_ 1:N:0:XXXXXXXX"
+    assert barcodes_umis.get_barcode(record) == "AAA"
+
+
+def test_get_barcode_delimiter():
+    """
+    Test :py:func:`riboviz.barcodes_umis.get_barcode` with a
+    non-default delimiter.
+    """
+    record = "@X1:Tag.AAA. 1:N:0:XXXXXXXX"
+    assert barcodes_umis.get_barcode(record, ".") == "AAA"
+
+
+def test_get_barcode_no_barcode():
+    """
+    Test :py:func:`riboviz.barcodes_umis.get_barcode` with a
+    record with no barcode.
+    """
+    record = "@X1:Tag 1:N:0:XXXXXXXX"
+    assert barcodes_umis.get_barcode(record) is None
+
+
+@pytest.mark.parametrize("mismatches,num_variants",
+                         [(0, 1), (1, 1 + 3 * 4), (2, 1 + 3 * 4 + 3 * 16),
+                          (3, 5 ** 3), (4, 5 ** 3)])
+def test_get_barcode_variants(mismatches, num_variants):
+    """
+    Test :py:func:`riboviz.barcodes_umis.get_barcode_variants`
+    returns the expected number of distinct variants each with the
+    correct Hamming distance.
+
+    :param mismatches: Number of mismatches
+    :type mismatches: int
+    :param num_variants: Expected number of variants
+    :type num_variants: int
+    """
+    variants = dict(barcodes_umis.get_barcode_variants("ACG",
+                                                       mismatches))
+    assert len(variants) == num_variants
+    for variant, distance in variants.items():
+        assert barcodes_umis.hamming_distance("ACG", variant) == distance
+        assert distance <= mismatches
+
+
+def test_create_barcode_index():
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_index`
+    maps variants to the closest barcode.
+    """
+    barcodes = ["GGG", "AAA", "TTT", "CCC"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 2)
+    assert barcode_index["AAA"] == (1, 0, False)
+    assert barcode_index["AGA"] == (1, 1, False)
+    assert barcode_index["AGG"] == (0, 1, False)
+    assert barcode_index["NNA"] == (1, 2, False)
+    assert "AAAA" not in barcode_index
+
+
+def test_create_barcode_index_ambiguous():
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_index`
+    maps variants equally close to two or more barcodes to the first
+    barcode and flags these as ambiguous.
+    """
+    barcodes = ["TTT", "AAA", "CCC", "GGG"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 2)
+    assert barcode_index["ACT"] == (0, 2, True)
+
+
+def test_match_barcode():
+    """
+    Test :py:func:`riboviz.barcodes_umis.match_barcode`.
+    """
+    barcodes = ["AAA", "CCC"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+    assert barcodes_umis.match_barcode(
+        "ACA", barcodes, barcode_index, 1) == (0, 1, False)
+    assert barcodes_umis.match_barcode(
+        "ACC", barcodes, barcode_index, 1) == (1, 1, False)
+    assert barcodes_umis.match_barcode(
+        "ACG", barcodes, barcode_index, 1) is None
+    assert barcodes_umis.match_barcode(
+        "AAAA", barcodes, barcode_index, 1) is None
+    assert barcodes_umis.match_barcode(
+        None, barcodes, barcode_index, 1) is None
+
+
+def test_match_barcode_letter_not_in_alphabet():
+    """
+    Test :py:func:`riboviz.barcodes_umis.match_barcode` with a
+    barcode that has a letter not used to create the barcode index,
+    and that the barcode is not added to the barcode index.
+    """
+    barcodes = ["AAA", "CCC"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+    num_variants = len(barcode_index)
+    assert barcodes_umis.match_barcode(
+        "AXA", barcodes, barcode_index, 1) == (0, 1, False)
+    assert barcodes_umis.match_barcode(
+        "XXA", barcodes, barcode_index, 1) is None
+    assert len(barcode_index) == num_variants
+
+
+@pytest.mark.parametrize("letters", [barcodes_umis.NUCLEOTIDES,
+                                     barcodes_umis.NUCLEOTIDES + "N"])
+@pytest.mark.parametrize("length", [0, 5, 40])
+@pytest.mark.parametrize("num_candidates", [
+    1, barcodes_umis.MIN_PACKED_PAIRS // 8])
+@pytest.mark.parametrize("tile_size", [1, 7, barcodes_umis.TILE_SIZE])
+def test_hamming_distances(letters, length, num_candidates, tile_size):
+    """
+    Test :py:func:`riboviz.barcodes_umis.hamming_distances` gives the
+    expected distances for sequences which can, and cannot, be 2-bit
+    packed, and for too few pairs to be packed.
+
+    :param letters: Letters
+    :type letters: str or unicode
+    :param length: Sequence length
+    :type length: int
+    :param num_candidates: Number of candidate sequences
+    :type num_candidates: int
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    """
+    rng = random.Random(length)
+    candidates = ["".join(rng.choice(letters) for _ in range(length))
+                  for _ in range(num_candidates)]
+    references = candidates[:4] + [
+        "".join(rng.choice(letters) for _ in range(length))
+        for _ in range(4)]
+    distances = barcodes_umis.hamming_distances(candidates, references,
+                                                tile_size)
+    assert distances.tolist() == [
+        [sum(1 for (a, b) in zip(candidate, reference) if a != b)
+         for reference in references] for candidate in candidates]
+
+
+def test_hamming_distances_empty():
+    """
+    Test :py:func:`riboviz.barcodes_umis.hamming_distances` with no
+    candidates or references.
+    """
+    assert barcodes_umis.hamming_distances([], ["ACG"]).shape == (0, 1)
+    assert barcodes_umis.hamming_distances(["ACG"], []).shape == (1, 0)
+
+
+@pytest.mark.parametrize("candidates,references", [
+    (["ACG", "AC"], ["ACG"]),
+    (["ACG"], ["ACG", "ACGT"]),
+    (["ACG"], ["ACGT"])])
+def test_hamming_distances_different_lengths(candidates, references):
+    """
+    Test :py:func:`riboviz.barcodes_umis.hamming_distances` with
+    sequences of different lengths raises ``ValueError``.
+
+    :param candidates: Candidate sequences
+    :type candidates: list(str or unicode)
+    :param references: Reference sequences
+    :type references: list(str or unicode)
+    """
+    with pytest.raises(ValueError):
+        barcodes_umis.hamming_distances(candidates, references)
+
+
+def test_match_barcodes():
+    """
+    Test :py:func:`riboviz.barcodes_umis.match_barcodes` gives the
+    same matches as :py:func:`riboviz.barcodes_umis.match_barcode`,
+    including for candidates with no barcode, of other lengths, or
+    equally close to two barcodes.
+    """
+    barcodes = ["TTT", "AAA", "CCC", "GGG", "AAAA"]
+    candidates = ["ACA", "ACT", "NNA", "AXA", "ACG", "AAAT", "AA", None]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 2)
+    expected = [barcodes_umis.match_barcode(candidate, barcodes,
+                                            barcode_index, 2)
+                for candidate in candidates]
+    assert expected == [(1, 1, False), (0, 2, True), (1, 2, False),
+                        (1, 1, False), (1, 2, True), (4, 1, False),
+                        None, None]
+    assert barcodes_umis.match_barcodes(candidates, barcodes, 2) == \
+        expected
+    assert barcodes_umis.match_barcodes(candidates, barcodes, 0) == \
+        [None] * len(candidates)
+
+
+def test_match_barcodes_by_index():
+    """
+    Test :py:func:`riboviz.barcodes_umis.match_barcodes_by_index`
+    matches candidates with letters not used to create the barcode
+    index without adding them to the index.
+    """
+    barcodes = ["AAA", "CCC"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+    num_variants = len(barcode_index)
+    assert barcodes_umis.match_barcodes_by_index(
+        ["ACA", "AXA", "XXA", "ACG", None, "AXA"],
+        barcodes,
+        barcode_index,
+        1) == [(0, 1, False), (0, 1, False), None, None, None,
+               (0, 1, False)]
+    assert len(barcode_index) == num_variants
+
+
+@pytest.mark.parametrize("length", [1, 2, 3])
+@pytest.mark.parametrize("tile_size", [1, 7, barcodes_umis.TILE_SIZE])
+def test_create_barcode_pairs_order(tmp_file, length, tile_size):
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_pairs` writes
+    every pair of barcodes, and their Hamming distance, in the order
+    given by ``itertools.product``.
+
+    :param tmp_file: Temporary file
+    :type tmp_file: str or unicode
+    :param length: Barcode length
+    :type length: int
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    """
+    barcodes_umis.create_barcode_pairs(tmp_file, length,
+                                       tile_size=tile_size)
+    with open(tmp_file) as csv_file:
+        rows = list(csv.reader(csv_file, delimiter="\t"))
+    barcodes = ["".join(barcode) for barcode in itertools.product(
+        barcodes_umis.NUCLEOTIDES, repeat=length)]
+    assert rows == [[a, b, str(barcodes_umis.hamming_distance(a, b))]
+                    for a, b in itertools.product(barcodes, repeat=2)]
+
+
+@pytest.mark.parametrize("unordered", [False, True])
+@pytest.mark.parametrize("max_distance", [None, 0, 2])
+@pytest.mark.parametrize("tile_size", [1, 5, barcodes_umis.TILE_SIZE])
+def test_create_barcode_pairs_barcodes(tmp_file, unordered, max_distance,
+                                       tile_size):
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_pairs` with
+    barcodes, unordered pairs and a maximum Hamming distance.
+
+    :param tmp_file: Temporary file
+    :type tmp_file: str or unicode
+    :param unordered: Output each unordered pair once only?
+    :type unordered: bool
+    :param max_distance: Maximum Hamming distance or ``None``
+    :type max_distance: int
+    :param tile_size: Maximum number of distances computed at a time
+    :type tile_size: int
+    """
+    barcodes = ["ACGTA", "ACGTT", "TTTTT", "ACCTT", "GGGGG", "ACGTA"]
+    barcodes_umis.create_barcode_pairs(tmp_file,
+                                       barcodes=barcodes,
+                                       unordered=unordered,
+                                       max_distance=max_distance,
+                                       tile_size=tile_size)
+    with open(tmp_file) as csv_file:
+        rows = list(csv.reader(csv_file, delimiter="\t"))
+    expected = []
+    for i, a in enumerate(barcodes):
+        for j, b in enumerate(barcodes):
+            distance = barcodes_umis.hamming_distance(a, b)
+            if (unordered and j <= i) or \
+               (max_distance is not None and distance > max_distance):
+                continue
+            expected.append([a, b, str(distance)])
+    assert rows == expected
+
+
+@pytest.mark.parametrize("file_name", ["pairs.bin", "pairs.bin.gz"])
+def test_create_barcode_pairs_binary(tmpdir, file_name):
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_pairs` with
+    :py:const:`riboviz.barcodes_umis.BINARY_FORMAT` and
+    :py:func:`riboviz.barcodes_umis.read_barcode_pairs`.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param file_name: File name
+    :type file_name: str or unicode
+    """
+    file_name = str(tmpdir.join(file_name))
+    barcodes_umis.create_barcode_pairs(
+        file_name, 2, output_format=barcodes_umis.BINARY_FORMAT,
+        unordered=True, tile_size=3)
+    barcodes = ["".join(barcode) for barcode in itertools.product(
+        barcodes_umis.NUCLEOTIDES, repeat=2)]
+    assert list(barcodes_umis.read_barcode_pairs(file_name, 2)) == \
+        [(a, b, barcodes_umis.hamming_distance(a, b))
+         for a, b in itertools.combinations(barcodes, 2)]
+
+
+@pytest.mark.parametrize("unordered", [False, True])
+def test_create_barcode_pairs_histogram(tmpdir, unordered):
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_pairs` with
+    :py:const:`riboviz.barcodes_umis.HISTOGRAM_FORMAT` and a
+    GZIP-compressed file.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param unordered: Count each unordered pair once only?
+    :type unordered: bool
+    """
+    file_name = str(tmpdir.join("histogram.tsv.gz"))
+    length = 4
+    barcodes_umis.create_barcode_pairs(
+        file_name, length, output_format=barcodes_umis.HISTOGRAM_FORMAT,
+        unordered=unordered, tile_size=100)
+    with gzip.open(file_name, "rt") as csv_file:
+        rows = list(csv.reader(csv_file, delimiter="\t"))
+    assert rows[0] == [barcodes_umis.DISTANCE, barcodes_umis.COUNT]
+    # Number of ordered pairs with distance d is 4^k * C(k, d) * 3^d.
+    expected = [4 ** length * math.comb(length, distance) * 3 ** distance
+                for distance in range(length + 1)]
+    if unordered:
+        expected[0] = 0
+        expected = [count // 2 for count in expected]
+    assert rows[1:] == [[str(distance), str(count)]
+                        for distance, count in enumerate(expected)]
+
+
+@pytest.mark.parametrize("barcodes", [["ACG", "AC"], ["ACN"],
+                                      ["A" * 33]])
+def test_create_barcode_pairs_invalid_barcodes(tmp_file, barcodes):
+    """
+    Test :py:func:`riboviz.barcodes_umis.create_barcode_pairs` with
+    barcodes of different lengths, with letters other than
+    :py:const:`riboviz.barcodes_umis.NUCLEOTIDES` or which are too
+    long raises ``ValueError``.
+
+    :param tmp_file: Temporary file
+    :type tmp_file: str or unicode
+    :param barcodes: Barcodes
+    :type barcodes: list(str or unicode)
+    """
+    with pytest.raises(ValueError):
+        barcodes_umis.create_barcode_pairs(tmp_file, barcodes=barcodes)
+
+
+@pytest.mark.parametrize("length", [1, 8, 16, 17, 32])
+def test_packed_hamming_distances(length):
+    """
+    Test :py:func:`riboviz.barcodes_umis.packed_hamming_distances`
+    and :py:func:`riboviz.barcodes_umis.decode_barcodes` with barcodes
+    encoded by :py:func:`riboviz.barcodes_umis.encode_barcodes`.
+
+    :param length: Barcode length
+    :type length: int
+    """
+    rng = random.Random(length)
+    barcodes = ["".join(rng.choice(barcodes_umis.NUCLEOTIDES)
+                        for _ in range(length)) for _ in range(20)]
+    codes = barcodes_umis.encode_barcodes(barcodes)
+    assert barcodes_umis.decode_barcodes(codes, length) == barcodes
+    distances = barcodes_umis.packed_hamming_distances(codes, codes[:7])
+    assert distances.tolist() == [
+        [barcodes_umis.hamming_distance(a, b) for b in barcodes[:7]]
+        for a in barcodes]
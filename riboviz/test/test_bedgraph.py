@@ -0,0 +1,203 @@
+"""
+:py:mod:`riboviz.bedgraph` tests.
+"""
+import os
+import numpy as np
+import pysam
+import pytest
+from riboviz import bedgraph
+from riboviz import sam_bam
+
+TEST_HEADER = {"HD": {"VN": "1.0"},
+               "SQ": [{"SN": "A", "LN": 20},
+                      {"SN": "B", "LN": 10},
+                      {"SN": "C", "LN": 5}]}
+""" Test BAM header. """
+TEST_READS = [
+    ("r1", 0, 2, False, [(pysam.CMATCH, 5)]),
+    ("r2", 0, 2, False, [(pysam.CMATCH, 5)]),
+    ("r3", 0, 7, False, [(pysam.CSOFT_CLIP, 2), (pysam.CMATCH, 3)]),
+    ("r4", 0, 3, True, [(pysam.CMATCH, 4)]),
+    ("r5", 0, 10, True, [(pysam.CMATCH, 3), (pysam.CDEL, 2),
+                         (pysam.CMATCH, 2)]),
+    ("r6", 1, 0, True, [(pysam.CMATCH, 4), (pysam.CSOFT_CLIP, 1)])
+]
+"""
+Test reads: name, reference ID, start, is reverse and CIGAR. 5' ends
+are at ``A`` 2, 2 and 7 on the ``+`` strand and ``A`` 6 and 16 and
+``B`` 3 on the ``-`` strand.
+"""
+EXPECTED_PLUS = [("A", 0, 2, 0), ("A", 2, 3, 2), ("A", 3, 7, 0),
+                 ("A", 7, 8, 1), ("A", 8, 20, 0),
+                 ("B", 0, 10, 0), ("C", 0, 5, 0)]
+""" Expected ``+`` strand bedGraph rows for :py:const:`TEST_READS`. """
+EXPECTED_MINUS = [("A", 0, 6, 0), ("A", 6, 7, 1), ("A", 7, 16, 0),
+                  ("A", 16, 17, 1), ("A", 17, 20, 0),
+                  ("B", 0, 3, 0), ("B", 3, 4, 1), ("B", 4, 10, 0),
+                  ("C", 0, 5, 0)]
+""" Expected ``-`` strand bedGraph rows for :py:const:`TEST_READS`. """
+
+
+def write_bam(bam_file, reads, is_sorted=True):
+    """
+    Write reads, from tuples as for :py:const:`TEST_READS`, to a BAM
+    file with :py:const:`TEST_HEADER`, with an unmapped read. If
+    ``is_sorted`` then the file is sorted and indexed, otherwise the
+    reads are written in order.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param reads: Reads
+    :type reads: list(tuple)
+    :param is_sorted: Sort and index the file?
+    :type is_sorted: bool
+    """
+    header = pysam.AlignmentHeader.from_dict(TEST_HEADER)
+    bam_reads = []
+    for name, reference_id, start, is_reverse, cigartuples in reads:
+        read = pysam.AlignedSegment(header)
+        read.query_name = name
+        read.reference_id = reference_id
+        read.reference_start = start
+        read.cigartuples = cigartuples
+        read.query_sequence = "A" * read.infer_query_length()
+        read.is_reverse = is_reverse
+        bam_reads.append(read)
+    unmapped = pysam.AlignedSegment(header)
+    unmapped.query_name = "unmapped"
+    unmapped.query_sequence = "A" * 5
+    unmapped.is_unmapped = True
+    bam_reads.append(unmapped)
+    if is_sorted:
+        sam_bam.write_sorted_bam(bam_reads, bam_file, header)
+    else:
+        with pysam.AlignmentFile(bam_file, "wb", header=header) as bam:
+            for read in bam_reads:
+                bam.write(read)
+
+
+def check_bedgraph(bedgraph_file, rows):
+    """
+    Check a bedGraph file has a track line and the given rows.
+
+    :param bedgraph_file: bedGraph file
+    :type bedgraph_file: str or unicode
+    :param rows: Expected rows
+    :type rows: list(tuple(str or unicode, int, int, int))
+    """
+    with open(bedgraph_file) as f:
+        lines = f.readlines()
+    assert lines == [bedgraph.TRACK_PREFIX + "\n"] + \
+        ["\t".join(map(str, row)) + "\n" for row in rows]
+
+
+@pytest.mark.parametrize("counts,expected",
+                         [([], ""),
+                          ([0, 0, 0], "A\t0\t3\t0\n"),
+                          ([1, 1, 0, 2],
+                           "A\t0\t2\t1\nA\t2\t3\t0\nA\t3\t4\t2\n")])
+def test_format_intervals(counts, expected):
+    """
+    Test :py:func:`riboviz.bedgraph.format_intervals` run-length
+    encodes counts.
+
+    :param counts: Counts
+    :type counts: list(int)
+    :param expected: Expected rows
+    :type expected: str or unicode
+    """
+    assert bedgraph.format_intervals(
+        "A", np.array(counts, dtype=np.int64)) == expected
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_write_bedgraphs(tmpdir, num_processes):
+    """
+    Test :py:func:`riboviz.bedgraph.write_bedgraphs` writes 5' end
+    counts for both strands, including reference sequences with no
+    reads, and that the files are valid bedGraph files.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    plus_file = str(tmpdir.join("plus.bedgraph"))
+    minus_file = str(tmpdir.join("minus.bedgraph"))
+    write_bam(bam_file, TEST_READS)
+    bedgraph.write_bedgraphs(bam_file, plus_file, minus_file,
+                             num_processes)
+    check_bedgraph(plus_file, EXPECTED_PLUS)
+    check_bedgraph(minus_file, EXPECTED_MINUS)
+    bedgraph.equal_bedgraph(plus_file, plus_file)
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_write_bedgraphs_strand_order(tmpdir, num_processes):
+    """
+    Test :py:func:`riboviz.bedgraph.write_bedgraphs` writes the rows
+    for reference sequences with reads on a strand before those for
+    reference sequences without, as ``bedtools genomecov`` does.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    plus_file = str(tmpdir.join("plus.bedgraph"))
+    minus_file = str(tmpdir.join("minus.bedgraph"))
+    write_bam(bam_file, [("r1", 0, 0, True, [(pysam.CMATCH, 20)]),
+                         ("r2", 2, 4, False, [(pysam.CMATCH, 1)])])
+    bedgraph.write_bedgraphs(bam_file, plus_file, minus_file,
+                             num_processes)
+    check_bedgraph(plus_file, [("C", 0, 4, 0), ("C", 4, 5, 1),
+                               ("A", 0, 20, 0), ("B", 0, 10, 0)])
+    check_bedgraph(minus_file, [("A", 0, 19, 0), ("A", 19, 20, 1),
+                                ("B", 0, 10, 0), ("C", 0, 5, 0)])
+
+
+def test_write_bedgraphs_unsorted(tmpdir):
+    """
+    Test :py:func:`riboviz.bedgraph.write_bedgraphs` with an unsorted
+    BAM file writes the rows for a reference sequence each time reads
+    on a strand return to it, as ``bedtools genomecov`` does.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    plus_file = str(tmpdir.join("plus.bedgraph"))
+    minus_file = str(tmpdir.join("minus.bedgraph"))
+    write_bam(bam_file, [("r1", 1, 1, False, [(pysam.CMATCH, 2)]),
+                         ("r2", 0, 0, True, [(pysam.CMATCH, 1)]),
+                         ("r3", 0, 5, False, [(pysam.CMATCH, 2)]),
+                         ("r4", 1, 2, False, [(pysam.CMATCH, 2)])],
+              is_sorted=False)
+    bedgraph.write_bedgraphs(bam_file, plus_file, minus_file, 2)
+    check_bedgraph(plus_file, [("B", 0, 1, 0), ("B", 1, 2, 1),
+                               ("B", 2, 10, 0),
+                               ("A", 0, 5, 0), ("A", 5, 6, 1),
+                               ("A", 6, 20, 0),
+                               ("B", 0, 2, 0), ("B", 2, 3, 1),
+                               ("B", 3, 10, 0),
+                               ("C", 0, 5, 0)])
+    check_bedgraph(minus_file, [("A", 0, 1, 1), ("A", 1, 20, 0),
+                                ("B", 0, 10, 0), ("C", 0, 5, 0)])
+
+
+def test_write_bedgraphs_no_such_file(tmpdir):
+    """
+    Test :py:func:`riboviz.bedgraph.write_bedgraphs` with a
+    non-existent BAM file raises ``FileNotFoundError`` and writes no
+    files.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    with pytest.raises(FileNotFoundError):
+        bedgraph.write_bedgraphs(str(tmpdir.join("nosuch.bam")),
+                                 str(tmpdir.join("plus.bedgraph")),
+                                 str(tmpdir.join("minus.bedgraph")))
+    assert not os.listdir(str(tmpdir))
@@ -321,6 +321,99 @@ def test_get_issues_start_codons():
         assert issue in test_check_issues
 
 
+TEST_BATCH_SEQUENCES = {
+    "Forward": "CCATGAAATAGTTTTAACC",
+    "Reverse": "GGTTAAAACTATTTCATGG",
+    "Lower": "ccatgaaatagttttaacc",
+    "Ambiguous": "CCATGNNRYTAACC",
+    "Incomplete": "CCATGAAATAGTTTTAACCA",
+    "NoComplement": "CCATGAZATAGTTTTAACC",
+}
+""" Sequences for :py:func:`test_get_issues_batched`. """
+TEST_BATCH_FEATURES = [
+    ("Forward", 3, 17, "+"), ("Forward", 3, 19, "+"),
+    ("Forward", 1, 19, "-"), ("Forward", 3, 25, "+"),
+    ("Reverse", 3, 17, "-"), ("Reverse", 4, 17, "-"),
+    ("Lower", 3, 17, "+"), ("Lower", 3, 17, "-"),
+    ("Ambiguous", 3, 14, "+"), ("Ambiguous", 3, 14, "-"),
+    ("Incomplete", 3, 20, "+"), ("Incomplete", 3, 20, "-"),
+    ("NoComplement", 3, 17, "+"), ("NoComplement", 3, 17, "-"),
+    ("Missing", 1, 9, "+"),
+]
+"""
+Features (sequence ID, start, end, strand) for
+:py:func:`test_get_issues_batched`.
+"""
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+@pytest.mark.parametrize("line_terminator", ["\n", "\r\n"])
+def test_get_issues_batched(tmpdir, monkeypatch, num_processes,
+                            line_terminator):
+    """
+    Test :py:func:`riboviz.check_fasta_gff.get_issues` returns the
+    same issues and warnings when CDS are checked in batches, including
+    CDS on the reverse strand, with lower-case or ambiguous
+    nucleotides, with nucleotides with no complement or beyond the end
+    of their sequence, as when each CDS is checked individually (see
+    :py:func:`riboviz.check_fasta_gff.get_feature_sequence_issues`).
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param monkeypatch: Monkeypatch fixture
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param line_terminator: FASTA file line terminator
+    :type line_terminator: str or unicode
+    """
+    fasta_file = str(tmpdir.join("batch.fasta"))
+    gff_file = str(tmpdir.join("batch.gff"))
+    with open(fasta_file, "w", newline="") as f:
+        for seq_id, sequence in TEST_BATCH_SEQUENCES.items():
+            f.write(">{}{}".format(seq_id, line_terminator))
+            for start in range(0, len(sequence), 7):
+                f.write(sequence[start:start + 7] + line_terminator)
+    with open(gff_file, "w") as f:
+        f.write("##gff-version 3\n")
+        for index, (seq_id, start, end, strand) in \
+                enumerate(TEST_BATCH_FEATURES):
+            f.write("\t".join([seq_id, "test", "CDS", str(start),
+                               str(end), ".", strand, ".",
+                               "ID={}_{}_CDS".format(seq_id, index)]))
+            f.write("\n")
+    monkeypatch.setattr(check_fasta_gff, "BATCH_SIZE", 30)
+    with pytest.warns(UserWarning) as batched_warnings:
+        batched = check_fasta_gff.get_issues(
+            fasta_file, gff_file, start_codons=[START_CODON, "atg"],
+            num_processes=num_processes)
+    monkeypatch.setattr(check_fasta_gff, "get_cds_codons",
+                        lambda fasta, fasta_genes, features, *args:
+                        [None] * len(features))
+    with pytest.warns(UserWarning) as individual_warnings:
+        individual = check_fasta_gff.get_issues(
+            fasta_file, gff_file, start_codons=[START_CODON, "atg"])
+    assert batched == individual
+    assert [str(warning.message) for warning in batched_warnings] == \
+        [str(warning.message) for warning in individual_warnings]
+    _, _, _, issues = batched
+    assert ("Forward", "Forward_2_CDS",
+            check_fasta_gff.NO_START_CODON, "GGT") in issues
+    assert ("Forward", "Forward_1_CDS",
+            check_fasta_gff.INCOMPLETE_FEATURE, None) in issues
+    assert ("Forward", "Forward_1_CDS",
+            check_fasta_gff.NO_STOP_CODON, "CCN") in issues
+    assert ("Reverse", "Reverse_4_CDS",
+            check_fasta_gff.INTERNAL_STOP_CODON, None) in issues
+    assert [issue for issue in issues
+            if issue[1] == "Reverse_4_CDS" and
+            issue[2] in [check_fasta_gff.NO_START_CODON,
+                         check_fasta_gff.NO_STOP_CODON]] == []
+    # Start codons are as given but stop codons are upper-case only.
+    assert ("Lower", "Lower_6_CDS",
+            check_fasta_gff.NO_STOP_CODON, "taa") in issues
+
+
 def check_fasta_gff_issues_csv(issues, csv_file):
     """
     Check contents of given list of tuples with issues held within
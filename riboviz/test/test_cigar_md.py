@@ -0,0 +1,265 @@
+"""
+:py:mod:`riboviz.cigar_md` tests.
+"""
+import pysam
+import pytest
+from riboviz import cigar_md
+
+
+@pytest.mark.parametrize("md_tag,tokens",
+                         [("25", [25]),
+                          ("0C24", [0, "C", 24]),
+                          ("10A5^AC6", [10, "A", 5, "^AC", 6]),
+                          ("23TT0", [23, "T", "T", 0]),
+                          ("", [])])
+def test_parse_md(md_tag, tokens):
+    """
+    Test :py:func:`riboviz.cigar_md.parse_md`.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param tokens: Expected tokens
+    :type tokens: list(int or str or unicode)
+    """
+    assert cigar_md.parse_md(md_tag) == tokens
+
+
+def test_parse_md_invalid():
+    """
+    Test :py:func:`riboviz.cigar_md.parse_md` with an invalid MD tag
+    raises ``ValueError``.
+    """
+    with pytest.raises(ValueError):
+        cigar_md.parse_md("10A5*6")
+
+
+@pytest.mark.parametrize("md_tag", ["10A5^AC6", "10A5^AC0T6", "0C0G23"])
+def test_scan_md_from_end(md_tag):
+    """
+    Test :py:func:`riboviz.cigar_md.scan_md` from the end of an MD tag
+    returns the same tokens as scanning from its start, in reverse.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    """
+    tokens = [token for token, _ in cigar_md.scan_md(md_tag, True)]
+    assert tokens == list(reversed(cigar_md.parse_md(md_tag)))
+
+
+@pytest.mark.parametrize("tokens,md_tag",
+                         [([25], "25"),
+                          (["C", 24], "0C24"),
+                          ([24, "T"], "24T0"),
+                          ([5, 5, "A", "^AC", 6], "10A0^AC6"),
+                          ([], "0")])
+def test_format_md(tokens, md_tag):
+    """
+    Test :py:func:`riboviz.cigar_md.format_md`.
+
+    :param tokens: Tokens
+    :type tokens: list(int or str or unicode)
+    :param md_tag: Expected MD tag
+    :type md_tag: str or unicode
+    """
+    assert cigar_md.format_md(tokens) == md_tag
+
+
+@pytest.mark.parametrize("md_tag,from_end,num_mismatches",
+                         [("25", False, 0),
+                          ("25", True, 0),
+                          ("0C24", False, 1),
+                          ("0C24", True, 0),
+                          ("0C0G23", False, 2),
+                          ("0C16T7", False, 1),
+                          ("24T0", True, 1),
+                          ("23T0T0", True, 2),
+                          ("23TT0", True, 2),
+                          ("0^AC5", False, 0),
+                          ("16^AG0", True, 0),
+                          ("5^AC0T0", True, 1),
+                          ("", False, 0)])
+def test_count_end_mismatches(md_tag, from_end, num_mismatches):
+    """
+    Test :py:func:`riboviz.cigar_md.count_end_mismatches`.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param from_end: Count from end of alignment?
+    :type from_end: bool
+    :param num_mismatches: Expected number of mismatches
+    :type num_mismatches: int
+    """
+    assert cigar_md.count_end_mismatches(md_tag, from_end) == \
+        num_mismatches
+
+
+@pytest.mark.parametrize("md_tag,num_bases,from_end,expected",
+                         [("0C16T7", 1, False, ("16T7", 1, 0)),
+                          ("24T0", 1, True, ("24", 1, 0)),
+                          ("0C0T5", 1, False, ("0T5", 1, 0)),
+                          ("0C0T5", 2, False, ("5", 2, 0)),
+                          ("25", 3, False, ("22", 0, 0)),
+                          ("25", 3, True, ("22", 0, 0)),
+                          ("1A5", 1, False, ("0A5", 0, 0)),
+                          ("0C^AG5", 1, False, ("5", 1, 2)),
+                          ("5^AG0C0", 1, True, ("5", 1, 2))])
+def test_clip_md(md_tag, num_bases, from_end, expected):
+    """
+    Test :py:func:`riboviz.cigar_md.clip_md`.
+
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param num_bases: Number of aligned bases to remove
+    :type num_bases: int
+    :param from_end: Remove bases from end of alignment?
+    :type from_end: bool
+    :param expected: Expected MD tag, number of mismatches removed, \
+    number of deleted bases removed
+    :type expected: tuple(str or unicode, int, int)
+    """
+    assert cigar_md.clip_md(md_tag, num_bases, from_end) == expected
+
+
+def test_clip_md_too_many_bases():
+    """
+    Test :py:func:`riboviz.cigar_md.clip_md` with more bases than are
+    aligned raises ``ValueError``.
+    """
+    with pytest.raises(ValueError):
+        cigar_md.clip_md("0C2", 4)
+
+
+@pytest.mark.parametrize(
+    "cigartuples,num_bases,from_end,expected",
+    [([(0, 25)], 1, False, ([(4, 1), (0, 24)], 1, 1, 0)),
+     ([(0, 25)], 1, True, ([(0, 24), (4, 1)], 1, 1, 0)),
+     ([(4, 1), (0, 25)], 1, False, ([(4, 2), (0, 24)], 1, 1, 0)),
+     ([(5, 3), (0, 25), (5, 2)], 2, True,
+      ([(5, 3), (0, 23), (4, 2), (5, 2)], 2, 2, 0)),
+     ([(0, 1), (1, 2), (0, 20)], 2, False,
+      ([(4, 2), (1, 1), (0, 20)], 1, 1, 1)),
+     ([(0, 1), (2, 2), (0, 20)], 1, False, ([(4, 1), (0, 20)], 3, 1, 0)),
+     ([(0, 20), (3, 100), (0, 1)], 1, True,
+      ([(0, 20), (4, 1)], 101, 1, 0)),
+     ([(0, 3)], 0, False, ([(4, 0), (0, 3)], 0, 0, 0))])
+def test_clip_cigar(cigartuples, num_bases, from_end, expected):
+    """
+    Test :py:func:`riboviz.cigar_md.clip_cigar`.
+
+    :param cigartuples: CIGAR operations
+    :type cigartuples: list(tuple(int, int))
+    :param num_bases: Number of query bases to soft-clip
+    :type num_bases: int
+    :param from_end: Soft-clip bases from end of alignment?
+    :type from_end: bool
+    :param expected: Expected CIGAR operations, number of reference \
+    bases clipped, number of aligned bases clipped, number of inserted \
+    bases clipped
+    :type expected: tuple(list(tuple(int, int)), int, int, int)
+    """
+    assert cigar_md.clip_cigar(cigartuples, num_bases, from_end) == \
+        expected
+
+
+@pytest.mark.parametrize("cigartuples", [[(0, 2)], [(4, 2), (0, 2)]])
+def test_clip_cigar_too_many_bases(cigartuples):
+    """
+    Test :py:func:`riboviz.cigar_md.clip_cigar` with more bases than
+    are unclipped raises ``ValueError``.
+
+    :param cigartuples: CIGAR operations
+    :type cigartuples: list(tuple(int, int))
+    """
+    with pytest.raises(ValueError):
+        cigar_md.clip_cigar(cigartuples, 3)
+
+
+def make_read(flag, cigar, md_tag=None, num_mismatches=None):
+    """
+    Create a read aligned at reference position 100.
+
+    :param flag: SAM flag
+    :type flag: int
+    :param cigar: CIGAR string
+    :type cigar: str or unicode
+    :param md_tag: MD tag, if any
+    :type md_tag: str or unicode
+    :param num_mismatches: NM tag, if any
+    :type num_mismatches: int
+    :return: Read
+    :rtype: pysam.libcalignedsegment.AlignedSegment
+    """
+    header = pysam.AlignmentHeader.from_dict(
+        {"SQ": [{"SN": "chr", "LN": 1000}]})
+    read = pysam.AlignedSegment(header)
+    read.query_name = "read"
+    read.flag = flag
+    read.reference_id = 0
+    read.reference_start = 100
+    read.cigarstring = cigar
+    read.query_sequence = "A" * read.query_length
+    if md_tag is not None:
+        read.set_tag(cigar_md.MD_TAG, md_tag)
+    if num_mismatches is not None:
+        read.set_tag(cigar_md.NM_TAG, num_mismatches)
+    return read
+
+
+@pytest.mark.parametrize("flag", [0, 99, 163, 256])
+def test_soft_clip_5p_forward(flag):
+    """
+    Test :py:func:`riboviz.cigar_md.soft_clip_5p` with forward strand
+    reads, including paired-end and secondary reads, soft-clips the
+    start of the alignment.
+
+    :param flag: SAM flag
+    :type flag: int
+    """
+    read = make_read(flag, "25M", "0C0T16G6", 3)
+    assert cigar_md.soft_clip_5p(read, 2) == 2
+    assert read.reference_start == 102
+    assert read.cigarstring == "2S23M"
+    assert read.get_tag(cigar_md.MD_TAG) == "16G6"
+    assert read.get_tag(cigar_md.NM_TAG) == 1
+
+
+@pytest.mark.parametrize("flag", [16, 83, 147, 272])
+def test_soft_clip_5p_reverse(flag):
+    """
+    Test :py:func:`riboviz.cigar_md.soft_clip_5p` with reverse strand
+    reads, including paired-end and secondary reads, soft-clips the
+    end of the alignment.
+
+    :param flag: SAM flag
+    :type flag: int
+    """
+    read = make_read(flag, "1S22M2I", "5G15A0", 4)
+    assert cigar_md.soft_clip_5p(read, 3) == 3
+    assert read.reference_start == 100
+    assert read.cigarstring == "1S21M3S"
+    assert read.get_tag(cigar_md.MD_TAG) == "5G15"
+    assert read.get_tag(cigar_md.NM_TAG) == 1
+
+
+def test_soft_clip_deletion():
+    """
+    Test :py:func:`riboviz.cigar_md.soft_clip` removes a deletion at
+    the new start of the alignment.
+    """
+    read = make_read(0, "1M2D20M", "0C^AG20", 3)
+    assert cigar_md.soft_clip(read, 1) == 3
+    assert read.reference_start == 103
+    assert read.cigarstring == "1S20M"
+    assert read.get_tag(cigar_md.MD_TAG) == "20"
+    assert read.get_tag(cigar_md.NM_TAG) == 0
+
+
+def test_soft_clip_no_md():
+    """
+    Test :py:func:`riboviz.cigar_md.soft_clip` with a read with no MD
+    tag soft-clips the read and returns ``None``.
+    """
+    read = make_read(0, "25M")
+    assert cigar_md.soft_clip(read, 1) is None
+    assert read.reference_start == 101
+    assert read.cigarstring == "1S24M"
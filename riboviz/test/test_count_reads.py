@@ -0,0 +1,377 @@
+"""
+:py:mod:`riboviz.count_reads` tests.
+"""
+import os
+import shutil
+import tempfile
+import pytest
+import pandas as pd
+import pysam
+import yaml
+from riboviz import count_reads
+from riboviz import demultiplex_fastq
+from riboviz import fastq
+from riboviz import params
+from riboviz import sample_sheets
+from riboviz import trim_5p_mismatch
+from riboviz import workflow_files
+from riboviz.test import data
+
+SAMPLES = ["SampleA", "SampleB"]
+""" Sample names. """
+FASTQ_RECORD = b"@r1\nACGT\n+\nIIII\n"
+""" FASTQ record. """
+SAM_FILE = os.path.join(os.path.dirname(data.__file__),
+                        "WTnone_rRNA_map_20.sam")
+""" SAM file with 20 reads. """
+BAM_FILE = os.path.join(os.path.dirname(data.__file__),
+                        "WTnone_rRNA_map_20.bam")
+""" BAM file with 20 reads. """
+
+
+@pytest.fixture(scope="function")
+def workflow_dirs():
+    """
+    Create temporary input, temporary and output directories and a
+    configuration file with FASTQ and SAM files for each sample in
+    :py:const:`SAMPLES`.
+
+    :return: configuration file, input, temporary and output \
+    directories
+    :rtype: tuple(str or unicode, str or unicode, str or unicode, \
+    str or unicode)
+    """
+    base_dir = tempfile.mkdtemp(__name__)
+    input_dir = os.path.join(base_dir, "input")
+    tmp_dir = os.path.join(base_dir, "tmp")
+    output_dir = os.path.join(base_dir, "output")
+    os.mkdir(input_dir)
+    os.mkdir(tmp_dir)
+    os.mkdir(output_dir)
+    fq_files = {}
+    for count, sample in enumerate(SAMPLES, 1):
+        fq_files[sample] = fastq.FASTQ_FORMAT.format(sample)
+        with open(os.path.join(input_dir, fq_files[sample]), "wb") as f:
+            f.write(FASTQ_RECORD * count * 3)
+        os.mkdir(os.path.join(tmp_dir, sample))
+        with open(os.path.join(tmp_dir, sample,
+                               workflow_files.ADAPTER_TRIM_FQ),
+                  "wb") as f:
+            f.write(FASTQ_RECORD * count * 2)
+        with open(os.path.join(tmp_dir, sample,
+                               workflow_files.NON_RRNA_FQ),
+                  "wb") as f:
+            f.write(FASTQ_RECORD * count)
+        shutil.copyfile(SAM_FILE,
+                        os.path.join(tmp_dir, sample,
+                                     workflow_files.RRNA_MAP_SAM))
+    config_file = os.path.join(base_dir, "config.yaml")
+    with open(config_file, "w") as f:
+        yaml.dump({params.FQ_FILES: fq_files}, f)
+    yield config_file, input_dir, tmp_dir, output_dir
+    shutil.rmtree(base_dir)
+
+
+def get_num_reads(df):
+    """
+    Get map from file names to number of reads.
+
+    :param df: Read counts
+    :type df: pandas.core.frame.DataFrame
+    :return: Map from file names to number of reads
+    :rtype: dict(str or unicode, int)
+    """
+    return {os.path.basename(os.path.dirname(file_name)) + "/" +
+            os.path.basename(file_name): num_reads
+            for file_name, num_reads in zip(df[count_reads.FILE],
+                                            df[count_reads.NUM_READS])}
+
+
+def test_count_reads_df(workflow_dirs):
+    """
+    Test :py:func:`riboviz.count_reads.count_reads_df`.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    """
+    df = count_reads.count_reads_df(*workflow_dirs)
+    assert get_num_reads(df) == {
+        "input/SampleA.fastq": 3,
+        "input/SampleB.fastq": 6,
+        "SampleA/trim.fq": 2,
+        "SampleA/nonrRNA.fq": 1,
+        "SampleA/rRNA_map.sam": 20,
+        "SampleB/trim.fq": 4,
+        "SampleB/nonrRNA.fq": 2,
+        "SampleB/rRNA_map.sam": 20
+    }
+
+
+def test_count_reads_df_num_processes(workflow_dirs):
+    """
+    Test :py:func:`riboviz.count_reads.count_reads_df` returns the
+    same rows, in the same order, when using more than one process.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    """
+    df = count_reads.count_reads_df(*workflow_dirs)
+    parallel_df = count_reads.count_reads_df(*workflow_dirs,
+                                             num_processes=3)
+    assert df.equals(parallel_df)
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_count_reads_df_cache(workflow_dirs, monkeypatch, num_processes):
+    """
+    Test :py:func:`riboviz.count_reads.count_reads_df` with a count
+    cache only recounts files whose size or modification time have
+    changed.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    :param monkeypatch: Monkeypatch
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    _, _, tmp_dir, _ = workflow_dirs
+    cache_file = os.path.join(tmp_dir,
+                              workflow_files.READ_COUNTS_CACHE_FILE)
+    df = count_reads.count_reads_df(*workflow_dirs,
+                                    num_processes=num_processes,
+                                    cache_file=cache_file)
+    cache = count_reads.load_count_cache(cache_file)
+    assert len(cache) == 8
+    changed_file = os.path.join(tmp_dir, SAMPLES[0],
+                                workflow_files.NON_RRNA_FQ)
+    with open(changed_file, "ab") as f:
+        f.write(FASTQ_RECORD)
+    counted = []
+    fastq_count_sequences = fastq.count_sequences
+
+    def count_sequences(file_name):
+        counted.append(file_name)
+        return fastq_count_sequences(file_name)
+    monkeypatch.setattr(count_reads.fastq, "count_sequences",
+                        count_sequences)
+    cached_df = count_reads.count_reads_df(*workflow_dirs,
+                                           cache_file=cache_file)
+    assert counted == [changed_file]
+    num_reads = get_num_reads(df)
+    num_reads["SampleA/nonrRNA.fq"] = 2
+    assert get_num_reads(cached_df) == num_reads
+    cache = count_reads.load_count_cache(cache_file)
+    assert cache[(os.path.abspath(changed_file),
+                  count_reads.FASTQ_TYPE)][2] == 2
+
+
+def test_get_task_cache(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads.get_task_cache` selects only
+    the entries for files in matching directories and with matching
+    names.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    tmp_dir = str(tmpdir)
+    entry = (1, 2, 3)
+    keys = [(os.path.join(tmp_dir, "a.fq"), count_reads.FASTQ_TYPE),
+            (os.path.join(tmp_dir, "b.fq"), count_reads.FASTQ_TYPE),
+            (os.path.join(tmp_dir, "A", "a.fq"), count_reads.FASTQ_TYPE),
+            (os.path.join(tmp_dir, "B", "b.sam"),
+             count_reads.SAM_BAM_TYPE)]
+    cache = {key: entry for key in keys}
+    assert count_reads.get_task_cache(None, tmp_dir) is None
+    assert count_reads.get_task_cache(cache, tmp_dir) == \
+        {key: entry for key in keys[:2]}
+    assert count_reads.get_task_cache(cache, tmp_dir, "a.fq") == \
+        {keys[0]: entry}
+    assert count_reads.get_task_cache(
+        cache, os.path.join(tmp_dir, "*")) == \
+        {key: entry for key in keys[2:]}
+    assert count_reads.get_task_cache(
+        cache, os.path.join(tmp_dir, "C")) == {}
+
+
+def fail_count_sequences(file_name):
+    """
+    Replacement for functions that count sequences in files, used to
+    check that no files are scanned.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :raise AssertionError: always
+    """
+    raise AssertionError("Unexpected scan of {}".format(file_name))
+
+
+def test_trim_5p_mismatch_sam_tsv(workflow_dirs, monkeypatch):
+    """
+    Test :py:func:`riboviz.count_reads.trim_5p_mismatch_sam` takes
+    the number of reads from the TSV summary file.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    :param monkeypatch: Monkeypatch
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    _, _, tmp_dir, _ = workflow_dirs
+    sample_dir = os.path.join(tmp_dir, SAMPLES[0])
+    shutil.copyfile(SAM_FILE, os.path.join(
+        sample_dir, workflow_files.ORF_MAP_CLEAN_SAM))
+    pd.DataFrame([[20, 0, 3, 17]],
+                 columns=[trim_5p_mismatch.NUM_PROCESSED,
+                          trim_5p_mismatch.NUM_DISCARDED,
+                          trim_5p_mismatch.NUM_TRIMMED,
+                          trim_5p_mismatch.NUM_WRITTEN]).to_csv(
+                              os.path.join(
+                                  sample_dir,
+                                  workflow_files.TRIM_5P_MISMATCH_TSV),
+                              sep="\t", index=False)
+    monkeypatch.setattr(count_reads.sam_bam, "count_sequences",
+                        fail_count_sequences)
+    row = count_reads.trim_5p_mismatch_sam(tmp_dir, SAMPLES[0])
+    assert row.iloc[0][count_reads.NUM_READS] == 17
+
+
+def test_fuse_trim_sort_tsv(workflow_dirs, monkeypatch):
+    """
+    Test :py:func:`riboviz.count_reads.hisat2_orf_map_tsv` and
+    :py:func:`riboviz.count_reads.trim_5p_mismatch_sam` take the
+    number of reads from the TSV summary file if reads were trimmed,
+    sorted and indexed in a single step, so there are no SAM files.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    :param monkeypatch: Monkeypatch
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    _, _, tmp_dir, _ = workflow_dirs
+    sample_dir = os.path.join(tmp_dir, SAMPLES[0])
+    bam_file = os.path.join(sample_dir, workflow_files.ORF_MAP_CLEAN_BAM)
+    shutil.copyfile(BAM_FILE, bam_file)
+    tsv_file = os.path.join(sample_dir, workflow_files.TRIM_5P_MISMATCH_TSV)
+    pd.DataFrame([[20, 3, 3, 17]],
+                 columns=[trim_5p_mismatch.NUM_PROCESSED,
+                          trim_5p_mismatch.NUM_DISCARDED,
+                          trim_5p_mismatch.NUM_TRIMMED,
+                          trim_5p_mismatch.NUM_WRITTEN]).to_csv(
+                              tsv_file, sep="\t", index=False)
+    monkeypatch.setattr(count_reads.sam_bam, "count_sequences",
+                        fail_count_sequences)
+    row = count_reads.hisat2_orf_map_tsv(tmp_dir, SAMPLES[0])
+    assert row.iloc[0][count_reads.NUM_READS] == 20
+    assert row.iloc[0][count_reads.FILE] == tsv_file
+    row = count_reads.trim_5p_mismatch_sam(tmp_dir, SAMPLES[0])
+    assert row.iloc[0][count_reads.NUM_READS] == 17
+    assert row.iloc[0][count_reads.FILE] == bam_file
+    shutil.copyfile(SAM_FILE, os.path.join(
+        sample_dir, workflow_files.ORF_MAP_SAM))
+    assert count_reads.hisat2_orf_map_tsv(tmp_dir, SAMPLES[0]) is None
+
+
+def test_trim_5p_mismatch_sam_bam_index(workflow_dirs, monkeypatch):
+    """
+    Test :py:func:`riboviz.count_reads.trim_5p_mismatch_sam` takes
+    the number of reads from the index statistics of the indexed BAM
+    file if there is no TSV summary file.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    :param monkeypatch: Monkeypatch
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    _, _, tmp_dir, _ = workflow_dirs
+    sample_dir = os.path.join(tmp_dir, SAMPLES[0])
+    shutil.copyfile(SAM_FILE, os.path.join(
+        sample_dir, workflow_files.ORF_MAP_CLEAN_SAM))
+    bam_file = os.path.join(sample_dir, workflow_files.ORF_MAP_CLEAN_BAM)
+    shutil.copyfile(BAM_FILE, bam_file)
+    pysam.index(bam_file)
+    monkeypatch.setattr(count_reads.sam_bam, "count_sequences",
+                        fail_count_sequences)
+    row = count_reads.trim_5p_mismatch_sam(tmp_dir, SAMPLES[0])
+    assert row.iloc[0][count_reads.NUM_READS] == 20
+
+
+def test_trim_5p_mismatch_sam_no_bam_index(workflow_dirs):
+    """
+    Test :py:func:`riboviz.count_reads.trim_5p_mismatch_sam` counts
+    the reads in the SAM file if there is no TSV summary file or
+    indexed BAM file.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    """
+    _, _, tmp_dir, _ = workflow_dirs
+    sample_dir = os.path.join(tmp_dir, SAMPLES[0])
+    shutil.copyfile(SAM_FILE, os.path.join(
+        sample_dir, workflow_files.ORF_MAP_CLEAN_SAM))
+    shutil.copyfile(BAM_FILE, os.path.join(
+        sample_dir, workflow_files.ORF_MAP_CLEAN_BAM))
+    row = count_reads.trim_5p_mismatch_sam(tmp_dir, SAMPLES[0])
+    assert row.iloc[0][count_reads.NUM_READS] == 20
+
+
+@pytest.mark.parametrize("is_umi_extract", [False, True])
+def test_cutadapt_fq_deplex_num_reads(workflow_dirs, monkeypatch,
+                                      is_umi_extract):
+    """
+    Test :py:func:`riboviz.count_reads.cutadapt_fq` takes the number
+    of reads in a multiplexed file from the ``num_reads.tsv`` file
+    output by demultiplexing, unless UMIs were extracted from the
+    file before demultiplexing.
+
+    :param workflow_dirs: configuration file, input, temporary and \
+    output directories
+    :type workflow_dirs: tuple(str or unicode, str or unicode, \
+    str or unicode, str or unicode)
+    :param monkeypatch: Monkeypatch
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    :param is_umi_extract: Were UMIs extracted?
+    :type is_umi_extract: bool
+    """
+    _, _, tmp_dir, _ = workflow_dirs
+    with open(os.path.join(
+            tmp_dir,
+            workflow_files.ADAPTER_TRIM_FQ_FORMAT.format("multiplex")),
+              "wb") as f:
+        f.write(FASTQ_RECORD * 9)
+    if is_umi_extract:
+        with open(os.path.join(
+                tmp_dir,
+                workflow_files.UMI_EXTRACT_FQ_FORMAT.format("multiplex")),
+                  "wb") as f:
+            f.write(FASTQ_RECORD * 8)
+    deplex_dir = os.path.join(
+        tmp_dir, workflow_files.DEPLEX_DIR_FORMAT.format("multiplex"))
+    os.mkdir(deplex_dir)
+    sample_sheet = pd.DataFrame([[sample, "ACG", 4]
+                                 for sample in SAMPLES],
+                                columns=[sample_sheets.SAMPLE_ID,
+                                         sample_sheets.TAG_READ,
+                                         sample_sheets.NUM_READS])
+    sample_sheets.save_deplexed_sample_sheet(
+        sample_sheet, 1,
+        os.path.join(deplex_dir, demultiplex_fastq.NUM_READS_FILE))
+    if not is_umi_extract:
+        monkeypatch.setattr(count_reads.fastq, "count_sequences",
+                            fail_count_sequences)
+    row = count_reads.cutadapt_fq(tmp_dir)
+    assert row.iloc[0][count_reads.NUM_READS] == 9
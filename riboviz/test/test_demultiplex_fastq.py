@@ -1,6 +1,7 @@
 """
 :py:mod:`riboviz.demultiplex_fastq` tests.
 """
+from io import BytesIO
 from io import StringIO
 from contextlib import ExitStack
 import gzip
@@ -8,6 +9,7 @@ import os
 import shutil
 import tempfile
 import pytest
+from riboviz import barcodes_umis
 from riboviz import demultiplex_fastq
 from riboviz import fastq
 from riboviz import utils
@@ -24,6 +26,22 @@ FASTQ_RECORD2 = ["@X1:Tag_AAC_ 1:N:0:XXXXXXXX\n",
                  "+\n",
                  "IIIIIIII\n"]
 """ Sample FASTQ record """
+FASTQ_RECORD_TUPLE1 = (b"X1:Tag_AAC_ 1:N:0:XXXXXXXX",
+                       b"GATTACCA",
+                       b"",
+                       b"IIIIIIII")
+"""
+Sample FASTQ record, as returned by
+:py:func:`riboviz.fastq.read_fastq_records`.
+"""
+FASTQ_RECORD_TUPLE2 = (b"X1:Tag_AAC_ 1:N:0:XXXXXXXX",
+                       b"AAAAAAAA",
+                       b"",
+                       b"IIIIIIII")
+"""
+Sample FASTQ record, as returned by
+:py:func:`riboviz.fastq.read_fastq_records`.
+"""
 
 
 @pytest.fixture(scope="function")
@@ -159,6 +177,137 @@ def test_assign_samples_no_match():
         assert read2_fhs[1].getvalue() == ""
 
 
+def test_assign_samples_by_index():
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.assign_samples_by_index`
+    with paired ends records and matching barcodes.
+    """
+    with ExitStack() as stack:
+        read1_fhs = [stack.enter_context(BytesIO()) for f in range(2)]
+        read2_fhs = [stack.enter_context(BytesIO()) for f in range(2)]
+        read1_writers = [fastq.FastqWriter(fh) for fh in read1_fhs]
+        read2_writers = [fastq.FastqWriter(fh) for fh in read2_fhs]
+        barcodes = ["CCC", "AAA"]
+        barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+        num_reads = [0] * len(barcodes)
+        match = demultiplex_fastq.assign_samples_by_index(
+            FASTQ_RECORD_TUPLE1, FASTQ_RECORD_TUPLE2,
+            barcodes,
+            barcode_index,
+            read1_writers, read2_writers,
+            True,
+            num_reads,
+            1, "_")
+        for writer in read1_writers + read2_writers:
+            writer.flush()
+        assert match == (1, 1, False)
+        assert num_reads[0] == 0
+        assert num_reads[1] == 1
+        assert read1_fhs[0].getvalue() == b""
+        assert read2_fhs[0].getvalue() == b""
+        assert "".join(FASTQ_RECORD1).encode() == read1_fhs[1].getvalue()
+        assert "".join(FASTQ_RECORD2).encode() == read2_fhs[1].getvalue()
+
+
+def test_demultiplex_chunk():
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex_chunk` with
+    paired ends records formats the records for each sample, and for
+    unassigned records, in order.
+    """
+    unassigned_record = "".join(
+        ["@X2:Tag_GGG_ 1:N:0:XXXXXXXX\n"] + FASTQ_RECORD1[1:])
+    chunk1 = "".join(FASTQ_RECORD1 + [unassigned_record] +
+                     FASTQ_RECORD1).encode()
+    chunk2 = "".join(FASTQ_RECORD2 * 3).encode()
+    barcodes = ["CCC", "AAA"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+    data1, data2, num_reads, total_reads, num_unassigned_reads, \
+        num_ambiguous_reads = demultiplex_fastq.demultiplex_chunk(
+            chunk1, chunk2, barcodes, barcode_index, 1, "_")
+    assert data1 == [b"",
+                     "".join(FASTQ_RECORD1 * 2).encode(),
+                     unassigned_record.encode()]
+    assert data2 == [b"",
+                     "".join(FASTQ_RECORD2 * 2).encode(),
+                     "".join(FASTQ_RECORD2).encode()]
+    assert num_reads == [0, 2]
+    assert total_reads == 3
+    assert num_unassigned_reads == 1
+    assert num_ambiguous_reads == 0
+
+
+def test_demultiplex_chunk_unequal():
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex_chunk` raises
+    ``ValueError`` if paired chunks have different numbers of records.
+    """
+    barcodes = ["CCC", "AAA"]
+    barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+    with pytest.raises(ValueError):
+        demultiplex_fastq.demultiplex_chunk(
+            "".join(FASTQ_RECORD1 * 2).encode(),
+            "".join(FASTQ_RECORD2).encode(),
+            barcodes, barcode_index, 1, "_")
+
+
+def test_assign_samples_by_index_closest():
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.assign_samples_by_index`
+    assigns a record to the closest barcode, not the first barcode
+    within the allowed mismatches.
+    """
+    with ExitStack() as stack:
+        read1_fhs = [stack.enter_context(BytesIO()) for f in range(2)]
+        read1_writers = [fastq.FastqWriter(fh) for fh in read1_fhs]
+        barcodes = ["CCC", "AAA"]
+        barcode_index = barcodes_umis.create_barcode_index(barcodes, 2)
+        num_reads = [0] * len(barcodes)
+        match = demultiplex_fastq.assign_samples_by_index(
+            FASTQ_RECORD_TUPLE1, None,
+            barcodes,
+            barcode_index,
+            read1_writers, None,
+            False,
+            num_reads,
+            2, "_")
+        for writer in read1_writers:
+            writer.flush()
+        assert match == (1, 1, False)
+        assert num_reads == [0, 1]
+        assert read1_fhs[0].getvalue() == b""
+        assert "".join(FASTQ_RECORD1).encode() == read1_fhs[1].getvalue()
+
+
+def test_assign_samples_by_index_no_match():
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.assign_samples_by_index`
+    with paired end records and non-matching barcodes.
+    """
+    with ExitStack() as stack:
+        read1_fhs = [stack.enter_context(BytesIO()) for f in range(2)]
+        read2_fhs = [stack.enter_context(BytesIO()) for f in range(2)]
+        read1_writers = [fastq.FastqWriter(fh) for fh in read1_fhs]
+        read2_writers = [fastq.FastqWriter(fh) for fh in read2_fhs]
+        barcodes = ["GGG", "TTT"]
+        barcode_index = barcodes_umis.create_barcode_index(barcodes, 1)
+        num_reads = [0] * len(barcodes)
+        match = demultiplex_fastq.assign_samples_by_index(
+            FASTQ_RECORD_TUPLE1, FASTQ_RECORD_TUPLE2,
+            barcodes,
+            barcode_index,
+            read1_writers, read2_writers,
+            True,
+            num_reads,
+            1, "_")
+        for writer in read1_writers + read2_writers:
+            writer.flush()
+        assert match is None
+        assert num_reads == [0, 0]
+        for fh in read1_fhs + read2_fhs:
+            assert fh.getvalue() == b""
+
+
 def test_demultiplex_no_sample_sheet(tmp_dir):
     """
     Test :py:func:`riboviz.demultiplex_fastq.demultiplex` raises
@@ -271,12 +420,40 @@ def test_demultiplex(tmp_dir, file_format):
                                    fastq.FASTQ_FORMAT.format(tag))
         fastq.equal_fastq(expected_fq, actual_fq)
     # The definition of the simulated data means that Tag3 has no
-    # matches, as Tag0|1|2 will match any barcodes first. Check
+    # matches, as Tag0|1|2 are at least as close to any barcodes. Check
     # there is no Tag3-related output file.
     assert not os.path.exists(os.path.join(tmp_dir,
                                            file_format.lower().format("Tag3")))
 
 
+def test_demultiplex_plus_line(tmp_dir):
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex` copies
+    records, including the content of their ``+`` lines, unchanged.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    sample_sheet_file = os.path.join(tmp_dir, "barcodes.tsv")
+    with open(sample_sheet_file, "w") as f:
+        f.write("SampleID\tTagRead\nTag0\tACG\n")
+    records = [b"@r1_ACG_x\nACGT\n+r1_ACG_x\nIIII\n",
+               b"@r2_ACG_x\nAC\n+\nII\n",
+               b"@r3_TTT_x\nGG\n+r3_TTT_x\nII\n"]
+    fastq_file = os.path.join(tmp_dir, fastq.FASTQ_FORMAT.format("test"))
+    with open(fastq_file, "wb") as f:
+        f.writelines(records)
+    demultiplex_fastq.demultiplex(sample_sheet_file,
+                                  fastq_file,
+                                  mismatches=0,
+                                  out_dir=tmp_dir)
+    for tag, expected in [("Tag0", records[:2]),
+                          ("Unassigned", records[2:])]:
+        with open(os.path.join(tmp_dir, fastq.FASTQ_FORMAT.format(tag)),
+                  "rb") as f:
+            assert f.read() == b"".join(expected)
+
+
 @pytest.mark.parametrize("file_format",
                          [(fastq.FASTQ_GZ_FORMAT,
                            fastq.FASTQ_FORMAT),
@@ -339,7 +516,212 @@ def test_demultiplex_gz(tmp_dir, file_format):
                 shutil.copyfileobj(fr, fw)
         fastq.equal_fastq(expected_fq, actual_fq)
     # The definition of the simulated data means that Tag3 has no
-    # matches, as Tag0|1|2 will match any barcodes first. Check
+    # matches, as Tag0|1|2 are at least as close to any barcodes. Check
     # there is no Tag3-related output file.
     assert not os.path.exists(os.path.join(tmp_dir,
                                            gz_fmt.lower().format("Tag3")))
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, demultiplex_fastq.BATCH_SIZE])
+def test_demultiplex_num_processes(tmp_dir, batch_size):
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex` using
+    more than one process.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param batch_size: Number of FASTQ records per batch
+    :type batch_size: int
+    """
+    demultiplex_fastq.demultiplex(
+        os.path.join(riboviz.test.SIMDATA_DIR,
+                     "multiplex_barcodes.tsv"),
+        os.path.join(riboviz.test.SIMDATA_DIR,
+                     "multiplex.fastq"),
+        mismatches=2,
+        out_dir=tmp_dir,
+        num_processes=2,
+        batch_size=batch_size)
+    actual_num_reads = os.path.join(
+        tmp_dir,
+        demultiplex_fastq.NUM_READS_FILE)
+    expected_num_reads = os.path.join(
+        riboviz.test.SIMDATA_DIR,
+        "deplex",
+        demultiplex_fastq.NUM_READS_FILE)
+    utils.equal_tsv(expected_num_reads, actual_num_reads,
+                    na_to_empty_str=True)
+    for tag in ["Tag0", "Tag1", "Tag2", "Unassigned"]:
+        actual_fq = os.path.join(tmp_dir, fastq.FASTQ_FORMAT.format(tag))
+        expected_fq = os.path.join(riboviz.test.SIMDATA_DIR,
+                                   "deplex",
+                                   fastq.FASTQ_FORMAT.format(tag))
+        fastq.equal_fastq(expected_fq, actual_fq)
+    assert not os.path.exists(os.path.join(
+        tmp_dir, fastq.FASTQ_FORMAT.format("Tag3")))
+
+
+def test_demultiplex_num_processes_paired_end(tmp_dir):
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex` with
+    paired reads writes identical files, in identical order, when
+    using one process and more than one process.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    read1_file = os.path.join(riboviz.test.SIMDATA_DIR,
+                              "multiplex.fastq")
+    out_dirs = []
+    for num_processes in [1, 3]:
+        out_dir = os.path.join(tmp_dir, str(num_processes))
+        demultiplex_fastq.demultiplex(
+            os.path.join(riboviz.test.SIMDATA_DIR,
+                         "multiplex_barcodes.tsv"),
+            read1_file,
+            read1_file,
+            mismatches=2,
+            out_dir=out_dir,
+            num_processes=num_processes,
+            batch_size=4)
+        out_dirs.append(out_dir)
+    utils.equal_tsv(
+        os.path.join(out_dirs[0], demultiplex_fastq.NUM_READS_FILE),
+        os.path.join(out_dirs[1], demultiplex_fastq.NUM_READS_FILE),
+        na_to_empty_str=True)
+    file_names = sorted(os.listdir(out_dirs[0]))
+    assert file_names == sorted(os.listdir(out_dirs[1]))
+    for file_name in file_names:
+        if file_name == demultiplex_fastq.NUM_READS_FILE:
+            continue
+        with open(os.path.join(out_dirs[0], file_name)) as f1, \
+             open(os.path.join(out_dirs[1], file_name)) as f2:
+            assert f1.read() == f2.read(), file_name
+
+
+@pytest.mark.parametrize("batch_size", [1, demultiplex_fastq.BATCH_SIZE])
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_demultiplex_paired_end_unequal(tmp_dir, num_processes,
+                                        batch_size):
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex` raises
+    ``ValueError`` if paired files have different numbers of records.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param batch_size: Number of FASTQ records per batch
+    :type batch_size: int
+    """
+    read1_file = os.path.join(riboviz.test.SIMDATA_DIR,
+                              "multiplex.fastq")
+    read2_file = os.path.join(tmp_dir, "multiplex_R2.fastq")
+    with open(read1_file, "rb") as f:
+        lines = f.read().splitlines(True)
+    with open(read2_file, "wb") as f:
+        f.writelines(lines[:-4])
+    with pytest.raises(ValueError):
+        demultiplex_fastq.demultiplex(
+            os.path.join(riboviz.test.SIMDATA_DIR,
+                         "multiplex_barcodes.tsv"),
+            read1_file,
+            read2_file,
+            mismatches=2,
+            out_dir=os.path.join(tmp_dir, "out"),
+            num_processes=num_processes,
+            batch_size=batch_size)
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_demultiplex_gz_num_threads(tmp_dir, num_processes):
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex` with
+    GZIPped paired reads writes BGZF files if using threads, with the
+    same content as the GZIP files written if not using threads.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    read1_file = os.path.join(tmp_dir,
+                              fastq.FASTQ_GZ_FORMAT.format("multiplex"))
+    with open(os.path.join(riboviz.test.SIMDATA_DIR,
+                           "multiplex.fastq"), "rb") as fr:
+        with gzip.open(read1_file, "wb") as fw:
+            shutil.copyfileobj(fr, fw)
+    out_dirs = []
+    for num_threads in [0, 3]:
+        out_dir = os.path.join(tmp_dir, str(num_threads))
+        demultiplex_fastq.demultiplex(
+            os.path.join(riboviz.test.SIMDATA_DIR,
+                         "multiplex_barcodes.tsv"),
+            read1_file,
+            read1_file,
+            mismatches=2,
+            out_dir=out_dir,
+            num_processes=num_processes,
+            batch_size=4,
+            num_threads=num_threads)
+        out_dirs.append(out_dir)
+    file_names = sorted(os.listdir(out_dirs[0]))
+    assert file_names == sorted(os.listdir(out_dirs[1]))
+    for file_name in file_names:
+        if file_name == demultiplex_fastq.NUM_READS_FILE:
+            continue
+        with gzip.open(os.path.join(out_dirs[0], file_name)) as f1, \
+             gzip.open(os.path.join(out_dirs[1], file_name)) as f2:
+            assert f1.read() == f2.read(), file_name
+        with open(os.path.join(out_dirs[1], file_name), "rb") as f:
+            data = f.read()
+        assert data.startswith(fastq.BGZF_HEADER), file_name
+        assert data.endswith(fastq.BGZF_EOF), file_name
+
+
+def test_demultiplex_max_open_files(tmp_dir):
+    """
+    Test :py:func:`riboviz.demultiplex_fastq.demultiplex` with
+    GZIPped paired reads and one open output file at a time writes
+    the same files as with no such limit, does not create files for
+    samples with no reads and removes such files left by previous
+    runs.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    read1_file = os.path.join(tmp_dir,
+                              fastq.FASTQ_GZ_FORMAT.format("multiplex"))
+    with open(os.path.join(riboviz.test.SIMDATA_DIR,
+                           "multiplex.fastq"), "rb") as fr:
+        with gzip.open(read1_file, "wb") as fw:
+            shutil.copyfileobj(fr, fw)
+    out_dirs = []
+    for max_open_files in [fastq.MAX_OPEN_FILES, 1]:
+        out_dir = os.path.join(tmp_dir, str(max_open_files))
+        os.mkdir(out_dir)
+        stale_file = os.path.join(out_dir,
+                                  fastq.FASTQ_GZ_FORMAT.format("Tag3_R1"))
+        with open(stale_file, "w") as f:
+            f.write("stale")
+        demultiplex_fastq.demultiplex(
+            os.path.join(riboviz.test.SIMDATA_DIR,
+                         "multiplex_barcodes.tsv"),
+            read1_file,
+            read1_file,
+            mismatches=2,
+            out_dir=out_dir,
+            num_threads=2,
+            max_open_files=max_open_files)
+        assert not os.path.exists(stale_file)
+        out_dirs.append(out_dir)
+    file_names = sorted(os.listdir(out_dirs[0]))
+    assert file_names == sorted(os.listdir(out_dirs[1]))
+    for file_name in file_names:
+        if file_name == demultiplex_fastq.NUM_READS_FILE:
+            continue
+        assert "Tag3" not in file_name
+        with open(os.path.join(out_dirs[0], file_name), "rb") as f1, \
+             open(os.path.join(out_dirs[1], file_name), "rb") as f2:
+            assert gzip.decompress(f1.read()) == \
+                gzip.decompress(f2.read()), file_name
@@ -0,0 +1,247 @@
+"""
+:py:mod:`riboviz.fasta_gff` tests.
+"""
+import gzip
+import os
+import pytest
+from pyfaidx import Fasta
+from riboviz import fasta_gff
+
+TEST_GFF = """##gff-version 3
+# Comment
+A\ttest\tmRNA\t1\t30\t.\t+\t.\tID=A_mRNA
+A\ttest\tCDS\t4\t27\t.\t+\t0\tID=A%2CCDS;Name=A_1,A_2
+A\ttest\tCDS\t4\t27\t.\t+\t0\tID=A%2CCDS;Name=A_3
+A\ttest\tCDS\t5\t27\t.\t+\t0\tID=A%2CCDS
+B\ttest\tCDS\t2\t7\t.\t-\t0\tID=;Name=B%3BCDS
+
+C\ttest\tCDS\t4\t27\t.\t+\t0\tNote=No ID or Name
+C\ttest\tCDS\t4\t27\t.\t+\t0\tID=C_CDS; Name=C_Name
+##FASTA
+>A
+ACGT
+"""
+""" Test GFF file contents. """
+TEST_CDS = [
+    ("A", 4, 27, "+", "0", {"ID": ["A,CDS"], "Name": ["A_1"]}),
+    ("A", 5, 27, "+", "0", {"ID": ["A,CDS"]}),
+    ("B", 2, 7, "-", "0", {"Name": ["B;CDS"]}),
+    ("C", 4, 27, "+", "0", {}),
+    ("C", 4, 27, "+", "0", {"ID": ["C_CDS"], "Name": ["C_Name"]})
+]
+"""
+Expected CDS in :py:const:`TEST_GFF`. The second ``A,CDS`` line is a
+duplicate of the first, bar its attributes, so is merged into it.
+"""
+TEST_NUM_FEATURES = 6
+""" Expected number of features in :py:const:`TEST_GFF`. """
+
+
+@pytest.fixture(scope="function")
+def gff_file(tmpdir):
+    """
+    Create a GFF file with :py:const:`TEST_GFF`.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :return: path to GFF file
+    :rtype: str or unicode
+    """
+    gff = tmpdir.join("test.gff")
+    gff.write(TEST_GFF)
+    yield str(gff)
+
+
+def test_read_gff_index(gff_file):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_index`.
+
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    """
+    index = fasta_gff.read_gff_index(gff_file)
+    assert index.num_features == TEST_NUM_FEATURES
+    assert len(index) == len(TEST_CDS)
+    assert [tuple(feature) for feature in index] == TEST_CDS
+
+
+def test_read_gff_index_feature_type(gff_file):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_index` with a feature
+    type other than ``CDS``.
+
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    """
+    index = fasta_gff.read_gff_index(gff_file, "mRNA")
+    assert index.num_features == TEST_NUM_FEATURES
+    assert [tuple(feature) for feature in index] == \
+        [("A", 1, 30, "+", ".", {"ID": ["A_mRNA"]})]
+
+
+def test_read_gff_index_gzip(tmpdir):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_index` with a
+    gzip-compressed GFF file.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    gff = str(tmpdir.join("test.gff.gz"))
+    with gzip.open(gff, "wt") as f:
+        f.write(TEST_GFF)
+    index = fasta_gff.read_gff_index(gff)
+    assert [tuple(feature) for feature in index] == TEST_CDS
+
+
+def test_read_gff_index_no_such_file(tmpdir):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_index` with a
+    non-existent GFF file raises an exception.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    with pytest.raises(FileNotFoundError):
+        fasta_gff.read_gff_index(str(tmpdir.join("nosuch.gff")))
+
+
+@pytest.mark.parametrize("contents", ["", "##gff-version 3\n# Comment\n"])
+def test_read_gff_index_empty_file(tmpdir, contents):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_index` with a GFF file
+    with no features raises an exception.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param contents: GFF file contents
+    :type contents: str or unicode
+    """
+    gff = tmpdir.join("test.gff")
+    gff.write(contents)
+    with pytest.raises(ValueError):
+        fasta_gff.read_gff_index(str(gff))
+
+
+@pytest.mark.parametrize("line", [
+    "A\ttest\tCDS\t4\t27\t.\t+",
+    "A\ttest\tCDS\tfour\t27\t.\t+\t0\tID=A_CDS"])
+def test_read_gff_index_invalid_line(tmpdir, line):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_index` with a GFF file
+    with an invalid line raises an exception.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param line: Invalid line
+    :type line: str or unicode
+    """
+    gff = tmpdir.join("test.gff")
+    gff.write("##gff-version 3\n" + line + "\n")
+    with pytest.raises(ValueError) as exception:
+        fasta_gff.read_gff_index(str(gff))
+    assert "line 2" in str(exception.value)
+
+
+@pytest.mark.parametrize("attributes,values", [
+    ("ID=A%2CCDS;Name=A_1,A_2", [["A,CDS"], ["A_1", "A_2"]]),
+    ("ID=;Note=No Name", [[], None]),
+    ('gene_id "A_CDS"; Name "A_1"; transcript_id "A"',
+     [None, ["A_1"]]),
+    ('ID A_CDS;Name ""', [["A_CDS"], []]),
+    ("", [None, None])])
+def test_get_attribute_values(attributes, values):
+    """
+    Test :py:func:`riboviz.fasta_gff.get_attribute_values` with
+    GFF3 and GFF2/GTF attributes.
+
+    :param attributes: Attributes column
+    :type attributes: str or unicode
+    :param values: Expected ``ID`` and ``Name`` attribute values
+    :type values: list(list(str or unicode))
+    """
+    assert fasta_gff.get_attribute_values(attributes,
+                                          ["ID", "Name"]) == values
+
+
+def test_read_gff_records(gff_file):
+    """
+    Test :py:func:`riboviz.fasta_gff.read_gff_records` yields every
+    record, including duplicates, and no comments or FASTA lines.
+
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    """
+    records = list(fasta_gff.read_gff_records(gff_file, ["Name"]))
+    assert [line_number for line_number, _, _ in records] == \
+        [3, 4, 5, 6, 7, 9, 10]
+    assert [fields[2] for _, fields, _ in records] == \
+        ["mRNA"] + ["CDS"] * 6
+    assert [values for _, _, values in records] == \
+        [[None], [["A_1", "A_2"]], [["A_3"]], [None], [["B;CDS"]],
+         [None], [["C_Name"]]]
+
+
+def test_get_gff_index_cache(tmpdir, gff_file):
+    """
+    Test :py:func:`riboviz.fasta_gff.get_gff_index` caches indices
+    and uses cached indices only if the GFF file is unchanged.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    """
+    cache_dir = str(tmpdir.join("cache"))
+    index = fasta_gff.get_gff_index(gff_file, cache_dir=cache_dir)
+    assert [tuple(feature) for feature in index] == TEST_CDS
+    index_files = os.listdir(cache_dir)
+    assert len(index_files) == 1
+    assert index_files[0].startswith(fasta_gff.get_file_hash(gff_file))
+    cached_index = fasta_gff.get_gff_index(gff_file, cache_dir=cache_dir)
+    assert cached_index.num_features == TEST_NUM_FEATURES
+    assert [tuple(feature) for feature in cached_index] == TEST_CDS
+    assert os.listdir(cache_dir) == index_files
+    with open(gff_file, "w") as f:
+        f.write(TEST_GFF.replace(
+            fasta_gff.FASTA_DIRECTIVE,
+            "D\ttest\tCDS\t4\t27\t.\t+\t0\tID=D_CDS\n" +
+            fasta_gff.FASTA_DIRECTIVE))
+    index = fasta_gff.get_gff_index(gff_file, cache_dir=cache_dir)
+    assert len(index) == len(TEST_CDS) + 1
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_get_gff_index_no_cache(tmpdir, gff_file):
+    """
+    Test :py:func:`riboviz.fasta_gff.get_gff_index` with no cache
+    directory.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param gff_file: GFF file
+    :type gff_file: str or unicode
+    """
+    index = fasta_gff.get_gff_index(gff_file, cache_dir=None)
+    assert [tuple(feature) for feature in index] == TEST_CDS
+    assert os.listdir(str(tmpdir)) == ["test.gff"]
+
+
+def test_gff_feature_sequence(tmpdir):
+    """
+    Test :py:meth:`riboviz.fasta_gff.GffFeature.sequence` for
+    features on each strand.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    fasta = tmpdir.join("test.fasta")
+    fasta.write(">A\nCCATGAA\nATAGG\n")
+    fasta_genes = Fasta(str(fasta))
+    assert fasta_gff.GffFeature("A", 3, 11, "+", "0", {}).sequence(
+        fasta_genes) == "ATGAAATAG"
+    assert fasta_gff.GffFeature("A", 3, 11, "-", "0", {}).sequence(
+        fasta_genes) == "CTATTTCAT"
+    with pytest.raises(KeyError):
+        fasta_gff.GffFeature("B", 3, 11, "+", "0", {}).sequence(
+            fasta_genes)
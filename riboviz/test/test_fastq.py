@@ -1,12 +1,16 @@
 """
 :py:mod:`riboviz.fastq` tests.
 """
+import concurrent.futures
 import gzip
+from io import BytesIO
 import itertools
 import os
 import tempfile
+import zlib
 import pytest
 from Bio import SeqIO
+from Bio import bgzf
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from riboviz import fastq
@@ -177,3 +181,597 @@ def test_count_sequences_gz(tmp_gz_file, count):
     with gzip.open(tmp_gz_file, "wt") as f:
         SeqIO.write(sequences, f, "fastq")
     assert fastq.count_sequences(tmp_gz_file) == count
+
+
+@pytest.mark.parametrize("block_size", [1, 7, fastq.BLOCK_SIZE])
+@pytest.mark.parametrize("count", [0, 1, 10])
+def test_read_fastq_records(tmp_file, count, block_size):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_records` returns the
+    same records as ``Bio.SeqIO``.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param count: Number of sequences
+    :type count: int
+    :param block_size: Block size in bytes
+    :type block_size: int
+    """
+    sequences = get_test_fastq_sequences(4, count)
+    with open(tmp_file, "wt") as f:
+        SeqIO.write(sequences, f, "fastq")
+    with fastq.open_fastq(tmp_file) as f:
+        records = list(fastq.read_fastq_records(f, block_size))
+    assert len(records) == count
+    for (header, sequence, _, quality), expected in zip(records,
+                                                        sequences):
+        assert header.decode() == expected.id
+        assert sequence.decode() == str(expected.seq)
+        assert [q - 33 for q in quality] == \
+            expected.letter_annotations["phred_quality"]
+
+
+def test_read_fastq_records_gz(tmp_gz_file):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_records` with GZIPped
+    FASTQ files.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    """
+    sequences = get_test_fastq_sequences(4, 10)
+    with gzip.open(tmp_gz_file, "wt") as f:
+        SeqIO.write(sequences, f, "fastq")
+    with fastq.open_fastq(tmp_gz_file) as f:
+        records = list(fastq.read_fastq_records(f))
+    assert [header.decode() for header, _, _, _ in records] == \
+        [sequence.id for sequence in sequences]
+
+
+def test_read_fastq_records_no_final_newline():
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_records` with a file
+    whose last line has no newline.
+    """
+    fh = BytesIO(b"@r1\nACGT\n+\nIIII\n@r2\nAC\n+r2\nII")
+    records = list(fastq.read_fastq_records(fh))
+    assert records == [(b"r1", b"ACGT", b"", b"IIII"),
+                       (b"r2", b"AC", b"r2", b"II")]
+
+
+@pytest.mark.parametrize("content",
+                         [b"@r1\nACGT\n+\nIIII\n@r2\nAC\n",
+                          b"r1\nACGT\n+\nIIII\n",
+                          b"@r1\nACGT\n-\nIIII\n",
+                          b"@r1\nACGT\n+\nIII\n"])
+def test_read_fastq_records_malformed(content):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_records` raises
+    ``ValueError`` with truncated or malformed records.
+
+    :param content: FASTQ file content
+    :type content: bytes
+    """
+    with pytest.raises(ValueError):
+        list(fastq.read_fastq_records(BytesIO(content)))
+
+
+@pytest.mark.parametrize("block_size", [1, 7, fastq.BLOCK_SIZE])
+def test_read_fastq_lines(block_size):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_lines` returns the lines
+    of each record, without newlines, irrespective of block size.
+
+    :param block_size: Block size in bytes
+    :type block_size: int
+    """
+    fh = BytesIO(b"@r1 x\nACGT\n+\nIIII\n@r2\nAC\n+r2\nII\n\n")
+    assert list(fastq.read_fastq_lines(fh, block_size)) == \
+        [(b"@r1 x", b"ACGT", b"+", b"IIII"), (b"@r2", b"AC", b"+r2", b"II")]
+
+
+@pytest.mark.parametrize("block_size", [1, 7, fastq.BLOCK_SIZE])
+def test_read_fastq_raw_records(block_size):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_raw_records` returns the
+    original content of each record, including that of ``+`` lines,
+    and adds a newline to a last line with no newline.
+
+    :param block_size: Block size in bytes
+    :type block_size: int
+    """
+    fh = BytesIO(b"@r1 x\nACGT\n+\nIIII\n@r2\nAC\n+r2\nII")
+    records = list(fastq.read_fastq_raw_records(fh, block_size))
+    assert records == [b"@r1 x\nACGT\n+\nIIII\n", b"@r2\nAC\n+r2\nII\n"]
+
+
+@pytest.mark.parametrize("content",
+                         [b"@r1\nACGT\n+\nIIII\n@r2\nAC\n",
+                          b"@r1\nACGT\n-\nIIII\n"])
+def test_read_fastq_raw_records_malformed(content):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_raw_records` raises
+    ``ValueError`` with truncated or malformed records.
+
+    :param content: FASTQ file content
+    :type content: bytes
+    """
+    with pytest.raises(ValueError):
+        list(fastq.read_fastq_raw_records(BytesIO(content)))
+
+
+def test_read_fastq_record_pairs():
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_record_pairs`.
+    """
+    fh1 = BytesIO(b"@r1/1\nACGT\n+\nIIII\n@r2/1\nAC\n+\nII\n")
+    fh2 = BytesIO(b"@r1/2\nTTTT\n+\nIIII\n@r2/2\nGG\n+\nII\n")
+    pairs = list(fastq.read_fastq_record_pairs(fh1, fh2, 5))
+    assert pairs == [((b"r1/1", b"ACGT", b"", b"IIII"),
+                      (b"r1/2", b"TTTT", b"", b"IIII")),
+                     ((b"r2/1", b"AC", b"", b"II"),
+                      (b"r2/2", b"GG", b"", b"II"))]
+
+
+def test_read_fastq_record_pairs_unequal():
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_record_pairs` raises
+    ``ValueError`` if the files have different numbers of records.
+    """
+    fh1 = BytesIO(b"@r1/1\nACGT\n+\nIIII\n@r2/1\nAC\n+\nII\n")
+    fh2 = BytesIO(b"@r1/2\nTTTT\n+\nIIII\n")
+    with pytest.raises(ValueError):
+        list(fastq.read_fastq_record_pairs(fh1, fh2))
+
+
+@pytest.mark.parametrize("block_size", [1, 7, fastq.BLOCK_SIZE])
+@pytest.mark.parametrize("num_records,num_chunks", [(1, 3), (2, 2), (3, 1)])
+def test_read_fastq_chunks(block_size, num_records, num_chunks):
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_chunks` splits the
+    original content of records into chunks of ``num_records``
+    records, irrespective of block size, and adds a newline to a last
+    line with no newline.
+
+    :param block_size: Block size in bytes
+    :type block_size: int
+    :param num_records: Number of records per chunk
+    :type num_records: int
+    :param num_chunks: Expected number of chunks
+    :type num_chunks: int
+    """
+    records = [b"@r1 x\nACGT\n+\nIIII\n",
+               b"@r2\nAC\n+r2\nII\n",
+               b"@r3\nA\n+\nI\n"]
+    fh = BytesIO(b"".join(records)[:-1])
+    chunks = list(fastq.read_fastq_chunks(fh, num_records, block_size))
+    assert len(chunks) == num_chunks
+    assert b"".join(chunks) == b"".join(records)
+    for chunk in chunks[:-1]:
+        assert len(list(fastq.read_fastq_records(BytesIO(chunk)))) == \
+            num_records
+
+
+def test_read_fastq_chunks_empty():
+    """
+    Test :py:func:`riboviz.fastq.read_fastq_chunks` returns no chunks
+    for a file with no records.
+    """
+    assert list(fastq.read_fastq_chunks(BytesIO(b"\n\n"), 2)) == []
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, fastq.WRITE_BATCH_SIZE])
+def test_fastq_writer(tmp_file, batch_size):
+    """
+    Test :py:class:`riboviz.fastq.FastqWriter` writes records that
+    can be read by ``Bio.SeqIO``.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param batch_size: Number of records to buffer before writing
+    :type batch_size: int
+    """
+    records = [(b"r1 extra", b"ACGT", b"", b"IIII"),
+               (b"r2", b"AC", b"r2", b"#I"),
+               (b"r3", b"A", b"", b"I")]
+    with fastq.FastqWriter(fastq.open_fastq(tmp_file, "wb"),
+                           batch_size) as writer:
+        writer.write(records[0])
+        writer.write_records(records[1:2])
+        writer.write_formatted(fastq.format_fastq_record(records[2]))
+    with open(tmp_file, "rb") as f:
+        assert f.read() == b"".join(fastq.format_fastq_record(record)
+                                    for record in records)
+    sequences = list(SeqIO.parse(tmp_file, "fastq"))
+    assert [sequence.description for sequence in sequences] == \
+        ["r1 extra", "r2", "r3"]
+    assert [str(sequence.seq) for sequence in sequences] == \
+        ["ACGT", "AC", "A"]
+
+
+@pytest.mark.parametrize("strict", [False, True])
+@pytest.mark.parametrize("content,count",
+                         [(b"", 0),
+                          (b"\n", 0),
+                          (b"@r1\nACGT\n+\nIIII\n", 1),
+                          (b"@r1\nACGT\n+\nIIII", 1),
+                          (b"@r1\nACGT\n+\nIIII\n\n\n", 1),
+                          (b"@r1\nACGT\n+\nIIII\n@r2\nAC\n+\nII\n", 2)])
+def test_count_sequences_content(tmp_file, content, count, strict):
+    """
+    Test :py:func:`riboviz.fastq.count_sequences` with files with
+    and without final newlines and with trailing empty lines.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param content: FASTQ file content
+    :type content: bytes
+    :param count: Number of sequences
+    :type count: int
+    :param strict: Parse and validate each record?
+    :type strict: bool
+    """
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+    assert fastq.count_sequences(tmp_file, strict) == count
+
+
+@pytest.mark.parametrize("strict", [False, True])
+def test_count_sequences_truncated(tmp_file, strict):
+    """
+    Test :py:func:`riboviz.fastq.count_sequences` raises
+    ``ValueError`` with a truncated file.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param strict: Parse and validate each record?
+    :type strict: bool
+    """
+    with open(tmp_file, "wb") as f:
+        f.write(b"@r1\nACGT\n+\nIIII\n@r2\nAC\n")
+    with pytest.raises(ValueError):
+        fastq.count_sequences(tmp_file, strict)
+
+
+def test_count_sequences_gz_multiple_members(tmp_gz_file):
+    """
+    Test :py:func:`riboviz.fastq.count_sequences` with a GZIPped
+    FASTQ file with multiple GZIP members.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    """
+    with open(tmp_gz_file, "wb") as f:
+        for _ in range(3):
+            f.write(gzip.compress(b"@r1\nACGT\n+\nIIII\n" * 10))
+    assert fastq.count_sequences(tmp_gz_file) == 30
+
+
+@pytest.mark.parametrize("block_size", [1, 5, fastq.BLOCK_SIZE])
+def test_read_blocks(tmp_file, tmp_gz_file, block_size):
+    """
+    Test :py:func:`riboviz.fastq.read_blocks` with FASTQ files and
+    GZIPped FASTQ files.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param block_size: Block size in bytes
+    :type block_size: int
+    """
+    content = b"@r1\nACGT\n+\nIIII\n" * 5
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+    with gzip.open(tmp_gz_file, "wb") as f:
+        f.write(content)
+    assert b"".join(fastq.read_blocks(tmp_file, block_size)) == content
+    assert b"".join(fastq.read_blocks(tmp_gz_file, block_size)) == content
+
+
+@pytest.mark.parametrize("block_size", [1, 5, fastq.BLOCK_SIZE])
+def test_read_blocks_gz_truncated(tmp_gz_file, block_size):
+    """
+    Test :py:func:`riboviz.fastq.read_blocks` and
+    :py:func:`riboviz.fastq.count_sequences` with a GZIPped FASTQ
+    file truncated on a record boundary raise ``EOFError``, as
+    :py:func:`gzip.open` does, rather than returning fewer records.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param block_size: Block size in bytes
+    :type block_size: int
+    """
+    content = b"@r1\nACGT\n+\nIIII\n" * 5
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    with open(tmp_gz_file, "wb") as f:
+        f.write(compressor.compress(content) +
+                compressor.flush(zlib.Z_SYNC_FLUSH))
+    blocks = []
+    with pytest.raises(EOFError):
+        for block in fastq.read_blocks(tmp_gz_file, block_size):
+            blocks.append(block)
+    assert b"".join(blocks) == content
+    with pytest.raises(EOFError):
+        fastq.count_sequences(tmp_gz_file)
+    with pytest.raises(EOFError):
+        with gzip.open(tmp_gz_file) as f:
+            f.read()
+
+
+def test_read_blocks_gz_empty(tmp_gz_file):
+    """
+    Test :py:func:`riboviz.fastq.read_blocks` with an empty GZIPped
+    FASTQ file returns no content, as :py:func:`gzip.open` does.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    """
+    open(tmp_gz_file, "wb").close()
+    assert b"".join(fastq.read_blocks(tmp_gz_file)) == b""
+
+
+@pytest.mark.parametrize("read_size", [-1, 1, 7, fastq.BLOCK_SIZE])
+def test_threaded_reader(tmp_file, tmp_gz_file, read_size):
+    """
+    Test :py:class:`riboviz.fastq.ThreadedReader` with FASTQ files and
+    GZIPped FASTQ files, with multiple GZIP members.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param read_size: Number of bytes to read at a time
+    :type read_size: int
+    """
+    content = b"@r1\nACGT\n+\nIIII\n" * 1000
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+    with open(tmp_gz_file, "wb") as f:
+        f.write(gzip.compress(content[:5000]))
+        f.write(gzip.compress(content[5000:]))
+    for file_name in [tmp_file, tmp_gz_file]:
+        with fastq.ThreadedReader(file_name, block_size=100) as f:
+            data = []
+            for block in iter(lambda: f.read(read_size), b""):
+                assert read_size < 0 or len(block) <= read_size
+                data.append(block)
+            assert f.read(read_size) == b""
+        assert b"".join(data) == content
+
+
+def test_threaded_reader_fastq_records(tmp_gz_file):
+    """
+    Test :py:class:`riboviz.fastq.ThreadedReader` with
+    :py:func:`riboviz.fastq.read_fastq_records`.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    """
+    records = [(b"r%d" % i, b"ACGT", b"", b"IIII") for i in range(100)]
+    with gzip.open(tmp_gz_file, "wb") as f:
+        f.writelines(fastq.format_fastq_record(record)
+                     for record in records)
+    with fastq.ThreadedReader(tmp_gz_file, block_size=10) as f:
+        assert list(fastq.read_fastq_records(f, 16)) == records
+
+
+def test_threaded_reader_invalid_gz(tmp_gz_file):
+    """
+    Test :py:class:`riboviz.fastq.ThreadedReader` with a truncated
+    GZIPped FASTQ file raises the error raised when decompressing
+    the file.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    """
+    with open(tmp_gz_file, "wb") as f:
+        f.write(gzip.compress(b"@r1\nACGT\n+\nIIII\n" * 10)[:20] +
+                b"\x00" * 20)
+    with fastq.ThreadedReader(tmp_gz_file) as f:
+        with pytest.raises(Exception):
+            f.read()
+
+
+def test_threaded_reader_close(tmp_file):
+    """
+    Test :py:class:`riboviz.fastq.ThreadedReader` can be closed
+    before the whole file has been read.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    """
+    with open(tmp_file, "wb") as f:
+        f.write(b"@r1\nACGT\n+\nIIII\n" * 1000)
+    with fastq.ThreadedReader(tmp_file, block_size=10,
+                              queue_size=1) as f:
+        assert f.read(4) == b"@r1\n"
+
+
+@pytest.mark.parametrize("num_threads", [1, 3])
+@pytest.mark.parametrize("member_size", [1, 100, fastq.GZ_MEMBER_SIZE])
+def test_parallel_gzip_writer(tmp_gz_file, num_threads, member_size):
+    """
+    Test :py:class:`riboviz.fastq.ParallelGzipWriter` writes a GZIP
+    file with the data written.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param num_threads: Number of threads
+    :type num_threads: int
+    :param member_size: GZIP member size
+    :type member_size: int
+    """
+    records = [fastq.format_fastq_record((b"r%d" % i, b"ACGT", b"", b"IIII"))
+               for i in range(200)]
+    with fastq.ParallelGzipWriter(tmp_gz_file, num_threads,
+                                  member_size) as f:
+        f.write(records[0])
+        f.writelines(records[1:])
+    with gzip.open(tmp_gz_file, "rb") as f:
+        assert f.read() == b"".join(records)
+
+
+def test_parallel_gzip_writer_empty(tmp_gz_file):
+    """
+    Test :py:class:`riboviz.fastq.ParallelGzipWriter` writes a valid,
+    empty, GZIP file if no data is written.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    """
+    with fastq.ParallelGzipWriter(tmp_gz_file, 2):
+        pass
+    with gzip.open(tmp_gz_file, "rb") as f:
+        assert f.read() == b""
+    assert os.path.getsize(tmp_gz_file) > 0
+
+
+@pytest.mark.parametrize("size", [0, 1, fastq.BGZF_BLOCK_SIZE,
+                                  fastq.BGZF_BLOCK_SIZE + 1])
+def test_compress_bgzf_blocks(size):
+    """
+    Test :py:func:`riboviz.fastq.compress_bgzf_blocks` writes BGZF
+    blocks which can be read by ``gzip`` and ``Bio.bgzf``.
+
+    :param size: Number of bytes of data
+    :type size: int
+    """
+    data = (b"@r1\nACGT\n+\nIIII\n" * (size // 16 + 1))[:size]
+    blocks = fastq.compress_bgzf_blocks(data)
+    assert gzip.decompress(blocks) == data
+    bgzf_blocks = list(bgzf.BgzfBlocks(BytesIO(blocks)))
+    assert len(bgzf_blocks) == -(-size // fastq.BGZF_BLOCK_SIZE)
+    assert sum(block[3] for block in bgzf_blocks) == size
+
+
+@pytest.mark.parametrize("num_threads", [1, 3])
+def test_parallel_bgzf_writer(tmp_gz_file, num_threads):
+    """
+    Test :py:class:`riboviz.fastq.ParallelBgzfWriter` writes a BGZF
+    file, with an end-of-file marker, which can be read by ``gzip``
+    and ``Bio.bgzf``.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param num_threads: Number of threads
+    :type num_threads: int
+    """
+    data = b"".join(fastq.format_fastq_record(
+        (b"r%d" % i, b"ACGT", b"", b"IIII")) for i in range(20000))
+    with fastq.ParallelBgzfWriter(tmp_gz_file, num_threads,
+                                  fastq.BGZF_BLOCK_SIZE) as f:
+        f.write(data)
+    with gzip.open(tmp_gz_file, "rb") as f:
+        assert f.read() == data
+    with bgzf.BgzfReader(tmp_gz_file, "rb") as f:
+        assert f.read(len(data) + 1) == data
+    with open(tmp_gz_file, "rb") as f:
+        assert f.read().endswith(fastq.BGZF_EOF)
+
+
+def test_open_fastq_writer_shared_executor(tmp_gz_file, tmp_file):
+    """
+    Test :py:func:`riboviz.fastq.open_fastq_writer` writes BGZF files
+    using a shared executor, which is not shut down when files are
+    closed, and plain files for non-GZIP file names.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    """
+    records = [(b"r%d" % i, b"ACGT", b"", b"IIII") for i in range(100)]
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        for file_name in [tmp_gz_file, tmp_file]:
+            with fastq.open_fastq_writer(file_name, 2, executor, 7) as f:
+                f.write_records(records)
+        assert executor.submit(sum, [1, 2]).result() == 3
+    with open(tmp_gz_file, "rb") as f:
+        assert f.read(len(fastq.BGZF_HEADER)) == fastq.BGZF_HEADER
+    with fastq.open_fastq(tmp_gz_file) as f:
+        assert list(fastq.read_fastq_records(f)) == records
+    with fastq.open_fastq(tmp_file) as f:
+        assert list(fastq.read_fastq_records(f)) == records
+
+
+@pytest.mark.parametrize("ext,num_threads", [(fastq.FASTQ_EXT, 0),
+                                             (fastq.FASTQ_GZ_EXT, 0),
+                                             (fastq.FASTQ_GZ_EXT, 2)])
+@pytest.mark.parametrize("max_open_files", [1, 2, 10])
+@pytest.mark.parametrize("buffer_size", [1, fastq.POOL_BUFFER_SIZE])
+def test_fastq_writer_pool(tmpdir, ext, num_threads, max_open_files,
+                           buffer_size):
+    """
+    Test :py:class:`riboviz.fastq.FastqWriterPool` writes records to
+    each file, in order, when files are closed and reopened, and
+    creates only files which are written to.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param ext: File extension
+    :type ext: str or unicode
+    :param num_threads: Number of threads
+    :type num_threads: int
+    :param max_open_files: Maximum number of open files
+    :type max_open_files: int
+    :param buffer_size: Maximum number of bytes to buffer
+    :type buffer_size: int
+    """
+    file_names = [str(tmpdir.join("{}.{}".format(i, ext)))
+                  for i in range(5)]
+    records = [(b"r%d" % i, b"ACGT", b"", b"IIII") for i in range(200)]
+    with fastq.FastqWriterPool(max_open_files, num_threads,
+                               batch_size=3,
+                               buffer_size=buffer_size) as pool:
+        writers = [pool.get_writer(file_name) for file_name in file_names]
+        for i, record in enumerate(records):
+            # Write nothing to the last file.
+            if i % 3 == 0:
+                writers[i % 4].write(record)
+            elif i % 3 == 1:
+                writers[i % 4].write_records([record])
+            else:
+                writers[i % 4].write_formatted(
+                    fastq.format_fastq_record(record))
+        assert not pool.is_created(file_names[4])
+    for i, file_name in enumerate(file_names[:4]):
+        with fastq.open_fastq(file_name) as f:
+            assert list(fastq.read_fastq_records(f)) == records[i::4]
+        if num_threads:
+            with open(file_name, "rb") as f:
+                data = f.read()
+            assert data.endswith(fastq.BGZF_EOF)
+            assert data.count(fastq.BGZF_EOF) == 1
+    assert not os.path.exists(file_names[4])
+
+
+def test_fastq_writer_pool_create(tmpdir):
+    """
+    Test :py:meth:`riboviz.fastq.FastqWriterPool.create` creates an
+    empty file, which is not truncated when records are written.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    file_name = str(tmpdir.join("test.fastq"))
+    other_file_name = str(tmpdir.join("other.fastq"))
+    with fastq.FastqWriterPool(1) as pool:
+        pool.create(file_name)
+        assert pool.is_created(file_name)
+        assert os.path.exists(file_name)
+        pool.get_writer(other_file_name).write((b"r0", b"AC", b"", b"II"))
+        pool.flush(other_file_name)
+        pool.get_writer(file_name).write((b"r1", b"AC", b"", b"II"))
+    with fastq.open_fastq(file_name) as f:
+        assert list(fastq.read_fastq_records(f)) == \
+            [(b"r1", b"AC", b"", b"II")]
+
+
+def test_fastq_writer_pool_max_open_files():
+    """
+    Test :py:class:`riboviz.fastq.FastqWriterPool` raises
+    ``ValueError`` if the maximum number of open files is less than 1.
+    """
+    with pytest.raises(ValueError):
+        fastq.FastqWriterPool(0)
@@ -540,3 +540,69 @@ def test_get_cds_codons_file_exclude_stop_codons(tmp_file):
         name: codons[:-1] for name, codons in TEST_CDS_CODONS.items()
     }
     check_feature_codons_csv(cds_codons_minus_stops, tmp_file)
+
+
+def test_iter_cds_codons_from_fasta():
+    """
+    Test :py:func:`riboviz.get_cds_codons.iter_cds_codons_from_fasta`
+    with FASTA file (:py:const:`TEST_FASTA_CODONS_FILE`) and GFF file
+    (:py:const:`TEST_GFF_CODONS_FILE`) returns codons in the order
+    of the CDS in the GFF file.
+    """
+    cds_codons = get_cds_codons.iter_cds_codons_from_fasta(
+        TEST_FASTA_CODONS_FILE,
+        TEST_GFF_CODONS_FILE)
+    assert list(cds_codons) == list(TEST_CDS_CODONS.items())
+
+
+def test_iter_cds_codons_from_fasta_no_such_gff_file(tmp_file):
+    """
+    Test :py:func:`riboviz.get_cds_codons.iter_cds_codons_from_fasta`
+    with FASTA file (:py:const:`TEST_FASTA_CODONS_FILE`) and a
+    non-existent GFF file raises an exception when called, rather
+    than when its codons are iterated over.
+
+    :param tmp_file: Temporary file
+    :type tmp_file: str or unicode
+    """
+    os.remove(tmp_file)
+    with pytest.raises(FileNotFoundError):
+        get_cds_codons.iter_cds_codons_from_fasta(TEST_FASTA_CODONS_FILE,
+                                                  tmp_file)
+
+
+@pytest.mark.parametrize("file_name", ["codons.tsv", "codons.tsv.gz"])
+def test_get_cds_codons_file_index(tmpdir, file_name):
+    """
+    Test :py:func:`riboviz.get_cds_codons.get_cds_codons_file` with
+    FASTA file (:py:const:`TEST_FASTA_CODONS_FILE`) and GFF file
+    (:py:const:`TEST_GFF_CODONS_FILE`) and an index file, validate
+    the TSV file output, and read codons for all, and some, features
+    using
+    :py:func:`riboviz.get_cds_codons.read_feature_codons_from_csv`.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param file_name: TSV file name
+    :type file_name: str or unicode
+    """
+    codons_file = str(tmpdir.join(file_name))
+    index_file = str(tmpdir.join("index.tsv"))
+    get_cds_codons.get_cds_codons_file(TEST_FASTA_CODONS_FILE,
+                                       TEST_GFF_CODONS_FILE,
+                                       codons_file,
+                                       index_file=index_file)
+    check_feature_codons_csv(TEST_CDS_CODONS, codons_file)
+    index_df = pd.read_csv(index_file, delimiter="\t", comment="#")
+    assert list(index_df[get_cds_codons.GENE]) == list(TEST_CDS_CODONS)
+    assert list(index_df[get_cds_codons.NUM_CODONS]) == \
+        [len(codons) for codons in TEST_CDS_CODONS.values()]
+    assert get_cds_codons.read_feature_codons_from_csv(
+        codons_file, index_file) == TEST_CDS_CODONS
+    features = ["YAL010CMultiDuplicateCDS_CDS.2", "YAL002C_CDS"]
+    assert get_cds_codons.read_feature_codons_from_csv(
+        codons_file, index_file, features) == \
+        {feature: TEST_CDS_CODONS[feature] for feature in features}
+    with pytest.raises(KeyError):
+        get_cds_codons.read_feature_codons_from_csv(
+            codons_file, index_file, ["NoSuchFeature"])
@@ -0,0 +1,368 @@
+"""
+:py:mod:`riboviz.h5` tests.
+"""
+import os
+import shutil
+import tempfile
+import h5py
+import numpy as np
+import pytest
+from riboviz import h5
+
+DATASET = "test"
+""" Dataset name. """
+LENGTHS = np.arange(10, 14, dtype=np.int32)
+""" Read lengths. """
+
+
+def make_genes():
+    """
+    Create genes with read counts and attributes. Genes include one
+    with no reads, one with an alternative name and one with a
+    single position.
+
+    :return: Genes
+    :rtype: list(tuple(str or unicode, str or unicode, \
+    numpy.ndarray, dict(str or unicode => numpy.ndarray)))
+    """
+    rng = np.random.default_rng(42)
+    genes = []
+    for gene, alt_gene, num_positions, density in [
+            ("G1", None, 30, 0.2), ("G2", "ALT2", 45, 0.5),
+            ("G3", None, 12, 0.0), ("G4", None, 1, 1.0)]:
+        counts = (rng.random((num_positions, len(LENGTHS))) <
+                  density) * rng.integers(1, 100, (num_positions,
+                                                   len(LENGTHS)))
+        counts = counts.astype(np.int32)
+        attributes = {
+            h5.READS_TOTAL: np.array([counts.sum()], dtype=np.int32),
+            h5.BUFFER_LEFT: np.array([5], dtype=np.int32),
+            h5.BUFFER_RIGHT: np.array([num_positions - 8],
+                                      dtype=np.int32),
+            h5.START_CODON_POS: np.array([6, 7, 8], dtype=np.int32),
+            h5.STOP_CODON_POS: np.array([num_positions - 10,
+                                         num_positions - 9,
+                                         num_positions - 8],
+                                        dtype=np.int32),
+            h5.READS_BY_LEN: counts.sum(axis=0).astype(np.int32),
+            h5.LENGTHS: LENGTHS
+        }
+        genes.append((gene, alt_gene, counts, attributes))
+    return genes
+
+
+@pytest.fixture(scope="function")
+def tmp_dir():
+    """
+    Create a temporary directory.
+
+    :return: path to temporary directory
+    :rtype: str or unicode
+    """
+    tmp_dir = tempfile.mkdtemp(__name__)
+    yield tmp_dir
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+
+def validate_reader(h5_file, genes):
+    """
+    Validate :py:class:`riboviz.h5.H5Reader` returns the expected
+    genes, read counts and attributes.
+
+    :param h5_file: H5 file
+    :type h5_file: str or unicode
+    :param genes: Expected genes (see :py:func:`make_genes`)
+    :type genes: list(tuple(str or unicode, str or unicode, \
+    numpy.ndarray, dict(str or unicode => numpy.ndarray)))
+    """
+    with h5.H5Reader(h5_file) as reader:
+        assert reader.dataset == DATASET
+        assert reader.genes == [gene for gene, _, _, _ in genes]
+        assert reader.alt_genes == [alt_gene for _, alt_gene, _, _
+                                    in genes]
+        np.testing.assert_array_equal(reader.lengths, LENGTHS)
+        for gene, alt_gene, counts, attributes in genes:
+            for name in [gene, alt_gene] if alt_gene else [gene]:
+                assert name in reader
+                np.testing.assert_array_equal(reader.get_counts(name),
+                                              counts)
+                actual = reader.get_attributes(name)
+                assert set(actual) == set(attributes)
+                for key, value in attributes.items():
+                    np.testing.assert_array_equal(actual[key], value)
+        iterated = list(reader.iter_genes())
+    assert [gene for gene, _, _ in iterated] == \
+        [gene for gene, _, _, _ in genes]
+    for (_, counts, attributes), (_, _, expected, expected_attributes) \
+            in zip(iterated, genes):
+        np.testing.assert_array_equal(counts, expected)
+        for key, value in expected_attributes.items():
+            np.testing.assert_array_equal(attributes[key], value)
+
+
+@pytest.mark.parametrize("layout", h5.LAYOUTS)
+def test_write_h5(tmp_dir, layout):
+    """
+    Test :py:func:`riboviz.h5.write_h5` and
+    :py:class:`riboviz.h5.H5Reader` with each layout.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param layout: Layout
+    :type layout: str or unicode
+    """
+    h5_file = os.path.join(tmp_dir, "test.h5")
+    genes = make_genes()
+    h5.write_h5(h5_file, DATASET, iter(genes), layout)
+    with h5py.File(h5_file, "r") as f:
+        if layout == h5.CSR:
+            assert f.attrs[h5.LAYOUT] == h5.CSR
+            assert f[h5.INDPTR].shape == (len(genes) + 1,)
+            assert f[h5.DATA].compression == "gzip"
+            assert f[h5.DATA].chunks == (h5.CSR_CHUNK_SIZE,)
+        else:
+            assert h5.LAYOUT not in f.attrs
+            assert isinstance(f.get("ALT2", getlink=True),
+                              h5py.ExternalLink)
+    validate_reader(h5_file, genes)
+
+
+def test_iter_genes_blocks(tmp_dir, monkeypatch):
+    """
+    Test :py:meth:`riboviz.h5.H5Reader.iter_genes` with a CSR layout
+    file, where blocks hold fewer non-zero counts than some genes.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param monkeypatch: Monkeypatch fixture
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    monkeypatch.setattr(h5, "BLOCK_SIZE", 30)
+    h5_file = os.path.join(tmp_dir, "test.h5")
+    genes = make_genes()
+    h5.write_h5(h5_file, DATASET, genes, h5.CSR)
+    validate_reader(h5_file, genes)
+
+
+@pytest.mark.parametrize("layout", h5.LAYOUTS)
+def test_convert_h5(tmp_dir, layout):
+    """
+    Test :py:func:`riboviz.h5.convert_h5` from each layout to the
+    other and back.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param layout: Layout of file to convert
+    :type layout: str or unicode
+    """
+    h5_file = os.path.join(tmp_dir, "test.h5")
+    converted_file = os.path.join(tmp_dir, "converted.h5")
+    round_trip_file = os.path.join(tmp_dir, "round_trip.h5")
+    other_layout = h5.CSR if layout == h5.LEGACY else h5.LEGACY
+    genes = make_genes()
+    h5.write_h5(h5_file, DATASET, genes, layout)
+    h5.convert_h5(h5_file, converted_file, other_layout)
+    with h5.H5Reader(converted_file) as reader:
+        assert reader.layout == other_layout
+    validate_reader(converted_file, genes)
+    h5.convert_h5(converted_file, round_trip_file, layout)
+    validate_reader(round_trip_file, genes)
+
+
+def test_write_h5_unknown_layout(tmp_dir):
+    """
+    Test :py:func:`riboviz.h5.write_h5` with an unknown layout raises
+    ``ValueError``.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    with pytest.raises(ValueError):
+        h5.write_h5(os.path.join(tmp_dir, "test.h5"), DATASET,
+                    make_genes(), "unknown")
+
+
+@pytest.mark.parametrize("layout", h5.LAYOUTS)
+def test_get_counts_unknown_gene(tmp_dir, layout):
+    """
+    Test :py:meth:`riboviz.h5.H5Reader.get_counts` with an unknown
+    gene raises ``KeyError``.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param layout: Layout
+    :type layout: str or unicode
+    """
+    h5_file = os.path.join(tmp_dir, "test.h5")
+    h5.write_h5(h5_file, DATASET, make_genes(), layout)
+    with h5.H5Reader(h5_file) as reader:
+        assert "Unknown" not in reader
+        with pytest.raises(KeyError):
+            reader.get_counts("Unknown")
+
+
+def write_h5_pair(tmp_dir, layout=h5.LEGACY):
+    """
+    Write two H5 files, with the same name in different directories,
+    from :py:func:`make_genes`.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param layout: Layout
+    :type layout: str or unicode
+    :return: H5 files
+    :rtype: tuple(str or unicode, str or unicode)
+    """
+    h5_files = []
+    for directory in ["expected", "actual"]:
+        os.mkdir(os.path.join(tmp_dir, directory))
+        h5_file = os.path.join(tmp_dir, directory, "test.h5")
+        h5.write_h5(h5_file, DATASET, make_genes(), layout)
+        h5_files.append(h5_file)
+    return tuple(h5_files)
+
+
+@pytest.mark.parametrize("layout", h5.LAYOUTS)
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_equal_h5(tmp_dir, layout, num_processes):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` with equal files.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param layout: Layout
+    :type layout: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    h5_file1, h5_file2 = write_h5_pair(tmp_dir, layout)
+    h5.equal_h5(h5_file1, h5_file2, num_processes=num_processes)
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_equal_h5_counts_differ(tmp_dir, num_processes):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` with files whose read counts
+    differ reports the genes and positions that differ.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    h5_file1, h5_file2 = write_h5_pair(tmp_dir)
+    path = "/".join(["G1", DATASET, h5.READS, h5.DATA])
+    with h5py.File(h5_file2, "r+") as f:
+        counts = f[path][()]
+        counts[3, 1] += 1
+        counts[7, 2] += 2
+        f[path][...] = counts
+    with pytest.raises(AssertionError) as exc_info:
+        h5.equal_h5(h5_file1, h5_file2, num_processes=num_processes)
+    message = str(exc_info.value)
+    assert "/" + path + ": 2 difference(s)" in message
+    assert "(3, 1)" in message
+    assert "(7, 2)" in message
+    assert "G2" not in message
+
+
+def test_equal_h5_max_differences(tmp_dir):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` reports at most
+    ``max_differences`` differing genes and positions.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    h5_file1, h5_file2 = write_h5_pair(tmp_dir)
+    with h5py.File(h5_file2, "r+") as f:
+        for gene in ["G1", "G2", "G3"]:
+            data = f[gene][DATASET][h5.READS][h5.DATA]
+            data[...] = data[()] + 1
+    with pytest.raises(AssertionError) as exc_info:
+        h5.equal_h5(h5_file1, h5_file2, max_differences=2)
+    message = str(exc_info.value)
+    assert "/G1/" in message
+    assert "/G2/" in message
+    assert "/G3/" not in message
+    first_line = [line for line in message.split("\n")
+                  if line.startswith("/G1/" + DATASET + "/" + h5.READS +
+                                     "/" + h5.DATA)][0]
+    assert first_line.count("!=") == 2
+
+
+def test_equal_h5_attribute_differs(tmp_dir):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` with files whose attributes
+    differ.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    h5_file1, h5_file2 = write_h5_pair(tmp_dir)
+    with h5py.File(h5_file2, "r+") as f:
+        f["G2"][DATASET][h5.READS].attrs[h5.BUFFER_LEFT] = \
+            np.array([6], dtype=np.int32)
+    with pytest.raises(AssertionError) as exc_info:
+        h5.equal_h5(h5_file1, h5_file2)
+    assert "attribute " + h5.BUFFER_LEFT in str(exc_info.value)
+
+
+def test_equal_h5_gene_missing(tmp_dir):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` with a file with a missing
+    gene.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    h5_file1, h5_file2 = write_h5_pair(tmp_dir)
+    with h5py.File(h5_file2, "r+") as f:
+        del f["G3"]
+    with pytest.raises(AssertionError) as exc_info:
+        h5.equal_h5(h5_file1, h5_file2)
+    assert "/G3: only in first file" in str(exc_info.value)
+    with pytest.raises(AssertionError) as exc_info:
+        h5.equal_h5(h5_file2, h5_file1)
+    assert "/G3: only in second file" in str(exc_info.value)
+
+
+def test_equal_h5_tolerance(tmp_dir):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` compares floating point values
+    to within a tolerance and considers ``NaN`` values to be equal.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    """
+    h5_files = []
+    for name, values in [("test1.h5", [0.5, np.nan, 1.0]),
+                         ("test2.h5", [0.5001, np.nan, 1.0])]:
+        h5_file = os.path.join(tmp_dir, name)
+        with h5py.File(h5_file, "w") as f:
+            f.create_dataset("values", data=np.array(values))
+        h5_files.append(h5_file)
+    h5.equal_h5(*h5_files, tolerance=0.001)
+    with pytest.raises(AssertionError):
+        h5.equal_h5(*h5_files)
+
+
+def test_equal_h5_different_storage(tmp_dir, monkeypatch):
+    """
+    Test :py:func:`riboviz.h5.equal_h5` with files with equal values
+    but different compression, so their raw chunks differ.
+
+    :param tmp_dir: Temporary directory
+    :type tmp_dir: str or unicode
+    :param monkeypatch: Monkeypatch fixture
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    h5_file1, h5_file2 = write_h5_pair(tmp_dir)
+    os.remove(h5_file2)
+    monkeypatch.setattr(h5, "COMPRESSION_LEVEL", 1)
+    h5.write_h5(h5_file2, DATASET, make_genes())
+    with h5py.File(h5_file1, "r") as f1, h5py.File(h5_file2, "r") as f2:
+        path = "/".join(["G2", DATASET, h5.READS, h5.DATA])
+        assert not h5.equal_chunks(f1[path], f2[path])
+    h5.equal_h5(h5_file1, h5_file2)
@@ -2,6 +2,9 @@
 :py:mod:`riboviz.sam_bam` tests.
 """
 import os
+import shutil
+import tempfile
+import pysam
 import pytest
 from riboviz import sam_bam
 from riboviz.test import data
@@ -83,3 +86,254 @@ def test_count_sequences(test_case, file_format):
                                 file_format.format(file_name))
     actual_counts = sam_bam.count_sequences(sam_bam_file)
     assert expected_counts == actual_counts
+
+
+@pytest.mark.parametrize("test_case",
+                         [("WTnone_rRNA_map_20", 20),
+                          ("WTnone_rRNA_map_6_primary", 6),
+                          ("WTnone_rRNA_map_14_secondary", 14)],
+                         ids=str)
+def test_count_indexed_sequences(test_case):
+    """
+    Test :py:func:`riboviz.sam_bam.count_indexed_sequences` with
+    indexed BAM files.
+
+    :param test_case: BAM file name prefix and expected number of \
+    sequences
+    :type test_case: tuple(str or unicode, int)
+    """
+    file_name, expected_count = test_case
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bam_file = os.path.join(tmp_dir, sam_bam.BAM_FORMAT.format(file_name))
+        shutil.copyfile(os.path.join(os.path.dirname(data.__file__),
+                                     sam_bam.BAM_FORMAT.format(file_name)),
+                        bam_file)
+        pysam.index(bam_file)
+        assert sam_bam.count_indexed_sequences(bam_file) == expected_count
+
+
+@pytest.mark.parametrize("file_format",
+                         [sam_bam.SAM_FORMAT, sam_bam.BAM_FORMAT])
+def test_count_indexed_sequences_no_index(file_format):
+    """
+    Test :py:func:`riboviz.sam_bam.count_indexed_sequences` with a
+    SAM file and a BAM file with no index returns ``None``.
+
+    :param file_format: File name format
+    :type file_format: str or unicode
+    """
+    sam_bam_file = os.path.join(os.path.dirname(data.__file__),
+                                file_format.format("WTnone_rRNA_map_20"))
+    assert sam_bam.count_indexed_sequences(sam_bam_file) is None
+
+
+@pytest.mark.parametrize("buffer_size", [1, 3, 7, sam_bam.SORT_BUFFER_SIZE])
+def test_write_sorted_bam(buffer_size):
+    """
+    Test :py:func:`riboviz.sam_bam.write_sorted_bam` sorts reads in
+    the same order as ``samtools sort``, with unmapped reads last,
+    and indexes the output file, whether or not reads are spilled to
+    temporary files.
+
+    :param buffer_size: Maximum number of reads held in memory
+    :type buffer_size: int
+    """
+    sam_file = os.path.join(os.path.dirname(data.__file__),
+                            sam_bam.SAM_FORMAT.format("WTnone_rRNA_map_20"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        expected_file = os.path.join(tmp_dir, "expected.bam")
+        pysam.sort("-o", expected_file, sam_file)
+        bam_file = os.path.join(tmp_dir, "sorted.bam")
+        with pysam.AlignmentFile(sam_file, "r") as sam_in:
+            num_spill_files = sam_bam.write_sorted_bam(
+                sam_in, bam_file, sam_in.header, buffer_size)
+        assert num_spill_files == 20 // buffer_size
+        # Temporary spill files are deleted.
+        assert sorted(os.listdir(tmp_dir)) == \
+            ["expected.bam", "sorted.bam", "sorted.bam.bai"]
+        assert sam_bam.count_indexed_sequences(bam_file) == 20
+        with pysam.AlignmentFile(expected_file, "rb") as f:
+            expected_reads = [read.to_string() for read in f]
+        with pysam.AlignmentFile(bam_file, "rb") as f:
+            assert f.header["HD"]["SO"] == "coordinate"
+            reads = [read.to_string() for read in f]
+        assert reads == expected_reads
+        assert reads[-1].split("\t")[2] == "*"
+
+
+def test_write_sorted_bam_buffer_size():
+    """
+    Test :py:func:`riboviz.sam_bam.write_sorted_bam` with a buffer
+    size of 0 raises ``ValueError``.
+    """
+    header = pysam.AlignmentHeader.from_dict(
+        {"SQ": [{"SN": "chr", "LN": 1000}]})
+    with pytest.raises(ValueError):
+        sam_bam.write_sorted_bam([], "sorted.bam", header, 0)
+
+
+def write_reads(file_name, reads, header, reverse=False):
+    """
+    Write reads, sorted by position, to a BAM file, which is indexed,
+    or a SAM file. Reads with the same position are written in the
+    order given or, if ``reverse``, in reverse order.
+
+    :param file_name: BAM or SAM file
+    :type file_name: str or unicode
+    :param reads: Reads
+    :type reads: list(pysam.AlignedSegment)
+    :param header: Header
+    :type header: pysam.AlignmentHeader
+    :param reverse: Reverse order of reads with the same position?
+    :type reverse: bool
+    """
+    reads = list(reversed(reads)) if reverse else list(reads)
+    # sort is stable, so reads with the same position keep their order.
+    reads.sort(key=sam_bam.get_coordinate_sort_key)
+    mode = "wb" if sam_bam.is_bam(file_name) else "w"
+    with pysam.AlignmentFile(file_name, mode, header=header) as f:
+        for read in reads:
+            f.write(read)
+    if sam_bam.is_bam(file_name):
+        pysam.index(file_name)
+
+
+@pytest.fixture(scope="function")
+def reads_header():
+    """
+    Get reads from ``WTnone_rRNA_map_20.sam``, plus copies, with
+    different names, of reads at the first mapped position, so there
+    are several reads at that position.
+
+    :return: Reads and header
+    :rtype: tuple(list(pysam.AlignedSegment), pysam.AlignmentHeader)
+    """
+    sam_file = os.path.join(os.path.dirname(data.__file__),
+                            sam_bam.SAM_FORMAT.format("WTnone_rRNA_map_20"))
+    with pysam.AlignmentFile(sam_file, "r") as f:
+        header = f.header
+        reads = list(f.fetch(until_eof=True))
+    first = min((read for read in reads if not read.is_unmapped),
+                key=sam_bam.get_coordinate_sort_key)
+    for index in range(3):
+        copy = pysam.AlignedSegment.fromstring(first.to_string(), header)
+        copy.query_name = "copy{}".format(index)
+        reads.append(copy)
+    yield reads, header
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_equal_bam(reads_header, num_processes):
+    """
+    Test :py:func:`riboviz.sam_bam.equal_bam` with BAM files with the
+    same reads, where reads with the same position are in a different
+    order.
+
+    :param reads_header: Reads and header
+    :type reads_header: tuple(list(pysam.AlignedSegment), \
+    pysam.AlignmentHeader)
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    reads, header = reads_header
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bam_file1 = os.path.join(tmp_dir, "test1.bam")
+        bam_file2 = os.path.join(tmp_dir, "test2.bam")
+        write_reads(bam_file1, reads, header)
+        write_reads(bam_file2, reads, header, reverse=True)
+        sam_bam.equal_bam(bam_file1, bam_file2, num_processes)
+
+
+def test_equal_sam(reads_header):
+    """
+    Test :py:func:`riboviz.sam_bam.equal_sam` with SAM files with the
+    same reads, where reads with the same position are in a different
+    order.
+
+    :param reads_header: Reads and header
+    :type reads_header: tuple(list(pysam.AlignedSegment), \
+    pysam.AlignmentHeader)
+    """
+    reads, header = reads_header
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sam_file1 = os.path.join(tmp_dir, "test1.sam")
+        sam_file2 = os.path.join(tmp_dir, "test2.sam")
+        write_reads(sam_file1, reads, header)
+        write_reads(sam_file2, reads, header, reverse=True)
+        sam_bam.equal_sam(sam_file1, sam_file2)
+
+
+@pytest.mark.parametrize("file_format,num_processes",
+                         [(sam_bam.BAM_FORMAT, 1),
+                          (sam_bam.BAM_FORMAT, 2),
+                          (sam_bam.SAM_FORMAT, 1)])
+def test_equal_bam_sam_reads_read_differs(reads_header, file_format,
+                                          num_processes):
+    """
+    Test :py:func:`riboviz.sam_bam.equal_bam_sam_reads` with files
+    where a read at a position with several reads differs reports
+    the position and the differing reads.
+
+    :param reads_header: Reads and header
+    :type reads_header: tuple(list(pysam.AlignedSegment), \
+    pysam.AlignmentHeader)
+    :param file_format: File name format
+    :type file_format: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    reads, header = reads_header
+    changed_reads = list(reads)
+    changed = pysam.AlignedSegment.fromstring(reads[-1].to_string(),
+                                              header)
+    changed.set_tag("XX", 1)
+    changed_reads[-1] = changed
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file1 = os.path.join(tmp_dir, file_format.format("test1"))
+        file2 = os.path.join(tmp_dir, file_format.format("test2"))
+        write_reads(file1, reads, header)
+        write_reads(file2, changed_reads, header, reverse=True)
+        with pysam.AlignmentFile(file1) as f1,\
+                pysam.AlignmentFile(file2) as f2:
+            with pytest.raises(AssertionError) as exc_info:
+                sam_bam.equal_bam_sam_reads(f1, f2, num_processes)
+    message = str(exc_info.value)
+    assert "Unequal reads at position {}:{}".format(
+        changed.reference_name, changed.reference_start + 1) in message
+    assert "(4 reads)" in message
+    only1, only2 = message.split("Only in")[1:]
+    assert "copy2" in only1 and "XX" not in only1
+    assert "copy2" in only2 and "XX:i:1" in only2
+    assert "copy0" not in message
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_equal_bam_sam_reads_read_missing(reads_header, num_processes):
+    """
+    Test :py:func:`riboviz.sam_bam.equal_bam_sam_reads` with files
+    where a read without coordinates is missing.
+
+    :param reads_header: Reads and header
+    :type reads_header: tuple(list(pysam.AlignedSegment), \
+    pysam.AlignmentHeader)
+    :param num_processes: Number of processes
+    :type num_processes: int
+    """
+    reads, header = reads_header
+    unmapped = [read for read in reads if read.reference_id < 0][0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bam_file1 = os.path.join(tmp_dir, "test1.bam")
+        bam_file2 = os.path.join(tmp_dir, "test2.bam")
+        write_reads(bam_file1, reads, header)
+        write_reads(bam_file2, [read for read in reads
+                                if read is not unmapped], header)
+        with pysam.AlignmentFile(bam_file1) as f1,\
+                pysam.AlignmentFile(bam_file2) as f2:
+            with pytest.raises(AssertionError) as exc_info:
+                sam_bam.equal_bam_sam_reads(f1, f2, num_processes)
+    message = str(exc_info.value)
+    assert "Unequal reads at position {}".format(sam_bam.UNPLACED) \
+        in message
+    only1, only2 = message.split("Only in")[1:]
+    assert unmapped.query_name in only1
+    assert unmapped.query_name not in only2
@@ -0,0 +1,429 @@
+"""
+:py:mod:`riboviz.subsample_bioseqfile` tests.
+"""
+import gzip
+from io import BytesIO
+import random
+import pytest
+from Bio import bgzf
+from riboviz import subsample_bioseqfile
+
+NUM_RECORDS = 3000
+""" Number of records in test files. """
+
+
+def make_fastq_records(count, prefix="r"):
+    """
+    Create FASTQ records, as ``bytes``, with some records having
+    content on their ``+`` line or quality lines starting with ``@``.
+
+    :param count: Number of records
+    :type count: int
+    :param prefix: Record ID prefix
+    :type prefix: str or unicode
+    :return: Records
+    :rtype: list(bytes)
+    """
+    records = []
+    for i in range(count):
+        sequence = "ACGT"[i % 4] * (20 + i % 7)
+        quality = ("@" if i % 3 == 0 else "I") * len(sequence)
+        plus = "+{}{}".format(prefix, i) if i % 5 == 0 else "+"
+        records.append("@{}{} extra\n{}\n{}\n{}\n".format(
+            prefix, i, sequence, plus, quality).encode())
+    return records
+
+
+def make_fasta_records(count):
+    """
+    Create FASTA records, as ``bytes``, with varying numbers of
+    sequence lines.
+
+    :param count: Number of records
+    :type count: int
+    :return: Records
+    :rtype: list(bytes)
+    """
+    return [">s{} description\n{}".format(
+        i, "ACGTACGTAC\n" * (1 + i % 3)).encode() for i in range(count)]
+
+
+def write_records(file_name, records):
+    """
+    Write records to a file, which is BGZF-compressed if its name ends
+    in ``.bgz.gz`` or GZIP-compressed if its name ends in ``.gz``.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param records: Records
+    :type records: list(bytes)
+    """
+    if file_name.endswith(".bgz.gz"):
+        with bgzf.BgzfWriter(file_name, "wb") as f:
+            f.write(b"".join(records))
+    elif file_name.endswith(".gz"):
+        with gzip.open(file_name, "wb") as f:
+            f.write(b"".join(records))
+    else:
+        with open(file_name, "wb") as f:
+            f.write(b"".join(records))
+
+
+def read_records(file_name, filetype):
+    """
+    Read records from a file.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param filetype: File type
+    :type filetype: str or unicode
+    :return: Records
+    :rtype: list(bytes)
+    """
+    open_file = gzip.open if file_name.endswith(".gz") else open
+    with open_file(file_name, "rb") as f:
+        return list(subsample_bioseqfile.read_raw_records(f, filetype))
+
+
+def is_subsequence(records, all_records):
+    """
+    Are records a subset of all records, in the same order?
+
+    :param records: Records
+    :type records: list(bytes)
+    :param all_records: All records
+    :type all_records: list(bytes)
+    :return: ``True`` or ``False``
+    :rtype: bool
+    """
+    it = iter(all_records)
+    return all(record in it for record in records)
+
+
+@pytest.mark.parametrize("block_size", [1, 10, 1000000])
+def test_read_fasta_raw_records(block_size):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.read_fasta_raw_records`
+    returns the original content of each record, ignores content
+    before the first record and adds a newline to a last line with
+    no newline.
+
+    :param block_size: Block size in bytes
+    :type block_size: int
+    """
+    records = make_fasta_records(5)
+    content = b"; comment\n" + b"".join(records) + b">last\nAC"
+    records = list(subsample_bioseqfile.read_fasta_raw_records(
+        BytesIO(content), block_size))
+    assert records == make_fasta_records(5) + [b">last\nAC\n"]
+
+
+@pytest.mark.parametrize("num_records", [0, 1, 5, 20, 25])
+def test_sample_reservoir(num_records):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.sample_reservoir`
+    returns the requested number of records, or all records if there
+    are fewer, in their original order.
+
+    :param num_records: Number of records to sample
+    :type num_records: int
+    """
+    random.seed(42)
+    records = subsample_bioseqfile.sample_reservoir(range(20), num_records)
+    assert len(records) == min(num_records, 20)
+    assert records == sorted(set(records))
+
+
+def test_sample_reservoir_uniform():
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.sample_reservoir`
+    samples each record with equal probability.
+    """
+    random.seed(42)
+    counts = [0] * 20
+    for _ in range(4000):
+        for record in subsample_bioseqfile.sample_reservoir(range(20), 5):
+            counts[record] += 1
+    # Expected count is 4000 * 5 / 20 = 1000.
+    assert all(900 < count < 1100 for count in counts), counts
+
+
+@pytest.mark.parametrize("file_name", ["in.fastq", "in.fastq.gz"])
+@pytest.mark.parametrize("num_records", [None, 50])
+def test_subsample_bioseqfile_fastq(tmpdir, file_name, num_records):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    with a FASTQ file, sampling with a probability or a number of
+    records, copies records as-is and in their original order.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param file_name: Input file name
+    :type file_name: str or unicode
+    :param num_records: Number of records to sample or ``None``
+    :type num_records: int
+    """
+    records = make_fastq_records(NUM_RECORDS)
+    seqfilein = str(tmpdir.join(file_name))
+    seqfileout = str(tmpdir.join("out." + file_name.split(".", 1)[1]))
+    write_records(seqfilein, records)
+    subsample_bioseqfile.subsample_bioseqfile(
+        seqfilein, seqfileout, "fastq", 0.05, False, 1, False,
+        num_records)
+    sampled = read_records(seqfileout, "fastq")
+    if num_records is None:
+        assert 100 < len(sampled) < 200
+    else:
+        assert len(sampled) == num_records
+    assert is_subsequence(sampled, records)
+
+
+def test_subsample_bioseqfile_fasta_seqio(tmpdir):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    samples the same records from a FASTA file when parsing records
+    using Bio.SeqIO, via file type ``fasta-2line``, as when copying
+    records as-is.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    records = [">s{}\nACGT\n".format(i).encode() for i in range(500)]
+    seqfilein = str(tmpdir.join("in.fasta"))
+    write_records(seqfilein, records)
+    for filetype in ["fasta", "fasta-2line"]:
+        subsample_bioseqfile.subsample_bioseqfile(
+            seqfilein, str(tmpdir.join(filetype)), filetype, 0.1, False,
+            1, False, 20)
+    assert read_records(str(tmpdir.join("fasta")), "fasta") == \
+        read_records(str(tmpdir.join("fasta-2line")), "fasta")
+
+
+@pytest.mark.parametrize("file_name", ["in.fastq", "in.fastq.bgz.gz"])
+@pytest.mark.parametrize("num_records", [1, 50])
+def test_subsample_bioseqfile_seek_fastq(tmpdir, file_name, num_records):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    with an uncompressed or BGZF-compressed FASTQ file, sampling by
+    seeking, returns complete records, as-is, in their original
+    order.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param file_name: Input file name
+    :type file_name: str or unicode
+    :param num_records: Number of records to sample
+    :type num_records: int
+    """
+    records = make_fastq_records(NUM_RECORDS)
+    seqfilein = str(tmpdir.join(file_name))
+    seqfileout = str(tmpdir.join("out.fastq"))
+    write_records(seqfilein, records)
+    subsample_bioseqfile.subsample_bioseqfile(
+        seqfilein, seqfileout, "fastq", 0.01, False, 1, False,
+        num_records, True)
+    sampled = read_records(seqfileout, "fastq")
+    assert len(sampled) == num_records
+    assert is_subsequence(sampled, records)
+
+
+def test_sample_seek_fastq_bgzf_spread(tmpdir):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.sample_seek` samples
+    records from throughout a BGZF-compressed FASTQ file with
+    multiple BGZF blocks, not just records at the start of blocks.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    records = make_fastq_records(NUM_RECORDS)
+    seqfilein = str(tmpdir.join("in.fastq.bgz.gz"))
+    write_records(seqfilein, records)
+    random.seed(1)
+    sampled = subsample_bioseqfile.sample_seek(seqfilein, "fastq", 500)
+    indices = [records.index(record) for record in sampled]
+    assert len(set(indices)) == 500
+    # Records are in each tenth of the file.
+    assert len({index * 10 // NUM_RECORDS for index in indices}) == 10
+
+
+def test_subsample_bioseqfile_seek_fasta(tmpdir):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    with a FASTA file, sampling by seeking, returns complete records,
+    as-is, in their original order.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    records = make_fasta_records(NUM_RECORDS)
+    seqfilein = str(tmpdir.join("in.fasta"))
+    seqfileout = str(tmpdir.join("out.fasta"))
+    write_records(seqfilein, records)
+    subsample_bioseqfile.subsample_bioseqfile(
+        seqfilein, seqfileout, "fasta", 0.01, False, 1, False, 40, True)
+    sampled = read_records(seqfileout, "fasta")
+    assert len(sampled) == 40
+    assert is_subsequence(sampled, records)
+
+
+@pytest.mark.parametrize("num_records", [10, 15])
+def test_subsample_bioseqfile_seek_few_records(tmpdir, num_records):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    with a FASTQ file, sampling by seeking, returns all records if
+    there are no more records than the number of records to sample.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param num_records: Number of records to sample
+    :type num_records: int
+    """
+    records = make_fastq_records(10)
+    seqfilein = str(tmpdir.join("in.fastq"))
+    seqfileout = str(tmpdir.join("out.fastq"))
+    write_records(seqfilein, records)
+    subsample_bioseqfile.subsample_bioseqfile(
+        seqfilein, seqfileout, "fastq", 0.01, False, 1, False,
+        num_records, True)
+    assert read_records(seqfileout, "fastq") == records
+
+
+@pytest.mark.parametrize("file_name,filetype,num_records",
+                         [("in.fastq.gz", "fastq", 10),
+                          ("in.fastq", "fastq", None),
+                          ("in.gb", "genbank", 10)])
+def test_subsample_bioseqfile_seek_invalid(tmpdir, file_name, filetype,
+                                           num_records):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    raises ``ValueError`` if sampling by seeking with a GZIP input
+    file, no number of records or a file type other than FASTQ or
+    FASTA.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param file_name: Input file name
+    :type file_name: str or unicode
+    :param filetype: File type
+    :type filetype: str or unicode
+    :param num_records: Number of records to sample or ``None``
+    :type num_records: int
+    """
+    seqfilein = str(tmpdir.join(file_name))
+    write_records(seqfilein, make_fastq_records(10))
+    with pytest.raises(ValueError):
+        subsample_bioseqfile.subsample_bioseqfile(
+            seqfilein, str(tmpdir.join("out.fastq")), filetype, 0.01,
+            False, 1, False, num_records, True)
+
+
+@pytest.mark.parametrize("num_records", [None, 50])
+def test_subsample_bioseqfile_paired(tmpdir, num_records):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`
+    samples the same pairs of records from paired FASTQ files, given
+    the same seed.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param num_records: Number of records to sample or ``None``
+    :type num_records: int
+    """
+    indices = []
+    for read in ["R1", "R2"]:
+        records = make_fastq_records(NUM_RECORDS, read)
+        seqfilein = str(tmpdir.join(read + ".fastq"))
+        seqfileout = str(tmpdir.join(read + "_out.fastq"))
+        write_records(seqfilein, records)
+        subsample_bioseqfile.subsample_bioseqfile(
+            seqfilein, seqfileout, "fastq", 0.05, False, 1, False,
+            num_records)
+        indices.append([records.index(record) for record in
+                        read_records(seqfileout, "fastq")])
+    assert indices[0] == indices[1]
+
+
+@pytest.mark.parametrize("num_records", [None, 50])
+@pytest.mark.parametrize("num_threads", [0, 2])
+def test_subsample_bioseqfiles_paired(tmpdir, num_records, num_threads):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfiles`
+    with paired GZIP FASTQ files samples the same pairs of records
+    from each file, and the same records as sampling each file
+    separately.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param num_records: Number of records to sample or ``None``
+    :type num_records: int
+    :param num_threads: Number of threads
+    :type num_threads: int
+    """
+    records = {}
+    for read in ["R1", "R2"]:
+        records[read] = make_fastq_records(NUM_RECORDS, read)
+        write_records(str(tmpdir.join(read + ".fastq.gz")), records[read])
+    subsample_bioseqfile.subsample_bioseqfiles(
+        [str(tmpdir.join(read + ".fastq.gz")) for read in ["R1", "R2"]],
+        [str(tmpdir.join(read + "_out.fastq.gz")) for read in ["R1", "R2"]],
+        "fastq", 0.05, False, 1, False, num_records,
+        num_threads=num_threads)
+    indices = []
+    for read in ["R1", "R2"]:
+        subsample_bioseqfile.subsample_bioseqfile(
+            str(tmpdir.join(read + ".fastq.gz")),
+            str(tmpdir.join(read + "_single.fastq.gz")),
+            "fastq", 0.05, False, 1, False, num_records)
+        sampled = read_records(str(tmpdir.join(read + "_out.fastq.gz")),
+                               "fastq")
+        assert sampled == read_records(
+            str(tmpdir.join(read + "_single.fastq.gz")), "fastq")
+        indices.append([records[read].index(record) for record in sampled])
+    assert indices[0] == indices[1]
+    if num_records is not None:
+        assert len(indices[0]) == num_records
+
+
+def test_subsample_bioseqfiles_paired_unequal(tmpdir):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfiles`
+    with paired FASTQ files with different numbers of records raises
+    ``ValueError``.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    write_records(str(tmpdir.join("R1.fastq")), make_fastq_records(10))
+    write_records(str(tmpdir.join("R2.fastq")), make_fastq_records(9))
+    with pytest.raises(ValueError):
+        subsample_bioseqfile.subsample_bioseqfiles(
+            [str(tmpdir.join("R1.fastq")), str(tmpdir.join("R2.fastq"))],
+            [str(tmpdir.join("R1_out.fastq")),
+             str(tmpdir.join("R2_out.fastq"))],
+            "fastq", 0.5, False, 1, False)
+
+
+@pytest.mark.parametrize("num_files_out,seek", [(1, False), (2, True)])
+def test_subsample_bioseqfiles_paired_invalid(tmpdir, num_files_out, seek):
+    """
+    Test :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfiles`
+    raises ``ValueError`` if the numbers of input and output files
+    differ or if sampling by seeking with paired files.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param num_files_out: Number of output files
+    :type num_files_out: int
+    :param seek: Sample by seeking?
+    :type seek: bool
+    """
+    for read in ["R1", "R2"]:
+        write_records(str(tmpdir.join(read + ".fastq")),
+                      make_fastq_records(10))
+    with pytest.raises(ValueError):
+        subsample_bioseqfile.subsample_bioseqfiles(
+            [str(tmpdir.join("R1.fastq")), str(tmpdir.join("R2.fastq"))],
+            [str(tmpdir.join("R{}_out.fastq".format(read)))
+             for read in range(num_files_out)],
+            "fastq", 0.5, False, 1, False, 5, seek)
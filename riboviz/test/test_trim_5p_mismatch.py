@@ -2,7 +2,10 @@
 :py:mod:`riboviz.trim_5p_mismatch` tests.
 """
 import os
+import subprocess
+import sys
 import tempfile
+import pysam
 import pytest
 import pandas as pd
 from riboviz.test import data
@@ -87,6 +90,21 @@ def tmp_sam_file():
         os.remove(tmp_sam_file)
 
 
+@pytest.fixture(scope="function")
+def tmp_bam_file():
+    """
+    Create a temporary file with a ``bam`` extension.
+
+    :return: path to temporary file
+    :rtype: str or unicode
+    """
+    _, tmp_bam_file = tempfile.mkstemp(
+        prefix="tmp", suffix="." + sam_bam.BAM_EXT)
+    yield tmp_bam_file
+    if os.path.exists(tmp_bam_file):
+        os.remove(tmp_bam_file)
+
+
 @pytest.fixture(scope="function")
 def tmp_tsv_file():
     """
@@ -161,3 +179,309 @@ def test_trim_5p_mismatch_file(test_case, tmp_sam_file, tmp_tsv_file):
     summary = summary_df.to_dict('records')
     assert len(summary_df) == 1, "Expected 1 summary row only"
     assert summary[0] == expected_summary, "Unexpeted summary"
+
+
+def get_reads(sam_file):
+    """
+    Get reads from a SAM/BAM file as SAM-formatted lines.
+
+    :param sam_file: SAM/BAM file
+    :type sam_file: str or unicode
+    :return: reads
+    :rtype: list(str or unicode)
+    """
+    with pysam.AlignmentFile(sam_file, "r") as f:
+        return [read.to_string() for read in f]
+
+
+@pytest.mark.parametrize("test_case", TEST_5P_CASES + TEST_5POS_5NEG_CASES,
+                         ids=str)
+def test_trim_5p_mismatch_bam(test_case, tmp_sam_file, tmp_bam_file):
+    """
+    Run :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch` with
+    BAM output, then again with that BAM file as input, and check
+    that the reads are the same as those for SAM output.
+
+    :param test_case: Test case
+    :type test_case: tuple(str or unicode, tuple(int, dict))
+    :param tmp_sam_file: path to temporary file
+    :type tmp_sam_file: str or unicode
+    :param tmp_bam_file: path to temporary file
+    :type tmp_bam_file: str or unicode
+    """
+    sam_file_name, (max_mismatches, expected_summary) = test_case
+    sam_file = os.path.join(os.path.dirname(data.__file__), sam_file_name)
+    summary = trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                                tmp_bam_file,
+                                                True,
+                                                max_mismatches)
+    assert summary == expected_summary, "Unexpeted summary"
+    with pysam.AlignmentFile(tmp_bam_file, "r") as f:
+        assert f.is_bam
+    trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                      tmp_sam_file,
+                                      True,
+                                      max_mismatches)
+    assert get_reads(tmp_bam_file) == get_reads(tmp_sam_file)
+    # Trimmed reads are not trimmed again.
+    num_written = expected_summary[trim_5p_mismatch.NUM_WRITTEN]
+    summary = trim_5p_mismatch.trim_5p_mismatch(tmp_bam_file,
+                                                tmp_sam_file,
+                                                True,
+                                                max_mismatches)
+    assert summary[trim_5p_mismatch.NUM_PROCESSED] == num_written
+    assert get_reads(tmp_bam_file) == get_reads(tmp_sam_file)
+
+
+@pytest.mark.parametrize("test_case", TEST_5P_CASES + TEST_5POS_5NEG_CASES,
+                         ids=str)
+@pytest.mark.parametrize("batch_size", [1, 5, trim_5p_mismatch.BATCH_SIZE])
+@pytest.mark.parametrize("is_bam", [False, True])
+def test_trim_5p_mismatch_num_processes(test_case,
+                                        batch_size,
+                                        is_bam,
+                                        tmp_sam_file,
+                                        tmp_bam_file):
+    """
+    Run :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch` using
+    more than one process and check that the summary and reads are
+    the same as for a single process.
+
+    :param test_case: Test case
+    :type test_case: tuple(str or unicode, tuple(int, dict))
+    :param batch_size: Number of reads per batch
+    :type batch_size: int
+    :param is_bam: Write BAM output?
+    :type is_bam: bool
+    :param tmp_sam_file: path to temporary file
+    :type tmp_sam_file: str or unicode
+    :param tmp_bam_file: path to temporary file
+    :type tmp_bam_file: str or unicode
+    """
+    sam_file_name, (max_mismatches, expected_summary) = test_case
+    sam_file = os.path.join(os.path.dirname(data.__file__), sam_file_name)
+    if is_bam:
+        out_file = tmp_bam_file
+    else:
+        out_file = tmp_sam_file
+    summary = trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                                out_file,
+                                                True,
+                                                max_mismatches,
+                                                num_processes=2,
+                                                batch_size=batch_size)
+    assert summary == expected_summary, "Unexpeted summary"
+    parallel_reads = get_reads(out_file)
+    trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                      out_file,
+                                      True,
+                                      max_mismatches)
+    assert parallel_reads == get_reads(out_file)
+
+
+@pytest.mark.parametrize("test_case", TEST_5P_CASES + TEST_5POS_5NEG_CASES,
+                         ids=str)
+@pytest.mark.parametrize("batch_size", [1, 5, trim_5p_mismatch.BATCH_SIZE])
+def test_trim_5p_mismatch_num_processes_bam(test_case,
+                                            batch_size,
+                                            tmp_sam_file,
+                                            tmp_bam_file):
+    """
+    Run :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch` on a BAM
+    file, which worker processes read from virtual offsets, using
+    more than one process and check that the summary and reads are
+    the same as for a SAM file using a single process.
+
+    :param test_case: Test case
+    :type test_case: tuple(str or unicode, tuple(int, dict))
+    :param batch_size: Number of reads per batch
+    :type batch_size: int
+    :param tmp_sam_file: path to temporary file
+    :type tmp_sam_file: str or unicode
+    :param tmp_bam_file: path to temporary file
+    :type tmp_bam_file: str or unicode
+    """
+    sam_file_name, (max_mismatches, expected_summary) = test_case
+    sam_file = os.path.join(os.path.dirname(data.__file__), sam_file_name)
+    pysam.view("-b", "-o", tmp_bam_file, sam_file, catch_stdout=False)
+    summary = trim_5p_mismatch.trim_5p_mismatch(tmp_bam_file,
+                                                tmp_sam_file,
+                                                True,
+                                                max_mismatches,
+                                                num_processes=2,
+                                                batch_size=batch_size)
+    assert summary == expected_summary, "Unexpected summary"
+    parallel_reads = get_reads(tmp_sam_file)
+    trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                      tmp_sam_file,
+                                      True,
+                                      max_mismatches)
+    assert parallel_reads == get_reads(tmp_sam_file)
+
+
+@pytest.mark.parametrize("flag,cigar", [(0, "1S24M"),
+                                        (99, "1S24M"),
+                                        (163, "1S24M"),
+                                        (83, "24M1S"),
+                                        (147, "24M1S")])
+def test_trim_5p_mismatch_paired_end(flag,
+                                     cigar,
+                                     tmp_sam_file,
+                                     tmp_bam_file):
+    """
+    Test :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch` trims
+    the 5' end of paired-end reads, using the strand to which each
+    read is mapped.
+
+    :param flag: SAM flag
+    :type flag: int
+    :param cigar: Expected CIGAR of trimmed read
+    :type cigar: str or unicode
+    :param tmp_sam_file: path to temporary file
+    :type tmp_sam_file: str or unicode
+    :param tmp_bam_file: path to temporary file
+    :type tmp_bam_file: str or unicode
+    """
+    is_reverse = bool(flag & 16)
+    md_tag = "24A0" if is_reverse else "0A24"
+    with open(tmp_sam_file, "w") as f:
+        f.write("@SQ\tSN:chr\tLN:1000\n")
+        f.write("\t".join(["read", str(flag), "chr", "101", "255", "25M",
+                           "=", "201", "125", "A" * 25, "E" * 25,
+                           "MD:Z:" + md_tag, "NM:i:1"]) + "\n")
+    summary = trim_5p_mismatch.trim_5p_mismatch(tmp_sam_file,
+                                                tmp_bam_file,
+                                                True,
+                                                0)
+    assert summary[trim_5p_mismatch.NUM_TRIMMED] == 1
+    assert summary[trim_5p_mismatch.NUM_WRITTEN] == 1
+    with pysam.AlignmentFile(tmp_bam_file, "rb") as f:
+        read = next(f)
+    assert read.flag == flag
+    assert read.cigarstring == cigar
+    assert read.get_tag("MD") == "24"
+    assert read.get_tag("NM") == 0
+    assert read.reference_start == (100 if is_reverse else 101)
+
+
+@pytest.mark.parametrize("flag,md_tag,expected_md_tag,is_trimmed,is_kept", [
+    (16, "14A0C0", "14A0", True, True),
+    (16, "14AC0", "14AC0", False, False),
+    (16, "14^AC0", "14^AC0", False, False),
+    (0, "0A0C14", "0A0C14", False, False),
+    (256, "0A15", "0A15", False, True),
+    (272, "15A0", "15A0", False, True),
+    (2048, "0A15", "0A15", False, True)])
+def test_trim_read(flag, md_tag, expected_md_tag, is_trimmed, is_kept):
+    """
+    Test :py:func:`riboviz.trim_5p_mismatch.trim_read` trims and
+    discards reads with mismatches at their 5' ends as earlier
+    versions of RiboViz did: secondary and supplementary alignments
+    are not trimmed and reverse strand reads are only discarded if
+    their MD tags have adjacent mismatches.
+
+    :param flag: SAM flag
+    :type flag: int
+    :param md_tag: MD tag
+    :type md_tag: str or unicode
+    :param expected_md_tag: Expected MD tag after trimming
+    :type expected_md_tag: str or unicode
+    :param is_trimmed: Expect read to be trimmed?
+    :type is_trimmed: bool
+    :param is_kept: Expect read to be kept?
+    :type is_kept: bool
+    """
+    header = pysam.AlignmentHeader.from_dict(
+        {"SQ": [{"SN": "chr", "LN": 1000}]})
+    read = pysam.AlignedSegment.fromstring(
+        "\t".join(["read", str(flag), "chr", "101", "255", "16M", "*",
+                   "0", "0", "A" * 16, "E" * 16, "MD:Z:" + md_tag,
+                   "NM:i:2"]), header)
+    assert trim_5p_mismatch.trim_read(read, True, 2) == (is_trimmed,
+                                                         is_kept)
+    if is_trimmed:
+        assert read.cigarstring == "15M1S"
+        assert read.get_tag("NM") == 1
+    else:
+        assert read.cigarstring == "16M"
+        assert read.get_tag("NM") == 2
+    assert read.get_tag("MD") == expected_md_tag
+    assert read.reference_start == 100
+
+
+@pytest.mark.parametrize("test_case", TEST_5P_CASES + TEST_5POS_5NEG_CASES,
+                         ids=str)
+@pytest.mark.parametrize("buffer_size", [1, 4, sam_bam.SORT_BUFFER_SIZE])
+def test_trim_5p_mismatch_sort(test_case, buffer_size, tmp_bam_file):
+    """
+    Test :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch` with
+    sorting gives the same reads as trimming then sorting using
+    ``samtools sort``, and indexes the output.
+
+    :param test_case: Test case
+    :type test_case: tuple(str or unicode, tuple(int, dict))
+    :param buffer_size: Maximum number of reads held in memory
+    :type buffer_size: int
+    :param tmp_bam_file: path to temporary file
+    :type tmp_bam_file: str or unicode
+    """
+    sam_file_name, (max_mismatches, expected_summary) = test_case
+    sam_file = os.path.join(os.path.dirname(data.__file__), sam_file_name)
+    summary = trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                                tmp_bam_file,
+                                                True,
+                                                max_mismatches,
+                                                sort=True,
+                                                buffer_size=buffer_size)
+    assert summary == expected_summary, "Unexpeted summary"
+    assert sam_bam.count_indexed_sequences(tmp_bam_file) == \
+        expected_summary[trim_5p_mismatch.NUM_WRITTEN]
+    sorted_reads = get_reads(tmp_bam_file)
+    trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                      tmp_bam_file,
+                                      True,
+                                      max_mismatches)
+    pysam.sort("-o", tmp_bam_file, tmp_bam_file)
+    assert sorted_reads == get_reads(tmp_bam_file)
+    os.remove(sam_bam.BAI_FORMAT.format(tmp_bam_file))
+
+
+def test_trim_5p_mismatch_sort_sam(tmp_sam_file):
+    """
+    Test :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch` with
+    sorting and SAM output raises ``ValueError``.
+
+    :param tmp_sam_file: path to temporary file
+    :type tmp_sam_file: str or unicode
+    """
+    sam_file = os.path.join(os.path.dirname(data.__file__), TEST_5P_FILE)
+    with pytest.raises(ValueError):
+        trim_5p_mismatch.trim_5p_mismatch(sam_file,
+                                          tmp_sam_file,
+                                          sort=True)
+
+
+def test_trim_5p_mismatch_tool_sort_stdin(tmp_bam_file, tmp_tsv_file):
+    """
+    Test :py:mod:`riboviz.tools.trim_5p_mismatch` with sorting and
+    SAM piped to standard input.
+
+    :param tmp_bam_file: path to temporary file
+    :type tmp_bam_file: str or unicode
+    :param tmp_tsv_file: path to temporary file
+    :type tmp_tsv_file: str or unicode
+    """
+    sam_file = os.path.join(os.path.dirname(data.__file__), TEST_5P_FILE)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(trim_5p_mismatch.__file__))))
+    with open(sam_file, "r") as f:
+        subprocess.run([sys.executable, "-m", "riboviz.tools.trim_5p_mismatch",
+                        "-m", "2", "-5", "-i", "-", "-o", tmp_bam_file,
+                        "-s", tmp_tsv_file, "-S", "-b", "4"],
+                       stdin=f, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+    summary = pd.read_csv(tmp_tsv_file, sep="\t", comment="#")
+    assert summary.iloc[0][trim_5p_mismatch.NUM_WRITTEN] == 11
+    assert sam_bam.count_indexed_sequences(tmp_bam_file) == 11
+    os.remove(sam_bam.BAI_FORMAT.format(tmp_bam_file))
@@ -0,0 +1,524 @@
+"""
+:py:mod:`riboviz.umi_tools` tests.
+"""
+import os
+import random
+import pysam
+import pytest
+from riboviz import sam_bam
+from riboviz import umi_tools
+
+TEST_HEADER = {"HD": {"VN": "1.0"},
+               "SQ": [{"SN": "A", "LN": 1000}, {"SN": "B", "LN": 1000}]}
+""" Test BAM file header. """
+TEST_READS = [
+    # (name, reference, start, length, reverse, mapping quality)
+    ("r1_AAAA", 0, 10, 30, False, 10),
+    ("r2_AAAA", 0, 10, 30, False, 60),
+    ("r3_AAAA", 0, 10, 30, False, 60),
+    ("r4_AAAT", 0, 10, 30, False, 60),
+    ("r5_CCCC", 0, 10, 30, False, 60),
+    ("r6_AAAA", 0, 10, 29, False, 60),
+    ("r7_AAAA", 0, 10, 30, True, 60),
+    ("r8_AAAA", 0, 20, 30, False, 60),
+    ("r9_GGGG", 1, 10, 30, False, 60),
+    ("r10_GGGC", 1, 10, 30, False, 60),
+    ("r11_GGCC", 1, 10, 30, False, 60),
+]
+"""
+Test reads. On ``A``, the 30-nt ``+`` strand reads at 10 with UMIs
+``AAAA`` (3) and ``AAAT`` (1) form a single group and ``CCCC``
+another. On ``B``, ``GGGG``, ``GGGC`` and ``GGCC`` form a single
+group.
+"""
+
+
+def make_read(header, name, reference_id, start, length, is_reverse,
+              mapping_quality, cigartuples=None):
+    """
+    Make a read.
+
+    :param header: Header
+    :type header: pysam.AlignmentHeader
+    :param name: Read name
+    :type name: str or unicode
+    :param reference_id: Reference ID
+    :type reference_id: int
+    :param start: Leftmost position (0-indexed)
+    :type start: int
+    :param length: Read length
+    :type length: int
+    :param is_reverse: Is read on ``-`` strand?
+    :type is_reverse: bool
+    :param mapping_quality: Mapping quality
+    :type mapping_quality: int
+    :param cigartuples: CIGAR operations, or ``None`` for all matches
+    :type cigartuples: list(tuple(int, int))
+    :return: Read
+    :rtype: pysam.AlignedSegment
+    """
+    read = pysam.AlignedSegment(header)
+    read.query_name = name
+    read.reference_id = reference_id
+    read.reference_start = start
+    read.query_sequence = "A" * length
+    read.cigartuples = cigartuples or [(pysam.CMATCH, length)]
+    read.is_reverse = is_reverse
+    read.mapping_quality = mapping_quality
+    return read
+
+
+def write_bam(bam_file, reads):
+    """
+    Write reads, from tuples as for :py:const:`TEST_READS`, to a
+    sorted, indexed, BAM file with :py:const:`TEST_HEADER`.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param reads: Reads
+    :type reads: list(tuple)
+    """
+    header = pysam.AlignmentHeader.from_dict(TEST_HEADER)
+    sam_bam.write_sorted_bam([make_read(header, *read) for read in reads],
+                             bam_file, header)
+
+
+def read_names(bam_file):
+    """
+    Get names of reads in a BAM file.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :return: Read names
+    :rtype: list(str or unicode)
+    """
+    with pysam.AlignmentFile(bam_file, "rb") as bam:
+        return [read.query_name for read in bam.fetch(until_eof=True)]
+
+
+def read_tsv(tsv_file):
+    """
+    Read a tab-separated values file.
+
+    :param tsv_file: File
+    :type tsv_file: str or unicode
+    :return: Rows
+    :rtype: list(list(str or unicode))
+    """
+    with open(tsv_file) as f:
+        return [line.rstrip("\n").split("\t") for line in f]
+
+
+def cluster_umis_reference(umis, counts, threshold):
+    """
+    Group UMIs using the ``umi_tools`` ``directional`` method,
+    comparing each pair of UMIs in turn.
+
+    :param umis: UMIs
+    :type umis: list(str or unicode)
+    :param counts: Number of reads with each UMI
+    :type counts: list(int)
+    :param threshold: Maximum Hamming distance between adjacent UMIs
+    :type threshold: int
+    :return: Groups
+    :rtype: list(list(int))
+    """
+    adjacency = {
+        a: [b for b in range(len(umis))
+            if a != b and len(umis[a]) == len(umis[b]) and
+            sum(x != y for x, y in zip(umis[a], umis[b])) <= threshold
+            and counts[a] >= 2 * counts[b] - 1]
+        for a in range(len(umis))}
+    order = sorted(range(len(umis)), key=lambda index: -counts[index])
+    found = set()
+    groups = []
+    for node in order:
+        if node in found:
+            continue
+        searched = {node}
+        queue = [node]
+        while queue:
+            for next_node in adjacency[queue.pop()]:
+                if next_node not in searched:
+                    searched.add(next_node)
+                    queue.append(next_node)
+        groups.append([index for index in order
+                       if index in searched and index not in found])
+        found.update(searched)
+    return groups
+
+
+def test_get_umi():
+    """
+    Test :py:func:`riboviz.umi_tools.get_umi`.
+    """
+    header = pysam.AlignmentHeader.from_dict(TEST_HEADER)
+    read = make_read(header, "r_1_ACGT", 0, 1, 10, False, 60)
+    assert umi_tools.get_umi(read) == "ACGT"
+    with pytest.raises(ValueError):
+        umi_tools.get_umi(read, ":")
+
+
+@pytest.mark.parametrize("is_reverse,position", [(False, 8), (True, 23)])
+def test_get_read_position(is_reverse, position):
+    """
+    Test :py:func:`riboviz.umi_tools.get_read_position` includes soft
+    clipping at the 5' end.
+
+    :param is_reverse: Is read on ``-`` strand?
+    :type is_reverse: bool
+    :param position: Expected position
+    :type position: int
+    """
+    header = pysam.AlignmentHeader.from_dict(TEST_HEADER)
+    read = make_read(header, "r_ACGT", 0, 10, 15, is_reverse, 60,
+                     [(pysam.CSOFT_CLIP, 2), (pysam.CMATCH, 10),
+                      (pysam.CSOFT_CLIP, 3)])
+    assert umi_tools.get_read_position(read) == position
+
+
+def test_cluster_umis():
+    """
+    Test :py:func:`riboviz.umi_tools.cluster_umis` groups UMIs
+    reachable in the directional adjacency.
+    """
+    umis = ["AAAA", "AAAT", "AATT", "AAAC", "CCCC", "AAAAA"]
+    counts = [10, 5, 2, 6, 1, 1]
+    # AAAA -> AAAT -> AATT but not AAAA -> AAAC (10 < 2 * 6 - 1).
+    assert umi_tools.cluster_umis(umis, counts) == \
+        [[0, 1, 2], [3], [4], [5]]
+    assert umi_tools.cluster_umis(umis, counts, 0) == \
+        [[0], [3], [1], [2], [4], [5]]
+    assert umi_tools.cluster_umis(["ACGT"], [3]) == [[0]]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cluster_umis_random(seed):
+    """
+    Test :py:func:`riboviz.umi_tools.cluster_umis` gives the same
+    groups as comparing each pair of UMIs in turn.
+
+    :param seed: Random seed
+    :type seed: int
+    """
+    rng = random.Random(seed)
+    umis = list({"".join(rng.choice("ACGT") for _ in range(4))
+                 for _ in range(60)})
+    counts = [rng.choice([1, 1, 2, 3, 8, 20]) for _ in umis]
+    assert umi_tools.cluster_umis(umis, counts) == \
+        cluster_umis_reference(umis, counts, 1)
+
+
+def test_get_average_umi_distance():
+    """
+    Test :py:func:`riboviz.umi_tools.get_average_umi_distance`.
+    """
+    assert umi_tools.get_average_umi_distance(["AAAA"]) == -1
+    assert umi_tools.get_average_umi_distance(
+        ["AAAA", "AAAT", "TTTT"]) == (1 + 4 + 3) / 3
+    assert umi_tools.get_average_umi_distance(
+        ["AAA", "AAT", "AAAAA"]) == (1 + 5 + 5) / 3
+
+
+def test_dedup_umis(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` deduplicates reads
+    and writes groups and statistics.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    dedup_bam_file = str(tmpdir.join("dedup.bam"))
+    pre_groups_file = str(tmpdir.join("pre_dedup_groups.tsv"))
+    post_groups_file = str(tmpdir.join("post_dedup_groups.tsv"))
+    stats_prefix = str(tmpdir.join("dedup_stats"))
+    write_bam(bam_file, TEST_READS)
+    summary = umi_tools.dedup_umis(bam_file,
+                                   dedup_bam_file,
+                                   pre_groups_file,
+                                   post_groups_file,
+                                   stats_prefix)
+    assert summary == {umi_tools.NUM_INPUT_READS: 11,
+                       umi_tools.NUM_UNMAPPED_READS: 0,
+                       umi_tools.NUM_POSITIONS: 5,
+                       umi_tools.NUM_OUTPUT_READS: 6,
+                       umi_tools.NUM_POST_DEDUP_GROUPS: 6}
+    assert sorted(read_names(dedup_bam_file)) == sorted(
+        ["r2_AAAA", "r5_CCCC", "r6_AAAA", "r7_AAAA", "r8_AAAA",
+         "r9_GGGG"])
+    assert os.path.exists(sam_bam.BAI_FORMAT.format(dedup_bam_file))
+    pre_groups = read_tsv(pre_groups_file)
+    assert pre_groups[0] == umi_tools.GROUP_COLUMNS
+    assert len(pre_groups) == 1 + len(TEST_READS)
+    # Buckets are output in order of position, strand then length.
+    assert pre_groups[2:6] == [
+        [name, "A", "10", umi_tools.NO_GENE, umi, count, "AAAA", "4", "1"]
+        for name, umi, count in [("r1_AAAA", "AAAA", "3"),
+                                 ("r2_AAAA", "AAAA", "3"),
+                                 ("r3_AAAA", "AAAA", "3"),
+                                 ("r4_AAAT", "AAAT", "1")]]
+    assert [(row[0], row[2], row[-1]) for row in pre_groups[1:2] +
+            pre_groups[6:]] == [("r6_AAAA", "10", "0"),
+                                ("r5_CCCC", "10", "2"),
+                                ("r8_AAAA", "20", "3"),
+                                ("r7_AAAA", "40", "4"),
+                                ("r9_GGGG", "10", "5"),
+                                ("r10_GGGC", "10", "5"),
+                                ("r11_GGCC", "10", "5")]
+    post_groups = read_tsv(post_groups_file)
+    assert post_groups[0] == umi_tools.GROUP_COLUMNS
+    assert [(row[0], row[-1]) for row in post_groups[1:]] == \
+        [("r6_AAAA", "0"), ("r2_AAAA", "1"), ("r5_CCCC", "2"),
+         ("r8_AAAA", "3"), ("r7_AAAA", "4"), ("r9_GGGG", "5")]
+    edit_distance = read_tsv(
+        umi_tools.EDIT_DISTANCE_STATS_FORMAT.format(stats_prefix))
+    assert edit_distance[0] == ["unique", "unique_null",
+                                umi_tools.DIRECTIONAL,
+                                umi_tools.DIRECTIONAL + "_null",
+                                "edit_distance"]
+    # Average distances are 3 and 4/3 pre-deduplication and 4
+    # post-deduplication.
+    assert [[row[0], row[2], row[4]] for row in edit_distance[1:]] == [
+        ["3", "4", umi_tools.SINGLE_UMI], ["0", "0", "0"],
+        ["0", "0", "1"], ["1", "0", "2"], ["1", "0", "3"],
+        ["0", "1", "4"], ["0", "0", "5"]]
+    assert sum(int(row[1]) for row in edit_distance[1:]) == 5
+    assert sum(int(row[3]) for row in edit_distance[1:]) == 5
+    per_position = read_tsv(
+        umi_tools.PER_UMI_PER_POSITION_STATS_FORMAT.format(stats_prefix))
+    assert per_position == [["counts", "instances_pre", "instances_post"],
+                            ["1", "8", "4"], ["3", "1", "1"],
+                            ["4", "0", "1"]]
+    per_umi = read_tsv(umi_tools.PER_UMI_STATS_FORMAT.format(stats_prefix))
+    assert per_umi[0][0] == "UMI"
+    assert per_umi[1:] == [["AAAA", "1", "4", "6", "1", "4", "7"],
+                           ["AAAT", "1", "1", "1", "0", "0", "0"],
+                           ["CCCC", "1", "1", "1", "1", "1", "1"],
+                           ["GGCC", "1", "1", "1", "0", "0", "0"],
+                           ["GGGC", "1", "1", "1", "0", "0", "0"],
+                           ["GGGG", "1", "1", "1", "3", "1", "3"]]
+
+
+def test_dedup_umis_processes(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` with more than one
+    process gives the same output as with one process.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    rng = random.Random(42)
+    reads = [("r{}_{}".format(index,
+                              "".join(rng.choice("AC") for _ in range(4))),
+              rng.randrange(2), rng.randrange(50), rng.choice([28, 30]),
+              rng.random() < 0.5, 60) for index in range(500)]
+    bam_file = str(tmpdir.join("test.bam"))
+    write_bam(bam_file, reads)
+    outputs = []
+    for num_processes in [1, 2]:
+        prefix = str(tmpdir.join(str(num_processes)))
+        summary = umi_tools.dedup_umis(bam_file,
+                                       prefix + ".bam",
+                                       prefix + "_pre.tsv",
+                                       prefix + "_post.tsv",
+                                       prefix,
+                                       prefix + "_summary",
+                                       num_processes=num_processes)
+        outputs.append((summary,
+                        read_names(prefix + ".bam"),
+                        read_tsv(prefix + "_pre.tsv"),
+                        read_tsv(prefix + "_post.tsv"),
+                        read_tsv(umi_tools.EDIT_DISTANCE_STATS_FORMAT.format(
+                            prefix)),
+                        read_tsv(umi_tools.PER_UMI_STATS_FORMAT.format(
+                            prefix)),
+                        read_tsv(umi_tools.READS_PER_POSITION_FORMAT.format(
+                            prefix + "_summary"))))
+    assert outputs[0] == outputs[1]
+    assert len(os.listdir(str(tmpdir))) == 2 + 2 * 10
+
+
+def test_dedup_umis_ignore_read_length(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` with
+    ``read_length=False`` buckets reads of different lengths together.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    dedup_bam_file = str(tmpdir.join("dedup.bam"))
+    write_bam(bam_file, TEST_READS)
+    summary = umi_tools.dedup_umis(bam_file, dedup_bam_file,
+                                   read_length=False)
+    assert summary[umi_tools.NUM_OUTPUT_READS] == 5
+    assert "r6_AAAA" not in read_names(dedup_bam_file)
+
+
+def test_dedup_umis_unmapped(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` skips unmapped
+    reads.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    dedup_bam_file = str(tmpdir.join("dedup.bam"))
+    header = pysam.AlignmentHeader.from_dict(TEST_HEADER)
+    read = make_read(header, "r1_AAAA", 0, 10, 30, False, 60)
+    unmapped = pysam.AlignedSegment(header)
+    unmapped.query_name = "r2_AAAA"
+    unmapped.query_sequence = "A" * 30
+    unmapped.is_unmapped = True
+    sam_bam.write_sorted_bam([read, unmapped], bam_file, header)
+    summary = umi_tools.dedup_umis(bam_file, dedup_bam_file)
+    assert summary[umi_tools.NUM_INPUT_READS] == 2
+    assert summary[umi_tools.NUM_UNMAPPED_READS] == 1
+    assert read_names(dedup_bam_file) == ["r1_AAAA"]
+
+
+def test_dedup_umis_no_umi(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` with reads with no
+    UMI raises ``ValueError`` and removes its temporary files.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    write_bam(bam_file, [("r1", 0, 10, 30, False, 60)])
+    with pytest.raises(ValueError):
+        umi_tools.dedup_umis(bam_file, str(tmpdir.join("dedup.bam")))
+    assert sorted(os.listdir(str(tmpdir))) == ["test.bam", "test.bam.bai"]
+
+
+def test_dedup_umis_no_such_file(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` with a non-existent
+    BAM file raises ``FileNotFoundError``.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    with pytest.raises(FileNotFoundError):
+        umi_tools.dedup_umis(str(tmpdir.join("nosuch.bam")),
+                             str(tmpdir.join("dedup.bam")))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 100])
+def test_summarise_groups(tmpdir, chunk_size):
+    """
+    Test :py:func:`riboviz.umi_tools.summarise_groups` summarises
+    groups written by :py:func:`riboviz.umi_tools.dedup_umis`,
+    irrespective of chunk size.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param chunk_size: Maximum number of rows read at a time
+    :type chunk_size: int
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    groups_file = str(tmpdir.join("pre_dedup_groups.tsv"))
+    write_bam(bam_file, TEST_READS)
+    umi_tools.dedup_umis(bam_file,
+                         str(tmpdir.join("dedup.bam")),
+                         groups_file)
+    summary = umi_tools.summarise_groups(groups_file, chunk_size)
+    assert summary.group_sizes == {1: 4, 3: 1, 4: 1}
+    assert summary.position_reads == {1: 2, 3: 1, 6: 1}
+    assert summary.gene_reads == {"A": 8, "B": 3}
+    assert summary.gene_groups == {"A": 5, "B": 1}
+
+
+def test_summarise_groups_genes(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.summarise_groups` uses gene
+    names, where present, and that positions more than the position
+    buffer apart are counted separately.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    groups_file = str(tmpdir.join("groups.tsv"))
+    rows = [("r1", "A", 10, "G1", 0), ("r2", "A", 10, "G1", 0),
+            ("r3", "A", 10, "G1", 1), ("r4", "A", 50, umi_tools.NO_GENE, 2),
+            ("r5", "A", 10, "G1", 3)]
+    with open(groups_file, "w") as f:
+        f.write("\t".join(umi_tools.GROUP_COLUMNS) + "\n")
+        for read_id, contig, position, gene, unique_id in rows:
+            size = sum(1 for row in rows if row[-1] == unique_id)
+            f.write("\t".join(map(str, [read_id, contig, position, gene,
+                                        "AAAA", size, "AAAA", size,
+                                        unique_id])) + "\n")
+    summary = umi_tools.summarise_groups(groups_file, position_buffer=10)
+    assert summary.group_sizes == {1: 3, 2: 1}
+    assert summary.position_reads == {1: 2, 3: 1}
+    assert summary.gene_reads == {"G1": 4, "A": 1}
+    assert summary.gene_groups == {"G1": 3, "A": 1}
+    summary_prefix = str(tmpdir.join("summary"))
+    summary.write(summary_prefix)
+    assert read_tsv(umi_tools.GROUP_SIZES_FORMAT.format(
+        summary_prefix)) == [[umi_tools.GROUP_SIZE, umi_tools.NUM_GROUPS],
+                             ["1", "3"], ["2", "1"]]
+    assert read_tsv(umi_tools.READS_PER_POSITION_FORMAT.format(
+        summary_prefix)) == [[umi_tools.NUM_READS,
+                              umi_tools.NUM_POSITIONS_COLUMN],
+                             ["1", "2"], ["3", "1"]]
+    assert read_tsv(umi_tools.GENE_DUPLICATION_FORMAT.format(
+        summary_prefix)) == [[umi_tools.GENE, umi_tools.NUM_READS,
+                              umi_tools.NUM_GROUPS,
+                              umi_tools.DUPLICATION_RATE],
+                             ["A", "1", "1", "0"],
+                             ["G1", "4", "3", "0.25"]]
+
+
+def test_summarise_groups_empty(tmpdir):
+    """
+    Test :py:func:`riboviz.umi_tools.summarise_groups` with a groups
+    file with only a header gives an empty summary.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    groups_file = str(tmpdir.join("groups.tsv"))
+    with open(groups_file, "w") as f:
+        f.write("\t".join(umi_tools.GROUP_COLUMNS) + "\n")
+    summary = umi_tools.summarise_groups(groups_file)
+    assert not summary.group_sizes
+    assert not summary.position_reads
+    assert not summary.gene_reads
+
+
+@pytest.mark.parametrize("is_pre_groups", [False, True])
+def test_dedup_umis_groups_summary(tmpdir, is_pre_groups):
+    """
+    Test :py:func:`riboviz.umi_tools.dedup_umis` writes the same
+    groups summary as :py:func:`riboviz.umi_tools.summarise_groups`
+    does from its pre-deduplication groups, whether or not these
+    groups are written.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param is_pre_groups: Write pre-deduplication groups?
+    :type is_pre_groups: bool
+    """
+    bam_file = str(tmpdir.join("test.bam"))
+    groups_file = str(tmpdir.join("pre_dedup_groups.tsv"))
+    write_bam(bam_file, TEST_READS)
+    umi_tools.dedup_umis(bam_file,
+                         str(tmpdir.join("dedup.bam")),
+                         groups_file if is_pre_groups else None,
+                         groups_summary_prefix=str(tmpdir.join("dedup")))
+    assert os.path.exists(groups_file) == is_pre_groups
+    umi_tools.dedup_umis(bam_file,
+                         str(tmpdir.join("groups.bam")),
+                         groups_file)
+    umi_tools.summarise_groups(groups_file).write(
+        str(tmpdir.join("groups")))
+    for file_format in [umi_tools.GROUP_SIZES_FORMAT,
+                        umi_tools.READS_PER_POSITION_FORMAT,
+                        umi_tools.GENE_DUPLICATION_FORMAT]:
+        assert read_tsv(file_format.format(str(tmpdir.join("dedup")))) == \
+            read_tsv(file_format.format(str(tmpdir.join("groups"))))
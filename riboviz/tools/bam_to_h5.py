@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Convert BAM files to RiboViz HDF5 files. This accepts the same
+command-line parameters as ``rscripts/bam_to_h5.R``, though
+``--num-processes`` is a number of BGZF decompression threads rather
+than a number of processes.
+
+Usage::
+
+    python -m riboviz.tools.bam_to_h5 [-h]
+        --bam-file BAM_FILE --orf-gff-file ORF_GFF_FILE
+        [--feature FEATURE]
+        [--min-read-length MIN_READ_LENGTH]
+        [--max-read-length MAX_READ_LENGTH]
+        [--buffer BUFFER] [--primary-id PRIMARY_ID]
+        [--secondary-id SECONDARY_ID] [--dataset DATASET]
+        [--stop-in-feature STOP_IN_FEATURE]
+        [--is-riboviz-gff IS_RIBOVIZ_GFF]
+        [--hd-file HD_FILE] [--num-processes NUM_PROCESSES]
+        [--chunk-size CHUNK_SIZE] [--layout {legacy,csr}]
+
+    -h, --help            show this help message and exit
+    --bam-file BAM_FILE   BAM input file
+    --orf-gff-file ORF_GFF_FILE
+                          GFF2/GFF3 Matched genome feature file,
+                          specifying coding sequences locations
+                          (start and stop coordinates) within the
+                          transcripts
+    --feature FEATURE     Feature e.g. CDS, ORF, or uORF
+                          (default CDS)
+    --min-read-length MIN_READ_LENGTH
+                          Minimum read length in H5 output
+                          (default 10)
+    --max-read-length MAX_READ_LENGTH
+                          Maximum read length in H5 output
+                          (default 50)
+    --buffer BUFFER       Length of flanking region around the
+                          feature (default 250)
+    --primary-id PRIMARY_ID
+                          Primary gene IDs to access the data
+                          (default gene_id)
+    --secondary-id SECONDARY_ID
+                          Secondary gene IDs to access the data
+                          (default none)
+    --dataset DATASET     Human-readable name of the dataset
+                          (default data)
+    --stop-in-feature STOP_IN_FEATURE
+                          Are stop codons part of the feature
+                          annotations in GFF? (TRUE or FALSE,
+                          default FALSE)
+    --is-riboviz-gff IS_RIBOVIZ_GFF
+                          Does the GFF file contain 3 elements per
+                          gene - UTR5, feature, and UTR3? (TRUE or
+                          FALSE, default TRUE)
+    --hd-file HD_FILE     H5 output file (default output.h5)
+    --num-processes NUM_PROCESSES
+                          Number of BGZF decompression threads
+                          (unlike bam_to_h5.R, where this is a
+                          number of processes) (default 1)
+    --chunk-size CHUNK_SIZE
+                          Maximum number of reads counted at a time
+                          (default 1000000)
+    --layout {legacy,csr}
+                          H5 layout (default legacy)
+
+See :py:func:`riboviz.bam_to_h5.bam_to_h5`.
+"""
+import argparse
+from riboviz import bam_to_h5
+from riboviz import h5
+from riboviz import provenance
+
+
+def parse_bool(value):
+    """
+    Parse an R-style logical value, ``TRUE`` or ``FALSE``, in any
+    case.
+
+    :param value: Value
+    :type value: str or unicode
+    :return: Value
+    :rtype: bool
+    :raise argparse.ArgumentTypeError: If the value is not \
+    ``TRUE`` or ``FALSE``
+    """
+    if value.upper() in ("TRUE", "T"):
+        return True
+    if value.upper() in ("FALSE", "F"):
+        return False
+    raise argparse.ArgumentTypeError(
+        "Expected TRUE or FALSE but got {}".format(value))
+
+
+def parse_command_line_options():
+    """
+    Parse command-line options.
+
+    :returns: command-line options
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert BAM files to RiboViz HDF5 files")
+    parser.add_argument("--bam-file",
+                        dest="bam_file",
+                        required=True,
+                        help="BAM input file")
+    parser.add_argument("--orf-gff-file",
+                        dest="orf_gff_file",
+                        required=True,
+                        help="GFF2/GFF3 Matched genome feature file, specifying coding sequences locations (start and stop coordinates) within the transcripts")
+    parser.add_argument("--feature",
+                        dest="feature",
+                        default="CDS",
+                        help="Feature e.g. CDS, ORF, or uORF (default CDS)")
+    parser.add_argument("--min-read-length",
+                        dest="min_read_length",
+                        default=10,
+                        type=int,
+                        help="Minimum read length in H5 output (default 10)")
+    parser.add_argument("--max-read-length",
+                        dest="max_read_length",
+                        default=50,
+                        type=int,
+                        help="Maximum read length in H5 output (default 50)")
+    parser.add_argument("--buffer",
+                        dest="buffer",
+                        default=250,
+                        type=int,
+                        help="Length of flanking region around the feature (default 250)")
+    parser.add_argument("--primary-id",
+                        dest="primary_id",
+                        default="gene_id",
+                        help="Primary gene IDs to access the data (default gene_id)")
+    parser.add_argument("--secondary-id",
+                        dest="secondary_id",
+                        default=None,
+                        help="Secondary gene IDs to access the data (default none)")
+    parser.add_argument("--dataset",
+                        dest="dataset",
+                        default="data",
+                        help="Human-readable name of the dataset (default data)")
+    parser.add_argument("--stop-in-feature",
+                        dest="stop_in_feature",
+                        default=False,
+                        type=parse_bool,
+                        help="Are stop codons part of the feature annotations in GFF? (TRUE or FALSE, default FALSE)")
+    parser.add_argument("--is-riboviz-gff",
+                        dest="is_riboviz_gff",
+                        default=True,
+                        type=parse_bool,
+                        help="Does the GFF file contain 3 elements per gene - UTR5, feature, and UTR3? (TRUE or FALSE, default TRUE)")
+    parser.add_argument("--hd-file",
+                        dest="hd_file",
+                        default="output.h5",
+                        help="H5 output file (default output.h5)")
+    parser.add_argument("--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of BGZF decompression threads (unlike bam_to_h5.R, where this is a number of processes) (default 1)")
+    parser.add_argument("--chunk-size",
+                        dest="chunk_size",
+                        default=bam_to_h5.CHUNK_SIZE,
+                        type=int,
+                        help="Maximum number of reads counted at a time (default " +
+                        str(bam_to_h5.CHUNK_SIZE) + ")")
+    parser.add_argument("--layout",
+                        dest="layout",
+                        default=h5.LEGACY,
+                        choices=h5.LAYOUTS,
+                        help="H5 layout (default " + h5.LEGACY + ")")
+    options = parser.parse_args()
+    return options
+
+
+def invoke_bam_to_h5():
+    """
+    Parse command-line options then invoke
+    :py:func:`riboviz.bam_to_h5.bam_to_h5`.
+    """
+    print(provenance.write_provenance_to_str(__file__))
+    options = parse_command_line_options()
+    bam_to_h5.bam_to_h5(options.bam_file,
+                        options.orf_gff_file,
+                        options.hd_file,
+                        options.feature,
+                        options.min_read_length,
+                        options.max_read_length,
+                        options.buffer,
+                        options.primary_id,
+                        options.secondary_id,
+                        options.dataset,
+                        options.stop_in_feature,
+                        options.is_riboviz_gff,
+                        options.chunk_size,
+                        options.num_processes,
+                        options.layout)
+
+
+if __name__ == "__main__":
+    invoke_bam_to_h5()
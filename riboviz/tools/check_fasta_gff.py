@@ -9,6 +9,7 @@ Usage::
         [--use-feature-name] \
         [--feature-format FEATURE_FORMAT]
         [--start-codon START_CODON [START_CODON ...]] [-v]
+        [-p NUM_PROCESSES]
 
     -h, --help            show this help message and exit
     -f FASTA, --fasta FASTA
@@ -28,6 +29,9 @@ Usage::
                           Allowable start codons (default 'ATG')
     -v, --verbose         Print information on each issue (if omitted
                           only issue counts are printed)
+    -p NUM_PROCESSES, --num-processes NUM_PROCESSES
+                          Number of processes used to check coding
+                          sequences (default 1)
 
 See :py:func:`riboviz.check_fasta_gff.check_fasta_gff`.
 """
@@ -83,6 +87,12 @@ def parse_command_line_options():
                         action='store_true',
                         default=False,
                         help="Print information on each issue (if omitted only issue counts are printed)")
+    parser.add_argument("-p",
+                        "--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of processes used to check coding sequences (default 1)")
     options = parser.parse_args()
     return options
 
@@ -101,6 +111,7 @@ def invoke_check_fasta_gff():
     use_feature_name = options.use_feature_name
     start_codons = options.start_codon
     is_verbose = options.is_verbose
+    num_processes = options.num_processes
     try:
         check_fasta_gff.check_fasta_gff(fasta,
                                         gff,
@@ -108,7 +119,8 @@ def invoke_check_fasta_gff():
                                         feature_format=feature_format,
                                         use_feature_name=use_feature_name,
                                         start_codons=start_codons,
-                                        is_verbose=is_verbose)
+                                        is_verbose=is_verbose,
+                                        num_processes=num_processes)
     except FastaIndexingError as e:
         print("{}: {}".format(type(e).__name__, e))
     except FileNotFoundError as e:
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Convert a RiboViz H5 file from one layout to another.
+
+Usage::
+
+    python -m riboviz.tools.convert_h5 [-h]
+        -i H5_FILE_IN -o H5_FILE_OUT [-l {legacy,csr}]
+
+    -h, --help            show this help message and exit
+    -i H5_FILE_IN, --input H5_FILE_IN
+                          H5 input file, in either layout
+    -o H5_FILE_OUT, --output H5_FILE_OUT
+                          H5 output file
+    -l {legacy,csr}, --layout {legacy,csr}
+                          H5 output layout (default csr)
+
+See :py:func:`riboviz.h5.convert_h5`.
+"""
+import argparse
+from riboviz import h5
+from riboviz import provenance
+
+
+def parse_command_line_options():
+    """
+    Parse command-line options.
+
+    :returns: command-line options
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert a RiboViz H5 file from one layout to another")
+    parser.add_argument("-i",
+                        "--input",
+                        dest="h5_file_in",
+                        required=True,
+                        help="H5 input file, in either layout")
+    parser.add_argument("-o",
+                        "--output",
+                        dest="h5_file_out",
+                        required=True,
+                        help="H5 output file")
+    parser.add_argument("-l",
+                        "--layout",
+                        dest="layout",
+                        default=h5.CSR,
+                        choices=h5.LAYOUTS,
+                        help="H5 output layout (default " + h5.CSR + ")")
+    options = parser.parse_args()
+    return options
+
+
+def invoke_convert_h5():
+    """
+    Parse command-line options then invoke
+    :py:func:`riboviz.h5.convert_h5`.
+    """
+    print(provenance.write_provenance_to_str(__file__))
+    options = parse_command_line_options()
+    h5.convert_h5(options.h5_file_in, options.h5_file_out, options.layout)
+
+
+if __name__ == "__main__":
+    invoke_convert_h5()
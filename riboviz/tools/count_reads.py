@@ -7,7 +7,7 @@ Usage::
 
     python -m riboviz.tools.count_reads [-h]
         -c CONFIG_FILE -i INPUT_DIR -t TMP_DIR -o OUTPUT_DIR
-        -r READS_FILE
+        -r READS_FILE [-p NUM_PROCESSES] [-k CACHE_FILE]
 
     -h, --help            show this help message and exit
     -c CONFIG_FILE, --config-file CONFIG_FILE
@@ -20,6 +20,11 @@ Usage::
                           Output directory
     -r READS_FILE, --reads-file READS_FILE
                           Reads file (output)
+    -p NUM_PROCESSES, --num-processes NUM_PROCESSES
+                          Number of processes (default 1)
+    -k CACHE_FILE, --cache-file CACHE_FILE
+                          Read counts cache file, created if it
+                          does not exist (default None)
 
 Example::
 
@@ -88,6 +93,17 @@ def parse_command_line_options():
                         dest="reads_file",
                         required=True,
                         help="Reads file (output)")
+    parser.add_argument("-p",
+                        "--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of processes (default 1)")
+    parser.add_argument("-k",
+                        "--cache-file",
+                        dest="cache_file",
+                        default=None,
+                        help="Read counts cache file, created if it does not exist (default None)")
     options = parser.parse_args()
     return options
 
@@ -104,8 +120,11 @@ def invoke_count_reads():
     tmp_dir = options.tmp_dir
     output_dir = options.output_dir
     reads_file = options.reads_file
+    num_processes = options.num_processes
+    cache_file = options.cache_file
     count_reads.count_reads(
-        config_file, input_dir, tmp_dir, output_dir, reads_file)
+        config_file, input_dir, tmp_dir, output_dir, reads_file,
+        num_processes, cache_file)
 
 
 if __name__ == "__main__":
@@ -6,18 +6,44 @@ between then to a file of tab-separated values.
 Usage::
 
     python -m riboviz.tools.create_barcode_pairs [-h]
-        -o OUTPUT_FILE -l LENGTH
+        -o OUTPUT_FILE [-l LENGTH] [-s SAMPLE_SHEET_FILE]
+        [-u] [-m MAX_DISTANCE] [-f {tsv,binary,histogram}]
 
     -h, --help            show this help message and exit
     -o OUTPUT_FILE, --output-file OUTPUT_FILE
-                          Output file
+                          Output file (GZIP-compressed if it ends
+                          with .gz)
     -l LENGTH, --length LENGTH
                           Barcode length (default 3)
+    -s SAMPLE_SHEET_FILE, --sample-sheet SAMPLE_SHEET_FILE
+                          Sample sheet file whose TagRead barcodes
+                          are used, instead of all barcodes of
+                          length LENGTH (default none)
+    -u, --unordered       Output each unordered pair of distinct
+                          barcodes once only
+    -m MAX_DISTANCE, --max-distance MAX_DISTANCE
+                          Output only pairs within this Hamming
+                          distance (default none)
+    -f {tsv,binary,histogram}, --format {tsv,binary,histogram}
+                          Output format (default tsv)
+
+For example, count the pairs of barcodes of length 8 with each
+Hamming distance::
+
+    $ python -m riboviz.tools.create_barcode_pairs
+      -o barcode_distances.tsv -l 8 -f histogram
+
+Output the pairs of sample sheet barcodes within Hamming distance 2::
+
+    $ python -m riboviz.tools.create_barcode_pairs
+      -o close_barcodes.tsv
+      -s data/demultiplex/TagSeqBarcodedOligos2015.txt -u -m 2
 
 See :py:func:`riboviz.barcodes_umis.create_barcode_pairs`.
 """
 import argparse
 from riboviz import barcodes_umis
+from riboviz import sample_sheets
 
 
 def parse_command_line_options():
@@ -33,13 +59,36 @@ def parse_command_line_options():
                         "--output-file",
                         dest="output_file",
                         required=True,
-                        help="Output file")
+                        help="Output file (GZIP-compressed if it ends with .gz)")
     parser.add_argument("-l",
                         "--length",
                         dest="length",
                         default=3,
                         type=int,
                         help="Barcode length (default 3)")
+    parser.add_argument("-s",
+                        "--sample-sheet",
+                        dest="sample_sheet_file",
+                        default=None,
+                        help="Sample sheet file whose TagRead barcodes are used, instead of all barcodes of length LENGTH (default none)")
+    parser.add_argument("-u",
+                        "--unordered",
+                        dest="unordered",
+                        action="store_true",
+                        help="Output each unordered pair of distinct barcodes once only")
+    parser.add_argument("-m",
+                        "--max-distance",
+                        dest="max_distance",
+                        default=None,
+                        type=int,
+                        help="Output only pairs within this Hamming distance (default none)")
+    parser.add_argument("-f",
+                        "--format",
+                        dest="output_format",
+                        default=barcodes_umis.TSV_FORMAT,
+                        choices=barcodes_umis.BARCODE_PAIR_FORMATS,
+                        help="Output format (default {})".format(
+                            barcodes_umis.TSV_FORMAT))
     options = parser.parse_args()
     return options
 
@@ -52,7 +101,18 @@ def invoke_create_barcode_pairs():
     options = parse_command_line_options()
     output_file = options.output_file
     length = options.length
-    barcodes_umis.create_barcode_pairs(output_file, length)
+    barcodes = None
+    if options.sample_sheet_file is not None:
+        sample_sheet = sample_sheets.load_sample_sheet(
+            options.sample_sheet_file)
+        barcodes = list(sample_sheet[sample_sheets.TAG_READ])
+    barcodes_umis.create_barcode_pairs(
+        output_file,
+        length,
+        barcodes=barcodes,
+        unordered=options.unordered,
+        max_distance=options.max_distance,
+        output_format=options.output_format)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Deduplicate reads in a coordinate-sorted BAM file using UMIs and,
+optionally, output UMI groups before and after deduplication and
+deduplication statistics, in a single pass. This is an alternative to
+running ``umi_tools dedup`` and ``umi_tools group``.
+
+Usage::
+
+    python -m riboviz.tools.dedup_umis [-h]
+        -I BAM_FILE_IN -S BAM_FILE_OUT
+        [--output-stats STATS_PREFIX]
+        [--group-out-pre PRE_GROUPS_FILE]
+        [--group-out-post POST_GROUPS_FILE]
+        [--groups-summary GROUPS_SUMMARY_PREFIX]
+        [--umi-separator UMI_SEPARATOR]
+        [--edit-distance-threshold THRESHOLD]
+        [--ignore-read-length]
+        [-p NUM_PROCESSES] [-t NUM_THREADS]
+        [-b BUFFER_SIZE] [--random-seed SEED]
+
+    -h, --help            show this help message and exit
+    -I BAM_FILE_IN, --stdin BAM_FILE_IN
+                          Coordinate-sorted BAM file input
+    -S BAM_FILE_OUT, --stdout BAM_FILE_OUT
+                          Deduplicated BAM file output (sorted and
+                          indexed)
+    --output-stats STATS_PREFIX
+                          Deduplication statistics file name prefix
+    --group-out-pre PRE_GROUPS_FILE
+                          UMI groups, pre-deduplication, file output
+    --group-out-post POST_GROUPS_FILE
+                          UMI groups, post-deduplication, file output
+    --groups-summary GROUPS_SUMMARY_PREFIX
+                          UMI groups, pre-deduplication, summary file
+                          name prefix
+    --umi-separator UMI_SEPARATOR
+                          Separator between read ID and UMI
+                          (default _)
+    --edit-distance-threshold THRESHOLD
+                          Maximum Hamming distance between adjacent
+                          UMIs (default 1)
+    --ignore-read-length  Do not bucket reads by read length
+    -p NUM_PROCESSES, --num-processes NUM_PROCESSES
+                          Number of processes, each deduplicating
+                          the reads on a reference sequence, if the
+                          BAM file is indexed (default 1)
+    -t NUM_THREADS, --num-threads NUM_THREADS
+                          Number of BGZF compression threads
+                          (default 1)
+    -b BUFFER_SIZE, --buffer-size BUFFER_SIZE
+                          Maximum number of reads held in memory,
+                          per process, when sorting (default 1000000)
+    --random-seed SEED    Seed for random UMIs for null edit distance
+                          statistics (default 0)
+
+See :py:func:`riboviz.umi_tools.dedup_umis`.
+"""
+import argparse
+from riboviz import provenance
+from riboviz import sam_bam
+from riboviz import umi_tools
+
+
+def parse_command_line_options():
+    """
+    Parse command-line options.
+
+    :returns: command-line options
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Deduplicate reads in a coordinate-sorted BAM file using UMIs and, optionally, output UMI groups before and after deduplication and deduplication statistics, in a single pass")
+    parser.add_argument("-I",
+                        "--stdin",
+                        dest="bam_file_in",
+                        required=True,
+                        help="Coordinate-sorted BAM file input")
+    parser.add_argument("-S",
+                        "--stdout",
+                        dest="bam_file_out",
+                        required=True,
+                        help="Deduplicated BAM file output (sorted and indexed)")
+    parser.add_argument("--output-stats",
+                        dest="stats_prefix",
+                        default=None,
+                        help="Deduplication statistics file name prefix")
+    parser.add_argument("--group-out-pre",
+                        dest="pre_groups_file",
+                        default=None,
+                        help="UMI groups, pre-deduplication, file output")
+    parser.add_argument("--group-out-post",
+                        dest="post_groups_file",
+                        default=None,
+                        help="UMI groups, post-deduplication, file output")
+    parser.add_argument("--groups-summary",
+                        dest="groups_summary_prefix",
+                        default=None,
+                        help="UMI groups, pre-deduplication, summary file name prefix")
+    parser.add_argument("--umi-separator",
+                        dest="umi_separator",
+                        default=umi_tools.UMI_SEPARATOR,
+                        help="Separator between read ID and UMI (default " +
+                        umi_tools.UMI_SEPARATOR + ")")
+    parser.add_argument("--edit-distance-threshold",
+                        dest="threshold",
+                        default=umi_tools.EDIT_DISTANCE_THRESHOLD,
+                        type=int,
+                        help="Maximum Hamming distance between adjacent UMIs (default " +
+                        str(umi_tools.EDIT_DISTANCE_THRESHOLD) + ")")
+    parser.add_argument("--ignore-read-length",
+                        dest="read_length",
+                        action="store_false",
+                        help="Do not bucket reads by read length")
+    parser.add_argument("-p",
+                        "--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of processes, each deduplicating the reads on a reference sequence, if the BAM file is indexed (default 1)")
+    parser.add_argument("-t",
+                        "--num-threads",
+                        dest="num_threads",
+                        default=1,
+                        type=int,
+                        help="Number of BGZF compression threads (default 1)")
+    parser.add_argument("-b",
+                        "--buffer-size",
+                        dest="buffer_size",
+                        default=sam_bam.SORT_BUFFER_SIZE,
+                        type=int,
+                        help="Maximum number of reads held in memory, per process, when sorting (default " +
+                        str(sam_bam.SORT_BUFFER_SIZE) + ")")
+    parser.add_argument("--random-seed",
+                        dest="seed",
+                        default=umi_tools.NULL_SEED,
+                        type=int,
+                        help="Seed for random UMIs for null edit distance statistics (default " +
+                        str(umi_tools.NULL_SEED) + ")")
+    options = parser.parse_args()
+    return options
+
+
+def invoke_dedup_umis():
+    """
+    Parse command-line options then invoke
+    :py:func:`riboviz.umi_tools.dedup_umis`.
+    """
+    print(provenance.write_provenance_to_str(__file__))
+    options = parse_command_line_options()
+    summary = umi_tools.dedup_umis(options.bam_file_in,
+                                   options.bam_file_out,
+                                   options.pre_groups_file,
+                                   options.post_groups_file,
+                                   options.stats_prefix,
+                                   options.groups_summary_prefix,
+                                   options.umi_separator,
+                                   options.threshold,
+                                   options.read_length,
+                                   options.num_processes,
+                                   options.num_threads,
+                                   options.buffer_size,
+                                   seed=options.seed)
+    print(("Input reads: {}".format(summary[umi_tools.NUM_INPUT_READS])))
+    print(("Unmapped reads: {}".format(
+        summary[umi_tools.NUM_UNMAPPED_READS])))
+    print(("Positions: {}".format(summary[umi_tools.NUM_POSITIONS])))
+    print(("Output reads: {}".format(summary[umi_tools.NUM_OUTPUT_READS])))
+
+
+if __name__ == "__main__":
+    invoke_dedup_umis()
@@ -8,7 +8,8 @@ Usage::
     python -m riboviz.tools.demultiplex_fastq [-h]
         -s SAMPLE_SHEET_FILE -1 READ1_FILE
         [-2 [READ2_FILE]] [-m MISMATCHES] [-o [OUT_DIR]]
-        [-d [DELIMITER]]
+        [-d [DELIMITER]] [-p NUM_PROCESSES] [-t NUM_THREADS]
+        [--max-open-files MAX_OPEN_FILES]
 
     -h, --help            show this help message and exit
     -s SAMPLE_SHEET_FILE, --sample-sheet SAMPLE_SHEET_FILE
@@ -24,6 +25,16 @@ Usage::
                           Output directory
     -d [DELIMITER], --delimiter [DELIMITER]
                           Barcode delimiter (default _)
+    -p NUM_PROCESSES, --num-processes NUM_PROCESSES
+                          Number of processes (default 1)
+    -t NUM_THREADS, --num-threads NUM_THREADS
+                          Number of threads for reading and
+                          compression, 0 to use none (default 1).
+                          If the input is GZIPped, the output is
+                          written in BGZF format if this is non-zero
+    --max-open-files MAX_OPEN_FILES
+                          Maximum number of output files open at
+                          once (default 256)
 
 For example, run UMI-tools on sample data and extract barcodes::
 
@@ -77,6 +88,7 @@ sheet file and the output files.
 import argparse
 from riboviz import barcodes_umis
 from riboviz import demultiplex_fastq
+from riboviz import fastq
 from riboviz import provenance
 
 
@@ -124,6 +136,23 @@ def parse_command_line_options():
                         default=barcodes_umis.BARCODE_DELIMITER,
                         help="Barcode delimiter (default " +
                         barcodes_umis.BARCODE_DELIMITER + ")")
+    parser.add_argument("-p",
+                        "--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of processes (default 1)")
+    parser.add_argument("-t",
+                        "--num-threads",
+                        dest="num_threads",
+                        default=1,
+                        type=int,
+                        help="Number of threads for reading and compression, 0 to use none (default 1)")
+    parser.add_argument("--max-open-files",
+                        dest="max_open_files",
+                        default=fastq.MAX_OPEN_FILES,
+                        type=int,
+                        help="Maximum number of output files open at once (default {})".format(fastq.MAX_OPEN_FILES))
     options = parser.parse_args()
     return options
 
@@ -141,12 +170,18 @@ def invoke_demultiplex_fastq():
     mismatches = options.mismatches
     out_dir = options.out_dir
     delimiter = options.delimiter
+    num_processes = options.num_processes
+    num_threads = options.num_threads
+    max_open_files = options.max_open_files
     demultiplex_fastq.demultiplex(sample_sheet_file,
                                   read1_file,
                                   read2_file,
                                   mismatches,
                                   out_dir,
-                                  delimiter)
+                                  delimiter,
+                                  num_processes,
+                                  num_threads=num_threads,
+                                  max_open_files=max_open_files)
 
 
 if __name__ == "__main__":
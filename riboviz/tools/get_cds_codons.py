@@ -6,7 +6,7 @@ file.
 Usage::
 
     python -m riboviz.tools.get_cds_codons [-h] \
-        -f FASTA -g GFF [-c CDS_CODONS] [-e] \
+        -f FASTA -g GFF [-c CDS_CODONS] [-i CDS_CODONS_INDEX] [-e] \
         [--use-feature-name] \
         [--cds-feature-format CDS_FEATURE_FORMAT]
 
@@ -15,7 +15,13 @@ Usage::
                           FASTA file input
     -g GFF, --gff GFF     GFF3 file input
     -c CDS_CODONS, --cds-codons CDS_CODONS
-                          Coding sequence codons file output
+                          Coding sequence codons file output (if
+                          ending in '.gz' then output is
+                          BGZF-compressed)
+    -i CDS_CODONS_INDEX, --cds-codons-index CDS_CODONS_INDEX
+                          Coding sequence codons index file output,
+                          with the offset of each feature's codons
+                          in the codons file (default none)
     -e, --exclude-stop-codons
                           Exclude stop codons (default false)
     --use-feature-name    If a CDS feature defines both 'ID' and 'Name'
@@ -29,7 +35,7 @@ Usage::
                           name.
 
 See :py:func:`riboviz.get_cds_codons.get_cds_codons_file` for
-information on the tab-separated values file format.
+information on the tab-separated values file and index file formats.
 """
 import argparse
 from pyfaidx import FastaIndexingError
@@ -61,7 +67,12 @@ def parse_command_line_options():
                         "--cds-codons",
                         dest="cds_codons",
                         default="cds_codons.tsv",
-                        help="Coding sequence codons file output")
+                        help="Coding sequence codons file output (if ending in '.gz' then output is BGZF-compressed)")
+    parser.add_argument("-i",
+                        "--cds-codons-index",
+                        dest="cds_codons_index",
+                        default=None,
+                        help="Coding sequence codons index file output, with the offset of each feature's codons in the codons file (default none)")
     parser.add_argument("-e",
                         "--exclude-stop-codons",
                         dest="exclude_stop_codons",
@@ -93,13 +104,15 @@ def invoke_get_cds_codons():
     exclude_stop_codons = options.exclude_stop_codons
     cds_feature_format = options.cds_feature_format
     use_feature_name = options.use_feature_name
+    cds_codons_index = options.cds_codons_index
     try:
         get_cds_codons.get_cds_codons_file(fasta,
                                            gff,
                                            cds_codons,
                                            exclude_stop_codons,
                                            cds_feature_format,
-                                           use_feature_name)
+                                           use_feature_name,
+                                           index_file=cds_codons_index)
     except FastaIndexingError as e:
         print("{}: {}".format(type(e).__name__, e))
     except FileNotFoundError as e:
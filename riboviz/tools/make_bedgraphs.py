@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Write bedGraph files of the number of 5' ends of reads at each
+position on the ``+`` and ``-`` strands in a single pass through a
+BAM file. The files follow the format of those from ``bedtools
+genomecov -ibam BAM_FILE -trackline -bga -5 -strand +`` and ``...
+-strand -``, though they have not been compared to files from
+``bedtools``.
+
+Usage::
+
+    python -m riboviz.tools.make_bedgraphs [-h]
+        -i BAM_FILE --plus PLUS_BEDGRAPH_FILE --minus MINUS_BEDGRAPH_FILE
+        [-p NUM_PROCESSES] [-t NUM_THREADS]
+
+    -h, --help            show this help message and exit
+    -i BAM_FILE, --input BAM_FILE
+                          BAM file input
+    --plus PLUS_BEDGRAPH_FILE
+                          + strand bedGraph file output
+    --minus MINUS_BEDGRAPH_FILE
+                          - strand bedGraph file output
+    -p NUM_PROCESSES, --num-processes NUM_PROCESSES
+                          Number of processes, each counting the reads
+                          on a reference sequence, if the BAM file is
+                          indexed (default 1)
+    -t NUM_THREADS, --num-threads NUM_THREADS
+                          Number of BGZF decompression threads
+                          (default 1)
+
+See :py:func:`riboviz.bedgraph.write_bedgraphs`.
+"""
+import argparse
+from riboviz import bedgraph
+from riboviz import provenance
+
+
+def parse_command_line_options():
+    """
+    Parse command-line options.
+
+    :returns: command-line options
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Write bedGraph files of the number of 5' ends of reads at each position on the + and - strands in a single pass through a BAM file")
+    parser.add_argument("-i",
+                        "--input",
+                        dest="bam_file",
+                        required=True,
+                        help="BAM file input")
+    parser.add_argument("--plus",
+                        dest="plus_bedgraph_file",
+                        required=True,
+                        help="+ strand bedGraph file output")
+    parser.add_argument("--minus",
+                        dest="minus_bedgraph_file",
+                        required=True,
+                        help="- strand bedGraph file output")
+    parser.add_argument("-p",
+                        "--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of processes, each counting the reads on a reference sequence, if the BAM file is indexed (default 1)")
+    parser.add_argument("-t",
+                        "--num-threads",
+                        dest="num_threads",
+                        default=1,
+                        type=int,
+                        help="Number of BGZF decompression threads (default 1)")
+    options = parser.parse_args()
+    return options
+
+
+def invoke_write_bedgraphs():
+    """
+    Parse command-line options then invoke
+    :py:func:`riboviz.bedgraph.write_bedgraphs`.
+    """
+    print(provenance.write_provenance_to_str(__file__))
+    options = parse_command_line_options()
+    bedgraph.write_bedgraphs(options.bam_file,
+                             options.plus_bedgraph_file,
+                             options.minus_bedgraph_file,
+                             options.num_processes,
+                             options.num_threads)
+
+
+if __name__ == "__main__":
+    invoke_write_bedgraphs()
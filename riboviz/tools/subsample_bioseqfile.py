@@ -2,19 +2,46 @@
 """
 Subsample an input FASTQ (or other sequencing) file, to produce a
 smaller file whose reads are randomly sampled from of the input with a
-fixed probability.
+fixed probability, or a fixed number of reads. Paired-end read 1 and
+read 2 files can be subsampled together, sampling the same reads from
+each.
 
 Usage::
 
-    subsample_bioseqfile.py [-h] -i SEQFILEIN -o SEQFILEOUT [-t FILE_TYPE]
-                                [-p PROB] [-f OVERWRITE] [-v]
+    subsample_bioseqfile.py [-h] -i SEQFILEIN -o SEQFILEOUT
+                                [-I SEQFILEIN2 -O SEQFILEOUT2]
+                                [-t FILE_TYPE] [-p PROB]
+                                [-n NUM_RECORDS] [--seek]
+                                [-j NUM_THREADS] [-f OVERWRITE] [-v]
 
 
     -h, --help                          show this help message and exit
     -i SEQFILEIN, --input SEQFILEIN     SeqIO file input
     -o SEQFILEOUT, --output SEQFILEOUT  SeqIO file output
+    -I SEQFILEIN2, --seqfilein2 SEQFILEIN2
+                                        SeqIO paired file input
+                                        (default none)
+    -O SEQFILEOUT2, --seqfileout2 SEQFILEOUT2
+                                        SeqIO paired file output
+                                        (required if SEQFILEIN2 is
+                                        given)
     -t FILE_TYPE, --type FILE_TYPE      SeqIO file type (default 'fastq')
     -p PROB, --probability PROB         proportion to sample (default 0.01)
+    -n NUM_RECORDS, --num-records NUM_RECORDS
+                                        number of records to sample,
+                                        instead of sampling with
+                                        probability PROB (default none)
+    --seek                              sample NUM_RECORDS records by
+                                        seeking to random offsets in
+                                        an uncompressed or BGZF input
+                                        file, rather than reading the
+                                        whole file (not
+                                        supported with SEQFILEIN2)
+    -j NUM_THREADS, --num-threads NUM_THREADS
+                                        number of threads for FASTQ
+                                        and FASTA file reading and
+                                        gzip compression, 0 to use
+                                        none (default 1)
     -f OVERWRITE, --overwrite           overwrite output if file exists
                                         (default False)
     -v, --verbose                       print progress statements
@@ -32,6 +59,16 @@ Examples::
         -t fastq
         -p 0.00001
 
+    python -m riboviz.tools.subsample_bioseqfile
+        -i vignette/input/SRR1042855_s1mi.fastq
+        -o vignette/tmp/SRR1042855_n1000.fastq
+        -n 1000 --seek
+
+    python -m riboviz.tools.subsample_bioseqfile
+        -i data/sample_R1.fastq.gz -I data/sample_R2.fastq.gz
+        -o tmp/sample_R1_p01.fastq.gz -O tmp/sample_R2_p01.fastq.gz
+        -p 0.01 -j 4
+
 See :py:func:`riboviz.subsample_bioseqfile.subsample_bioseqfile`.
 """
 import argparse
@@ -58,6 +95,16 @@ def parse_command_line_options():
                         dest="seqfileout",
                         required=True,
                         help="SeqIO file output")
+    parser.add_argument("-I",
+                        "--seqfilein2",
+                        dest="seqfilein2",
+                        default=None,
+                        help="SeqIO paired file input (default none)")
+    parser.add_argument("-O",
+                        "--seqfileout2",
+                        dest="seqfileout2",
+                        default=None,
+                        help="SeqIO paired file output")
     parser.add_argument("-t",
                         "--type",
                         dest="file_type",
@@ -69,6 +116,22 @@ def parse_command_line_options():
                         type=float,
                         default=0.01,
                         help="proportion to sample (default 0.01)")
+    parser.add_argument("-n",
+                        "--num-records",
+                        dest="num_records",
+                        type=int,
+                        default=None,
+                        help="number of records to sample, instead of sampling with probability PROB (default none)")
+    parser.add_argument("--seek",
+                        dest="seek",
+                        action="store_true",
+                        help="sample NUM_RECORDS records by seeking to random offsets in an uncompressed or BGZF input file, rather than reading the whole file")
+    parser.add_argument("-j",
+                        "--num-threads",
+                        dest="num_threads",
+                        type=int,
+                        default=1,
+                        help="number of threads for FASTQ and FASTA file reading and gzip compression, 0 to use none (default 1)")
     parser.add_argument("-f",
                         "--overwrite",
                         dest="overwrite",
@@ -86,6 +149,8 @@ def parse_command_line_options():
                         action="store_true",
                         help="print progress statements")
     options = parser.parse_args()
+    if (options.seqfilein2 is None) != (options.seqfileout2 is None):
+        parser.error("--seqfilein2 and --seqfileout2 must be given together")
     return options
 
 
@@ -104,13 +169,24 @@ def invoke_subsample_bioseqfile():
     overwrite = options.overwrite
     seedvalue = options.seedvalue
     verbose = options.verbose
-    subsample_bioseqfile.subsample_bioseqfile(seqfilein,
-                                              seqfileout,
-                                              file_type,
-                                              prob,
-                                              overwrite,
-                                              seedvalue,
-                                              verbose)
+    num_records = options.num_records
+    seek = options.seek
+    num_threads = options.num_threads
+    seqfilesin = [seqfilein]
+    seqfilesout = [seqfileout]
+    if options.seqfilein2 is not None:
+        seqfilesin.append(options.seqfilein2)
+        seqfilesout.append(options.seqfileout2)
+    subsample_bioseqfile.subsample_bioseqfiles(seqfilesin,
+                                               seqfilesout,
+                                               file_type,
+                                               prob,
+                                               overwrite,
+                                               seedvalue,
+                                               verbose,
+                                               num_records,
+                                               seek,
+                                               num_threads)
 
 
 if __name__ == "__main__":
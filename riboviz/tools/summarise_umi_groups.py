@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Summarise UMI groups in a file output by ``umi_tools group
+--group-out`` or ``riboviz.tools.dedup_umis``, reading the file in
+chunks, and write UMI group sizes, reads per position and duplication
+rate per gene.
+
+Usage::
+
+    python -m riboviz.tools.summarise_umi_groups [-h]
+        -i GROUPS_FILE -o SUMMARY_PREFIX
+        [-c CHUNK_SIZE] [--position-buffer POSITION_BUFFER]
+
+    -h, --help            show this help message and exit
+    -i GROUPS_FILE, --input GROUPS_FILE
+                          UMI groups file input
+    -o SUMMARY_PREFIX, --output SUMMARY_PREFIX
+                          Summary file name prefix
+    -c CHUNK_SIZE, --chunk-size CHUNK_SIZE
+                          Maximum number of rows read at a time
+                          (default 1000000)
+    --position-buffer POSITION_BUFFER
+                          Number of nucleotides after which reads at
+                          a position are counted (default 1000)
+
+See :py:func:`riboviz.umi_tools.summarise_groups`.
+"""
+import argparse
+from riboviz import provenance
+from riboviz import umi_tools
+
+
+def parse_command_line_options():
+    """
+    Parse command-line options.
+
+    :returns: command-line options
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Summarise UMI groups in a file output by 'umi_tools group --group-out' or 'riboviz.tools.dedup_umis', reading the file in chunks, and write UMI group sizes, reads per position and duplication rate per gene")
+    parser.add_argument("-i",
+                        "--input",
+                        dest="groups_file",
+                        required=True,
+                        help="UMI groups file input")
+    parser.add_argument("-o",
+                        "--output",
+                        dest="summary_prefix",
+                        required=True,
+                        help="Summary file name prefix")
+    parser.add_argument("-c",
+                        "--chunk-size",
+                        dest="chunk_size",
+                        default=umi_tools.GROUPS_CHUNK_SIZE,
+                        type=int,
+                        help="Maximum number of rows read at a time (default " +
+                        str(umi_tools.GROUPS_CHUNK_SIZE) + ")")
+    parser.add_argument("--position-buffer",
+                        dest="position_buffer",
+                        default=umi_tools.POSITION_BUFFER,
+                        type=int,
+                        help="Number of nucleotides after which reads at a position are counted (default " +
+                        str(umi_tools.POSITION_BUFFER) + ")")
+    options = parser.parse_args()
+    return options
+
+
+def invoke_summarise_umi_groups():
+    """
+    Parse command-line options then invoke
+    :py:func:`riboviz.umi_tools.summarise_groups`.
+    """
+    print(provenance.write_provenance_to_str(__file__))
+    options = parse_command_line_options()
+    summary = umi_tools.summarise_groups(options.groups_file,
+                                         options.chunk_size,
+                                         options.position_buffer)
+    summary.write(options.summary_prefix)
+    print(("Groups: {}".format(sum(summary.group_sizes.values()))))
+    print(("Reads: {}".format(sum(summary.gene_reads.values()))))
+
+
+if __name__ == "__main__":
+    invoke_summarise_umi_groups()
@@ -1,20 +1,25 @@
 #!/usr/bin/env python
 """
 Remove a single 5' mismatched nt and filter reads with more than a
-specified mismatches from a SAM file and save the trimming summary to
-a file.
+specified mismatches from a SAM or BAM file and save the trimming
+summary to a file. Optionally, sort the reads that are kept by
+coordinate and write them to an indexed BAM file, in a single pass.
 
 Usage::
 
     python -m riboviz.tools.trim_5p_mismatch [-h]
         -i SAM_FILE_IN -o SAM_FILE_OUT
         [-m [MAX_MISMATCHES]] [-5 | -k] [-s SUMMARY_FILE]
+        [-p NUM_PROCESSES] [-t NUM_THREADS]
+        [-S] [-b BUFFER_SIZE]
 
     -h, --help            show this help message and exit
     -i SAM_FILE_IN, --input SAM_FILE_IN
-                          SAM file input
+                          SAM or BAM file input ('-' for standard
+                          input)
     -o SAM_FILE_OUT, --output SAM_FILE_OUT
-                          SAM file output
+                          SAM or BAM file output (BAM if the file
+                          extension is bam)
     -m [MAX_MISMATCHES], --max-mismatches [MAX_MISMATCHES]
                           Number of mismatches to allow
                           (default 1)
@@ -23,12 +28,23 @@ Usage::
     -s SUMMARY_FILE, --summary-file SUMMARY_FILE
                           Summary file output
                           (default trim_5p_mismatch.tsv)
+    -p NUM_PROCESSES, --num-processes NUM_PROCESSES
+                          Number of processes (default 1)
+    -t NUM_THREADS, --num-threads NUM_THREADS
+                          Number of BGZF compression threads
+                          (default 1)
+    -S, --sort            Sort output by coordinate and index it
+                          (output must be BAM, -p is ignored)
+    -b BUFFER_SIZE, --buffer-size BUFFER_SIZE
+                          Maximum number of reads held in memory
+                          when sorting (default 1000000)
 
 See :py:func:`riboviz.trim_5p_mismatch.trim_5p_mismatch_file`.
 """
 import argparse
 from riboviz import trim_5p_mismatch
 from riboviz import provenance
+from riboviz import sam_bam
 
 
 def parse_command_line_options():
@@ -39,17 +55,17 @@ def parse_command_line_options():
     :rtype: argparse.Namespace
     """
     parser = argparse.ArgumentParser(
-        description="Remove a single 5' mismatched nt and filter reads with more than a specified mismatches from a SAM file and save the trimming summary to a file")
+        description="Remove a single 5' mismatched nt and filter reads with more than a specified mismatches from a SAM or BAM file and save the trimming summary to a file")
     parser.add_argument("-i",
                         "--input",
                         dest="sam_file_in",
                         required=True,
-                        help="SAM file input")
+                        help="SAM or BAM file input ('-' for standard input)")
     parser.add_argument("-o",
                         "--output",
                         dest="sam_file_out",
                         required=True,
-                        help="SAM file output")
+                        help="SAM or BAM file output (BAM if the file extension is bam)")
     parser.add_argument("-m",
                         "--max-mismatches",
                         dest="max_mismatches",
@@ -75,6 +91,30 @@ def parse_command_line_options():
                         default=trim_5p_mismatch.TRIM_5P_MISMATCH_FILE,
                         help="Summary file output (default " +
                         trim_5p_mismatch.TRIM_5P_MISMATCH_FILE + ")")
+    parser.add_argument("-p",
+                        "--num-processes",
+                        dest="num_processes",
+                        default=1,
+                        type=int,
+                        help="Number of processes (default 1)")
+    parser.add_argument("-t",
+                        "--num-threads",
+                        dest="num_threads",
+                        default=1,
+                        type=int,
+                        help="Number of BGZF compression threads (default 1)")
+    parser.add_argument("-S",
+                        "--sort",
+                        dest="sort",
+                        action="store_true",
+                        help="Sort output by coordinate and index it (output must be BAM, -p is ignored)")
+    parser.add_argument("-b",
+                        "--buffer-size",
+                        dest="buffer_size",
+                        default=sam_bam.SORT_BUFFER_SIZE,
+                        type=int,
+                        help="Maximum number of reads held in memory when sorting (default " +
+                        str(sam_bam.SORT_BUFFER_SIZE) + ")")
     options = parser.parse_args()
     return options
 
@@ -91,11 +131,19 @@ def invoke_trim_5p_mismatch():
     fivep_remove = options.fivep_remove
     max_mismatches = options.max_mismatches
     summary_file = options.summary_file
+    num_processes = options.num_processes
+    num_threads = options.num_threads
+    sort = options.sort
+    buffer_size = options.buffer_size
     trim_5p_mismatch.trim_5p_mismatch_file(sam_file_in,
                                            sam_file_out,
                                            fivep_remove,
                                            max_mismatches,
-                                           summary_file)
+                                           summary_file,
+                                           num_processes,
+                                           num_threads,
+                                           sort,
+                                           buffer_size)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,17 @@
 """
 Trim 5' reads constants and functions.
 """
-import re
+import collections
+import multiprocessing
+import os
+import shutil
+import tempfile
+from itertools import islice
 import pysam
 import pandas as pd
+from riboviz import cigar_md
 from riboviz import provenance
+from riboviz import sam_bam
 
 
 NUM_PROCESSED = "num_processed"
@@ -17,82 +24,513 @@ NUM_WRITTEN = "num_written"
 """ Trimming summary key. """
 TRIM_5P_MISMATCH_FILE = "trim_5p_mismatch.tsv"
 """ Default summary file name. """
+MISMATCH_BASES = ["A", "C", "G", "T"]
+""" MD tag mismatched reference bases checked when trimming. """
+BATCH_SIZE = 100000
+""" Number of reads per batch when using more than one process. """
+_WORKER_STATE = {}
+"""
+SAM/BAM header and trimming configuration used by worker processes,
+set by :py:func:`_init_worker`.
+"""
 
 
 def increase_soft_clip_init(read):
     """
-    Edit CIGAR string of a read to increase soft clip, reducing the
-    number of initial matches.
+    Edit CIGAR operations of a read to increase soft clip, reducing
+    the number of initial matches. See
+    :py:func:`riboviz.cigar_md.clip_cigar`.
 
     :param read: Read
     :type read: pysam.libcalignedsegment.AlignedSegment
     """
-    cigar_string = read.cigarstring
-    if "S" not in cigar_string[:3]:
-        # Read is not soft-clipped on left.
-        # Find number of initial matches.
-        num_init_match = int(re.findall(r"^([0-9]+)M", cigar_string)[0])
-        # Add initial "1S" and reduce initial match by 1.
-        new_init_bit = "1S" + str(num_init_match - 1) + "M"
-        read.cigarstring = re.sub(r"^([0-9]+)M",
-                                  new_init_bit,
-                                  cigar_string)
-    else:
-        # Read is soft-clipped on left.
-        num_soft_clip = int(re.findall(r"^([0-9]+)S",
-                                       cigar_string)[0])
-        num_init_match = int(re.findall(r"([0-9]+)M",
-                                        cigar_string)[0])
-        # Add 1 to left soft-clip and reduce initial match by 1.
-        new_init_bit = str(num_soft_clip + 1) + \
-            "S" + str(num_init_match - 1) + "M"
-        read.cigarstring = re.sub(r"^([0-9]+)S([0-9]+)M",
-                                  new_init_bit,
-                                  cigar_string)
+    read.cigartuples, _, _, _ = cigar_md.clip_cigar(read.cigartuples, 1)
 
 
 def increase_soft_clip_term(read):
     """
-    Edit CIGAR string of a read to increase soft clip, reducing the
-    number of terminal matches.
+    Edit CIGAR operations of a read to increase soft clip, reducing
+    the number of terminal matches. See
+    :py:func:`riboviz.cigar_md.clip_cigar`.
 
     :param read: Read
     :type read: pysam.libcalignedsegment.AlignedSegment
     """
-    cigar_string = read.cigarstring
-    if cigar_string[-1] != "S":
-        # Read is not soft-clipped on left (= right along template)
-        # Find number of terminal matches.
-        num_term_match = int(re.findall(r"([0-9]+)M$",
-                                        cigar_string)[0])
-        # Add initial "1S" and reduce initial match by 1.
-        new_term_bit = str(num_term_match - 1) + "M1S"
-        read.cigarstring = re.sub(r"([0-9]+)M$",
-                                  new_term_bit,
-                                  cigar_string)
+    read.cigartuples, _, _, _ = cigar_md.clip_cigar(
+        read.cigartuples, 1, from_end=True)
+
+
+def trim_read(read, fivep_remove=True, max_mismatches=1):
+    """
+    Remove a single 5' mismatched nt from a read, editing the read in
+    place, and check whether the read has more than a specified
+    mismatches.
+
+    The 5' end of a read is the start of its alignment, or the end if
+    the read is mapped to the reverse strand. If the two 5'-most nt
+    are both mismatched then the read is discarded.
+
+    As for earlier versions of RiboViz:
+
+    * Only primary alignments are trimmed. Secondary and
+      supplementary alignments are kept or discarded based on their
+      mismatches alone.
+    * For a read on the reverse strand, the 2nd nt is taken to be
+      mismatched only if the MD tag has no ``0`` between the two
+      mismatches e.g. a read with MD tag ``10AC0`` is discarded but
+      one with MD tag ``10A0C0`` has one nt trimmed and is kept.
+
+    :param read: Read
+    :type read: pysam.libcalignedsegment.AlignedSegment
+    :param fivep_remove: Remove mismatched 5' nt?
+    :type fivep_remove: bool
+    :param max_mismatches: Number of mismatches
+    :type max_mismatches: int
+    :return: (``True`` if the read was trimmed, ``True`` if the read \
+    is to be kept, ``False`` if it is to be discarded)
+    :rtype: tuple(bool, bool)
+    """
+    try:
+        # Get MD tag for read, encoding mismatches.
+        md_tag = read.get_tag(cigar_md.MD_TAG)
+    except KeyError:
+        # MD tag not present, assume read not aligned, discard.
+        return (False, False)
+    is_trimmed = False
+    # Count mismatches in read.
+    num_mismatches = read.get_tag(cigar_md.NM_TAG)
+    if num_mismatches > 0 and fivep_remove and \
+       not (read.is_secondary or read.is_supplementary):
+        # If there are any mismatches, check those at the 5' end.
+        # Positive sense is with template, so for a minus strand
+        # read (reverse-complement) the 5' end is the alignment end.
+        if read.is_reverse:
+            is_5p_mismatch = md_tag[-2:-1] in MISMATCH_BASES and \
+                md_tag.endswith("0")
+            is_2nd_mismatch = md_tag[-3:-2] in MISMATCH_BASES
+        else:
+            is_5p_mismatch = md_tag[:1] == "0"
+            is_2nd_mismatch = md_tag[2:3] in MISMATCH_BASES + ["0"]
+        if is_5p_mismatch and is_2nd_mismatch:
+            # 2nd nt is also mismatched; discard.
+            return (False, False)
+        if is_5p_mismatch:
+            # Soft-clip 5' nt, editing position (for plus strand
+            # reads), CIGAR, MD and NM.
+            num_mismatches -= cigar_md.soft_clip_5p(read, 1)
+            is_trimmed = True
+    return (is_trimmed, num_mismatches <= max_mismatches)
+
+
+def filter_reads(reads, summary, fivep_remove=True, max_mismatches=1):
+    """
+    Remove a single 5' mismatched nt and filter reads with more than
+    a specified mismatches, yielding the reads that are kept. See
+    :py:func:`trim_read`. The trimming summary, see
+    :py:func:`trim_5p_mismatch`, is updated as reads are processed.
+
+    :param reads: Reads
+    :type reads: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    :param summary: trimming summary
+    :type summary: dict
+    :param fivep_remove: Remove mismatched 5' nt?
+    :type fivep_remove: bool
+    :param max_mismatches: Number of mismatches
+    :type max_mismatches: int
+    :return: Reads that are kept
+    :rtype: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    """
+    for read in reads:
+        summary[NUM_PROCESSED] += 1
+        if (summary[NUM_PROCESSED] % 1000000) == 0:
+            print(("processed " + str(summary[NUM_PROCESSED]) + " reads"))
+        is_trimmed, is_kept = trim_read(read, fivep_remove, max_mismatches)
+        if is_trimmed:
+            summary[NUM_TRIMMED] += 1
+        if is_kept:
+            summary[NUM_WRITTEN] += 1
+            yield read
+        else:
+            summary[NUM_DISCARDED] += 1
+
+
+def trim_reads(reads, sam_out, fivep_remove=True, max_mismatches=1):
+    """
+    Remove a single 5' mismatched nt and filter reads with more than
+    a specified mismatches, writing the reads that are kept. See
+    :py:func:`filter_reads`. A trimming summary is returned. See
+    :py:func:`trim_5p_mismatch`.
+
+    :param reads: Reads
+    :type reads: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    :param sam_out: SAM/BAM output file
+    :type sam_out: pysam.AlignmentFile
+    :param fivep_remove: Remove mismatched 5' nt?
+    :type fivep_remove: bool
+    :param max_mismatches: Number of mismatches
+    :type max_mismatches: int
+    :return: trimming summary
+    :rtype: dict
+    """
+    summary = {NUM_PROCESSED: 0,
+               NUM_DISCARDED: 0,
+               NUM_TRIMMED: 0,
+               NUM_WRITTEN: 0}
+    for read in filter_reads(reads, summary, fivep_remove, max_mismatches):
+        sam_out.write(read)
+    return summary
+
+
+def get_write_mode(file_name):
+    """
+    Get :py:class:`pysam.AlignmentFile` mode for writing a SAM file,
+    with header, or a BAM file, depending upon the file extension.
+
+    :param file_name: SAM/BAM file name
+    :type file_name: str or unicode
+    :return: ``wb`` for BAM files, ``wh`` otherwise
+    :rtype: str or unicode
+    """
+    if sam_bam.is_bam(file_name):
+        return "wb"
+    return "wh"
+
+
+def read_sam_lines(sam_in):
+    """
+    Iterate through the reads in a SAM/BAM file as SAM-formatted
+    lines. Uncompressed SAM files, other than standard input, are read
+    as text, without parsing the reads. Other files are parsed and
+    each read formatted.
+
+    :param sam_in: SAM/BAM input file
+    :type sam_in: pysam.AlignmentFile
+    :return: SAM-formatted lines, without trailing newlines
+    :rtype: collections.Iterable(str or unicode)
+    """
+    if sam_in.is_sam and sam_in.compression == "NONE" and \
+       os.path.isfile(sam_in.filename):
+        with open(sam_in.filename, "r") as f:
+            for line in f:
+                if line.startswith("@") or line == "\n":
+                    continue
+                yield line.rstrip("\n")
+    else:
+        for read in sam_in:
+            yield read.to_string()
+
+
+def read_batches(sam_in, batch_size=BATCH_SIZE):
+    """
+    Split the reads in a SAM/BAM file into batches, for trimming by
+    worker processes, yielding, for each batch, a function which
+    iterates through the reads in the batch in a worker process, its
+    arguments, and the number of reads in the batch.
+
+    BAM files are split by the virtual offset of the first read of
+    each batch and uncompressed SAM files by the byte offset of the
+    first read of each batch, so each worker reads and parses its own
+    batch (see :py:func:`_read_bam_batch` and
+    :py:func:`_read_sam_batch`). Other files, such as standard input,
+    are read as SAM-formatted lines (see :py:func:`read_sam_lines`)
+    which are sent to the workers (see :py:func:`_parse_sam_lines`).
+
+    :param sam_in: SAM/BAM input file
+    :type sam_in: pysam.AlignmentFile
+    :param batch_size: Number of reads per batch
+    :type batch_size: int
+    :return: Function, arguments and number of reads for each batch
+    :rtype: collections.Iterable(tuple(function, tuple, int))
+    """
+    if sam_in.is_bam and os.path.isfile(sam_in.filename):
+        offset = sam_in.tell()
+        num_reads = 0
+        for _ in sam_in:
+            num_reads += 1
+            if num_reads == batch_size:
+                yield _read_bam_batch, (offset, num_reads), num_reads
+                offset = sam_in.tell()
+                num_reads = 0
+        if num_reads > 0:
+            yield _read_bam_batch, (offset, num_reads), num_reads
+    elif sam_in.is_sam and sam_in.compression == "NONE" and \
+            os.path.isfile(sam_in.filename):
+        with open(sam_in.filename, "rb") as f:
+            position = 0
+            offset = 0
+            num_reads = 0
+            for line in f:
+                if not (line.startswith(b"@") or line == b"\n"):
+                    if num_reads == 0:
+                        offset = position
+                    num_reads += 1
+                    if num_reads == batch_size:
+                        yield _read_sam_batch, (offset, num_reads), num_reads
+                        num_reads = 0
+                position += len(line)
+        if num_reads > 0:
+            yield _read_sam_batch, (offset, num_reads), num_reads
     else:
-        # Read is soft-clipped on left (= right along template).
-        # Find number of terminal matches.
-        num_soft_clip = int(re.findall(r"([0-9]+)S$",
-                                       cigar_string)[0])
-        num_term_match = int(re.findall(r"([0-9]+)M",
-                                        cigar_string)[-1])
-        # Add initial "1S" and reduce initial match by 1.
-        new_term_bit = str(num_term_match - 1) + \
-            "M" + str(num_soft_clip + 1) + "S"
-        read.cigarstring = re.sub(r"([0-9]+)M([0-9]+)S$",
-                                  new_term_bit,
-                                  cigar_string)
+        sam_lines = read_sam_lines(sam_in)
+        while True:
+            lines = list(islice(sam_lines, batch_size))
+            if not lines:
+                break
+            yield _parse_sam_lines, (lines,), len(lines)
+
+
+def _init_worker(sam_file_in, header, fivep_remove, max_mismatches,
+                 shard_dir, shard_format):
+    """
+    Initialise a worker process with the SAM/BAM input file, header
+    and trimming configuration so these are not sent with every batch.
+
+    :param sam_file_in: SAM/BAM input file
+    :type sam_file_in: str or unicode
+    :param header: SAM/BAM header
+    :type header: dict
+    :param fivep_remove: Remove mismatched 5' nt?
+    :type fivep_remove: bool
+    :param max_mismatches: Number of mismatches
+    :type max_mismatches: int
+    :param shard_dir: Directory for output files for each batch
+    :type shard_dir: str or unicode
+    :param shard_format: Output file name format for each batch
+    :type shard_format: str or unicode
+    """
+    _WORKER_STATE["sam_file_in"] = sam_file_in
+    _WORKER_STATE["header"] = pysam.AlignmentHeader.from_dict(header)
+    _WORKER_STATE["fivep_remove"] = fivep_remove
+    _WORKER_STATE["max_mismatches"] = max_mismatches
+    _WORKER_STATE["shard_dir"] = shard_dir
+    _WORKER_STATE["shard_format"] = shard_format
+
+
+def _read_bam_batch(offset, num_reads):
+    """
+    Iterate through a batch of reads in the BAM file set by
+    :py:func:`_init_worker`.
+
+    :param offset: Virtual offset of the first read in the batch
+    :type offset: int
+    :param num_reads: Number of reads in the batch
+    :type num_reads: int
+    :return: Reads
+    :rtype: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    """
+    with pysam.AlignmentFile(_WORKER_STATE["sam_file_in"], "rb") \
+            as sam_in:
+        sam_in.seek(offset)
+        yield from islice(sam_in, num_reads)
+
+
+def _read_sam_batch(offset, num_reads):
+    """
+    Iterate through a batch of reads in the uncompressed SAM file set
+    by :py:func:`_init_worker`.
+
+    :param offset: Byte offset of the first read in the batch
+    :type offset: int
+    :param num_reads: Number of reads in the batch
+    :type num_reads: int
+    :return: Reads
+    :rtype: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    """
+    with open(_WORKER_STATE["sam_file_in"], "rb") as f:
+        f.seek(offset)
+        lines = (line for line in f
+                 if not (line.startswith(b"@") or line == b"\n"))
+        yield from _parse_sam_lines(
+            line.decode().rstrip("\n") for line in islice(lines, num_reads))
+
+
+def _parse_sam_lines(lines):
+    """
+    Parse a batch of SAM-formatted lines using the header set by
+    :py:func:`_init_worker`.
+
+    :param lines: Reads, as SAM-formatted lines
+    :type lines: collections.Iterable(str or unicode)
+    :return: Reads
+    :rtype: collections.Iterable(\
+    pysam.libcalignedsegment.AlignedSegment)
+    """
+    header = _WORKER_STATE["header"]
+    return (pysam.AlignedSegment.fromstring(line, header)
+            for line in lines)
+
+
+def _trim_batch_worker(batch_index, read_batch, args):
+    """
+    Call :py:func:`trim_reads` on a batch of reads, using the state
+    set by :py:func:`_init_worker`, and write the reads that are kept
+    to an output file for the batch.
+
+    :param batch_index: Batch index
+    :type batch_index: int
+    :param read_batch: Function which iterates through the reads in \
+    the batch, see :py:func:`read_batches`
+    :type read_batch: function
+    :param args: ``read_batch`` arguments
+    :type args: tuple
+    :return: Output file for batch and trimming summary for batch
+    :rtype: tuple(str or unicode, dict)
+    """
+    header = _WORKER_STATE["header"]
+    shard_file = os.path.join(
+        _WORKER_STATE["shard_dir"],
+        _WORKER_STATE["shard_format"].format(batch_index))
+    with pysam.AlignmentFile(shard_file,
+                             get_write_mode(shard_file),
+                             header=header) as sam_out:
+        summary = trim_reads(read_batch(*args),
+                             sam_out,
+                             _WORKER_STATE["fivep_remove"],
+                             _WORKER_STATE["max_mismatches"])
+    return shard_file, summary
+
+
+def merge_shards(shard_files, sam_file_out, template, num_threads=1):
+    """
+    Concatenate the output files written for each batch by
+    :py:func:`_trim_batch_worker` into a single SAM/BAM file.
+
+    BAM files are concatenated using ``samtools cat``, without
+    decompressing the reads. SAM files are appended, excluding their
+    headers, to a SAM file holding the header of ``template``.
+
+    :param shard_files: Output files for each batch, in order
+    :type shard_files: list(str or unicode)
+    :param sam_file_out: SAM/BAM output file
+    :type sam_file_out: str or unicode
+    :param template: SAM/BAM file providing header
+    :type template: pysam.AlignmentFile
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    """
+    if sam_bam.is_bam(sam_file_out) and shard_files:
+        pysam.cat("--no-PG", "-o", sam_file_out, *shard_files)
+        return
+    with pysam.AlignmentFile(sam_file_out,
+                             get_write_mode(sam_file_out),
+                             template=template,
+                             threads=num_threads):
+        pass
+    with open(sam_file_out, "a") as f:
+        for shard_file in shard_files:
+            with open(shard_file, "r") as shard:
+                f.writelines(line for line in shard
+                             if not line.startswith("@"))
+
+
+def trim_batches(sam_in,
+                 sam_file_out,
+                 fivep_remove,
+                 max_mismatches,
+                 num_processes,
+                 num_threads=1,
+                 batch_size=BATCH_SIZE):
+    """
+    Remove a single 5' mismatched nt and filter reads with more than
+    a specified mismatches using a pool of worker processes.
+
+    The reads are split into batches (see :py:func:`read_batches`),
+    each batch is read and trimmed by a worker process which writes
+    the reads that are kept to an output file for that batch, and
+    these are then concatenated in the order in which the batches
+    were read, so the output is the same as when trimming reads one
+    at a time. At most twice ``num_processes`` batches are pending at
+    any time.
+
+    :param sam_in: SAM/BAM input file
+    :type sam_in: pysam.AlignmentFile
+    :param sam_file_out: SAM/BAM output file
+    :type sam_file_out: str or unicode
+    :param fivep_remove: Remove mismatched 5' nt?
+    :type fivep_remove: bool
+    :param max_mismatches: Number of mismatches
+    :type max_mismatches: int
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    :param batch_size: Number of reads per batch
+    :type batch_size: int
+    :return: trimming summary
+    :rtype: dict
+    """
+    summary = {NUM_PROCESSED: 0,
+               NUM_DISCARDED: 0,
+               NUM_TRIMMED: 0,
+               NUM_WRITTEN: 0}
+    shard_files = []
+    pending = collections.deque()
+
+    def merge_next():
+        shard_file, batch_summary = pending.popleft().get()
+        shard_files.append(shard_file)
+        for key, value in batch_summary.items():
+            summary[key] += value
+
+    shard_dir = tempfile.mkdtemp(
+        prefix="trim_5p_mismatch",
+        dir=os.path.dirname(os.path.abspath(sam_file_out)))
+    if sam_bam.is_bam(sam_file_out):
+        shard_format = sam_bam.BAM_FORMAT
+    else:
+        shard_format = sam_bam.SAM_FORMAT
+    try:
+        with multiprocessing.Pool(num_processes,
+                                  initializer=_init_worker,
+                                  initargs=(sam_in.filename,
+                                            sam_in.header.to_dict(),
+                                            fivep_remove,
+                                            max_mismatches,
+                                            shard_dir,
+                                            shard_format)) as pool:
+            num_processed = 0
+            for read_batch, args, num_reads in read_batches(sam_in,
+                                                            batch_size):
+                # Output every millionth processed read.
+                if (num_processed + num_reads) // 1000000 > \
+                   num_processed // 1000000:
+                    print(("processed " + str(
+                        1000000 * ((num_processed + num_reads) //
+                                   1000000)) + " reads"))
+                pending.append(
+                    pool.apply_async(_trim_batch_worker,
+                                     (len(shard_files) + len(pending),
+                                      read_batch,
+                                      args)))
+                num_processed += num_reads
+                if len(pending) >= 2 * num_processes:
+                    merge_next()
+            while pending:
+                merge_next()
+        merge_shards(shard_files, sam_file_out, sam_in, num_threads)
+    finally:
+        shutil.rmtree(shard_dir)
+    return summary
 
 
 def trim_5p_mismatch(sam_file_in,
                      sam_file_out,
                      fivep_remove=True,
-                     max_mismatches=1):
+                     max_mismatches=1,
+                     num_processes=1,
+                     num_threads=1,
+                     batch_size=BATCH_SIZE,
+                     sort=False,
+                     buffer_size=sam_bam.SORT_BUFFER_SIZE):
     """
     Remove a single 5' mismatched nt and filter reads with more than
-    a specified mismatches from a SAM file. A trimming summary is
-    returned, with keys:
+    a specified mismatches from a SAM or BAM file. A trimming summary
+    is returned, with keys:
 
     * ``num_processed``
     * ``num_discarded``
@@ -102,82 +540,84 @@ def trim_5p_mismatch(sam_file_in,
     and values with the numbers of reads corresponding to each of
     these categories.
 
-    :param sam_file_in: SAM input file
+    The output is written as BAM if ``sam_file_out`` has extension
+    ``bam`` or ``BAM``, otherwise as SAM. Reads are streamed from the
+    input file to the output file. ``num_threads`` threads are used
+    for BGZF compression and decompression of BAM files.
+
+    If ``num_processes`` is greater than 1 then reads are trimmed by
+    a pool of worker processes, see :py:func:`trim_batches`.
+
+    If ``sort`` is ``True`` then the reads that are kept are sorted
+    by coordinate, written to ``sam_file_out``, which must be a BAM
+    file, and indexed, in a single pass over the input, see
+    :py:func:`riboviz.sam_bam.write_sorted_bam`. Reads are trimmed
+    in this process and ``num_processes`` is ignored. ``sam_file_in``
+    can be ``-`` to read SAM from standard input e.g. piped from
+    HISAT2.
+
+    :param sam_file_in: SAM/BAM input file
     :type sam_file_in: str or unicode
-    :param sam_file_out: SAM output file
+    :param sam_file_out: SAM/BAM output file
     :type sam_file_out: str or unicode
     :param fivep_remove: Remove mismatched 5' nt?
     :type fivep_remove: bool
     :param max_mismatches: Number of mismatches
     :type max_mismatches: int
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    :param batch_size: Number of reads per batch, if using more \
+    than one process
+    :type batch_size: int
+    :param sort: Sort and index output BAM file?
+    :type sort: bool
+    :param buffer_size: Maximum number of reads held in memory when \
+    sorting
+    :type buffer_size: int
     :return: trimming summary
     :rtype: dict
+    :raise ValueError: If ``sort`` is ``True`` and ``sam_file_out`` \
+    is not a BAM file
     """
-    num_processed = 0
-    num_discarded = 0
-    num_trimmed = 0
-    num_written = 0
-    with pysam.AlignmentFile(sam_file_in, "r") as sam_in,\
-         pysam.AlignmentFile(sam_file_out, "wh", template=sam_in) as sam_out:
-        for read in sam_in.fetch():
-            num_processed += 1
-            if (num_processed % 1000000) == 1:
-                print(("processed " + str(num_processed - 1) + " reads"))
-            try:
-                # Get MD tag for read, encoding mismatches.
-                md_tag = read.get_tag('MD')
-            except KeyError:
-                # MD tag not present, assume read not aligned, discard.
-                num_discarded += 1
-                continue
-            # Count mismatches in read.
-            num_mismatches = read.get_tag('NM')
-            if num_mismatches > 0 and fivep_remove:
-                # If there are any mismatches...
-                if md_tag[0] == "0" and read.flag == 0:
-                    # If the 5' nt is mismatched on a plus-strand read...
-                    if md_tag[2] in ["A", "T", "C", "G", "0"]:
-                        # 2nd nt is also mismatched; discard.
-                        num_discarded += 1
-                        continue
-                    # ... soft-clip 5' nt
-                    # Increment position of alignment.
-                    read.pos += 1
-                    # Edit MD tag to remove leading mismatch.
-                    read.set_tag('MD', re.sub("^0[ATCG]", "", md_tag))
-                    num_mismatches -= 1
-                    read.set_tag('NM', num_mismatches)
-                    increase_soft_clip_init(read)
-                    num_trimmed += 1
-
-                if bool(re.search("[ATCG]0$", md_tag)) and read.flag == 16:
-                    # If the 5' nt is mismatched on a minus strand read...
-                    # Positive sense is with template.
-                    # Read is reverse-complement.
-                    if md_tag[-3] in ["A", "T", "C", "G"]:
-                        # 2nd nt is also mismatched; discard.
-                        num_discarded += 1
-                        continue
-                    # ... soft-clip 5' nt
-                    # Don't increment position of alignment!
-                    # Edit MD tag to remove trailing mismatch.
-                    read.set_tag('MD', re.sub("[ATCG]0$", "", md_tag))
-                    num_mismatches -= 1
-                    read.set_tag('NM', num_mismatches)
-                    increase_soft_clip_term(read)
-                    num_trimmed += 1
-
-            if num_mismatches <= max_mismatches:
-                num_written += 1
-                sam_out.write(read)
-            else:
-                num_discarded += 1
-    print(("processed " + str(num_processed - 1) + " reads"))
+    if sort and not sam_bam.is_bam(sam_file_out):
+        raise ValueError("Sorted output must be a BAM file: {}".format(
+            sam_file_out))
+    with pysam.AlignmentFile(sam_file_in, "r", threads=num_threads) \
+            as sam_in:
+        if sort:
+            summary = {NUM_PROCESSED: 0,
+                       NUM_DISCARDED: 0,
+                       NUM_TRIMMED: 0,
+                       NUM_WRITTEN: 0}
+            sam_bam.write_sorted_bam(filter_reads(sam_in,
+                                                  summary,
+                                                  fivep_remove,
+                                                  max_mismatches),
+                                     sam_file_out,
+                                     sam_in.header,
+                                     buffer_size,
+                                     num_threads=num_threads)
+        elif num_processes > 1:
+            summary = trim_batches(sam_in,
+                                   sam_file_out,
+                                   fivep_remove,
+                                   max_mismatches,
+                                   num_processes,
+                                   num_threads,
+                                   batch_size)
+        else:
+            with pysam.AlignmentFile(sam_file_out,
+                                     get_write_mode(sam_file_out),
+                                     template=sam_in,
+                                     threads=num_threads) as sam_out:
+                summary = trim_reads(sam_in,
+                                     sam_out,
+                                     fivep_remove,
+                                     max_mismatches)
+    print(("processed " + str(summary[NUM_PROCESSED]) + " reads"))
     print("Summary:")
-    summary = {NUM_PROCESSED: num_processed,
-               NUM_DISCARDED: num_discarded,
-               NUM_TRIMMED: num_trimmed,
-               NUM_WRITTEN: num_written}
     for (name, value) in list(summary.items()):
         print(("{}:\t{}".format(name, value)))
     return summary
@@ -187,15 +627,19 @@ def trim_5p_mismatch_file(sam_file_in,
                           sam_file_out,
                           fivep_remove=True,
                           max_mismatches=1,
-                          summary_file=TRIM_5P_MISMATCH_FILE):
+                          summary_file=TRIM_5P_MISMATCH_FILE,
+                          num_processes=1,
+                          num_threads=1,
+                          sort=False,
+                          buffer_size=sam_bam.SORT_BUFFER_SIZE):
     """
     Remove a single 5' mismatched nt and filter reads with more than
-    a specified mismatches from a SAM file and save the trimming
-    summary to a file. See :py:func:`trim_5p_mismatch`.
+    a specified mismatches from a SAM or BAM file and save the
+    trimming summary to a file. See :py:func:`trim_5p_mismatch`.
 
-    :param sam_file_in: SAM input file
+    :param sam_file_in: SAM/BAM input file
     :type sam_file_in: str or unicode
-    :param sam_file_out: SAM output file
+    :param sam_file_out: SAM/BAM output file
     :type sam_file_out: str or unicode
     :param fivep_remove: Remove mismatched 5' nt?
     :type fivep_remove: bool
@@ -203,11 +647,26 @@ def trim_5p_mismatch_file(sam_file_in,
     :type max_mismatches: int
     :param summary_file: Summary file name
     :type summary_file: str or unicode
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    :param sort: Sort and index output BAM file?
+    :type sort: bool
+    :param buffer_size: Maximum number of reads held in memory when \
+    sorting
+    :type buffer_size: int
+    :raise ValueError: If ``sort`` is ``True`` and ``sam_file_out`` \
+    is not a BAM file
     """
     summary = trim_5p_mismatch(sam_file_in,
                                sam_file_out,
                                fivep_remove,
-                               max_mismatches)
+                               max_mismatches,
+                               num_processes,
+                               num_threads,
+                               sort=sort,
+                               buffer_size=buffer_size)
     provenance.write_provenance_header(__file__, summary_file)
     summary_df = pd.DataFrame.from_dict([summary])
     summary_df[list(summary_df.columns)].to_csv(
@@ -1,6 +1,37 @@
 """
 umi_tools-related constants and functions.
+
+:py:func:`dedup_umis` is a native alternative to running ``umi_tools
+dedup`` and ``umi_tools group`` (once before and once after
+deduplication) over the same BAM file. It reads a coordinate-sorted
+BAM file once and writes the deduplicated reads, the UMI groups before
+and after deduplication, in the format of ``umi_tools group
+--group-out``, and the deduplication statistics, in the format of
+``umi_tools dedup --output-stats``.
+
+Reads are bucketed by reference, 5' position, strand and, optionally,
+read length, as for ``umi_tools dedup --read-length``. The UMIs within
+each bucket are clustered using the ``directional`` method, the
+``umi_tools`` default, with Hamming distances computed in batches by
+:py:func:`riboviz.barcodes_umis.hamming_distances`.
+
+UMI groups files hold a row per read, so :py:func:`summarise_groups`
+summarises these in chunks, as histograms of group sizes and reads
+per position and duplication rate per gene (see
+:py:class:`GroupsSummary`). :py:func:`dedup_umis` can write this
+summary without writing the groups files.
 """
+import collections
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pysam
+from riboviz import barcodes_umis
+from riboviz import sam_bam
 
 UMI_COUNT = "umi_count"
 """ Column in ``umi_tools group`` output file. """
@@ -10,3 +41,1201 @@ UNIQUE_ID = "unique_id"
 """ Column in ``umi_tools group`` output file. """
 READ_ID = "read_id"
 """ Column in ``umi_tools group`` output file. """
+CONTIG = "contig"
+""" Column in ``umi_tools group`` output file. """
+POSITION = "position"
+""" Column in ``umi_tools group`` output file. """
+GENE = "gene"
+""" Column in ``umi_tools group`` output file. """
+UMI = "umi"
+""" Column in ``umi_tools group`` output file. """
+FINAL_UMI = "final_umi"
+""" Column in ``umi_tools group`` output file. """
+GROUP_COLUMNS = [READ_ID, CONTIG, POSITION, GENE, UMI, UMI_COUNT,
+                 FINAL_UMI, FINAL_UMI_COUNT, UNIQUE_ID]
+""" Columns in ``umi_tools group`` output file. """
+NO_GENE = "NA"
+""" ``umi_tools group`` output file gene for reads not per-gene. """
+UMI_SEPARATOR = "_"
+""" Default separator between read ID and UMI in read names. """
+EDIT_DISTANCE_THRESHOLD = 1
+""" Default maximum Hamming distance between adjacent UMIs. """
+POSITION_BUFFER = 1000
+"""
+Default distance, in nucleotides, behind the leftmost position of the
+current read beyond which no more reads are expected for a bucket, as
+for ``umi_tools``.
+"""
+DIRECTIONAL = "directional"
+""" UMI clustering method. """
+SINGLE_UMI = "Single_UMI"
+""" Edit distance statistics label for buckets with a single UMI. """
+EDIT_DISTANCE_STATS_FORMAT = "{}_edit_distance.tsv"
+""" Edit distance statistics file name format. """
+PER_UMI_PER_POSITION_STATS_FORMAT = "{}_per_umi_per_position.tsv"
+""" Per UMI per position statistics file name format. """
+PER_UMI_STATS_FORMAT = "{}_per_umi.tsv"
+""" Per UMI statistics file name format. """
+NULL_SEED = 0
+"""
+Default seed for the random UMIs used for null edit distance
+statistics.
+"""
+GROUP_SIZES_FORMAT = "{}_group_sizes.tsv"
+""" UMI group sizes summary file name format. """
+READS_PER_POSITION_FORMAT = "{}_reads_per_position.tsv"
+""" Reads per position summary file name format. """
+GENE_DUPLICATION_FORMAT = "{}_gene_duplication.tsv"
+""" Duplication rate per gene summary file name format. """
+GROUP_SIZE = "group_size"
+""" Column in UMI group sizes summary file. """
+NUM_GROUPS = "num_groups"
+"""
+Column in UMI group sizes and duplication rate per gene summary
+files.
+"""
+NUM_READS = "num_reads"
+"""
+Column in reads per position and duplication rate per gene summary
+files.
+"""
+NUM_POSITIONS_COLUMN = "num_positions"
+""" Column in reads per position summary file. """
+DUPLICATION_RATE = "duplication_rate"
+""" Column in duplication rate per gene summary file. """
+GROUPS_CHUNK_SIZE = 1000000
+""" Default number of rows read at a time from UMI groups files. """
+NUM_INPUT_READS = "num_input_reads"
+""" Deduplication summary key. """
+NUM_UNMAPPED_READS = "num_unmapped_reads"
+""" Deduplication summary key. """
+NUM_POSITIONS = "num_positions"
+""" Deduplication summary key. """
+NUM_OUTPUT_READS = "num_output_reads"
+""" Deduplication summary key. """
+NUM_POST_DEDUP_GROUPS = "num_post_dedup_groups"
+"""
+Deduplication summary key. This is 0 unless post-deduplication groups
+are output.
+"""
+
+
+def get_umi(read, umi_separator=UMI_SEPARATOR):
+    """
+    Get the UMI of a read, added to the end of its name by ``umi_tools
+    extract``.
+
+    :param read: Read
+    :type read: pysam.AlignedSegment
+    :param umi_separator: Separator between read ID and UMI
+    :type umi_separator: str or unicode
+    :return: UMI
+    :rtype: str or unicode
+    :raise ValueError: If the read name has no ``umi_separator``
+    """
+    _, separator, umi = read.query_name.rpartition(umi_separator)
+    if not separator:
+        raise ValueError("Read {} has no UMI after {}".format(
+            read.query_name, umi_separator))
+    return umi
+
+
+def get_read_position(read):
+    """
+    Get the 5' position of a read, including any soft-clipping, as for
+    ``umi_tools``. This is the leftmost position for reads on the
+    ``+`` strand and the rightmost position plus one for reads on the
+    ``-`` strand.
+
+    :param read: Read
+    :type read: pysam.AlignedSegment
+    :return: 5' position (0-indexed)
+    :rtype: int
+    """
+    cigar = read.cigartuples
+    if read.is_reverse:
+        position = read.reference_end
+        if cigar and cigar[-1][0] == pysam.CSOFT_CLIP:
+            position += cigar[-1][1]
+    else:
+        position = read.reference_start
+        if cigar and cigar[0][0] == pysam.CSOFT_CLIP:
+            position -= cigar[0][1]
+    return position
+
+
+class UmiBucket:
+    """
+    Reads with the same reference, 5' position, strand and,
+    optionally, length, grouped by UMI.
+
+    ``umis`` are the UMIs in the order in which they were first seen,
+    ``counts`` the number of reads with each UMI and ``best_reads``
+    the read with each UMI with the highest mapping quality (the
+    first such read if there are ties, whereas ``umi_tools`` chooses
+    one at random). If ``keep_reads`` is ``True`` then ``reads`` holds
+    all the reads with each UMI.
+    """
+
+    def __init__(self, keep_reads=False):
+        """
+        Constructor.
+
+        :param keep_reads: Keep all reads?
+        :type keep_reads: bool
+        """
+        self.keep_reads = keep_reads
+        self.umis = []
+        self.counts = []
+        self.best_reads = []
+        self.reads = []
+        self._indices = {}
+
+    def add(self, umi, read):
+        """
+        Add a read.
+
+        :param umi: UMI
+        :type umi: str or unicode
+        :param read: Read
+        :type read: pysam.AlignedSegment
+        """
+        index = self._indices.get(umi)
+        if index is None:
+            self._indices[umi] = len(self.umis)
+            self.umis.append(umi)
+            self.counts.append(1)
+            self.best_reads.append(read)
+            self.reads.append([read] if self.keep_reads else None)
+            return
+        self.counts[index] += 1
+        if read.mapping_quality > self.best_reads[index].mapping_quality:
+            self.best_reads[index] = read
+        if self.keep_reads:
+            self.reads[index].append(read)
+
+
+def get_umi_buckets(reads,
+                    summary,
+                    umi_separator=UMI_SEPARATOR,
+                    read_length=True,
+                    keep_reads=False,
+                    position_buffer=POSITION_BUFFER):
+    """
+    Bucket coordinate-sorted reads by reference, 5' position (see
+    :py:func:`get_read_position`), strand and, if ``read_length`` is
+    ``True``, read length, in a single pass.
+
+    A bucket is complete, and is returned, once a read is seen whose
+    leftmost position is more than ``position_buffer`` beyond the
+    bucket's position, or whose reference differs. Unmapped reads are
+    skipped. ``summary`` values for :py:const:`NUM_INPUT_READS`,
+    :py:const:`NUM_UNMAPPED_READS` and :py:const:`NUM_POSITIONS` are
+    incremented.
+
+    :param reads: Reads
+    :type reads: collections.Iterable(pysam.AlignedSegment)
+    :param summary: Deduplication summary
+    :type summary: dict
+    :param umi_separator: Separator between read ID and UMI
+    :type umi_separator: str or unicode
+    :param read_length: Bucket reads by length?
+    :type read_length: bool
+    :param keep_reads: Keep all reads in buckets (see \
+    :py:class:`UmiBucket`)?
+    :type keep_reads: bool
+    :param position_buffer: Distance behind the current read beyond \
+    which buckets are complete
+    :type position_buffer: int
+    :return: Buckets
+    :rtype: collections.Iterable(UmiBucket)
+    :raise ValueError: If a read has no UMI
+    """
+    buckets = {}
+    # Bucket keys, which start with the bucket's position, as a heap.
+    keys = []
+    reference_id = None
+    for read in reads:
+        summary[NUM_INPUT_READS] += 1
+        if read.is_unmapped:
+            summary[NUM_UNMAPPED_READS] += 1
+            continue
+        if read.reference_id != reference_id:
+            reference_id = read.reference_id
+            end = float("inf")
+        else:
+            end = read.reference_start - position_buffer
+        while keys and keys[0][0] < end:
+            summary[NUM_POSITIONS] += 1
+            yield buckets.pop(heapq.heappop(keys))
+        key = (get_read_position(read),
+               read.is_reverse,
+               read.query_length if read_length else 0)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = UmiBucket(keep_reads)
+            buckets[key] = bucket
+            heapq.heappush(keys, key)
+        bucket.add(get_umi(read, umi_separator), read)
+    while keys:
+        summary[NUM_POSITIONS] += 1
+        yield buckets.pop(heapq.heappop(keys))
+
+
+def get_umi_adjacency(umis, counts, threshold=EDIT_DISTANCE_THRESHOLD):
+    """
+    Get the directional adjacency of UMIs, as for ``umi_tools``. There
+    is an edge from UMI ``a`` to UMI ``b`` if they are within
+    ``threshold`` of each other, in terms of Hamming distance, and
+    ``count(a) >= 2 * count(b) - 1``. UMIs of different lengths are
+    never adjacent.
+
+    Distances are computed by
+    :py:func:`riboviz.barcodes_umis.hamming_distances` in blocks of
+    rows, so at most about
+    :py:const:`riboviz.barcodes_umis.TILE_SIZE` distances are held at
+    a time.
+
+    :param umis: UMIs
+    :type umis: list(str or unicode)
+    :param counts: Number of reads with each UMI
+    :type counts: list(int)
+    :param threshold: Maximum Hamming distance
+    :type threshold: int
+    :return: For each UMI, indices of adjacent UMIs
+    :rtype: list(list(int))
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    adjacency = [[] for _ in umis]
+    by_length = collections.defaultdict(list)
+    for index, umi in enumerate(umis):
+        by_length[len(umi)].append(index)
+    for indices in by_length.values():
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) < 2:
+            continue
+        length_umis = [umis[index] for index in indices]
+        min_counts = 2 * counts[indices] - 1
+        num_rows = max(1, barcodes_umis.TILE_SIZE // len(indices))
+        for row in range(0, len(indices), num_rows):
+            distances = barcodes_umis.hamming_distances(
+                length_umis[row:row + num_rows], length_umis)
+            is_adjacent = (distances <= threshold) & \
+                (counts[indices[row:row + num_rows], np.newaxis] >=
+                 min_counts[np.newaxis, :])
+            sources, targets = np.nonzero(is_adjacent)
+            for source, target in zip(
+                    indices[sources + row].tolist(),
+                    indices[targets].tolist()):
+                if source != target:
+                    adjacency[source].append(target)
+    return adjacency
+
+
+def cluster_umis(umis, counts, threshold=EDIT_DISTANCE_THRESHOLD):
+    """
+    Group UMIs using the ``umi_tools`` ``directional`` method.
+
+    UMIs are visited in decreasing order of count. Each UMI not yet in
+    a group starts a new group, which holds every UMI reachable from
+    it in the directional adjacency (see
+    :py:func:`get_umi_adjacency`) not already in a group. UMIs with
+    equal counts are visited in the order given.
+
+    :param umis: UMIs
+    :type umis: list(str or unicode)
+    :param counts: Number of reads with each UMI
+    :type counts: list(int)
+    :param threshold: Maximum Hamming distance between adjacent UMIs
+    :type threshold: int
+    :return: Groups, each a list of indices into ``umis`` in \
+    decreasing order of count, the first of which is the group's \
+    representative UMI
+    :rtype: list(list(int))
+    """
+    if len(umis) == 1:
+        return [[0]]
+    adjacency = get_umi_adjacency(umis, counts, threshold)
+    order = np.argsort(-np.asarray(counts, dtype=np.int64),
+                       kind="stable").tolist()
+    ranks = {index: rank for rank, index in enumerate(order)}
+    is_grouped = [False] * len(umis)
+    groups = []
+    for index in order:
+        if is_grouped[index]:
+            continue
+        component = {index}
+        queue = [index]
+        while queue:
+            for neighbour in adjacency[queue.pop()]:
+                if neighbour not in component:
+                    component.add(neighbour)
+                    queue.append(neighbour)
+        group = sorted((member for member in component
+                        if not is_grouped[member]), key=ranks.get)
+        for member in group:
+            is_grouped[member] = True
+        groups.append(group)
+    return groups
+
+
+def get_average_umi_distance(umis):
+    """
+    Get the average Hamming distance between every pair of UMIs, as
+    for ``umi_tools``. Pairs of UMIs of different lengths are taken to
+    differ at every position of the longer UMI.
+
+    :param umis: UMIs
+    :type umis: list(str or unicode)
+    :return: Average distance or -1 if there is only one UMI
+    :rtype: float
+    """
+    if len(umis) < 2:
+        return -1
+    by_length = collections.defaultdict(list)
+    for umi in umis:
+        by_length[len(umi)].append(umi)
+    total = 0
+    lengths = sorted(by_length)
+    for position, length in enumerate(lengths):
+        length_umis = by_length[length]
+        num_rows = max(1, barcodes_umis.TILE_SIZE // len(length_umis))
+        for row in range(0, len(length_umis), num_rows):
+            total += int(np.triu(barcodes_umis.hamming_distances(
+                length_umis[row:row + num_rows], length_umis),
+                                 k=row + 1).sum())
+        for other in lengths[position + 1:]:
+            total += other * len(length_umis) * len(by_length[other])
+    num_pairs = len(umis) * (len(umis) - 1) // 2
+    return float(total) / num_pairs
+
+
+class DedupStats:
+    """
+    UMI deduplication statistics, as output by ``umi_tools dedup
+    --output-stats``.
+
+    For each UMI, the number of positions at which it was observed
+    with each count, before (``pre_counts``) and after
+    (``post_counts``) deduplication, the number of positions with each
+    average edit distance between their UMIs (``pre_distances`` and
+    ``post_distances``), the number of positions with each number of
+    UMIs (``pre_sizes`` and ``post_sizes``) and the total number of
+    reads with each UMI (``umi_counts``).
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.pre_counts = collections.defaultdict(collections.Counter)
+        self.post_counts = collections.defaultdict(collections.Counter)
+        self.pre_distances = collections.Counter()
+        self.post_distances = collections.Counter()
+        self.pre_sizes = collections.Counter()
+        self.post_sizes = collections.Counter()
+        self.umi_counts = collections.Counter()
+
+    def update(self, umis, counts, group_umis, group_counts):
+        """
+        Add the statistics for a bucket.
+
+        :param umis: UMIs
+        :type umis: list(str or unicode)
+        :param counts: Number of reads with each UMI
+        :type counts: list(int)
+        :param group_umis: Representative UMI of each group
+        :type group_umis: list(str or unicode)
+        :param group_counts: Number of reads in each group
+        :type group_counts: list(int)
+        """
+        for umi, count in zip(umis, counts):
+            self.pre_counts[umi][count] += 1
+            self.umi_counts[umi] += count
+        for umi, count in zip(group_umis, group_counts):
+            self.post_counts[umi][count] += 1
+        self.pre_distances[get_average_umi_distance(umis)] += 1
+        self.post_distances[get_average_umi_distance(group_umis)] += 1
+        self.pre_sizes[len(umis)] += 1
+        self.post_sizes[len(group_umis)] += 1
+
+    def merge(self, other):
+        """
+        Add the statistics from another :py:class:`DedupStats`.
+
+        :param other: Statistics
+        :type other: DedupStats
+        """
+        for counts, other_counts in [(self.pre_counts, other.pre_counts),
+                                     (self.post_counts, other.post_counts)]:
+            for umi, umi_counts in other_counts.items():
+                counts[umi].update(umi_counts)
+        for counter, other_counter in [
+                (self.pre_distances, other.pre_distances),
+                (self.post_distances, other.post_distances),
+                (self.pre_sizes, other.pre_sizes),
+                (self.post_sizes, other.post_sizes),
+                (self.umi_counts, other.umi_counts)]:
+            counter.update(other_counter)
+
+    def get_null_distances(self, sizes, rng):
+        """
+        Get the number of positions with each average edit distance
+        (see :py:func:`get_average_umi_distance`) between random UMIs,
+        drawn with the frequencies in ``umi_counts``, for positions
+        with each number of UMIs.
+
+        If all UMIs have the same length then the samples for each
+        number of UMIs are drawn, and their distances computed, in
+        batches of at most about
+        :py:const:`riboviz.barcodes_umis.TILE_SIZE` UMIs.
+
+        :param sizes: Number of positions with each number of UMIs
+        :type sizes: collections.Counter
+        :param rng: Random number generator
+        :type rng: numpy.random.Generator
+        :return: Number of positions with each average edit distance
+        :rtype: collections.Counter
+        """
+        umis = sorted(self.umi_counts)
+        probabilities = np.array([self.umi_counts[umi] for umi in umis],
+                                 dtype=np.float64)
+        probabilities /= probabilities.sum() if umis else 1
+        data = None
+        if len(set(len(umi) for umi in umis)) == 1:
+            data = barcodes_umis.get_sequence_bytes(umis)
+        distances = collections.Counter()
+        for size, num_positions in sorted(sizes.items()):
+            if size < 2:
+                distances[-1] += num_positions
+                continue
+            if data is None:
+                for _ in range(num_positions):
+                    sample = rng.choice(len(umis), size, p=probabilities)
+                    distances[get_average_umi_distance(
+                        [umis[index] for index in sample])] += 1
+                continue
+            num_pairs = size * (size - 1) // 2
+            num_rows = max(1, barcodes_umis.TILE_SIZE // size)
+            for row in range(0, num_positions, num_rows):
+                sample = data[rng.choice(
+                    len(umis),
+                    (min(num_rows, num_positions - row), size),
+                    p=probabilities)]
+                totals = np.zeros(len(sample), dtype=np.int64)
+                for column in range(size - 1):
+                    totals += np.count_nonzero(
+                        sample[:, column + 1:, :] !=
+                        sample[:, column:column + 1, :], axis=(1, 2))
+                distances.update((totals / num_pairs).tolist())
+        return distances
+
+    def write(self, prefix, seed=NULL_SEED):
+        """
+        Write statistics to files named using
+        :py:const:`EDIT_DISTANCE_STATS_FORMAT`,
+        :py:const:`PER_UMI_PER_POSITION_STATS_FORMAT` and
+        :py:const:`PER_UMI_STATS_FORMAT`.
+
+        :param prefix: File name prefix
+        :type prefix: str or unicode
+        :param seed: Seed for random UMIs for null edit distances
+        :type seed: int
+        """
+        rng = np.random.default_rng(seed)
+        columns = [self.pre_distances,
+                   self.get_null_distances(self.pre_sizes, rng),
+                   self.post_distances,
+                   self.get_null_distances(self.post_sizes, rng)]
+        max_distance = int(max((distance for column in columns
+                                for distance in column), default=0))
+        bins = list(range(-1, max_distance + 2))
+        with open(EDIT_DISTANCE_STATS_FORMAT.format(prefix), "w") as f:
+            f.write("\t".join(["unique", "unique_null", DIRECTIONAL,
+                               DIRECTIONAL + "_null",
+                               "edit_distance"]) + "\n")
+            tallies = []
+            for column in columns:
+                tally = np.zeros(len(bins), dtype=np.int64)
+                for distance, num_positions in column.items():
+                    tally[np.digitize(distance, bins, right=True)] += \
+                        num_positions
+                tallies.append(tally.tolist())
+            labels = [SINGLE_UMI] + [str(edit) for edit in bins[1:]]
+            for row in zip(*tallies, labels):
+                f.write("\t".join(map(str, row)) + "\n")
+        histograms = []
+        for umi_counts in [self.pre_counts, self.post_counts]:
+            histogram = collections.Counter()
+            for counts in umi_counts.values():
+                histogram.update(counts)
+            histograms.append(histogram)
+        with open(PER_UMI_PER_POSITION_STATS_FORMAT.format(prefix),
+                  "w") as f:
+            f.write("counts\tinstances_pre\tinstances_post\n")
+            for count in sorted(set(histograms[0]) | set(histograms[1])):
+                f.write("{}\t{}\t{}\n".format(count,
+                                              histograms[0][count],
+                                              histograms[1][count]))
+        with open(PER_UMI_STATS_FORMAT.format(prefix), "w") as f:
+            f.write("\t".join(["UMI",
+                               "median_counts_pre",
+                               "times_observed_pre",
+                               "total_counts_pre",
+                               "median_counts_post",
+                               "times_observed_post",
+                               "total_counts_post"]) + "\n")
+            for umi in sorted(self.pre_counts):
+                row = [umi]
+                for umi_counts in [self.pre_counts, self.post_counts]:
+                    counts = umi_counts.get(umi, collections.Counter())
+                    if not counts:
+                        row.extend([0, 0, 0])
+                        continue
+                    values = np.repeat(list(counts.keys()),
+                                       list(counts.values()))
+                    row.extend([int(np.median(values)),
+                                len(values),
+                                int(values.sum())])
+                f.write("\t".join(map(str, row)) + "\n")
+
+
+class GroupsSummary:
+    """
+    Summary of UMI groups, as output by ``umi_tools group
+    --group-out``, which uses memory bounded by the number of genes
+    and the number of distinct group sizes, rather than the number of
+    reads.
+
+    ``group_sizes`` is the number of groups with each number of reads,
+    ``position_reads`` the number of positions with each number of
+    reads, and ``gene_reads`` and ``gene_groups`` the number of reads
+    and groups for each gene. The gene is the reference sequence name
+    if reads have no gene (:py:const:`NO_GENE`).
+
+    Reads are expected in order of reference sequence and,
+    approximately, position. Reads for a reference sequence are
+    counted at each position until a read is more than
+    ``position_buffer`` nucleotides downstream of the position, so
+    reads at the same position more than ``position_buffer``
+    nucleotides apart in the input are counted as separate
+    positions.
+    """
+
+    def __init__(self, position_buffer=POSITION_BUFFER):
+        """
+        Constructor.
+
+        :param position_buffer: Position buffer
+        :type position_buffer: int
+        """
+        self.position_buffer = position_buffer
+        self.group_sizes = collections.Counter()
+        self.position_reads = collections.Counter()
+        self.gene_reads = collections.Counter()
+        self.gene_groups = collections.Counter()
+        self._contig = None
+        self._positions = collections.Counter()
+        self._flush_position = None
+
+    def add_group(self, gene, num_reads):
+        """
+        Add a group.
+
+        :param gene: Gene
+        :type gene: str or unicode
+        :param num_reads: Number of reads in the group
+        :type num_reads: int
+        """
+        self.group_sizes[num_reads] += 1
+        self.gene_reads[gene] += num_reads
+        self.gene_groups[gene] += 1
+
+    def add_reads(self, contig, position, num_reads=1):
+        """
+        Add reads at a position.
+
+        :param contig: Reference sequence name
+        :type contig: str or unicode
+        :param position: Position
+        :type position: int
+        :param num_reads: Number of reads
+        :type num_reads: int
+        """
+        if contig != self._contig:
+            self.flush()
+            self._contig = contig
+            self._flush_position = position + self.position_buffer
+        self._positions[position] += num_reads
+        if position > self._flush_position:
+            start = position - self.position_buffer
+            flushed = [pos for pos in self._positions if pos < start]
+            for pos in flushed:
+                self.position_reads[self._positions.pop(pos)] += 1
+            self._flush_position = position + self.position_buffer
+
+    def flush(self):
+        """
+        Count the reads at all positions added so far.
+        """
+        self.position_reads.update(self._positions.values())
+        self._positions.clear()
+        self._contig = None
+
+    def merge(self, other):
+        """
+        Add the summary from another :py:class:`GroupsSummary`.
+
+        :param other: Summary
+        :type other: GroupsSummary
+        """
+        self.flush()
+        other.flush()
+        for counter, other_counter in [
+                (self.group_sizes, other.group_sizes),
+                (self.position_reads, other.position_reads),
+                (self.gene_reads, other.gene_reads),
+                (self.gene_groups, other.gene_groups)]:
+            counter.update(other_counter)
+
+    def write(self, prefix):
+        """
+        Write the summary to tab-separated values files:
+
+        * :py:const:`GROUP_SIZES_FORMAT`: :py:const:`GROUP_SIZE`,
+          :py:const:`NUM_GROUPS`.
+        * :py:const:`READS_PER_POSITION_FORMAT`:
+          :py:const:`NUM_READS`, :py:const:`NUM_POSITIONS_COLUMN`.
+        * :py:const:`GENE_DUPLICATION_FORMAT`: :py:const:`GENE`,
+          :py:const:`NUM_READS`, :py:const:`NUM_GROUPS`,
+          :py:const:`DUPLICATION_RATE`, the fraction of reads that
+          are duplicates, 1 - groups / reads.
+
+        :param prefix: File name prefix
+        :type prefix: str or unicode
+        """
+        self.flush()
+        for file_format, columns, counter in [
+                (GROUP_SIZES_FORMAT, [GROUP_SIZE, NUM_GROUPS],
+                 self.group_sizes),
+                (READS_PER_POSITION_FORMAT,
+                 [NUM_READS, NUM_POSITIONS_COLUMN],
+                 self.position_reads)]:
+            with open(file_format.format(prefix), "w") as f:
+                f.write("\t".join(columns) + "\n")
+                for key in sorted(counter):
+                    f.write("{}\t{}\n".format(key, counter[key]))
+        with open(GENE_DUPLICATION_FORMAT.format(prefix), "w") as f:
+            f.write("\t".join([GENE, NUM_READS, NUM_GROUPS,
+                               DUPLICATION_RATE]) + "\n")
+            for gene in sorted(self.gene_reads):
+                num_reads = self.gene_reads[gene]
+                num_groups = self.gene_groups[gene]
+                f.write("{}\t{}\t{}\t{:g}\n".format(
+                    gene, num_reads, num_groups,
+                    1 - num_groups / num_reads))
+
+
+def summarise_groups(groups_file,
+                     chunk_size=GROUPS_CHUNK_SIZE,
+                     position_buffer=POSITION_BUFFER):
+    """
+    Summarise UMI groups in a file output by ``umi_tools group
+    --group-out`` or :py:func:`dedup_umis`, reading at most
+    ``chunk_size`` rows at a time. See :py:class:`GroupsSummary`.
+
+    The rows of each group are expected to be contiguous, as output
+    by both tools.
+
+    :param groups_file: Groups file
+    :type groups_file: str or unicode
+    :param chunk_size: Maximum number of rows read at a time
+    :type chunk_size: int
+    :param position_buffer: See :py:class:`GroupsSummary`
+    :type position_buffer: int
+    :return: Summary
+    :rtype: GroupsSummary
+    :raise FileNotFoundError: If the groups file cannot be found
+    """
+    summary = GroupsSummary(position_buffer)
+    last_unique_id = None
+    with pd.read_csv(groups_file,
+                     sep="\t",
+                     usecols=[CONTIG, POSITION, GENE, FINAL_UMI_COUNT,
+                              UNIQUE_ID],
+                     dtype={CONTIG: str, GENE: str},
+                     keep_default_na=False,
+                     chunksize=chunk_size) as chunks:
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            genes = chunk[GENE].where(chunk[GENE] != NO_GENE,
+                                      chunk[CONTIG])
+            unique_ids = chunk[UNIQUE_ID]
+            starts = unique_ids != unique_ids.shift(
+                fill_value=last_unique_id)
+            last_unique_id = unique_ids.iloc[-1]
+            summary.gene_reads.update(genes.value_counts().to_dict())
+            summary.gene_groups.update(
+                genes[starts].value_counts().to_dict())
+            summary.group_sizes.update(
+                chunk[FINAL_UMI_COUNT][starts].value_counts().to_dict())
+            contigs = chunk[CONTIG].to_numpy()
+            positions = chunk[POSITION].to_numpy()
+            run_starts = np.flatnonzero(
+                np.r_[True, (contigs[1:] != contigs[:-1]) |
+                      (positions[1:] != positions[:-1])])
+            run_lengths = np.diff(np.r_[run_starts, len(chunk)])
+            for contig, position, num_reads in zip(
+                    contigs[run_starts], positions[run_starts].tolist(),
+                    run_lengths.tolist()):
+                summary.add_reads(contig, position, num_reads)
+    summary.flush()
+    return summary
+
+
+def write_groups(groups_file, groups, umis, counts, reads, unique_id=0):
+    """
+    Write UMI groups for a bucket, as for ``umi_tools group
+    --group-out``, without a header. Each read in each group is
+    written on a line with the columns :py:const:`GROUP_COLUMNS`.
+
+    :param groups_file: File
+    :type groups_file: io.TextIOWrapper
+    :param groups: Groups, see :py:func:`cluster_umis`
+    :type groups: list(list(int))
+    :param umis: UMIs
+    :type umis: list(str or unicode)
+    :param counts: Number of reads with each UMI
+    :type counts: list(int)
+    :param reads: Reads with each UMI
+    :type reads: list(list(pysam.AlignedSegment))
+    :param unique_id: ID of first group
+    :type unique_id: int
+    :return: ID of next group
+    :rtype: int
+    """
+    for group in groups:
+        final_umi = umis[group[0]]
+        final_umi_count = str(sum(counts[index] for index in group))
+        for index in group:
+            umi_count = str(counts[index])
+            for read in reads[index]:
+                position = read.reference_end if read.is_reverse \
+                    else read.reference_start
+                groups_file.write("\t".join([
+                    read.query_name, read.reference_name, str(position),
+                    NO_GENE, umis[index], umi_count, final_umi,
+                    final_umi_count, str(unique_id)]) + "\n")
+        unique_id += 1
+    return unique_id
+
+
+def summarise_bucket(groups_summary, groups, counts, reads):
+    """
+    Add UMI groups for a bucket to a summary, as
+    :py:func:`summarise_groups` would from the output of
+    :py:func:`write_groups`.
+
+    :param groups_summary: Summary
+    :type groups_summary: GroupsSummary
+    :param groups: Groups, see :py:func:`cluster_umis`
+    :type groups: list(list(int))
+    :param counts: Number of reads with each UMI
+    :type counts: list(int)
+    :param reads: Reads with each UMI
+    :type reads: list(list(pysam.AlignedSegment))
+    """
+    for group in groups:
+        for index in group:
+            for read in reads[index]:
+                position = read.reference_end if read.is_reverse \
+                    else read.reference_start
+                groups_summary.add_reads(read.reference_name, position)
+        groups_summary.add_group(reads[group[0]][0].reference_name,
+                                 sum(counts[index] for index in group))
+
+
+def dedup_reads(reads,
+                summary,
+                stats=None,
+                pre_groups_file=None,
+                post_groups_file=None,
+                umi_separator=UMI_SEPARATOR,
+                threshold=EDIT_DISTANCE_THRESHOLD,
+                read_length=True,
+                position_buffer=POSITION_BUFFER,
+                groups_summary=None):
+    """
+    Deduplicate coordinate-sorted reads. Reads are bucketed by
+    :py:func:`get_umi_buckets`, the UMIs in each bucket grouped by
+    :py:func:`cluster_umis` and, for each group, the best read with
+    the group's representative UMI (see :py:class:`UmiBucket`) is
+    returned.
+
+    If ``pre_groups_file`` is provided, then the groups are written
+    to it (see :py:func:`write_groups`). If ``post_groups_file`` is
+    provided, then the UMIs of the reads that are returned are
+    grouped again, as for running ``umi_tools group`` on the
+    deduplicated reads, and these groups are written to it. Group IDs
+    in each file start at 0. If ``groups_summary`` is provided, then
+    the groups are added to it, as they would be by
+    :py:func:`summarise_groups` from ``pre_groups_file``, without
+    ``pre_groups_file`` needing to be written. ``summary`` values for
+    :py:const:`NUM_OUTPUT_READS` and
+    :py:const:`NUM_POST_DEDUP_GROUPS` are incremented.
+
+    :param reads: Reads
+    :type reads: collections.Iterable(pysam.AlignedSegment)
+    :param summary: Deduplication summary
+    :type summary: dict
+    :param stats: Deduplication statistics or ``None``
+    :type stats: DedupStats
+    :param pre_groups_file: Pre-deduplication groups file or ``None``
+    :type pre_groups_file: io.TextIOWrapper
+    :param post_groups_file: Post-deduplication groups file or \
+    ``None``
+    :type post_groups_file: io.TextIOWrapper
+    :param umi_separator: Separator between read ID and UMI
+    :type umi_separator: str or unicode
+    :param threshold: Maximum Hamming distance between adjacent UMIs
+    :type threshold: int
+    :param read_length: Bucket reads by length?
+    :type read_length: bool
+    :param position_buffer: See :py:func:`get_umi_buckets`
+    :type position_buffer: int
+    :param groups_summary: Pre-deduplication groups summary or \
+    ``None``
+    :type groups_summary: GroupsSummary
+    :return: Deduplicated reads
+    :rtype: collections.Iterable(pysam.AlignedSegment)
+    :raise ValueError: If a read has no UMI
+    """
+    pre_unique_id = 0
+    post_unique_id = 0
+    for bucket in get_umi_buckets(reads,
+                                  summary,
+                                  umi_separator,
+                                  read_length,
+                                  pre_groups_file is not None or
+                                  groups_summary is not None,
+                                  position_buffer):
+        groups = cluster_umis(bucket.umis, bucket.counts, threshold)
+        group_umis = [bucket.umis[group[0]] for group in groups]
+        group_reads = [bucket.best_reads[group[0]] for group in groups]
+        if pre_groups_file is not None:
+            pre_unique_id = write_groups(pre_groups_file,
+                                         groups,
+                                         bucket.umis,
+                                         bucket.counts,
+                                         bucket.reads,
+                                         pre_unique_id)
+        if groups_summary is not None:
+            summarise_bucket(groups_summary, groups, bucket.counts,
+                             bucket.reads)
+        if post_groups_file is not None:
+            ones = [1] * len(groups)
+            post_groups = cluster_umis(group_umis, ones, threshold)
+            summary[NUM_POST_DEDUP_GROUPS] += len(post_groups)
+            post_unique_id = write_groups(post_groups_file,
+                                          post_groups,
+                                          group_umis,
+                                          ones,
+                                          [[read] for read in group_reads],
+                                          post_unique_id)
+        if stats is not None:
+            stats.update(bucket.umis,
+                         bucket.counts,
+                         group_umis,
+                         [sum(bucket.counts[index] for index in group)
+                          for group in groups])
+        summary[NUM_OUTPUT_READS] += len(group_reads)
+        yield from group_reads
+
+
+def dedup_contig(bam_file,
+                 contig,
+                 out_prefix,
+                 is_stats=False,
+                 is_pre_groups=False,
+                 is_post_groups=False,
+                 is_groups_summary=False,
+                 umi_separator=UMI_SEPARATOR,
+                 threshold=EDIT_DISTANCE_THRESHOLD,
+                 read_length=True,
+                 position_buffer=POSITION_BUFFER,
+                 buffer_size=sam_bam.SORT_BUFFER_SIZE,
+                 num_threads=1):
+    """
+    Deduplicate the reads on a reference sequence, or all reads, using
+    :py:func:`dedup_reads` and write the deduplicated reads to a
+    sorted, indexed, BAM file, and groups, if requested, to files,
+    named using ``out_prefix``.
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param contig: Reference sequence name or ``None`` for all reads
+    :type contig: str or unicode
+    :param out_prefix: Output file name prefix
+    :type out_prefix: str or unicode
+    :param is_stats: Collect deduplication statistics?
+    :type is_stats: bool
+    :param is_pre_groups: Write pre-deduplication groups?
+    :type is_pre_groups: bool
+    :param is_post_groups: Write post-deduplication groups?
+    :type is_post_groups: bool
+    :param is_groups_summary: Summarise pre-deduplication groups?
+    :type is_groups_summary: bool
+    :param umi_separator: Separator between read ID and UMI
+    :type umi_separator: str or unicode
+    :param threshold: Maximum Hamming distance between adjacent UMIs
+    :type threshold: int
+    :param read_length: Bucket reads by length?
+    :type read_length: bool
+    :param position_buffer: See :py:func:`get_umi_buckets`
+    :type position_buffer: int
+    :param buffer_size: Maximum number of reads held in memory when \
+    sorting (see :py:func:`riboviz.sam_bam.write_sorted_bam`)
+    :type buffer_size: int
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    :return: BAM file, pre- and post-deduplication groups files (or \
+    ``None``), summary, statistics (or ``None``) and groups summary \
+    (or ``None``)
+    :rtype: tuple(str or unicode, str or unicode, str or unicode, \
+    dict, DedupStats, GroupsSummary)
+    :raise ValueError: If a read has no UMI
+    """
+    dedup_bam_file = sam_bam.BAM_FORMAT.format(out_prefix)
+    pre_groups_file = out_prefix + "_pre.tsv" if is_pre_groups else None
+    post_groups_file = out_prefix + "_post.tsv" if is_post_groups \
+        else None
+    summary = {key: 0 for key in [NUM_INPUT_READS, NUM_UNMAPPED_READS,
+                                  NUM_POSITIONS, NUM_OUTPUT_READS,
+                                  NUM_POST_DEDUP_GROUPS]}
+    stats = DedupStats() if is_stats else None
+    groups_summary = GroupsSummary(position_buffer) \
+        if is_groups_summary else None
+    pre_groups = open(pre_groups_file, "w") if is_pre_groups else None
+    post_groups = open(post_groups_file, "w") if is_post_groups else None
+    try:
+        with pysam.AlignmentFile(bam_file, "rb") as bam:
+            if contig is None:
+                reads = bam.fetch(until_eof=True)
+            else:
+                reads = bam.fetch(contig)
+            sam_bam.write_sorted_bam(dedup_reads(reads,
+                                                 summary,
+                                                 stats,
+                                                 pre_groups,
+                                                 post_groups,
+                                                 umi_separator,
+                                                 threshold,
+                                                 read_length,
+                                                 position_buffer,
+                                                 groups_summary),
+                                     dedup_bam_file,
+                                     bam.header,
+                                     buffer_size,
+                                     os.path.dirname(out_prefix),
+                                     num_threads)
+    finally:
+        for groups_file in [pre_groups, post_groups]:
+            if groups_file is not None:
+                groups_file.close()
+    if groups_summary is not None:
+        groups_summary.flush()
+    return dedup_bam_file, pre_groups_file, post_groups_file, summary, \
+        stats, groups_summary
+
+
+def _dedup_contig_task(args):
+    """
+    Unpack arguments and call :py:func:`dedup_contig`.
+
+    :param args: Arguments
+    :type args: tuple
+    :return: See :py:func:`dedup_contig`
+    :rtype: tuple(str or unicode, str or unicode, str or unicode, \
+    dict, DedupStats, GroupsSummary)
+    """
+    return dedup_contig(*args)
+
+
+def merge_groups(groups_files, merged_file, num_groups):
+    """
+    Concatenate groups files written by :py:func:`dedup_contig`,
+    adding a header and offsetting group IDs so these are unique
+    across all files.
+
+    :param groups_files: Groups files, in order
+    :type groups_files: list(str or unicode)
+    :param merged_file: Merged groups file
+    :type merged_file: str or unicode
+    :param num_groups: Number of groups in each file
+    :type num_groups: list(int)
+    """
+    offset = 0
+    with open(merged_file, "w") as f:
+        f.write("\t".join(GROUP_COLUMNS) + "\n")
+        for groups_file, file_num_groups in zip(groups_files, num_groups):
+            with open(groups_file, "r") as groups:
+                for line in groups:
+                    prefix, _, unique_id = line.rstrip("\n").rpartition(
+                        "\t")
+                    f.write("{}\t{}\n".format(prefix,
+                                              int(unique_id) + offset))
+            offset += file_num_groups
+
+
+def dedup_umis(bam_file,
+               dedup_bam_file,
+               pre_groups_file=None,
+               post_groups_file=None,
+               stats_prefix=None,
+               groups_summary_prefix=None,
+               umi_separator=UMI_SEPARATOR,
+               threshold=EDIT_DISTANCE_THRESHOLD,
+               read_length=True,
+               num_processes=1,
+               num_threads=1,
+               buffer_size=sam_bam.SORT_BUFFER_SIZE,
+               position_buffer=POSITION_BUFFER,
+               seed=NULL_SEED):
+    """
+    Deduplicate reads in a coordinate-sorted BAM file using UMIs, in a
+    single pass, as for ``umi_tools dedup``, and write the
+    deduplicated reads to a sorted, indexed, BAM file. See
+    :py:func:`dedup_reads`.
+
+    Optionally, UMI groups before and after deduplication are written
+    to ``pre_groups_file`` and ``post_groups_file``, as for
+    ``umi_tools group --group-out``, and statistics to files prefixed
+    by ``stats_prefix``, as for ``umi_tools dedup --output-stats``
+    (see :py:meth:`DedupStats.write`). A summary of the UMI groups
+    before deduplication can be written to files prefixed by
+    ``groups_summary_prefix`` (see :py:meth:`GroupsSummary.write`),
+    with or without ``pre_groups_file``.
+
+    If ``num_processes`` is more than 1 and ``bam_file`` is indexed
+    then the reads on each reference sequence are deduplicated by a
+    separate task, and the results concatenated in reference order.
+    Temporary files are written to a directory alongside
+    ``dedup_bam_file``, which is deleted when done.
+
+    A summary is returned, with keys:
+
+    * :py:const:`NUM_INPUT_READS`
+    * :py:const:`NUM_UNMAPPED_READS`
+    * :py:const:`NUM_POSITIONS`
+    * :py:const:`NUM_OUTPUT_READS`
+    * :py:const:`NUM_POST_DEDUP_GROUPS`
+
+    :param bam_file: BAM file
+    :type bam_file: str or unicode
+    :param dedup_bam_file: Deduplicated BAM file
+    :type dedup_bam_file: str or unicode
+    :param pre_groups_file: Pre-deduplication groups file or ``None``
+    :type pre_groups_file: str or unicode
+    :param post_groups_file: Post-deduplication groups file or \
+    ``None``
+    :type post_groups_file: str or unicode
+    :param stats_prefix: Statistics file name prefix or ``None``
+    :type stats_prefix: str or unicode
+    :param groups_summary_prefix: Pre-deduplication groups summary \
+    file name prefix or ``None``
+    :type groups_summary_prefix: str or unicode
+    :param umi_separator: Separator between read ID and UMI
+    :type umi_separator: str or unicode
+    :param threshold: Maximum Hamming distance between adjacent UMIs
+    :type threshold: int
+    :param read_length: Bucket reads by length?
+    :type read_length: bool
+    :param num_processes: Number of processes
+    :type num_processes: int
+    :param num_threads: Number of BGZF compression threads
+    :type num_threads: int
+    :param buffer_size: Maximum number of reads held in memory when \
+    sorting, per process
+    :type buffer_size: int
+    :param position_buffer: See :py:func:`get_umi_buckets`
+    :type position_buffer: int
+    :param seed: Seed for random UMIs for null edit distances
+    :type seed: int
+    :return: Deduplication summary
+    :rtype: dict
+    :raise FileNotFoundError: If the BAM file cannot be found
+    :raise ValueError: If a read has no UMI
+    """
+    if not os.path.isfile(bam_file):
+        raise FileNotFoundError(bam_file)
+    contigs = [None]
+    num_no_coordinate = 0
+    with pysam.AlignmentFile(bam_file, "rb") as bam:
+        if num_processes > 1 and bam.has_index():
+            contigs = [stats.contig for stats in
+                       bam.get_index_statistics() if stats.total > 0]
+            num_no_coordinate = bam.nocoordinate
+    out_dir = tempfile.mkdtemp(
+        prefix="dedup_umis",
+        dir=os.path.dirname(os.path.abspath(dedup_bam_file)))
+    try:
+        tasks = [(bam_file, contig, os.path.join(out_dir, str(index)),
+                  stats_prefix is not None, pre_groups_file is not None,
+                  post_groups_file is not None,
+                  groups_summary_prefix is not None, umi_separator,
+                  threshold, read_length, position_buffer, buffer_size,
+                  1 if len(contigs) > 1 else num_threads)
+                 for index, contig in enumerate(contigs)]
+        if len(tasks) > 1:
+            with multiprocessing.Pool(num_processes) as pool:
+                results = list(pool.imap(_dedup_contig_task, tasks))
+        else:
+            results = [dedup_contig(*tasks[0])] if contigs else []
+        summary = {key: 0 for key in [NUM_INPUT_READS,
+                                      NUM_UNMAPPED_READS,
+                                      NUM_POSITIONS,
+                                      NUM_OUTPUT_READS,
+                                      NUM_POST_DEDUP_GROUPS]}
+        summary[NUM_INPUT_READS] = num_no_coordinate
+        summary[NUM_UNMAPPED_READS] = num_no_coordinate
+        stats = DedupStats()
+        groups_summary = GroupsSummary(position_buffer)
+        for _, _, _, task_summary, task_stats, task_groups_summary \
+                in results:
+            for key, value in task_summary.items():
+                summary[key] += value
+            if task_stats is not None:
+                stats.merge(task_stats)
+            if task_groups_summary is not None:
+                groups_summary.merge(task_groups_summary)
+        bam_files = [result[0] for result in results]
+        if len(bam_files) == 1:
+            os.replace(bam_files[0], dedup_bam_file)
+            os.replace(sam_bam.BAI_FORMAT.format(bam_files[0]),
+                       sam_bam.BAI_FORMAT.format(dedup_bam_file))
+        else:
+            if bam_files:
+                pysam.cat("--no-PG", "-o", dedup_bam_file, *bam_files)
+            else:
+                with pysam.AlignmentFile(bam_file, "rb") as bam:
+                    sam_bam.write_sorted_bam([], dedup_bam_file,
+                                             bam.header, tmp_dir=out_dir)
+            pysam.index(dedup_bam_file)
+        if pre_groups_file is not None:
+            merge_groups([result[1] for result in results],
+                         pre_groups_file,
+                         [result[3][NUM_OUTPUT_READS]
+                          for result in results])
+        if post_groups_file is not None:
+            merge_groups([result[2] for result in results],
+                         post_groups_file,
+                         [result[3][NUM_POST_DEDUP_GROUPS]
+                          for result in results])
+        if stats_prefix is not None:
+            stats.write(stats_prefix, seed)
+        if groups_summary_prefix is not None:
+            groups_summary.write(groups_summary_prefix)
+    finally:
+        shutil.rmtree(out_dir)
+    return summary
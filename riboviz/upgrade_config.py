@@ -36,6 +36,7 @@ configuration:
 * ``extract_umis: false``
 * ``feature: CDS``
 * ``features_file: null``
+* ``fuse_trim_sort: false``
 * ``group_umis: false``
 * ``job_email: null``
 * ``job_email_events: beas``
@@ -52,6 +53,9 @@ configuration:
 * ``nextflow_work_dir: work``
 * ``output_pdfs: true``
 * ``publish_index_tmp: false``
+* ``python_bam_to_h5: false``
+* ``python_dedup_umis: false``
+* ``python_make_bedgraph: false``
 * ``run_static_html: true``
 * ``sample_sheet: null``
 * ``samsort_memory: null``
@@ -122,10 +126,14 @@ UPDATES = {
     params.FEATURE: "CDS",
     params.FEATURES_FILE: None,
     params.FQ_FILES: None,
+    params.FUSE_TRIM_SORT: False,
     params.GROUP_UMIS: False,
     params.MULTIPLEX_FQ_FILES: None,
     params.OUTPUT_PDFS: True,
     params.PUBLISH_INDEX_TMP: False,
+    params.PYTHON_BAM_TO_H5: False,
+    params.PYTHON_DEDUP_UMIS: False,
+    params.PYTHON_MAKE_BEDGRAPH: False,
     params.RUN_STATIC_HTML: True,
     params.SAMPLE_SHEET: None,
     params.SAMSORT_MEMORY: None,
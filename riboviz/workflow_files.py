@@ -42,5 +42,7 @@ PLUS_BEDGRAPH = "plus.bedgraph"
 """ Reads from plus strand bedgraph file name."""
 READ_COUNTS_FILE = "read_counts.tsv"
 """ Read counts file name. """
+READ_COUNTS_CACHE_FILE = "read_counts_cache.tsv"
+""" Read counts cache file name. """
 STATIC_HTML_FILE = "{}_output_report.html"
 """ Analysis outputs HTML file name. """